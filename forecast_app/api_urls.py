@@ -17,6 +17,11 @@ urlpatterns = [
     url(r'^project/(?P<pk>\d+)/truth/$', api_views.TruthDetail.as_view(), name='api-truth-detail'),
     url(r'^project/(?P<pk>\d+)/forecast_queries/$', api_views.query_forecasts_endpoint, name='api-forecast-queries'),
     url(r'^project/(?P<pk>\d+)/truth_queries/$', api_views.query_truth_endpoint, name='api-truth-queries'),
+    url(r'^project/(?P<pk>\d+)/score_queries/$', api_views.query_scores_endpoint, name='api-score-queries'),
+    url(r'^project/(?P<pk>\d+)/forecast_queries_sync/$', api_views.query_forecasts_sync_endpoint,
+        name='api-forecast-queries-sync'),
+    url(r'^project/(?P<pk>\d+)/truth_queries_sync/$', api_views.query_truth_sync_endpoint,
+        name='api-truth-queries-sync'),
     url(r'^project/(?P<pk>\d+)/forecasts/$', api_views.download_latest_forecasts, name='api-project-latest-forecasts'),
 
     # other object detail
@@ -30,6 +35,11 @@ urlpatterns = [
 
     url(r'^model/(?P<pk>\d+)/$', api_views.ForecastModelDetail.as_view(), name='api-model-detail'),
     url(r'^model/(?P<pk>\d+)/forecasts/$', api_views.ForecastModelForecastList.as_view(), name='api-forecast-list'),
+    url(r'^model/(?P<pk>\d+)/forecast_archive/$', api_views.upload_forecast_archive,
+        name='api-forecast-archive-upload'),
+    url(r'^model/(?P<pk>\d+)/forecast_manifest/$', api_views.forecast_manifest_endpoint,
+        name='api-forecast-manifest'),
+    url(r'^model/(?P<pk>\d+)/ensembles/$', api_views.build_ensemble_endpoint, name='api-build-ensemble'),
 
     url(r'^forecast/(?P<pk>\d+)/$', api_views.ForecastDetail.as_view(), name='api-forecast-detail'),
     url(r'^forecast/(?P<pk>\d+)/data/$', api_views.forecast_data, name='api-forecast-data'),
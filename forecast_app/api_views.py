@@ -1,5 +1,6 @@
 import csv
 import datetime
+import itertools
 import logging
 import tempfile
 from wsgiref.util import FileWrapper
@@ -12,7 +13,7 @@ from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.db import IntegrityError
 from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, HttpResponseBadRequest, \
-    HttpResponseNotFound
+    HttpResponseNotFound, StreamingHttpResponse
 from django.utils.text import get_valid_filename
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, renderer_classes
@@ -24,18 +25,23 @@ from rest_framework_csv.renderers import CSVRenderer
 
 from forecast_app.models import Project, ForecastModel, Forecast, Target
 from forecast_app.models.job import Job, JOB_TYPE_QUERY_FORECAST, JOB_TYPE_UPLOAD_TRUTH, \
-    JOB_TYPE_UPLOAD_FORECAST, JOB_TYPE_QUERY_TRUTH
+    JOB_TYPE_UPLOAD_FORECAST, JOB_TYPE_QUERY_TRUTH, JOB_TYPE_UPLOAD_FORECAST_ARCHIVE, JOB_TYPE_QUERY_FORECAST_SHARD, \
+    JOB_TYPE_QUERY_SCORES, JOB_TYPE_BUILD_ENSEMBLE
 from forecast_app.models.project import TimeZero, Unit
 from forecast_app.serializers import ProjectSerializer, UserSerializer, ForecastModelSerializer, ForecastSerializer, \
     TruthSerializer, JobSerializer, TimeZeroSerializer, UnitSerializer, TargetSerializer
 from forecast_app.views import is_user_ok_edit_project, is_user_ok_edit_model, is_user_ok_create_model, \
     _upload_truth_worker, enqueue_delete_forecast, is_user_ok_delete_forecast, is_user_ok_create_project, \
     is_user_ok_view_project
-from forecast_repo.settings.base import QUERY_FORECAST_QUEUE_NAME
-from utils.forecast import json_io_dict_from_forecast
+from forecast_repo.settings.base import QUERY_FORECAST_QUEUE_NAME, QUERY_SYNC_MAX_NUM_PRED_ELES, MAX_NUM_QUERY_ROWS, \
+    ENSEMBLE_QUEUE_NAME
+from utils.forecast import json_io_dict_from_forecast, forecast_manifest
 from utils.project import create_project_from_json, config_dict_from_project, latest_forecast_cols_for_project
 from utils.project_diff import execute_project_config_diff, project_config_diff
-from utils.project_queries import _forecasts_query_worker, _truth_query_worker
+from utils.project_queries import _forecasts_query_worker, _truth_query_worker, cached_query_job, query_cache_key, \
+    plan_forecast_query_shards, QUERY_OUTPUT_FORMAT_CSV, QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE, \
+    estimate_query_num_pred_eles, run_small_query, estimate_forecast_query_rows, is_query_estimate_too_large, \
+    forecast_query_pred_ele_counts
 from utils.utilities import YYYY_MM_DD_DATE_FORMAT
 
 
@@ -446,6 +452,9 @@ class ForecastModelForecastList(UserPassesTestMixin, generics.ListCreateAPIView)
         - 'timezero_date' (required): The TimeZero.timezero_date to use to look up the TimeZero to associate with the
             upload. The date format is utils.utilities.YYYY_MM_DD_DATE_FORMAT. The TimeZero must exist, and will not be
             created if one corresponding to 'timezero_date' isn't found.
+        - 'is_patch' (optional): 'true' if 'data_file' is a "patch" to the latest version that contains only added or
+            changed prediction elements plus explicit retractions. see `forecast_manifest_endpoint()` and
+            load_predictions_from_json_io_dict()'s `is_patch`
         """
         # todo xx merge below with views.upload_forecast() and views.validate_data_file()
 
@@ -505,8 +514,9 @@ class ForecastModelForecastList(UserPassesTestMixin, generics.ListCreateAPIView)
                                 status=status.HTTP_400_BAD_REQUEST)
 
         # upload to cloud and enqueue a job to process a new Job
+        is_patch = str(request.data.get('is_patch', '')).lower() == 'true'
         is_error, job = _upload_file(request.user, data_file, _upload_forecast_worker, type=JOB_TYPE_UPLOAD_FORECAST,
-                                     forecast_pk=new_forecast.pk)
+                                     forecast_pk=new_forecast.pk, is_patch=is_patch)
         if is_error:
             return JsonResponse({'error': f"There was an error uploading the file. The error was: '{is_error}'. "
                                           f"forecast_model={forecast_model}"},
@@ -516,6 +526,134 @@ class ForecastModelForecastList(UserPassesTestMixin, generics.ListCreateAPIView)
         return JsonResponse(job_serializer.data)
 
 
+@api_view(['GET'])
+def forecast_manifest_endpoint(request, pk):
+    """
+    Returns the compact manifest of the latest version of a ForecastModel's forecast for a TimeZero. See
+    `forecast_manifest()` for the format. Clients use it to upload "patches" (see `ForecastModelForecastList.post()`).
+
+    GET query parameters:
+    - 'timezero_date' (required): The TimeZero.timezero_date of the forecast. The date format is
+        utils.utilities.YYYY_MM_DD_DATE_FORMAT
+
+    :param request: a request
+    :param pk: a ForecastModel's pk
+    :return: the manifest as JSON
+    """
+    forecast_model = get_object_or_404(ForecastModel, pk=pk)
+    if (not request.user.is_authenticated) or not is_user_ok_view_project(request.user, forecast_model.project):
+        return HttpResponseForbidden()
+
+    timezero_date_str = request.query_params.get('timezero_date')
+    if not timezero_date_str:
+        return JsonResponse({'error': f"No 'timezero_date' query parameter. forecast_model={forecast_model}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        timezero_date_obj = datetime.datetime.strptime(timezero_date_str, YYYY_MM_DD_DATE_FORMAT)
+    except ValueError as ve:
+        return JsonResponse({'error': f"Badly formatted 'timezero_date' query parameter: '{ve!r}'. "
+                                      f"forecast_model={forecast_model}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    time_zero = forecast_model.project.time_zero_for_timezero_date(timezero_date_obj)
+    if not time_zero:
+        return JsonResponse({'error': f"TimeZero not found for 'timezero_date' query parameter: "
+                                      f"'{timezero_date_obj}'. forecast_model={forecast_model}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    return JsonResponse(forecast_manifest(forecast_model, time_zero))
+
+
+@api_view(['POST'])
+def upload_forecast_archive(request, pk):
+    """
+    Handles uploading a zip or tar archive of forecast files to a ForecastModel, creating one new Forecast per file. This
+    is much faster than uploading them one at a time via `ForecastModelForecastList.post()` b/c all files are processed
+    by one Job. Each file's name must start with the TimeZero.timezero_date that it is for, e.g.,
+    '2020-04-12-my-model.json'. See `load_forecasts_from_archive()` for details. POST form fields:
+    - 'data_file' (required): The archive file to upload
+    - 'notes' (optional): The new Forecasts' notes
+
+    :param request: a request
+    :param pk: a ForecastModel's pk
+    :return: the serialized Job. its output_json has each file's status once done
+    """
+    # imported here so that tests can patch via mock:
+    from forecast_app.views import _upload_file, _upload_forecast_archive_worker, is_user_ok_upload_forecast
+    from forecast_repo.settings.base import MAX_UPLOAD_ARCHIVE_FILE_SIZE
+
+
+    # check authorization
+    forecast_model = get_object_or_404(ForecastModel, pk=pk)
+    if (not request.user.is_authenticated) or not is_user_ok_upload_forecast(request, forecast_model):
+        return HttpResponseForbidden()
+
+    # validate 'data_file'
+    if 'data_file' not in request.data:
+        return JsonResponse({'error': "No 'data_file' form field."}, status=status.HTTP_400_BAD_REQUEST)
+
+    data_file = request.data['data_file']  # UploadedFile (e.g., InMemoryUploadedFile or TemporaryUploadedFile)
+    if data_file.size > MAX_UPLOAD_ARCHIVE_FILE_SIZE:
+        message = f"File was too large to upload. size={data_file.size}, max={MAX_UPLOAD_ARCHIVE_FILE_SIZE}."
+        return JsonResponse({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+
+    # upload to cloud and enqueue a job to process a new Job
+    is_error, job = _upload_file(request.user, data_file, _upload_forecast_archive_worker,
+                                 type=JOB_TYPE_UPLOAD_FORECAST_ARCHIVE, forecast_model_pk=forecast_model.pk,
+                                 notes=request.data.get('notes', ''))
+    if is_error:
+        return JsonResponse({'error': f"There was an error uploading the file. The error was: '{is_error}'. "
+                                      f"forecast_model={forecast_model}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    job_serializer = JobSerializer(job, context={'request': request})
+    return JsonResponse(job_serializer.data)
+
+
+@api_view(['POST'])
+def build_ensemble_endpoint(request, pk):
+    """
+    Enqueues a Job that builds ensemble forecasts in a ForecastModel by combining other models' quantile predictions,
+    creating one new Forecast per time zero. See `build_ensemble_forecasts()` for details. POST form fields:
+    - 'ensemble' (required): a dict of the ensemble's parameters as documented in `validate_ensemble_params()`
+
+    :param request: a request
+    :param pk: the ensemble ForecastModel's pk
+    :return: the serialized Job. its output_json has each time zero's status once done
+    """
+    # imported here so that tests can patch via mock:
+    from forecast_app.views import is_user_ok_upload_forecast
+    from utils.ensemble import validate_ensemble_params, _build_ensemble_worker
+
+
+    # check authorization
+    forecast_model = get_object_or_404(ForecastModel, pk=pk)
+    if (not request.user.is_authenticated) or not is_user_ok_upload_forecast(request, forecast_model):
+        return HttpResponseForbidden()
+
+    # validate 'ensemble'
+    if 'ensemble' not in request.data:
+        return JsonResponse({'error': "No 'ensemble' form field."}, status=status.HTTP_400_BAD_REQUEST)
+
+    params = request.data['ensemble']
+    error_messages, _ = validate_ensemble_params(forecast_model.project, forecast_model, params)
+    if error_messages:
+        return JsonResponse({'error': f"Invalid ensemble. error_messages='{error_messages}', ensemble={params}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    # create and enqueue the Job
+    job = Job.objects.create(user=request.user)  # status = PENDING
+    job.input_json = {'type': JOB_TYPE_BUILD_ENSEMBLE, 'forecast_model_pk': forecast_model.pk, 'ensemble': params}
+    job.save()
+    queue = django_rq.get_queue(ENSEMBLE_QUEUE_NAME)
+    queue.enqueue(_build_ensemble_worker, job.pk)
+    job.status = Job.QUEUED
+    job.save()
+    job_serializer = JobSerializer(job, context={'request': request})
+    return JsonResponse(job_serializer.data)
+
+
 class JobDetailView(UserPassesTestMixin, generics.RetrieveAPIView):
     queryset = Job.objects.all()
     serializer_class = JobSerializer
@@ -788,10 +926,14 @@ class TruthDetail(UserPassesTestMixin, generics.RetrieveAPIView):
 @api_view(['POST'])
 def query_forecasts_endpoint(request, pk):
     """
-    Enqueues a query of the project's forecasts.
+    Enqueues a query of the project's forecasts. The query's size is first estimated (see
+    `estimate_forecast_query_rows()`), and queries that are obviously too large are rejected with a 400 response whose
+    JSON includes the 'estimate'. Otherwise the estimate is in the returned Job's input_json.
 
     POST form fields:
     - 'query' (required): a dict specifying the query parameters. see https://docs.zoltardata.com/ for documentation
+    - 'output_format' (optional): the format of the job's output file: either 'csv' (the default) or 'parquet'. see
+      utils/query_parquet.py for the latter
 
     :param request: a request
     :param pk: a Project's pk
@@ -811,6 +953,7 @@ def query_truth_endpoint(request, pk):
 
     POST form fields:
     - 'query' (required): a dict specifying the query parameters. see https://docs.zoltardata.com/ for documentation
+    - 'output_format' (optional): "" query_forecasts_endpoint()
 
     :param request: a request
     :param pk: a Project's pk
@@ -823,9 +966,73 @@ def query_truth_endpoint(request, pk):
     return _query_endpoint(request, pk, validate_truth_query, JOB_TYPE_QUERY_TRUTH, _truth_query_worker)
 
 
-def _query_endpoint(request, project_pk, query_validation_fcn, query_job_type, query_worker_fcn):
+@api_view(['POST'])
+def query_scores_endpoint(request, pk):
+    """
+    Similar to query_forecasts_endpoint(), enqueues a query of the project's forecast scores. see
+    `query_scores_for_project()` for the query's parameters.
+
+    POST form fields:
+    - 'query' (required): a dict specifying the query parameters
+    - 'output_format' (optional): "" query_forecasts_endpoint()
+
+    :param request: a request
+    :param pk: a Project's pk
+    :return: the serialized Job
+    """
+    # imported here so that tests can patch via mock:
+    from utils.scores import validate_scores_query, _scores_query_worker
+
+
+    return _query_endpoint(request, pk, validate_scores_query, JOB_TYPE_QUERY_SCORES, _scores_query_worker)
+
+
+@api_view(['POST'])
+def query_forecasts_sync_endpoint(request, pk):
+    """
+    A synchronous variant of query_forecasts_endpoint() for small queries. If the query is estimated to be small (see
+    `estimate_query_num_pred_eles()`) then it is run in the request and its rows are returned directly as CSV.
+    Otherwise, or if it turns out to be too slow or large, it is enqueued just as query_forecasts_endpoint() does and
+    the serialized Job is returned. Clients can tell which happened from the response's content type:
+    'text/csv' vs. 'application/json'. Queries whose 'output_format' is not CSV always use a Job.
+
+    POST form fields: "" query_forecasts_endpoint()
+
+    :param request: a request
+    :param pk: a Project's pk
+    :return: the query's CSV rows, or the serialized Job
     """
-    `query_forecasts_endpoint()` and `_truth_query_worker()` helper
+    # imported here so that tests can patch via mock:
+    from utils.project_queries import validate_forecasts_query, query_forecasts_for_project
+
+
+    return _query_endpoint(request, pk, validate_forecasts_query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                           query_forecasts_for_project)
+
+
+@api_view(['POST'])
+def query_truth_sync_endpoint(request, pk):
+    """
+    Similar to query_forecasts_sync_endpoint(), a synchronous variant of query_truth_endpoint() for small queries.
+
+    POST form fields: "" query_truth_endpoint()
+
+    :param request: a request
+    :param pk: a Project's pk
+    :return: the query's CSV rows, or the serialized Job
+    """
+    # imported here so that tests can patch via mock:
+    from utils.project_queries import validate_truth_query, query_truth_for_project
+
+
+    return _query_endpoint(request, pk, validate_truth_query, JOB_TYPE_QUERY_TRUTH, _truth_query_worker,
+                           query_truth_for_project)
+
+
+def _query_endpoint(request, project_pk, query_validation_fcn, query_job_type, query_worker_fcn,
+                    query_project_fcn=None):
+    """
+    `query_forecasts_endpoint()` and `_truth_query_worker()` helper, and of their synchronous variants
 
     :param request: a request
     :param project_pk: a Project's pk
@@ -835,10 +1042,13 @@ def _query_endpoint(request, project_pk, query_validation_fcn, query_job_type, q
         `_truth_query_worker`. there are two cases, which determine the return values: 1) valid query: error_messages
         is [], and ID lists are valid integers. 2) invalid query: error_messages is a list of strings, and the ID lists
         are all [].
-    :param query_job_type: is either JOB_TYPE_QUERY_FORECAST or JOB_TYPE_QUERY_TRUTH. used for the new Job's `type`
+    :param query_job_type: is one of JOB_TYPE_QUERY_FORECAST, JOB_TYPE_QUERY_TRUTH, or JOB_TYPE_QUERY_SCORES. used for
+        the new Job's `type`
     :param query_worker_fcn: an enqueue() helper function of one arg (job_pk). the function is either
         `_forecasts_query_worker` or `_truth_query_worker`
-    :return: the serialized Job
+    :param query_project_fcn: passed by the synchronous variants: either `query_forecasts_for_project()` or
+        `query_truth_for_project()`. if passed then small CSV queries are run in the request
+    :return: the serialized Job, or the query's rows as CSV if it was run in the request
     """
     if request.method != 'POST':
         return Response(f"Only POST is allowed at this endpoint", status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -854,25 +1064,103 @@ def _query_endpoint(request, project_pk, query_validation_fcn, query_job_type, q
 
     query = request.data['query']
     logger.debug(f"query_forecasts_endpoint(): query={query}")
-    error_messages, _ = query_validation_fcn(project, query)
+    error_messages, validated_query = query_validation_fcn(project, query)
     if error_messages:
         return JsonResponse({'error': f"Invalid query. error_messages='{error_messages}', query={query}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-    job = _create_query_job(project_pk, query, query_job_type, query_worker_fcn, request)
+    # validate 'output_format'
+    output_format = request.data.get('output_format', QUERY_OUTPUT_FORMAT_CSV)
+    if output_format not in QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE:
+        return JsonResponse({'error': f"Invalid 'output_format'. output_format={output_format!r}, "
+                                      f"valid formats={list(QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    # reject forecast queries that are obviously too large before running them. the estimate is returned either way.
+    # the forecast counts that the estimate, the sync size check, and shard planning are based on are computed once
+    pred_ele_counts = forecast_query_pred_ele_counts(project, query, validated_query) \
+        if query_job_type == JOB_TYPE_QUERY_FORECAST else None
+    estimate = estimate_forecast_query_rows(project, query, validated_query, pred_ele_counts) \
+        if query_job_type == JOB_TYPE_QUERY_FORECAST else None
+    if estimate and is_query_estimate_too_large(estimate):
+        return JsonResponse({'error': f"Query too large. estimated number of prediction elements="
+                                      f"{estimate['num_pred_eles']}, maximum={MAX_NUM_QUERY_ROWS}. please narrow the "
+                                      f"query, e.g., by selecting fewer models, time zeros, units, or targets",
+                             'estimate': estimate},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    # try running small queries in the request
+    if query_project_fcn and (output_format == QUERY_OUTPUT_FORMAT_CSV):
+        num_pred_eles = estimate_query_num_pred_eles(project, query_job_type, query, validated_query, pred_ele_counts)
+        rows = run_small_query(project, query, query_project_fcn) \
+            if (num_pred_eles is not None) and (num_pred_eles <= QUERY_SYNC_MAX_NUM_PRED_ELES) else None
+        if rows is not None:
+            logger.debug(f"query_forecasts_endpoint(): query run in request. num_pred_eles={num_pred_eles}, "
+                         f"num_rows={len(rows)}")
+            return _csv_response_for_rows(rows, f"project-{project.name}-query.csv")
+
+    query_hash, data_version = query_cache_key(project, query_job_type, query, validated_query, output_format)
+    shard_queries = plan_forecast_query_shards(project, query, validated_query, pred_ele_counts=pred_ele_counts) \
+        if query_job_type == JOB_TYPE_QUERY_FORECAST else []
+    job = _create_query_job(project_pk, query, query_job_type, query_worker_fcn, request, query_hash, data_version,
+                            shard_queries, output_format, estimate)
     job_serializer = JobSerializer(job, context={'request': request})
     logger.debug(f"query_forecasts_endpoint(): query enqueued. job={job}")
     return JsonResponse(job_serializer.data)
 
 
-def _create_query_job(project_pk, query, query_job_type, query_worker_fcn, request):
+def _create_query_job(project_pk, query, query_job_type, query_worker_fcn, request, query_hash, data_version,
+                      shard_queries=None, output_format=QUERY_OUTPUT_FORMAT_CSV, estimate=None):
+    """
+    `_query_endpoint()` helper that creates and enqueues a query Job, or, if the query result cache has an output for
+    query_hash, creates an already-successful one that shares it.
+
+    :param shard_queries: an optional list of shard queries as returned by `plan_forecast_query_shards()`. if passed
+        then each one is run by a shard Job, whose outputs are then merged into the returned Job's
+    :param output_format: one of QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE's keys
+    :param estimate: an optional estimate of the query's size as returned by `estimate_forecast_query_rows()`. saved in
+        the Job's input_json so that callers can see it
+    :return: the new Job
+    """
+    input_json = {'type': query_job_type, 'project_pk': project_pk, 'query': query, 'query_hash': query_hash,
+                  'data_version': data_version, 'output_format': output_format}
+    if estimate is not None:
+        input_json['estimate'] = estimate
+
+    # a query result cache hit completes at once, sharing the previous job's output. we touch that job so that
+    # `delete_old_jobs_app()` evicts the least recently used outputs first
+    cached_job = cached_query_job(query_hash)
+    if cached_job:
+        cached_job.save(update_fields=['updated_at'])
+        job = Job.objects.create(user=request.user, status=Job.SUCCESS, input_json=input_json,
+                                 output_json={'num_rows': cached_job.output_json.get('num_rows'),
+                                              'cached_job_pk': cached_job.pk})
+        logger.debug(f"_create_query_job(): query result cache hit. cached_job={cached_job}, job={job}")
+        return job
+
     job = Job.objects.create(user=request.user)  # status = PENDING
-    job.input_json = {'type': query_job_type, 'project_pk': project_pk, 'query': query}
+    job.input_json = input_json
     job.save()
     queue = django_rq.get_queue(QUERY_FORECAST_QUEUE_NAME)
-    queue.enqueue(query_worker_fcn, job.pk)
+    if not shard_queries:
+        queue.enqueue(query_worker_fcn, job.pk)
+        job.status = Job.QUEUED
+        job.save()
+        return job
+
+    # sharded query. shard Jobs have no user so that failures are only emailed once, via the parent. all are QUEUED
+    # before any are enqueued so that a shard that finishes right away does not have its status overwritten, and so
+    # that `_query_shard_done()` sees the parent as QUEUED
+    shard_jobs = [Job.objects.create(status=Job.QUEUED, parent_job=job,
+                                     input_json={'type': JOB_TYPE_QUERY_FORECAST_SHARD, 'project_pk': project_pk,
+                                                 'query': shard_query, 'shard_idx': shard_idx,
+                                                 'output_format': output_format})
+                  for shard_idx, shard_query in enumerate(shard_queries)]
     job.status = Job.QUEUED
+    job.output_json = {'num_shards': len(shard_jobs), 'num_shards_done': 0}
     job.save()
+    for shard_job in shard_jobs:
+        queue.enqueue(query_worker_fcn, shard_job.pk)
     return job
 
 
@@ -924,7 +1212,7 @@ def download_job_data(request, pk):
     A note regarding Job "type": Currently there is no Job.type IV, so we have to infer it from Job.input_json, which
     will have a 'query' key if it was created by `query_forecasts_endpoint()`.
 
-    :return: a Job's data as CSV
+    :return: a Job's data as CSV, or as Parquet if that was the query's 'output_format'
     """
     job = get_object_or_404(Job, pk=pk)
     if (not request.user.is_authenticated) or ((not request.user.is_superuser) and (not request.user == job.user)):
@@ -939,7 +1227,8 @@ def download_job_data(request, pk):
 def _download_job_data_request(job):
     """
     :param job: a Job
-    :return: the data file corresponding to `job` as a CSV file
+    :return: the data file corresponding to `job` as a CSV file, or as a Parquet one if that was its 'output_format'.
+        older jobs have no 'output_format', and are CSV
     """
     # imported here so that tests can patch via mock:
     from utils.cloud_file import download_file, _file_name_for_object
@@ -947,15 +1236,17 @@ def _download_job_data_request(job):
 
     with tempfile.TemporaryFile() as cloud_file_fp:  # <class '_io.BufferedRandom'>
         try:
-            download_file(job, cloud_file_fp)
+            download_file(job.output_job(), cloud_file_fp)
             cloud_file_fp.seek(0)  # yes you have to do this!
 
             # https://stackoverflow.com/questions/16538210/downloading-files-from-amazon-s3-using-django
-            csv_filename = get_valid_filename(f'job-{_file_name_for_object(job)}-data.csv')
+            output_format = job.input_json.get('output_format', QUERY_OUTPUT_FORMAT_CSV) \
+                if isinstance(job.input_json, dict) else QUERY_OUTPUT_FORMAT_CSV
+            data_filename = get_valid_filename(f'job-{_file_name_for_object(job)}-data.{output_format}')
             wrapper = FileWrapper(cloud_file_fp)
-            response = HttpResponse(wrapper, content_type='text/csv')
+            response = HttpResponse(wrapper, content_type=QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE[output_format])
             # response['Content-Length'] = os.path.getsize('/tmp/'+fname)
-            response['Content-Disposition'] = 'attachment; filename="{}"'.format(str(csv_filename))
+            response['Content-Disposition'] = 'attachment; filename="{}"'.format(str(data_filename))
             return response
         except (BotoCoreError, Boto3Error, ClientError, ConnectionClosedError) as aws_exc:
             logger.debug(f"download_job_data(): AWS error: {aws_exc!r}. job={job}")
@@ -974,27 +1265,48 @@ def _download_job_data_request(job):
 def download_latest_forecasts(request, pk):
     """
     :return: `latest_forecast_cols_for_project()` output as CSV. for now just does returns a list of the 2-tuples:
-        (Forecast.id, Forecast.source), but later may generalize to allow passing specific columns in `request`
+        (Forecast.id, Forecast.source), but later may generalize to allow passing specific columns in `request`. the
+        response is streamed, so rows go from the database's cursor to the client without being held in memory
     """
     project = get_object_or_404(Project, pk=pk)
     if (not request.user.is_authenticated) or not is_user_ok_view_project(request.user, project):
         return HttpResponseForbidden()
 
-    response = HttpResponse(content_type='text/csv')
-    csv_filename = get_valid_filename(f"project-{project.name}-latest-forecasts.csv")
-    response['Content-Disposition'] = 'attachment; filename="{}"'.format(str(csv_filename))
-
     # for now just does returns a list of the 2-tuples: (Forecast.id, Forecast.source)
     rows = latest_forecast_cols_for_project(project, is_incl_fm_id=False, is_incl_tz_id=False,
                                             is_incl_issued_at=False, is_incl_created_at=False,
                                             is_incl_source=True, is_incl_notes=False)
-    writer = csv.writer(response)
-    writer.writerow(['forecast_id', 'source'])  # header
+    writer = csv.writer(_Echo())
 
     # process rows, cleaning up for csv:
     # - [maybe later] render date and datetime objects as strings: 'issued_at', 'created_at'
     # - remove \n from free form text: 'source', [maybe later] 'notes'
-    for f_id, source in rows:
-        writer.writerow([f_id, source.replace('\n', '_')])
+    csv_lines = itertools.chain([writer.writerow(['forecast_id', 'source'])],  # header
+                                (writer.writerow([f_id, source.replace('\n', '_')]) for f_id, source in rows))
+    response = StreamingHttpResponse(csv_lines, content_type='text/csv')
+    csv_filename = get_valid_filename(f"project-{project.name}-latest-forecasts.csv")
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(str(csv_filename))
+    return response
+
 
+def _csv_response_for_rows(rows, csv_filename):
+    """
+    :param rows: a list of CSV rows, including the header
+    :param csv_filename: the attachment's filename
+    :return: a StreamingHttpResponse of rows as CSV
+    """
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(str(get_valid_filename(csv_filename)))
     return response
+
+
+class _Echo:
+    """
+    A write-only file-like object whose `write()` returns what's written to it, which lets a `csv.writer` produce lines
+    for a StreamingHttpResponse. per https://docs.djangoproject.com/en/3.1/howto/outputting-csv/#streaming-large-csv-files
+    """
+
+
+    def write(self, value):
+        return value
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+#
+# Widens PredictionElement.data_hash to hold scheme-prefixed hashes (see PredictionElement.hash_for_canonical_json()).
+# Existing MD5 hashes are unchanged.
+#
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0020_target'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='predictionelement',
+            name='data_hash',
+            field=models.CharField(max_length=40),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.1.13 on 2026-10-17 05:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+#
+# Schema and data migration for LatestPredictionElement. I edited the Django-generated file to add the RunSQL, which
+# populates the new table from all existing forecasts using the same ranking as `_query_forecasts_sql_for_pred_class()`.
+# It is the equivalent of `rebuild_latest_pred_eles_for_project()` on every project, but does not import that function
+# so that it is not affected by later model changes.
+#
+
+POPULATE_LATEST_SQL = """
+    INSERT INTO forecast_app_latestpredictionelement
+        (forecast_model_id, time_zero_id, unit_id, target_id, pred_class, pred_ele_id)
+    SELECT ranked_rows.fm_id, ranked_rows.tz_id, ranked_rows.unit_id, ranked_rows.target_id, ranked_rows.pred_class,
+           ranked_rows.pred_ele_id
+    FROM (SELECT f.forecast_model_id  AS fm_id,
+                 f.time_zero_id       AS tz_id,
+                 pred_ele.id          AS pred_ele_id,
+                 pred_ele.pred_class  AS pred_class,
+                 pred_ele.unit_id     AS unit_id,
+                 pred_ele.target_id   AS target_id,
+                 pred_ele.is_retract  AS is_retract,
+                 RANK() OVER (
+                     PARTITION BY f.forecast_model_id, f.time_zero_id, pred_ele.unit_id, pred_ele.target_id,
+                         pred_ele.pred_class
+                     ORDER BY f.issued_at DESC) AS rownum
+          FROM forecast_app_predictionelement AS pred_ele
+                   JOIN forecast_app_forecast AS f ON pred_ele.forecast_id = f.id) AS ranked_rows
+    WHERE ranked_rows.rownum = 1
+      AND NOT ranked_rows.is_retract;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forecast_app', '0021_prediction_element_data_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestPredictionElement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pred_class', models.IntegerField(choices=[(0, 'bin'), (1, 'named'), (2, 'point'), (3, 'sample'), (4, 'quantile')])),
+                ('forecast_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.forecastmodel')),
+                ('pred_ele', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.predictionelement')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.target')),
+                ('time_zero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.timezero')),
+                ('unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.unit')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='latestpredictionelement',
+            index=models.Index(fields=['forecast_model', 'time_zero', 'unit', 'target', 'pred_class'], name='latest_pred_ele_key'),
+        ),
+        migrations.RunSQL(POPULATE_LATEST_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+#
+# Schema and data migration for PredictionElement's validity intervals (`valid_from` and `valid_to`). valid_from is
+# added as nullable so that the RunSQL can fill both fields from existing forecasts' issued_ats, and then made required.
+# The SQL is a copy of `PRED_ELE_VALIDITY_UPDATE_SQL` (applied to all forecasts) so that it is not affected by later
+# changes.
+#
+
+POPULATE_VALIDITY_SQL = """
+    UPDATE forecast_app_predictionelement
+    SET valid_from = (SELECT f.issued_at FROM forecast_app_forecast AS f
+                      WHERE f.id = forecast_app_predictionelement.forecast_id),
+        valid_to   = (SELECT MIN(newer_f.issued_at)
+                      FROM forecast_app_predictionelement AS newer_pred_ele
+                               JOIN forecast_app_forecast AS newer_f ON newer_pred_ele.forecast_id = newer_f.id
+                               JOIN forecast_app_forecast AS f ON f.id = forecast_app_predictionelement.forecast_id
+                      WHERE newer_f.forecast_model_id = f.forecast_model_id
+                        AND newer_f.time_zero_id = f.time_zero_id
+                        AND newer_f.issued_at > f.issued_at
+                        AND newer_pred_ele.unit_id = forecast_app_predictionelement.unit_id
+                        AND newer_pred_ele.target_id = forecast_app_predictionelement.target_id
+                        AND newer_pred_ele.pred_class = forecast_app_predictionelement.pred_class);
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0022_latest_prediction_element'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionelement',
+            name='valid_from',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='predictionelement',
+            name='valid_to',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunSQL(POPULATE_VALIDITY_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='predictionelement',
+            name='valid_from',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='predictionelement',
+            index=models.Index(fields=['forecast', 'valid_to'], name='pred_ele_forecast_valid_to'),
+        ),
+    ]
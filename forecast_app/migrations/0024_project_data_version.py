@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0023_prediction_element_validity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='data_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.13 on 2026-10-17 06:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forecast_app', '0024_project_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(choices=[(0, 'abs_error'), (1, 'wis'), (2, 'interval_50'), (3, 'interval_95'), (4, 'coverage_50'), (5, 'coverage_95'), (6, 'log_score'), (7, 'pit'), (8, 'crps')])),
+                ('value', models.FloatField()),
+                ('pred_ele', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.predictionelement')),
+                ('truth_pred_ele', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forecast_app.predictionelement')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='forecastscore',
+            constraint=models.UniqueConstraint(fields=('pred_ele', 'score'), name='unique_forecast_score'),
+        ),
+    ]
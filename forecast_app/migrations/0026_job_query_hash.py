@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def copy_query_hashes(apps, schema_editor):
+    """
+    Moves existing cache entries' 'query_hash' from Job.output_json to the new column.
+    """
+    Job = apps.get_model('forecast_app', 'Job')
+    for job in Job.objects.filter(output_json__has_key='query_hash').iterator():
+        job.query_hash = job.output_json.pop('query_hash')
+        job.save(update_fields=['query_hash', 'output_json'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0025_forecast_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='query_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(copy_query_hashes, migrations.RunPython.noop),
+    ]
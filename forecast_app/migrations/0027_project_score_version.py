@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0026_job_query_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='score_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
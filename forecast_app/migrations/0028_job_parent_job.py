@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_parent_job_pks(apps, schema_editor):
+    """
+    Moves existing shard jobs' 'parent_job_pk' from Job.input_json to the new column. Shards whose parents no longer
+    exist are left without one.
+    """
+    Job = apps.get_model('forecast_app', 'Job')
+    for job in Job.objects.filter(input_json__has_key='parent_job_pk').iterator():
+        parent_job_pk = job.input_json.pop('parent_job_pk')
+        job.parent_job_id = parent_job_pk if Job.objects.filter(pk=parent_job_pk).exists() else None
+        job.save(update_fields=['parent_job', 'input_json'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('forecast_app', '0027_project_score_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='parent_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='shard_jobs', to='forecast_app.job'),
+        ),
+        migrations.RunPython(copy_parent_job_pks, migrations.RunPython.noop),
+    ]
@@ -4,7 +4,9 @@
 from .forecast import Forecast
 from .forecast_metadata import ForecastMetadataCache, ForecastMetaPrediction, ForecastMetaUnit, ForecastMetaTarget
 from .forecast_model import ForecastModel
+from .forecast_score import ForecastScore
 from .job import Job
+from .latest_prediction_element import LatestPredictionElement
 from .prediction_data import PredictionData
 from .prediction_element import PredictionElement
 from .project import Project, Unit, TimeZero
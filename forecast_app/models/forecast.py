@@ -1,6 +1,6 @@
 import django
-from django.db import models, connection
-from django.db.models.signals import pre_save, pre_delete
+from django.db import models, connection, transaction
+from django.db.models.signals import pre_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.urls import reverse
 
@@ -57,12 +57,15 @@ class Forecast(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Defaults issued_at to now if not passed.
+        Defaults issued_at to now if not passed. Saves in a transaction so that the version rules checked by
+        `pre_validate_new_or_edited_forecast()` and the save itself are atomic with respect to other uploads to the
+        same model and time zero (see `lock_forecast_versions()`).
         """
         if not self.issued_at:
             self.issued_at = django.utils.timezone.now()
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
     def get_absolute_url(self):
@@ -101,6 +104,7 @@ class Forecast(models.Model):
 
 @receiver(pre_save, sender=Forecast)
 def pre_validate_new_or_edited_forecast(instance, **kwargs):
+    lock_forecast_versions(instance.forecast_model_id, instance.time_zero_id)
     if instance.pk is None:  # creating a Forecast
         # validate the rule: "you cannot position a new forecast before any existing versions"
         newest_version = _newest_forecast_version(instance.forecast_model, instance.time_zero)
@@ -120,9 +124,21 @@ def pre_validate_new_or_edited_forecast(instance, **kwargs):
             raise RuntimeError(f"editing a version's issued_at cannot reposition it before any existing forecasts. "
                                f"forecast={instance}, db_forecasts={db_forecasts}, new_forecasts={new_forecasts}")
 
+        # move instance's prediction elements' validity intervals, and those of the ones it supersedes
+        old_issued_at = next((forecast.issued_at for forecast in db_forecasts if forecast.pk == instance.pk), None)
+        if old_issued_at and (old_issued_at != instance.issued_at):
+            from utils.forecast import update_pred_ele_validity_for_issued_at  # avoid circular imports
+            from utils.project_queries import bump_project_data_version  # ""
+
+
+            update_pred_ele_validity_for_issued_at(instance, old_issued_at)
+            bump_project_data_version(instance.forecast_model.project_id)  # changes `as_of` query results
+
 
 @receiver(pre_delete, sender=Forecast)
 def pre_validate_deleted_forecast(instance, **kwargs):
+    lock_forecast_versions(instance.forecast_model_id, instance.time_zero_id)
+
     # validate the rule: "you cannot delete a forecast that has any newer versions"
     is_newer_forecasts = Forecast.objects.filter(forecast_model=instance.forecast_model,
                                                  time_zero=instance.time_zero,
@@ -131,6 +147,43 @@ def pre_validate_deleted_forecast(instance, **kwargs):
         raise RuntimeError(f"you cannot delete a forecast that has any newer versions. forecast={instance}")
 
 
+@receiver(post_delete, sender=Forecast)
+def update_derived_pred_ele_data_for_deleted_forecast(instance, **kwargs):
+    from utils.forecast import rebuild_latest_pred_eles_for_version, \
+        update_pred_ele_validity_for_deleted_forecast  # avoid circular imports
+    from utils.project_queries import bump_project_data_version  # ""
+
+
+    # deleting instance's PredictionElements cascaded to their LatestPredictionElements, which un-masks any previous
+    # versions' elements. we are still in the deleting transaction and so hold the lock taken by pre_delete
+    update_pred_ele_validity_for_deleted_forecast(instance)
+    rebuild_latest_pred_eles_for_version(instance.forecast_model_id, instance.time_zero_id)
+    bump_project_data_version(instance.forecast_model.project_id)  # invalidates cached query outputs
+
+
+#
+# lock_forecast_versions()
+#
+
+def lock_forecast_versions(forecast_model_id, time_zero_id):
+    """
+    Serializes version rule checks and the writes that depend on them for the versions identified by
+    (forecast_model_id, time_zero_id). On postgres this takes a transaction-level advisory lock that's held until the
+    current transaction ends, so uploads to different models or time zeros do not block each other. Callers must be in
+    a transaction for the lock to cover anything beyond this call. Does nothing on other databases (sqlite serializes
+    all writers anyway). Locks are re-entrant, and callers that lock more than one time zero do so in time_zero_id
+    order to avoid deadlocks.
+
+    :param forecast_model_id: a ForecastModel's pk
+    :param time_zero_id: a TimeZero's pk
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s);", (forecast_model_id, time_zero_id,))
+
+
 #
 # _newest_forecast_version()
 #
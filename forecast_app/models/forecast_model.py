@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 
 from forecast_app.models.project import Project
@@ -152,3 +154,17 @@ class ForecastModel(models.Model):
         :return: the first Forecast in me corresponding to time_zero. returns None o/w. NB: tests for object equality
         """
         return self.forecasts.filter(time_zero=time_zero).first()
+
+
+#
+# set up signals to invalidate cached query outputs when models change. NB: queries output model abbreviations, and
+# deletes cascade to forecast data
+#
+
+@receiver(post_save, sender=ForecastModel)
+@receiver(post_delete, sender=ForecastModel)
+def bump_data_version_for_forecast_model(instance, **kwargs):
+    from utils.project_queries import bump_project_data_version  # avoid circular imports
+
+
+    bump_project_data_version(instance.project_id)
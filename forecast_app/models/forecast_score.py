@@ -0,0 +1,83 @@
+from django.db import models
+
+from forecast_app.models.prediction_element import PredictionElement
+from utils.utilities import basic_str
+
+
+#
+# ForecastScore
+#
+
+class ForecastScore(models.Model):
+    """
+    A derived table that holds the scores of forecasts' prediction elements against the project's truth, i.e., one row
+    per (forecast, unit, target, score), where the forecast, unit, and target are pred_ele's and the prediction class is
+    implied by the score (see SCORE_TO_PRED_CLASS). Scores are computed against the latest truth for pred_ele's
+    (time zero, unit, target), which is truth_pred_ele, so replacing that truth makes its scores stale. Kept up to date
+    incrementally by `update_scores_for_project()`, and queried by `query_scores_for_project()` (see utils/scores.py).
+    """
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pred_ele', 'score'], name='unique_forecast_score'),
+        ]
+
+
+    # scores
+    ABS_ERROR = 0  # point
+    WIS = 1  # quantile: weighted interval score
+    INTERVAL_50 = 2  # "": interval score of the central 50% interval, i.e., the (0.25, 0.75) quantiles
+    INTERVAL_95 = 3  # "" 95% interval, i.e., the (0.025, 0.975) quantiles
+    COVERAGE_50 = 4  # "": 1 if the truth is in the central 50% interval, and 0 o/w
+    COVERAGE_95 = 5  # "" 95% interval
+    LOG_SCORE = 6  # bin
+    PIT = 7  # "": probability integral transform
+    CRPS = 8  # sample: continuous ranked probability score
+    SCORE_CHOICES = (
+        (ABS_ERROR, 'abs_error'),
+        (WIS, 'wis'),
+        (INTERVAL_50, 'interval_50'),
+        (INTERVAL_95, 'interval_95'),
+        (COVERAGE_50, 'coverage_50'),
+        (COVERAGE_95, 'coverage_95'),
+        (LOG_SCORE, 'log_score'),
+        (PIT, 'pit'),
+        (CRPS, 'crps'),
+    )
+
+    pred_ele = models.ForeignKey(PredictionElement, related_name='+', on_delete=models.CASCADE)
+    truth_pred_ele = models.ForeignKey(PredictionElement, related_name='+', on_delete=models.CASCADE)
+    score = models.IntegerField(choices=SCORE_CHOICES)
+    value = models.FloatField()
+
+
+    def __repr__(self):
+        return str((self.pk, self.pred_ele_id, self.truth_pred_ele_id, self.score_as_str(), self.value))
+
+
+    def __str__(self):  # todo
+        return basic_str(self)
+
+
+    def score_as_str(self):
+        return SCORE_INT_TO_NAME.get(self.score, '!?')
+
+
+#
+# ---- score name and prediction class mappings ----
+#
+
+SCORE_INT_TO_NAME = {score_int: score_name for score_int, score_name in ForecastScore.SCORE_CHOICES}
+SCORE_NAME_TO_INT = {score_name: score_int for score_int, score_name in ForecastScore.SCORE_CHOICES}
+
+# the prediction class that each score is computed from
+SCORE_TO_PRED_CLASS = {ForecastScore.ABS_ERROR: PredictionElement.POINT_CLASS,
+                       ForecastScore.WIS: PredictionElement.QUANTILE_CLASS,
+                       ForecastScore.INTERVAL_50: PredictionElement.QUANTILE_CLASS,
+                       ForecastScore.INTERVAL_95: PredictionElement.QUANTILE_CLASS,
+                       ForecastScore.COVERAGE_50: PredictionElement.QUANTILE_CLASS,
+                       ForecastScore.COVERAGE_95: PredictionElement.QUANTILE_CLASS,
+                       ForecastScore.LOG_SCORE: PredictionElement.BIN_CLASS,
+                       ForecastScore.PIT: PredictionElement.BIN_CLASS,
+                       ForecastScore.CRPS: PredictionElement.SAMPLE_CLASS}
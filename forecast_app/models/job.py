@@ -16,7 +16,7 @@ from rq.timeouts import JobTimeoutException
 
 from forecast_repo.settings.base import UPLOAD_FILE_QUEUE_NAME
 from utils.cloud_file import delete_file
-from utils.utilities import basic_str
+from utils.utilities import basic_str, IngestStats
 
 
 logger = logging.getLogger(__name__)
@@ -33,9 +33,13 @@ logger = logging.getLogger(__name__)
 
 JOB_TYPE_QUERY_FORECAST = 'QUERY_FORECAST'
 JOB_TYPE_QUERY_TRUTH = 'JOB_TYPE_QUERY_TRUTH'
+JOB_TYPE_QUERY_FORECAST_SHARD = 'QUERY_FORECAST_SHARD'
+JOB_TYPE_QUERY_SCORES = 'QUERY_SCORES'
 JOB_TYPE_DELETE_FORECAST = 'DELETE_FORECAST'
 JOB_TYPE_UPLOAD_TRUTH = 'UPLOAD_TRUTH'
 JOB_TYPE_UPLOAD_FORECAST = 'UPLOAD_FORECAST'
+JOB_TYPE_UPLOAD_FORECAST_ARCHIVE = 'UPLOAD_FORECAST_ARCHIVE'
+JOB_TYPE_BUILD_ENSEMBLE = 'BUILD_ENSEMBLE'
 
 
 #
@@ -79,6 +83,15 @@ class Job(models.Model):
     # app-specific results from a successful completion of the upload. ex: 'forecast_pk':
     output_json = models.JSONField(null=True, blank=True)
 
+    # set only for successful query jobs whose uploaded output can be reused by later identical queries. see
+    # `query_cache_key()`. indexed b/c `cached_query_job()` looks it up for every query submitted
+    query_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+
+    # set only for the shard jobs of a sharded query, to the query's job. see `plan_forecast_query_shards()`. a foreign
+    # key (and therefore indexed) b/c `_query_shard_done()` looks up a parent's shards every time one of them finishes
+    parent_job = models.ForeignKey('self', related_name='shard_jobs', on_delete=models.SET_NULL, null=True,
+                                   blank=True)
+
 
     def __repr__(self):
         return str((self.pk, self.user, self.status_as_str(),
@@ -128,6 +141,42 @@ class Job(models.Model):
         return self.updated_at - self.created_at
 
 
+    def output_job(self):
+        """
+        :return: the Job whose cloud file holds my output data. this is me unless I am a query result cache hit (see
+            `_create_query_job()`), in which case it is the job whose output I share. returns me if that job has been
+            deleted
+        """
+        cached_job_pk = (self.output_json or {}).get('cached_job_pk')
+        if cached_job_pk is None:
+            return self
+
+        return Job.objects.filter(pk=cached_job_pk).first() or self
+
+
+    #
+    # ingest stats-related functions
+    #
+
+    def ingest_stats(self):
+        """
+        :return: an IngestStats that continues from my output_json's 'ingest_stats', if any. `job_cloud_file()` saves
+            the download's stats there so that upload workers can add theirs
+        """
+        return IngestStats.from_dict((self.output_json or {}).get('ingest_stats'))
+
+
+    def set_ingest_stats(self, stats, project_pk):
+        """
+        Saves stats and project_pk in my output_json, keeping its other keys. Does not save me. The two are aggregated
+        by `views.zadmin_jobs()`.
+
+        :param stats: an IngestStats
+        :param project_pk: the pk of the Project that was uploaded to
+        """
+        self.output_json = {**(self.output_json or {}), 'project_pk': project_pk, 'ingest_stats': stats.as_dict()}
+
+
     #
     # RQ service-specific functions
     #
@@ -174,9 +223,13 @@ def job_cloud_file(job_pk):
     with tempfile.TemporaryFile() as cloud_file_fp:  # <class '_io.BufferedRandom'>
         try:
             logger.debug(f"job_cloud_file(): 2/4 Downloading from cloud. job={job}")
-            download_file(job, cloud_file_fp)
+            stats = IngestStats()
+            with stats.stage('download'):
+                download_file(job, cloud_file_fp)
+            stats.add_count('num_bytes_downloaded', cloud_file_fp.tell())
             cloud_file_fp.seek(0)  # yes you have to do this!
             job.status = Job.CLOUD_FILE_DOWNLOADED
+            job.output_json = {**(job.output_json or {}), 'ingest_stats': stats.as_dict()}  # see `ingest_stats()`
             job.save()
 
             # make the context call. we need TextIOWrapper ('a buffered text stream over a BufferedIOBase binary
@@ -0,0 +1,47 @@
+from django.db import models
+
+from forecast_app.models.prediction_element import PredictionElement
+from utils.utilities import basic_str
+
+
+#
+# LatestPredictionElement
+#
+
+class LatestPredictionElement(models.Model):
+    """
+    A derived table that holds the ids of the currently-latest, non-retracted PredictionElements for each (forecast
+    model, time zero, unit, target, prediction class), i.e., exactly the rows that `_query_forecasts_sql_for_pred_class()`
+    ranks its way to when there is no `as_of` and retractions are excluded. Lets those (the most common) queries skip
+    ranking every version of every forecast. Kept up to date in the same transaction as forecast loads and deletes (see
+    `update_latest_pred_eles_for_forecast()` and `rebuild_latest_pred_eles_for_version()`), and can be rebuilt and
+    verified via utils/latest_pred_eles_util.py's `rebuild` and `verify` subcommands (see
+    `rebuild_latest_pred_eles_for_project()` and `verify_latest_pred_eles_for_project()`). Other fields are copied from
+    pred_ele so that queries can filter without joining through Forecast. NB: there can be more than one row per key,
+    which happens only for truth forecasts with duplicate rows (see `_insert_pred_ele_rows()`'s `is_dups_allowed`). The
+    ranked query returns them all, and so do we.
+    """
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['forecast_model', 'time_zero', 'unit', 'target', 'pred_class'],
+                         name='latest_pred_ele_key'),
+        ]
+
+
+    forecast_model = models.ForeignKey('ForecastModel', related_name='+', on_delete=models.CASCADE)
+    time_zero = models.ForeignKey('TimeZero', related_name='+', on_delete=models.CASCADE)
+    unit = models.ForeignKey('Unit', related_name='+', on_delete=models.CASCADE)
+    target = models.ForeignKey('Target', related_name='+', on_delete=models.CASCADE)
+    pred_class = models.IntegerField(choices=PredictionElement.PRED_CLASS_CHOICES)
+    pred_ele = models.OneToOneField(PredictionElement, related_name='+', on_delete=models.CASCADE)
+
+
+    def __repr__(self):
+        return str((self.pk, self.forecast_model_id, self.time_zero_id, self.unit_id, self.target_id,
+                    self.pred_class, self.pred_ele_id))
+
+
+    def __str__(self):  # todo
+        return basic_str(self)
@@ -15,6 +15,13 @@ class PredictionElement(models.Model):
     Represents a prediction element as loaded from a "JSON IO dict" (aka 'json_io_dict' by callers).
     """
 
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['forecast', 'valid_to'], name='pred_ele_forecast_valid_to'),
+        ]
+
+
     # prediction classes. corresponds to json_io_dict's 'class' key
     BIN_CLASS = 0
     NAMED_CLASS = 1
@@ -35,7 +42,13 @@ class PredictionElement(models.Model):
     target = models.ForeignKey('Target', on_delete=models.CASCADE)
     is_retract = models.BooleanField(default=False)
 
-    # A binary MD5 hex hash of input "prediction" dict (converted to a json string), e.g., input dicts like:
+    # data_hash schemes. see `hash_for_canonical_json()`
+    MD5_HASH_SCHEME = 'md5'  # legacy: 32 MD5 hex chars, no prefix
+    BLAKE2B_HASH_SCHEME = 'b2'  # BLAKE2B_HASH_PREFIX + 32 hex chars of a blake2b hash truncated to 16 bytes
+    BLAKE2B_HASH_PREFIX = 'b2:'
+    DEFAULT_HASH_SCHEME = BLAKE2B_HASH_SCHEME
+
+    # A hex hash of input "prediction" dict (converted to a canonical json string), e.g., input dicts like:
     #
     #   {"family": "pois", "param1": 1.1}
     #   {"value": 5}
@@ -45,8 +58,19 @@ class PredictionElement(models.Model):
     #
     # This hash is used by `load_predictions_from_json_io_dict()` to compare prediction elements for equality so that
     # duplicate data can be skipped. The algorithm we use to calculate this hash is as implemented in
-    # `hash_for_prediction_data_dict()`. we store '' if is_retract b/c there is no PredictionData and therefore no hash
-    data_hash = models.CharField(max_length=32)  # length based on output from hashlib.md5(s).hexdigest()
+    # `hash_for_canonical_json()`, which supports more than one hash scheme: older rows have plain MD5 hashes, and newer
+    # ones are prefixed with their scheme. Comparisons are only made between versions of the same forecast (i.e., same
+    # model and time zero), and all versions of a forecast use the same scheme (see `_data_hash_scheme()`).
+    # we store '' if is_retract b/c there is no PredictionData and therefore no hash
+    data_hash = models.CharField(max_length=40)  # length based on the longest scheme ('b2:' + 32 hex chars)
+
+    # My validity interval within my forecast's versions, i.e., the `as_of`s for which I am the latest prediction element
+    # for my (unit, target, pred_class): valid_from <= as_of < valid_to. valid_from is my forecast's issued_at, and
+    # valid_to is the issued_at of the oldest newer version that has a prediction element (possibly a retraction) for my
+    # (unit, target, pred_class), or None if there is none. Maintained by `_insert_pred_ele_rows()` and Forecast's
+    # signals. Lets `as_of` queries do a range lookup instead of ranking versions.
+    valid_from = models.DateTimeField()
+    valid_to = models.DateTimeField(null=True)
 
 
     def __repr__(self):
@@ -68,20 +92,59 @@ class PredictionElement(models.Model):
 
 
     @classmethod
-    def hash_for_prediction_data_dict(cls, prediction_data):
+    def hash_for_prediction_data_dict(cls, prediction_data, hash_scheme=DEFAULT_HASH_SCHEME):
         """
         Top-level method for computing the hash of a json_io_dict's "prediction" value. This function is not meant to be
-        general to any dict, just json_io_dict ones. Recall MD5 is 128 bits (16 bytes).
+        general to any dict, just json_io_dict ones. Callers that also need the serialized data (e.g., for loading
+        PredictionData) should instead call `canonical_json_for_prediction_data_dict()` and then
+        `hash_for_canonical_json()` to avoid serializing twice.
 
         :param prediction_data: the json_io_dict's "prediction" value, e.g.,
-            {"family": "pois", "param1": 1.1}  -> '845e3d041b6be23a381b6afd263fb113'
+            {"family": "pois", "param1": 1.1}  -> 'b2:...' (or '845e3d041b6be23a381b6afd263fb113' for MD5_HASH_SCHEME)
             {"value": 5}
             {"sample": [0, 2, 5]}
             {"cat": [0, 2, 50], "prob": [0.0, 0.1, 0.9]}
             {"quantile": [0.25, 0.75], "value": [0, 50]}
-        :return: MD5 hex hash of `prediction_data` as `str`
+        :param hash_scheme: one of the *_HASH_SCHEME constants
+        :return: hex hash of `prediction_data` as `str`
+        """
+        return cls.hash_for_canonical_json(cls.canonical_json_for_prediction_data_dict(prediction_data), hash_scheme)
+
+
+    @classmethod
+    def canonical_json_for_prediction_data_dict(cls, prediction_data):
+        """
+        :param prediction_data: the json_io_dict's "prediction" value
+        :return: the canonical (sorted-key) JSON `str` for prediction_data. this is both what's hashed and what's stored
+            in PredictionData
+        """
+        return json.dumps(prediction_data, sort_keys=True)
+
+
+    @classmethod
+    def hash_for_canonical_json(cls, canonical_json, hash_scheme):
+        """
+        :param canonical_json: as returned by `canonical_json_for_prediction_data_dict()`
+        :param hash_scheme: one of the *_HASH_SCHEME constants
+        :return: hex hash of canonical_json as `str`. recall MD5 is 128 bits (16 bytes), which we also truncate
+            blake2b to
+        """
+        canonical_bytes = canonical_json.encode('utf-8')
+        if hash_scheme == cls.BLAKE2B_HASH_SCHEME:
+            return cls.BLAKE2B_HASH_PREFIX + hashlib.blake2b(canonical_bytes, digest_size=16).hexdigest()
+        elif hash_scheme == cls.MD5_HASH_SCHEME:
+            return hashlib.md5(canonical_bytes).hexdigest()
+        else:
+            raise RuntimeError(f"invalid hash_scheme: {hash_scheme!r}")
+
+
+    @classmethod
+    def hash_scheme_for_data_hash(cls, data_hash):
+        """
+        :param data_hash: a non-empty PredictionElement.data_hash
+        :return: the *_HASH_SCHEME that data_hash was computed with
         """
-        return hashlib.md5(json.dumps(prediction_data, sort_keys=True).encode('utf-8')).hexdigest()
+        return cls.BLAKE2B_HASH_SCHEME if data_hash.startswith(cls.BLAKE2B_HASH_PREFIX) else cls.MD5_HASH_SCHEME
 
 
 #
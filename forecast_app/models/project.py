@@ -4,6 +4,8 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import ManyToManyField
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 
 from utils.utilities import basic_str
@@ -61,6 +63,16 @@ class Project(models.Model):
         help_text="Directory or Zip file containing data files (e.g., CSV files) made made available to everyone in "
                   "the challenge, including supplemental data like Google queries or weather.")
 
+    # bumped by `bump_project_data_version()` every time a forecast or truth is loaded, edited, or deleted, and every
+    # time a model, unit, target, or time zero is saved or deleted. used by `query_cache_key()` to tell whether a
+    # previous query job's output is still current
+    data_version = models.IntegerField(default=0, editable=False)
+
+    # bumped by `bump_project_score_version()` every time `update_scores_for_project()` changes the project's scores.
+    # used by `query_cache_key()` (together with data_version) only for score queries, so that re-scoring does not
+    # invalidate cached forecast and truth query outputs
+    score_version = models.IntegerField(default=0, editable=False)
+
 
     def __repr__(self):
         return str((self.pk, self.name))
@@ -372,3 +384,19 @@ class TimeZero(models.Model):
 
         # done
         super().save(*args, **kwargs)
+
+
+#
+# set up signals to invalidate cached query outputs when units or time zeros change. NB: queries output unit
+# abbreviations and time zero dates and season names, and deletes cascade to forecast data
+#
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+@receiver(post_save, sender=TimeZero)
+@receiver(post_delete, sender=TimeZero)
+def bump_data_version_for_unit_or_timezero(instance, **kwargs):
+    from utils.project_queries import bump_project_data_version  # avoid circular imports
+
+
+    bump_project_data_version(instance.project_id)
@@ -6,10 +6,13 @@ from dateutil import relativedelta
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import BooleanField, IntegerField
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from rest_framework.test import APIRequestFactory
 
 from forecast_app.models import Project
 from utils.utilities import basic_str, YYYY_MM_DD_DATE_FORMAT
+from utils.validation_context import invalidate_validation_context
 
 
 #
@@ -253,6 +256,8 @@ class Target(models.Model):
             for lwr, upper in itertools.zip_longest(cats, cats[1:], fillvalue=float('inf')):
                 TargetLwr.objects.create(target=self, lwr=lwr, upper=upper)
 
+        invalidate_validation_context(self.project_id)
+
 
     def set_range(self, lower, upper):
         """
@@ -283,6 +288,7 @@ class Target(models.Model):
         TargetRange.objects.create(target=self,
                                    value_i=upper if (data_types[0] == Target.INTEGER_DATA_TYPE) else None,
                                    value_f=upper if (data_types[0] == Target.FLOAT_DATA_TYPE) else None)
+        invalidate_validation_context(self.project_id)
 
 
     @staticmethod
@@ -546,3 +552,17 @@ class TargetRange(models.Model):
 
     def __str__(self):  # todo
         return basic_str(self)
+
+
+#
+# set up signals to invalidate cached query outputs when targets change. NB: queries output target names, and deletes
+# cascade to forecast data
+#
+
+@receiver(post_save, sender=Target)
+@receiver(post_delete, sender=Target)
+def bump_data_version_for_target(instance, **kwargs):
+    from utils.project_queries import bump_project_data_version  # avoid circular imports
+
+
+    bump_project_data_version(instance.project_id)
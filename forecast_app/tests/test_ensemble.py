@@ -0,0 +1,179 @@
+import datetime
+import logging
+from pathlib import Path
+
+from django.test import TestCase
+
+from forecast_app.models import Forecast, Job
+from forecast_app.models.forecast_model import ForecastModel
+from utils.ensemble import build_ensemble_forecasts, validate_ensemble_params, _build_ensemble_worker
+from utils.forecast import load_predictions_from_json_io_dict
+from utils.project import create_project_from_json
+from utils.project_queries import query_forecasts_for_project
+from utils.utilities import get_or_create_super_po_mo_users
+
+
+logging.getLogger().setLevel(logging.ERROR)
+
+
+def _quantile_prediction(unit, target, quantiles, values):
+    return {"unit": unit, "target": target, "class": "quantile", "prediction": {"quantile": quantiles, "value": values}}
+
+
+class EnsembleTestCase(TestCase):
+    """
+    """
+
+
+    @classmethod
+    def setUpTestData(cls):
+        _, _, cls.po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        cls.project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), cls.po_user)
+        cls.tz1 = cls.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 2)).first()
+        cls.tz2 = cls.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        cls.tz3 = cls.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 16)).first()
+        cls.ensemble_model = ForecastModel.objects.create(project=cls.project, name='ensemble', abbreviation='ens')
+        cls.models = [ForecastModel.objects.create(project=cls.project, name=f'model {idx}', abbreviation=f'm{idx}')
+                      for idx in range(1, 4)]
+        m1, m2, m3 = cls.models
+        pct_quantiles = [0.25, 0.5, 0.75]
+        model_tz_predictions = [
+            (m1, cls.tz1, [_quantile_prediction('loc1', 'pct next week', pct_quantiles, [1.0, 2.0, 3.0]),
+                           _quantile_prediction('loc1', 'cases next week', [0.5], [1]),
+                           _quantile_prediction('loc2', 'pct next week', [0.1, 0.9], [5.0, 6.0])]),
+            (m2, cls.tz1, [_quantile_prediction('loc1', 'pct next week', pct_quantiles, [2.0, 4.0, 6.0]),
+                           _quantile_prediction('loc1', 'cases next week', [0.5], [2]),
+                           _quantile_prediction('loc2', 'pct next week', [0.5], [1.0])]),
+            (m3, cls.tz1, [_quantile_prediction('loc1', 'pct next week', pct_quantiles, [3.0, 9.0, 10.0]),
+                           {"unit": 'loc1', "target": 'pct next week', "class": "point",  # not a quantile
+                            "prediction": {"value": 50.0}},
+                           _quantile_prediction('loc2', 'Season peak week', [0.5], ['2019-12-22'])]),  # not numeric
+            (m1, cls.tz2, [_quantile_prediction('loc1', 'pct next week', [0.5], [7.0])])]
+        cls.forecasts = []
+        for forecast_model, time_zero, predictions in model_tz_predictions:
+            forecast = Forecast.objects.create(forecast_model=forecast_model, source='f', time_zero=time_zero)
+            load_predictions_from_json_io_dict(forecast, {'predictions': predictions}, is_validate_cats=False)
+            cls.forecasts.append(forecast)
+
+
+    def test_validate_ensemble_params(self):
+        ok_params = {'models': ['m1', 'm2'], 'rule': 'median'}
+        error_messages, (model_ids, timezero_ids, as_of, rule, trim) = \
+            validate_ensemble_params(self.project, self.ensemble_model, ok_params)
+        self.assertEqual([], error_messages)
+        self.assertEqual({self.models[0].pk, self.models[1].pk}, set(model_ids))
+        self.assertEqual([self.tz1.pk, self.tz2.pk, self.tz3.pk], timezero_ids)
+        self.assertEqual((None, 'median', 0.2), (as_of, rule, trim))
+
+        # case: time zero range
+        params = {**ok_params, 'timezero_from': '2011-10-09', 'timezero_to': '2011-10-09'}
+        error_messages, (_, timezero_ids, _, _, _) = validate_ensemble_params(self.project, self.ensemble_model, params)
+        self.assertEqual([], error_messages)
+        self.assertEqual([self.tz2.pk], timezero_ids)
+
+        # case: errors
+        for params, exp_error in [(-1, "params was not a dict"),
+                                  ({'models': ['m1']}, "one or more params keys were invalid or missing"),
+                                  ({**ok_params, 'foo': 1}, "one or more params keys were invalid or missing"),
+                                  ({**ok_params, 'rule': 'max'}, "rule was not one of"),
+                                  ({**ok_params, 'trim': 0.5}, "trim was not a number in [0, 0.5)"),
+                                  ({**ok_params, 'as_of': '2011-10-02'}, "did not contain timezone info"),
+                                  ({**ok_params, 'models': []}, "models was empty"),
+                                  ({**ok_params, 'models': ['bad model']}, "model with abbreviation not found"),
+                                  ({**ok_params, 'models': ['m1', 'ens']}, "the ensemble model cannot be one of"),
+                                  ({**ok_params, 'timezero_to': '2011/10/02'}, "'timezero_to' was not a date"),
+                                  ({**ok_params, 'timezero_from': '2020-01-01'}, "no time zeros were in the range")]:
+            error_messages, _ = validate_ensemble_params(self.project, self.ensemble_model, params)
+            self.assertEqual(1, len(error_messages), params)
+            self.assertIn(exp_error, error_messages[0])
+
+
+    def test_build_ensemble_forecasts(self):
+        model_ids = [forecast_model.pk for forecast_model in self.models]
+        for rule, trim, exp_loc1_pct_values, exp_loc2_pct_values in [
+            ('mean', 0.2, [2.0, 5.0, 19 / 3], [5.0, 5.0, 6.0]),  # loc2 is made non-decreasing: [5, 1, 6] -> [5, 5, 6]
+            ('median', 0.2, [2.0, 4.0, 6.0], [5.0, 5.0, 6.0]),
+            ('trimmed_mean', 0.2, [2.0, 5.0, 19 / 3], [5.0, 5.0, 6.0]),  # floor(0.2 * 3) = 0: nothing trimmed
+            ('trimmed_mean', 0.4, [2.0, 4.0, 6.0], [5.0, 5.0, 6.0])]:  # floor(0.4 * 3) = 1: the middle value
+            ensemble_model = ForecastModel.objects.create(project=self.project, name=f'ens {rule} {trim}',
+                                                          abbreviation=f'ens_{rule}_{trim}')
+            tz_statuses = build_ensemble_forecasts(ensemble_model, model_ids, [self.tz1.pk, self.tz2.pk, self.tz3.pk],
+                                                   None, rule, trim)
+            self.assertEqual([('2011-10-02', 3, True), ('2011-10-09', 1, True), ('2011-10-16', 0, False)],
+                             [(tz_status['timezero_date'], tz_status['num_models'], tz_status['is_success'])
+                              for tz_status in tz_statuses])
+            self.assertEqual("no quantile predictions to combine", tz_statuses[2]['failure_message'])
+
+            rows = list(query_forecasts_for_project(self.project, {'models': [ensemble_model.abbreviation]}))[1:]
+            key_to_values = {}
+            for _, timezero, _, unit, target, class_str, value, _, _, _, quantile, _, _, _, _ in sorted(rows):
+                self.assertEqual('quantile', class_str)
+                key_to_values.setdefault((timezero, unit, target), []).append((quantile, value))
+            self.assertEqual([('2011-10-02', 'loc1', 'cases next week'), ('2011-10-02', 'loc1', 'pct next week'),
+                              ('2011-10-02', 'loc2', 'pct next week'), ('2011-10-09', 'loc1', 'pct next week')],
+                             sorted(key_to_values))
+            self.assertEqual([(0.5, 2)], key_to_values[('2011-10-02', 'loc1', 'cases next week')])  # 1.5 rounded up
+            for key, exp_quantiles, exp_values in [
+                (('2011-10-02', 'loc1', 'pct next week'), [0.25, 0.5, 0.75], exp_loc1_pct_values),
+                (('2011-10-02', 'loc2', 'pct next week'), [0.1, 0.5, 0.9], exp_loc2_pct_values),
+                (('2011-10-09', 'loc1', 'pct next week'), [0.5], [7.0])]:
+                self.assertEqual(exp_quantiles, [quantile for quantile, _ in key_to_values[key]], msg=(rule, key))
+                for exp_value, (_, act_value) in zip(exp_values, key_to_values[key]):
+                    self.assertAlmostEqual(exp_value, act_value, msg=(rule, key))
+
+
+    def test_build_ensemble_forecasts_as_of(self):
+        # a newer version of m1's tz1 forecast is ignored when as_of is before it
+        m1_forecast = self.forecasts[0]
+        forecast = Forecast.objects.create(forecast_model=self.models[0], source='f2', time_zero=self.tz1)
+        load_predictions_from_json_io_dict(forecast, {'predictions': [
+            _quantile_prediction('loc1', 'pct next week', [0.25, 0.5, 0.75], [10.0, 20.0, 30.0]),
+            _quantile_prediction('loc1', 'cases next week', [0.5], [1]),
+            _quantile_prediction('loc2', 'pct next week', [0.1, 0.9], [5.0, 6.0])]}, is_validate_cats=False)
+        model_ids = [self.models[0].pk]
+        for as_of, exp_values in [(None, [10.0, 20.0, 30.0]), (m1_forecast.issued_at, [1.0, 2.0, 3.0])]:
+            ensemble_model = ForecastModel.objects.create(project=self.project, name=f'ens {as_of}',
+                                                          abbreviation=f'ens {as_of}')
+            tz_statuses = build_ensemble_forecasts(ensemble_model, model_ids, [self.tz1.pk], as_of, 'mean')
+            ensemble_forecast = Forecast.objects.get(pk=tz_statuses[0]['forecast_pk'])
+            pred_data = ensemble_forecast.pred_eles.get(unit__abbreviation='loc1', target__name='pct next week') \
+                .pred_data.first().data
+            self.assertEqual(exp_values, pred_data['value'])
+
+
+    def test_build_ensemble_forecasts_subset(self):
+        # rebuilding an unchanged ensemble is a subset of the previous version, which is recorded as a failure
+        model_ids = [forecast_model.pk for forecast_model in self.models]
+        tz_statuses = build_ensemble_forecasts(self.ensemble_model, model_ids, [self.tz1.pk], None, 'mean')
+        self.assertTrue(tz_statuses[0]['is_success'])
+        tz_statuses = build_ensemble_forecasts(self.ensemble_model, model_ids, [self.tz1.pk], None, 'mean')
+        self.assertFalse(tz_statuses[0]['is_success'])
+        self.assertIsNone(tz_statuses[0]['forecast_pk'])
+        self.assertEqual(1, self.ensemble_model.forecasts.count())
+
+
+    def test__build_ensemble_worker(self):
+        # case: blue sky
+        job = Job.objects.create(user=self.po_user, input_json={'forecast_model_pk': self.ensemble_model.pk,
+                                                                'ensemble': {'models': ['m1', 'm2', 'm3'],
+                                                                             'rule': 'median', 'notes': 'hi'}})
+        _build_ensemble_worker(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(Job.SUCCESS, job.status)
+        self.assertEqual((2, 1), (job.output_json['num_succeeded'], job.output_json['num_failed']))
+        self.assertEqual({'hi'}, set(self.ensemble_model.forecasts.values_list('notes', flat=True)))
+
+        # case: invalid params
+        job = Job.objects.create(user=self.po_user, input_json={'forecast_model_pk': self.ensemble_model.pk,
+                                                                'ensemble': {'models': ['m1'], 'rule': 'max'}})
+        _build_ensemble_worker(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(Job.FAILED, job.status)
+        self.assertIn("invalid params", job.failure_message)
+
+        # case: no model
+        job = Job.objects.create(user=self.po_user, input_json={'forecast_model_pk': -1})
+        _build_ensemble_worker(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(Job.FAILED, job.status)
+        self.assertIn("no ForecastModel found", job.failure_message)
@@ -1,8 +1,11 @@
 import datetime
+import io
 import json
 import shutil
+import tarfile
 import tempfile
 import unittest
+import zipfile
 from pathlib import Path
 from unittest.mock import patch
 
@@ -13,13 +16,15 @@ from rq.timeouts import JobTimeoutException
 from forecast_app.models import Project, TimeZero, Job, PredictionElement
 from forecast_app.models.forecast import Forecast
 from forecast_app.models.forecast_model import ForecastModel
-from forecast_app.views import _upload_forecast_worker
+from forecast_app.models.job import JOB_TYPE_UPLOAD_FORECAST
+from forecast_app.views import _upload_forecast_worker, _upload_forecast_archive_worker, ingest_stats_summary
 from utils.cdc_io import load_cdc_csv_forecast_file, make_cdc_units_and_targets
-from utils.forecast import json_io_dict_from_forecast, load_predictions_from_json_io_dict
+from utils.forecast import json_io_dict_from_forecast, load_predictions_from_json_io_dict, \
+    load_forecasts_from_archive, load_predictions_from_json_io_file
 from utils.make_minimal_projects import _make_docs_project
 from utils.make_thai_moph_project import load_cdc_csv_forecasts_from_dir
 from utils.project import create_project_from_json
-from utils.utilities import get_or_create_super_po_mo_users
+from utils.utilities import get_or_create_super_po_mo_users, IngestStats
 
 
 class ForecastTestCase(TestCase):
@@ -82,6 +87,24 @@ class ForecastTestCase(TestCase):
         self.assertIn("time_zero was not in project", str(context.exception))
 
 
+    def test_load_predictions_ingest_stats(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project, time_zero, forecast_model, forecast = _make_docs_project(po_user)  # 29 prediction elements
+        forecast2 = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero)
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            json_io_dict = json.load(fp)
+        json_io_dict['predictions'][0]['prediction'] = None  # retract one
+        json_io_dict['predictions'][1]['prediction']['param1'] += 1  # change one. the rest are dups
+
+        stats = IngestStats()
+        load_predictions_from_json_io_file(forecast2, io.StringIO(json.dumps(json_io_dict)), stats=stats)
+        stats_dict = stats.as_dict()
+        self.assertEqual({'num_pred_eles_parsed': 29, 'num_retractions': 1, 'num_pred_eles_inserted': 2,
+                          'num_dups_skipped': 27}, stats_dict['counts'])
+        self.assertEqual(['validate', 'parse', 'stage', 'version_rules', 'dedup', 'insert_pred_eles',
+                          'insert_pred_data', 'update_validity', 'update_latest'], list(stats_dict['stages']))  # sqlite -> multi-statement insert
+
+
     def test_load_forecasts_from_dir(self):
         project2 = Project.objects.create()
         make_cdc_units_and_targets(project2)
@@ -275,19 +298,19 @@ class ForecastTestCase(TestCase):
         # test `_upload_forecast_worker()` error conditions. this test is complicated by that function's use of
         # the `job_cloud_file` context manager. solution is per https://stackoverflow.com/questions/60198229/python-patch-context-manager-to-return-object
         with patch('forecast_app.models.job.job_cloud_file') as job_cloud_file_mock, \
-                patch('utils.forecast.load_predictions_from_json_io_dict') as load_preds_mock, \
+                patch('utils.forecast.load_predictions_from_json_io_file') as load_preds_mock, \
                 patch('utils.forecast.cache_forecast_metadata') as cache_metatdata_mock:
             job = Job.objects.create()
             job.input_json = {}  # no 'forecast_pk'
             job.save()
             job_cloud_file_mock.return_value.__enter__.return_value = (job, None)  # 2-tuple: (job, cloud_file_fp)
-            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_dict()
+            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_file()
             load_preds_mock.assert_not_called()
 
             # test no 'filename'
             job.input_json = {'forecast_pk': None}  # no 'filename'
             job.save()
-            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_dict()
+            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_file()
             job.refresh_from_db()
             load_preds_mock.assert_not_called()
             self.assertEqual(Job.FAILED, job.status)
@@ -295,7 +318,7 @@ class ForecastTestCase(TestCase):
             # test bad 'forecast_pk'
             job.input_json = {'forecast_pk': -1, 'filename': None}
             job.save()
-            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_dict()
+            _upload_forecast_worker(job.pk)  # should fail and not call load_predictions_from_json_io_file()
             job.refresh_from_db()
             load_preds_mock.assert_not_called()
             self.assertEqual(Job.FAILED, job.status)
@@ -303,7 +326,7 @@ class ForecastTestCase(TestCase):
 
     def test__upload_forecast_worker_deletes_forecast(self):
         # verifies that _upload_forecast_worker() deletes the (presumably empty) Forecast that's passed to it by
-        # upload functions if the file is invalid. here we mock load_predictions_from_json_io_dict() to throw the two
+        # upload functions if the file is invalid. here we mock load_predictions_from_json_io_file() to throw the two
         # exceptions that cause deletes: JobTimeoutException and Exception
         _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
         project, time_zero, forecast_model, forecast = _make_docs_project(po_user)
@@ -313,7 +336,7 @@ class ForecastTestCase(TestCase):
         for exception, exp_job_status in [(Exception('load_preds_mock Exception'), Job.FAILED),
                                           (JobTimeoutException('load_preds_mock JobTimeoutException'), Job.TIMEOUT)]:
             with patch('forecast_app.models.job.job_cloud_file') as job_cloud_file_mock, \
-                    patch('utils.forecast.load_predictions_from_json_io_dict') as load_preds_mock, \
+                    patch('utils.forecast.load_predictions_from_json_io_file') as load_preds_mock, \
                     patch('utils.forecast.cache_forecast_metadata') as cache_metatdata_mock, \
                     open('forecast_app/tests/predictions/docs-predictions.json') as cloud_file_fp:
                 load_preds_mock.side_effect = exception
@@ -334,7 +357,7 @@ class ForecastTestCase(TestCase):
 
     def test__upload_forecast_worker_atomic(self):
         # test `_upload_forecast_worker()` does not create a Forecast if subsequent calls to
-        # `load_predictions_from_json_io_dict()` or `cache_forecast_metadata()` fail. this test is complicated by that
+        # `load_predictions_from_json_io_file()` or `cache_forecast_metadata()` fail. this test is complicated by that
         # function's use of the `job_cloud_file` context manager. solution is per https://stackoverflow.com/questions/60198229/python-patch-context-manager-to-return-object
         _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
         project, time_zero, forecast_model, forecast = _make_docs_project(po_user)
@@ -342,7 +365,7 @@ class ForecastTestCase(TestCase):
         forecast.save()
 
         with patch('forecast_app.models.job.job_cloud_file') as job_cloud_file_mock, \
-                patch('utils.forecast.load_predictions_from_json_io_dict') as load_preds_mock, \
+                patch('utils.forecast.load_predictions_from_json_io_file') as load_preds_mock, \
                 patch('utils.forecast.cache_forecast_metadata') as cache_metatdata_mock:
             forecast2 = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero)
             job = Job.objects.create()
@@ -351,7 +374,7 @@ class ForecastTestCase(TestCase):
 
             job_cloud_file_mock.return_value.__enter__.return_value = (job, None)  # 2-tuple: (job, cloud_file_fp)
 
-            # test that no Forecast is created when load_predictions_from_json_io_dict() fails
+            # test that no Forecast is created when load_predictions_from_json_io_file() fails
             load_preds_mock.side_effect = Exception('load_preds_mock Exception')
             num_forecasts_before = forecast_model.forecasts.count()
             _upload_forecast_worker(job.pk)
@@ -370,7 +393,7 @@ class ForecastTestCase(TestCase):
 
 
     def test__upload_forecast_worker_blue_sky(self):
-        # blue sky to verify load_predictions_from_json_io_dict() and cache_forecast_metadata() are called. also tests
+        # blue sky to verify load_predictions_from_json_io_file() and cache_forecast_metadata() are called. also tests
         # that _upload_forecast_worker() correctly sets job.output_json. this test is complicated by that function's use
         # of the `job_cloud_file` context manager. solution is per https://stackoverflow.com/questions/60198229/python-patch-context-manager-to-return-object
         _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
@@ -379,7 +402,7 @@ class ForecastTestCase(TestCase):
         forecast.save()
 
         with patch('forecast_app.models.job.job_cloud_file') as job_cloud_file_mock, \
-                patch('utils.forecast.load_predictions_from_json_io_dict') as load_preds_mock, \
+                patch('utils.forecast.load_predictions_from_json_io_file') as load_preds_mock, \
                 patch('utils.forecast.cache_forecast_metadata') as cache_metatdata_mock, \
                 open('forecast_app/tests/predictions/docs-predictions.json') as cloud_file_fp:
             job = Job.objects.create()
@@ -392,3 +415,111 @@ class ForecastTestCase(TestCase):
             cache_metatdata_mock.assert_called_once()
             self.assertEqual(Job.SUCCESS, job.status)
             self.assertEqual(job.input_json['forecast_pk'], job.output_json['forecast_pk'])
+            self.assertEqual(project.pk, job.output_json['project_pk'])
+            self.assertIn('cache_metadata', job.output_json['ingest_stats']['stages'])
+            self.assertIsInstance(load_preds_mock.call_args.kwargs['stats'], IngestStats)
+
+            # test aggregation by zadmin_jobs()
+            job.input_json['type'] = JOB_TYPE_UPLOAD_FORECAST
+            header, rows = ingest_stats_summary([job, job, Job.objects.create()])  # the last has no stats
+            self.assertEqual(['date', 'project', 'type', 'num_jobs', 'wall_secs', 'cpu_secs',
+                              'cache_metadata_wall_secs'], header)
+            self.assertEqual(1, len(rows))
+            self.assertEqual([project.name, JOB_TYPE_UPLOAD_FORECAST, 2], rows[0][1:4])
+
+
+    def test_load_forecasts_from_archive(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project, time_zero, forecast_model, forecast = _make_docs_project(po_user)  # time_zero: 2011-10-02
+        with open('forecast_app/tests/predictions/docs-predictions.json', 'rb') as fp:
+            docs_predictions_bytes = fp.read()
+
+        # case: not an archive
+        with self.assertRaises(RuntimeError) as context:
+            load_forecasts_from_archive(forecast_model, io.BytesIO(docs_predictions_bytes))
+        self.assertIn("file was not a zip or tar archive", str(context.exception))
+
+        # case: zip with good and bad files
+        zip_fp = io.BytesIO()
+        with zipfile.ZipFile(zip_fp, 'w') as zip_file:
+            zip_file.writestr('2011-10-09-docs.json', docs_predictions_bytes)  # ok
+            zip_file.writestr('2011-10-09-dup.json', docs_predictions_bytes)  # duplicate timezero_date
+            zip_file.writestr('subdir/2011-10-16-docs.json', b'{}')  # no 'predictions'
+            zip_file.writestr('1999-01-01-docs.json', docs_predictions_bytes)  # TimeZero not found
+            zip_file.writestr('2011-10-02-docs.json', docs_predictions_bytes)  # 100% duplicate data
+            zip_file.writestr('docs.json', docs_predictions_bytes)  # no timezero_date
+            zip_file.writestr('__MACOSX/._2011-10-09-docs.json', b'')  # skipped
+        num_forecasts_before = forecast_model.forecasts.count()
+        file_statuses = load_forecasts_from_archive(forecast_model, zip_fp, notes='some notes')
+        self.assertEqual(num_forecasts_before + 1, forecast_model.forecasts.count())  # failed ones were deleted
+        new_forecast = forecast_model.forecasts.filter(time_zero__timezero_date=datetime.date(2011, 10, 9)).first()
+        self.assertEqual('2011-10-09-docs.json', new_forecast.source)
+        self.assertEqual('some notes', new_forecast.notes)
+        self.assertEqual(29, new_forecast.pred_eles.count())
+        self.assertEqual(1, new_forecast.forecastmetaprediction_set.count())  # metadata was cached
+        exp_statuses = [('1999-01-01-docs.json', '1999-01-01', False, None, "TimeZero not found"),
+                        ('2011-10-02-docs.json', '2011-10-02', False, None, "cannot load 100% duplicate data"),
+                        ('2011-10-09-docs.json', '2011-10-09', True, new_forecast.pk, ""),
+                        ('2011-10-09-dup.json', '2011-10-09', False, None, "more than one file"),
+                        ('docs.json', None, False, None, "did not start with a timezero_date"),
+                        ('subdir/2011-10-16-docs.json', '2011-10-16', False, None, "had no 'predictions' key")]
+        self.assertEqual(len(exp_statuses), len(file_statuses))
+        for (exp_filename, exp_tz_date, exp_is_success, exp_forecast_pk, exp_message), file_status \
+                in zip(exp_statuses, file_statuses):
+            self.assertEqual((exp_filename, exp_tz_date, exp_is_success, exp_forecast_pk),
+                             (file_status['filename'], file_status['timezero_date'], file_status['is_success'],
+                              file_status['forecast_pk']))
+            self.assertIn(exp_message, file_status['failure_message'])
+
+        # case: compressed tar
+        tar_fp = io.BytesIO()
+        with tarfile.open(fileobj=tar_fp, mode='w:gz') as tar_file:
+            tar_info = tarfile.TarInfo('2011-10-16-docs.json')
+            tar_info.size = len(docs_predictions_bytes)
+            tar_file.addfile(tar_info, io.BytesIO(docs_predictions_bytes))
+        file_statuses = load_forecasts_from_archive(forecast_model, tar_fp)
+        self.assertEqual(1, len(file_statuses))
+        self.assertTrue(file_statuses[0]['is_success'])
+        self.assertEqual(29, Forecast.objects.get(pk=file_statuses[0]['forecast_pk']).pred_eles.count())
+
+
+    def test__upload_forecast_archive_worker(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project, time_zero, forecast_model, forecast = _make_docs_project(po_user)
+        with patch('forecast_app.models.job.job_cloud_file') as job_cloud_file_mock, \
+                patch('utils.forecast.load_forecasts_from_archive') as load_archive_mock:
+            # case: bad 'forecast_model_pk'
+            job = Job.objects.create()
+            job.input_json = {'forecast_model_pk': -1, 'filename': 'archive.zip'}
+            job.save()
+            job_cloud_file_mock.return_value.__enter__.return_value = (job, None)  # 2-tuple: (job, cloud_file_fp)
+            _upload_forecast_archive_worker(job.pk)
+            job.refresh_from_db()
+            load_archive_mock.assert_not_called()
+            self.assertEqual(Job.FAILED, job.status)
+
+            # case: blue sky. we pass cloud_file_fp's binary buffer
+            file_statuses = [{'filename': '2011-10-09.json', 'timezero_date': '2011-10-09', 'is_success': True,
+                              'forecast_pk': forecast.pk, 'failure_message': ''},
+                             {'filename': 'x.json', 'timezero_date': None, 'is_success': False, 'forecast_pk': None,
+                              'failure_message': 'x'}]
+            load_archive_mock.return_value = file_statuses
+            cloud_file_fp = io.TextIOWrapper(io.BytesIO(b''), 'utf-8')
+            job.input_json = {'forecast_model_pk': forecast_model.pk, 'filename': 'archive.zip', 'notes': 'n'}
+            job.save()
+            job_cloud_file_mock.return_value.__enter__.return_value = (job, cloud_file_fp)
+            _upload_forecast_archive_worker(job.pk)
+            job.refresh_from_db()
+            load_archive_mock.assert_called_once()
+            self.assertEqual((forecast_model, cloud_file_fp.buffer, 'n'), load_archive_mock.call_args.args)
+            self.assertEqual(Job.SUCCESS, job.status)
+            self.assertEqual({'forecast_model_pk': forecast_model.pk, 'files': file_statuses, 'num_succeeded': 1,
+                              'num_failed': 1, 'project_pk': project.pk,
+                              'ingest_stats': {'stages': {}, 'counts': {}}}, job.output_json)
+
+            # case: no files loaded
+            load_archive_mock.return_value = file_statuses[1:]
+            _upload_forecast_archive_worker(job.pk)
+            job.refresh_from_db()
+            self.assertEqual(Job.FAILED, job.status)
+            self.assertIn("no files were loaded", job.failure_message)
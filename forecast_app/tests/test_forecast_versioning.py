@@ -2,18 +2,22 @@ import datetime
 import json
 import time
 from pathlib import Path
+from unittest.mock import patch
 
 import django
+from django.db import connection
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 
-from forecast_app.models import Forecast, TimeZero, ForecastModel
+from forecast_app.models import Forecast, TimeZero, ForecastModel, PredictionElement, LatestPredictionElement
 from utils.forecast import load_predictions_from_json_io_dict, json_io_dict_from_forecast, cache_forecast_metadata, \
-    forecast_metadata, data_rows_from_forecast
+    forecast_metadata, data_rows_from_forecast, forecast_manifest, _insert_staging_rows, \
+    rebuild_latest_pred_eles_for_project, rebuild_latest_pred_eles_for_version, verify_latest_pred_eles_for_project
 from utils.make_minimal_projects import _make_docs_project
 from utils.project import models_summary_table_rows_for_project, latest_forecast_ids_for_project, \
     create_project_from_json, latest_forecast_cols_for_project
+from utils.project_queries import query_forecasts_for_project
 from utils.utilities import get_or_create_super_po_mo_users
 
 
@@ -316,6 +320,67 @@ class ForecastVersionsTestCase(TestCase):
             load_predictions_from_json_io_dict(f3, {'meta': {}, 'predictions': pred_dicts[2:4]})  # 0 & 1 missing
 
 
+    def test_patch_forecast_versions(self):
+        # tests "patch" versions, which contain only added or changed prediction elements plus explicit retractions, and
+        # the manifests that clients use to create them
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        tz1 = TimeZero.objects.create(project=project, timezero_date=datetime.date(2020, 10, 4))
+        forecast_model = ForecastModel.objects.create(project=project, name='name', abbreviation='abbrev')
+
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            pred_dicts = json.load(fp)['predictions'][:4]  # loc1 point & named, loc2 point & bin ('pct next week')
+        issued_at = datetime.datetime.combine(tz1.timezero_date, datetime.time(), tzinfo=datetime.timezone.utc)
+        f1, f2, f3 = [Forecast.objects.create(forecast_model=forecast_model, source=f'f{idx}', time_zero=tz1,
+                                              issued_at=issued_at + datetime.timedelta(days=idx))
+                      for idx in range(3)]
+
+        # case: no versions
+        self.assertEqual({'forecast_id': None, 'issued_at': None, 'hash_scheme': PredictionElement.DEFAULT_HASH_SCHEME,
+                          'elements': []}, forecast_manifest(forecast_model, tz1))
+
+        # case: patch with no previous version
+        with self.assertRaisesRegex(RuntimeError, 'cannot load a patch into a forecast with no previous version'):
+            load_predictions_from_json_io_dict(f1, {'predictions': pred_dicts}, is_patch=True)
+
+        load_predictions_from_json_io_dict(f1, {'predictions': pred_dicts})
+        manifest = forecast_manifest(forecast_model, tz1)
+        self.assertEqual(f1.pk, manifest['forecast_id'])
+        self.assertEqual([('loc1', 'pct next week', 'named',
+                           PredictionElement.hash_for_prediction_data_dict(pred_dicts[1]['prediction'])),
+                          ('loc1', 'pct next week', 'point',
+                           PredictionElement.hash_for_prediction_data_dict(pred_dicts[0]['prediction'])),
+                          ('loc2', 'pct next week', 'bin',
+                           PredictionElement.hash_for_prediction_data_dict(pred_dicts[3]['prediction'])),
+                          ('loc2', 'pct next week', 'point',
+                           PredictionElement.hash_for_prediction_data_dict(pred_dicts[2]['prediction']))],
+                         manifest['elements'])
+
+        # case: patch that changes loc1's point and retracts loc2's. NB: not a subset error
+        changed_point_dict = dict(pred_dicts[0], prediction={'value': 3.3})
+        load_predictions_from_json_io_dict(f2, {'predictions': [changed_point_dict,
+                                                                dict(pred_dicts[2], prediction=None)]}, is_patch=True)
+        self.assertEqual(2, f2.pred_eles.count())
+        manifest = forecast_manifest(forecast_model, tz1)
+        self.assertEqual(f2.pk, manifest['forecast_id'])
+        self.assertEqual([('loc1', 'pct next week', 'named'), ('loc1', 'pct next week', 'point'),
+                          ('loc2', 'pct next week', 'bin')], [element[:3] for element in manifest['elements']])
+        self.assertEqual(PredictionElement.hash_for_prediction_data_dict({'value': 3.3}), manifest['elements'][1][3])
+
+        # case: patch that adds a named to loc2, which conflicts with the bin carried forward from f1
+        named_dict = dict(pred_dicts[1], unit='loc2')
+        with self.assertRaisesRegex(RuntimeError, r"Found these conflicting unit/target tuples in the patch as "
+                                                  r"composed with previous versions: \[\('loc2', 'pct next week'\)\]"):
+            load_predictions_from_json_io_dict(f3, {'predictions': [named_dict]}, is_patch=True)
+
+        # case: ok if the patch also retracts the bin
+        load_predictions_from_json_io_dict(f3, {'predictions': [named_dict, dict(pred_dicts[3], prediction=None)]},
+                                           is_patch=True)
+        self.assertEqual([('loc1', 'pct next week', 'named'), ('loc1', 'pct next week', 'point'),
+                          ('loc2', 'pct next week', 'named')],
+                         [element[:3] for element in forecast_manifest(forecast_model, tz1)['elements']])
+
+
     def test_non_subset_forecast_version_rules(self):
         """
         Tests these forecast rules:
@@ -373,6 +438,174 @@ class ForecastVersionsTestCase(TestCase):
             f1.delete()
 
 
+    def test_version_rules_lock_and_staging_tables(self):
+        """
+        Tests that the version rules are checked under `lock_forecast_versions()` (a no-op on sqlite, so we just test
+        the calls) and that each load stages into its own temp table, which it drops.
+        """
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            pred_dicts = json.load(fp)['predictions']
+
+        # creating, loading, and deleting all lock (forecast_model, time_zero)
+        with patch('forecast_app.models.forecast.lock_forecast_versions') as signal_lock_mock, \
+                patch('utils.forecast.lock_forecast_versions') as load_lock_mock:
+            f2 = Forecast.objects.create(forecast_model=self.forecast_model, source='f2', time_zero=self.tz2)
+            signal_lock_mock.assert_called_once_with(self.forecast_model.pk, self.tz2.pk)
+
+            load_predictions_from_json_io_dict(f2, {'meta': {}, 'predictions': pred_dicts[:2]})
+            load_lock_mock.assert_called_once_with(self.forecast_model.pk, self.tz2.pk)
+
+            signal_lock_mock.reset_mock()
+            f2.delete()
+            signal_lock_mock.assert_called_once_with(self.forecast_model.pk, self.tz2.pk)
+
+        # staging tables have unique names and are dropped
+        staged_table_names = []
+
+
+        def insert_staging_rows(temp_table_name, rows):
+            staged_table_names.append(temp_table_name)
+            _insert_staging_rows(temp_table_name, rows)
+
+
+        with patch('utils.forecast._insert_staging_rows', side_effect=insert_staging_rows):
+            for time_zero in [self.tz2, self.tz3]:
+                forecast = Forecast.objects.create(forecast_model=self.forecast_model, source='f', time_zero=time_zero)
+                load_predictions_from_json_io_dict(forecast, {'meta': {}, 'predictions': pred_dicts[:2]})
+        self.assertEqual(2, len(set(staged_table_names)))
+        self.assertTrue(all(table_name.startswith('pred_ele_temp_') for table_name in staged_table_names))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_temp_master WHERE type = 'table';")
+            self.assertFalse(set(staged_table_names) & {row[0] for row in cursor.fetchall()})
+
+
+    def test_latest_pred_eles_table(self):
+        """
+        Tests that the LatestPredictionElement table is kept in sync with loads (including duplicates, retractions, and
+        out-of-order loads) and deletes, that queries without `as_of` (which read it) match ones with a far-future
+        `as_of` (which rank all versions), and that it can be verified and rebuilt.
+        """
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            pred_dicts = json.load(fp)['predictions'][:4]  # loc1 point & named, loc2 point & bin ('pct next week')
+
+
+        def assert_latest(exp_f_ids):  # exp_f_ids: list of forecast ids, one per latest row
+            self.assertEqual((0, 0), verify_latest_pred_eles_for_project(self.project))
+            latest_qs = LatestPredictionElement.objects.filter(forecast_model=self.forecast_model, time_zero=self.tz2)
+            self.assertEqual(sorted(exp_f_ids),
+                             sorted(PredictionElement.objects.get(pk=latest.pred_ele_id).forecast_id
+                                    for latest in latest_qs))
+            self.assertEqual(sorted(query_forecasts_for_project(self.project, {}), key=str),  # no ORDER BY
+                             sorted(query_forecasts_for_project(self.project, {'as_of': '2100-01-01T00:00:00+00:00'}),
+                                    key=str))
+
+
+        # the docs forecast has no other versions, so all of its rows are latest
+        self.assertEqual((0, 0), verify_latest_pred_eles_for_project(self.project))
+        self.assertEqual(self.forecast.pred_eles.count(),
+                         LatestPredictionElement.objects.filter(forecast_model=self.forecast_model).count())
+
+        # f1 then f2: f2 changes loc1 point, retracts loc1 named, and duplicates the other two
+        f1 = Forecast.objects.create(forecast_model=self.forecast_model, source='f1', time_zero=self.tz2,
+                                     issued_at=datetime.datetime(2011, 10, 9, tzinfo=datetime.timezone.utc))
+        f2 = Forecast.objects.create(forecast_model=self.forecast_model, source='f2', time_zero=self.tz2,
+                                     issued_at=f1.issued_at + datetime.timedelta(days=1))
+        load_predictions_from_json_io_dict(f1, {'meta': {}, 'predictions': pred_dicts})
+        assert_latest([f1.pk] * 4)
+
+        f2_pred_dicts = json.loads(json.dumps(pred_dicts))
+        f2_pred_dicts[0]['prediction']['value'] += 1
+        f2_pred_dicts[1]['prediction'] = None
+        load_predictions_from_json_io_dict(f2, {'meta': {}, 'predictions': f2_pred_dicts})
+        assert_latest([f2.pk, f1.pk, f1.pk])
+
+        # deleting f2 un-masks f1
+        f2.delete()
+        assert_latest([f1.pk] * 4)
+
+        # out-of-order load: loading an older, empty version after a newer one rebuilds instead of masking the newer one
+        f0 = Forecast.objects.create(forecast_model=self.forecast_model, source='f0', time_zero=self.tz2,
+                                     issued_at=f1.issued_at + datetime.timedelta(days=1))
+        f3 = Forecast.objects.create(forecast_model=self.forecast_model, source='f3', time_zero=self.tz2,
+                                     issued_at=f1.issued_at + datetime.timedelta(days=2))
+        load_predictions_from_json_io_dict(f3, {'meta': {}, 'predictions': f2_pred_dicts})
+        f0_pred_dicts = json.loads(json.dumps(pred_dicts))
+        f0_pred_dicts[0]['prediction']['value'] += 2
+        with patch('utils.forecast.rebuild_latest_pred_eles_for_version',
+                   wraps=rebuild_latest_pred_eles_for_version) as rebuild_mock:
+            load_predictions_from_json_io_dict(f0, {'meta': {}, 'predictions': f0_pred_dicts})
+            rebuild_mock.assert_called_once_with(self.forecast_model.pk, self.tz2.pk)
+        assert_latest([f3.pk, f1.pk, f1.pk])
+
+        # verify finds a damaged table, and rebuilding fixes it
+        num_project_rows = LatestPredictionElement.objects.filter(forecast_model__project=self.project).count()
+        LatestPredictionElement.objects.filter(forecast_model=self.forecast_model, time_zero=self.tz2).first().delete()
+        self.assertEqual((1, 0), verify_latest_pred_eles_for_project(self.project))
+        self.assertEqual(num_project_rows, rebuild_latest_pred_eles_for_project(self.project))
+        assert_latest([f3.pk, f1.pk, f1.pk])
+
+
+    def test_pred_ele_validity_intervals(self):
+        """
+        Tests that PredictionElement.valid_from and valid_to are kept in sync with loads (including duplicates and
+        retractions), issued_at edits, and deletes, and that `as_of` queries (which use them) see the right versions.
+        """
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            pred_dicts = json.load(fp)['predictions'][:4]  # loc1 point & named, loc2 point & bin ('pct next week')
+
+        day_1 = datetime.datetime(2011, 10, 9, tzinfo=datetime.timezone.utc)
+        f1 = Forecast.objects.create(forecast_model=self.forecast_model, source='f1', time_zero=self.tz2,
+                                     issued_at=day_1)
+        f2 = Forecast.objects.create(forecast_model=self.forecast_model, source='f2', time_zero=self.tz2,
+                                     issued_at=day_1 + datetime.timedelta(days=2))
+        load_predictions_from_json_io_dict(f1, {'meta': {}, 'predictions': pred_dicts})
+        f2_pred_dicts = json.loads(json.dumps(pred_dicts))
+        f2_pred_dicts[0]['prediction']['value'] += 1
+        f2_pred_dicts[1]['prediction'] = None
+        load_predictions_from_json_io_dict(f2, {'meta': {}, 'predictions': f2_pred_dicts})  # 2 & 3 are dups
+
+
+        def validity(forecast):  # a list of 2-tuples: (valid_from, valid_to), in pred_class, unit, target order
+            return [(pred_ele.valid_from, pred_ele.valid_to)
+                    for pred_ele in forecast.pred_eles.order_by('pred_class', 'unit__abbreviation', 'target__name')]
+
+
+        def query_values(as_of):  # a sorted list of 3-tuples: (unit, class, value), limited to tz2
+            query = {'timezeros': ['2011-10-09']}
+            if as_of:
+                query['as_of'] = as_of.isoformat()
+            rows = list(query_forecasts_for_project(self.project, query))[1:]  # skip header
+            return sorted((row[3], row[5], row[6]) for row in rows if row[0] == self.forecast_model.abbreviation)
+
+
+        # f1: bin loc2, named loc1, point loc1, point loc2. f2: named loc1 (retract), point loc1
+        day_3 = day_1 + datetime.timedelta(days=2)
+        self.assertEqual([(day_1, None), (day_1, day_3), (day_1, day_3), (day_1, None)], validity(f1))
+        self.assertEqual([(day_3, None), (day_3, None)], validity(f2))
+        f1_values = [('loc1', 'named', ''), ('loc1', 'point', 2.1), ('loc2', 'bin', ''), ('loc2', 'bin', ''),
+                     ('loc2', 'bin', ''), ('loc2', 'point', 2.0)]
+        f2_values = [('loc1', 'point', 3.1), ('loc2', 'bin', ''), ('loc2', 'bin', ''), ('loc2', 'bin', ''),
+                     ('loc2', 'point', 2.0)]
+        self.assertEqual([], query_values(day_1 - datetime.timedelta(days=1)))
+        self.assertEqual(f1_values, query_values(day_1))
+        self.assertEqual(f1_values, query_values(day_3 - datetime.timedelta(seconds=1)))
+        self.assertEqual(f2_values, query_values(day_3))
+        self.assertEqual(f2_values, query_values(None))
+
+        # editing f2's issued_at (without repositioning it) moves the intervals it starts and ends
+        day_2 = day_1 + datetime.timedelta(days=1)
+        f2.issued_at = day_2
+        f2.save()
+        self.assertEqual([(day_1, None), (day_1, day_2), (day_1, day_2), (day_1, None)], validity(f1))
+        self.assertEqual([(day_2, None), (day_2, None)], validity(f2))
+        self.assertEqual(f2_values, query_values(day_2))
+
+        # deleting f2 re-opens the intervals it ended
+        f2.delete()
+        self.assertEqual([(day_1, None)] * 4, validity(f1))
+        self.assertEqual(f1_values, query_values(day_3))
+
+
     def test_json_io_dict_from_forecast_on_versions(self):
         def sort_key(pred_dict):
             return pred_dict['unit'], pred_dict['target'], pred_dict['class']
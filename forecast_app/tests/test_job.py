@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import patch, ANY
 
 from botocore.exceptions import BotoCoreError
 from django.test import TestCase
@@ -6,6 +6,7 @@ from rq.timeouts import JobTimeoutException
 
 from forecast_app.models import Job
 from forecast_app.models.job import job_cloud_file
+from utils.cloud_file import upload_file_stream
 
 
 class ForecastTestCase(TestCase):
@@ -55,3 +56,38 @@ class ForecastTestCase(TestCase):
                     pass
             job.refresh_from_db()
             self.assertEqual(Job.FAILED, job.status)
+
+
+    def test_upload_file_stream(self):
+        job = Job.objects.create()
+        with patch('boto3.client') as client_mock:
+            s3_client = client_mock.return_value
+            s3_client.create_multipart_upload.return_value = {'UploadId': 'the-id'}
+            s3_client.upload_part.side_effect = lambda **kwargs: {'ETag': f"etag-{kwargs['PartNumber']}"}
+
+            # case: fits in one part -> put_object()
+            with upload_file_stream(job, part_size=10) as text_io:
+                text_io.write('abc')
+            s3_client.put_object.assert_called_once_with(Bucket=ANY, Key=str(job.pk), Body=b'abc')
+            s3_client.create_multipart_upload.assert_not_called()
+
+            # case: more than one part -> multipart upload of full parts plus the remainder
+            with upload_file_stream(job, part_size=10) as text_io:
+                text_io.write('0123456789' * 2 + 'xyz')
+            self.assertEqual([b'0123456789', b'0123456789', b'xyz'],
+                             [call.kwargs['Body'] for call in s3_client.upload_part.call_args_list])
+            s3_client.complete_multipart_upload.assert_called_once_with(
+                Bucket=ANY, Key=str(job.pk), UploadId='the-id',
+                MultipartUpload={'Parts': [{'PartNumber': 1, 'ETag': 'etag-1'}, {'PartNumber': 2, 'ETag': 'etag-2'},
+                                           {'PartNumber': 3, 'ETag': 'etag-3'}]})
+            s3_client.abort_multipart_upload.assert_not_called()
+
+            # case: a timeout after a part was uploaded aborts the upload and re-raises
+            s3_client.reset_mock()
+            with self.assertRaises(JobTimeoutException):
+                with upload_file_stream(job, part_size=10) as text_io:
+                    text_io.write('0123456789' * 2)
+                    text_io.flush()
+                    raise JobTimeoutException('timeout')
+            s3_client.abort_multipart_upload.assert_called_once_with(Bucket=ANY, Key=str(job.pk), UploadId='the-id')
+            s3_client.complete_multipart_upload.assert_not_called()
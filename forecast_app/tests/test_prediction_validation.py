@@ -1,13 +1,15 @@
 import datetime
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
 from django.test import TestCase
 
 from forecast_app.models import ForecastModel, TimeZero, Forecast, Target
 from forecast_app.models.prediction_data import PredictionData
 from forecast_app.models.target import TargetRange
-from utils.forecast import load_predictions_from_json_io_dict, NamedData
+from utils.forecast import load_predictions_from_json_io_dict, NamedData, _validated_pred_ele_rows_for_pred_dicts, \
+    _iter_validated_rows_parallel
 from utils.project import create_project_from_json
 from utils.project_truth import load_truth_data, truth_data_qs, oracle_model_for_project
 from utils.utilities import get_or_create_super_po_mo_users
@@ -681,6 +683,80 @@ class PredictionValidationTestCase(TestCase):
         self.assertIn(f"Entries in `value` must obey existing ranges for targets.", str(context.exception))
 
 
+    def test__batch_validator(self):
+        # tests that numeric checks done in batches report the first offending prediction_dict
+        ok_quantile_dict = {"unit": "loc1", "target": "pct next week", "class": "quantile",
+                            "prediction": {"quantile": [0.25, 0.5, 0.75], "value": [1.0, 0.99999999, 2.0]}}  # tol
+        ok_bin_dict = {"unit": "loc2", "target": "pct next week", "class": "bin",
+                       "prediction": {"cat": [0.0, 1.0], "prob": [0.3, 0.7]}}
+        ok_sample_dict = {"unit": "loc3", "target": "cases next week", "class": "sample",
+                          "prediction": {"sample": [0, 2, 5]}}
+        bad_bin_dict = {"unit": "loc2", "target": "cases next week", "class": "bin",
+                        "prediction": {"cat": [0, 2], "prob": [0.3, 0.3]}}  # sum != 1
+        bad_quantile_dict = {"unit": "loc3", "target": "pct next week", "class": "quantile",
+                             "prediction": {"quantile": [0.25, 0.5, 0.75], "value": [1.0, 0.9, 2.0]}}  # decreasing
+        bad_sample_dict = {"unit": "loc1", "target": "cases next week", "class": "sample",
+                           "prediction": {"sample": [0, 2, 100001]}}  # out of range
+        bad_unit_dict = {"unit": "bad unit", "target": "pct next week", "class": "point", "prediction": {"value": 1}}
+        for batch_size in [1, 2, 100]:
+            with patch('utils.forecast.VALIDATION_BATCH_SIZE', batch_size):
+                # all valid
+                rows = list(_validated_pred_ele_rows_for_pred_dicts(
+                    self.forecast, [ok_quantile_dict, ok_bin_dict, ok_sample_dict], False, False))
+                self.assertEqual(3, len(rows))
+
+                for prediction_dicts, exp_error, exp_pred_dict in [
+                    ([ok_quantile_dict, bad_quantile_dict, bad_bin_dict], "must be non-decreasing", bad_quantile_dict),
+                    ([ok_quantile_dict, bad_bin_dict, bad_quantile_dict], "values within prob must sum to 1.0",
+                     bad_bin_dict),
+                    ([ok_bin_dict, bad_sample_dict, bad_quantile_dict], "should be contained within `range`",
+                     bad_sample_dict),
+                    ([ok_bin_dict, bad_bin_dict, bad_unit_dict], "values within prob must sum to 1.0", bad_bin_dict),
+                    ([ok_bin_dict, bad_unit_dict, bad_bin_dict], "undefined Unit", None),
+                ]:
+                    with self.assertRaises(RuntimeError) as context:
+                        list(_validated_pred_ele_rows_for_pred_dicts(self.forecast, prediction_dicts, False, False))
+                    self.assertIn(exp_error, str(context.exception))
+                    if exp_pred_dict:
+                        self.assertIn(f"prediction_dict={exp_pred_dict}", str(context.exception))
+
+
+    def test__validated_pred_ele_rows_parallel(self):
+        # tests that parallel validation yields the same rows, and raises the same errors, as serial validation
+        ok_dicts = [{"unit": unit, "target": target, "class": "point", "prediction": {"value": value}}
+                    for unit, target, value in [("loc1", "pct next week", 1.1), ("loc2", "pct next week", 2.2),
+                                                ("loc3", "pct next week", 3.3), ("loc1", "cases next week", 4),
+                                                ("loc2", "cases next week", 5)]] + \
+                   [{"unit": "loc3", "target": "cases next week", "class": "sample",
+                     "prediction": {"sample": [0, 2, 5]}}]
+        bad_sample_dict = {"unit": "loc1", "target": "cases next week", "class": "sample",
+                           "prediction": {"sample": [0, 2, 100001]}}  # out of range
+        dup_dict = dict(ok_dicts[0])
+        with patch('utils.forecast.PARALLEL_VALIDATION_MIN_NUM_PRED_ELES', 0):
+            exp_rows = list(_validated_pred_ele_rows_for_pred_dicts(self.forecast, ok_dicts, False, False))
+        with patch('utils.forecast.PARALLEL_VALIDATION_MIN_NUM_PRED_ELES', 2), \
+                patch('utils.forecast.PARALLEL_VALIDATION_NUM_WORKERS', 2), \
+                patch('utils.forecast.PARALLEL_VALIDATION_CHUNK_SIZE', 2), \
+                patch('utils.forecast._iter_validated_rows_parallel',
+                      side_effect=_iter_validated_rows_parallel) as parallel_mock:
+            # too few to validate in parallel
+            rows = list(_validated_pred_ele_rows_for_pred_dicts(self.forecast, ok_dicts[:1], False, False))
+            parallel_mock.assert_not_called()
+            self.assertEqual(exp_rows[:1], rows)
+
+            # parallel
+            rows = list(_validated_pred_ele_rows_for_pred_dicts(self.forecast, iter(ok_dicts), False, False))
+            parallel_mock.assert_called_once()
+            self.assertEqual(exp_rows, rows)
+
+            # errors in worker processes, and cross-chunk "prediction"-level errors
+            for prediction_dicts, exp_error in [(ok_dicts + [bad_sample_dict], "should be contained within `range`"),
+                                                (ok_dicts + [dup_dict], "cannot be more than 1 Prediction Element")]:
+                with self.assertRaises(RuntimeError) as context:
+                    list(_validated_pred_ele_rows_for_pred_dicts(self.forecast, prediction_dicts, False, False))
+                self.assertIn(exp_error, str(context.exception))
+
+
     def test_data_format_of_value_should_correspond_or_be_translatable_to_the_type_as_in_the_target_def_quant(self):
         # 'pct next week': continuous
         prediction_dict = {"unit": "loc2", "target": "pct next week", "class": "quantile",
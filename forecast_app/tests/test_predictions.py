@@ -1,7 +1,9 @@
 import datetime
+import io
 import json
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
 from django.test import TestCase
 
@@ -9,7 +11,8 @@ from forecast_app.models import Forecast, PredictionElement, PredictionData
 from forecast_app.models import ForecastModel, TimeZero
 from forecast_app.models.prediction_element import PRED_CLASS_NAME_TO_INT
 from forecast_app.tests.test_project_queries import ProjectQueriesTestCase
-from utils.forecast import load_predictions_from_json_io_dict, _validated_pred_ele_rows_for_pred_dicts
+from utils.forecast import load_predictions_from_json_io_dict, _validated_pred_ele_rows_for_pred_dicts, \
+    load_predictions_from_json_io_file, _iter_json_io_predictions, json_io_dict_from_forecast
 from utils.make_minimal_projects import _make_docs_project
 from utils.project import create_project_from_json
 from utils.project_queries import query_truth_for_project, query_forecasts_for_project
@@ -39,8 +42,62 @@ class PredictionsTestCase(TestCase):
             ('1b98c3c7b5b09d3ba0ea43566d5e9d03', {"cat": [True, False], "prob": [0.9, 0.1]}),
             ('c74e3f626224eeb482368d9fb7a387da',
              {"cat": ["2019-12-15", "2019-12-22", "2019-12-29"], "prob": [0.01, 0.1, 0.89]}),
+        ]:
+            self.assertEqual(exp_hash, PredictionElement.hash_for_prediction_data_dict(
+                prediction_dict, PredictionElement.MD5_HASH_SCHEME))
+            self.assertEqual(PredictionElement.MD5_HASH_SCHEME, PredictionElement.hash_scheme_for_data_hash(exp_hash))
+
+        for exp_hash, prediction_dict in [
+            ('b2:660067f76b91d00e9b077953a1bdc42d', {"family": "pois", "param1": 1.1}),
+            ('b2:83a55b62a34d84a8a5f26497752569c8', {"value": 5}),
+            ('b2:81b8dc664edca347713eb9bc5c33b4e4', {"sample": [0, 2, 5]}),
         ]:
             self.assertEqual(exp_hash, PredictionElement.hash_for_prediction_data_dict(prediction_dict))
+            self.assertEqual(PredictionElement.BLAKE2B_HASH_SCHEME,
+                             PredictionElement.hash_scheme_for_data_hash(exp_hash))
+
+        with self.assertRaises(RuntimeError) as context:
+            PredictionElement.hash_for_prediction_data_dict({"value": 5}, 'bad scheme')
+        self.assertIn("invalid hash_scheme", str(context.exception))
+
+
+    def test_data_hash_scheme_is_per_forecast(self):
+        # new forecasts use the default scheme, but new versions of forecasts whose versions have legacy MD5 hashes
+        # continue to use MD5 so that duplicates are still detected
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        forecast_model = ForecastModel.objects.create(project=project, name='name', abbreviation='abbrev')
+        time_zero = TimeZero.objects.create(project=project, timezero_date=datetime.date(2017, 1, 1))
+        forecast_1 = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero,
+                                             issued_at=datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc))
+        prediction_dicts = [{"unit": "loc1", "target": "pct next week", "class": "point",
+                             "prediction": {"value": 2.1}},
+                            {"unit": "loc2", "target": "pct next week", "class": "point",
+                             "prediction": {"value": 2.2}}]
+        with patch.object(PredictionElement, 'DEFAULT_HASH_SCHEME', PredictionElement.MD5_HASH_SCHEME):
+            load_predictions_from_json_io_dict(forecast_1, {'predictions': prediction_dicts[:1]})
+        self.assertEqual([PredictionElement.MD5_HASH_SCHEME],
+                         [PredictionElement.hash_scheme_for_data_hash(data_hash)
+                          for data_hash in forecast_1.pred_eles.values_list('data_hash', flat=True)])
+
+        # a new version of forecast_1 uses MD5, and skips the duplicate
+        forecast_2 = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero,
+                                             issued_at=datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc))
+        load_predictions_from_json_io_dict(forecast_2, {'predictions': prediction_dicts})
+        self.assertEqual([PredictionElement.MD5_HASH_SCHEME],
+                         [PredictionElement.hash_scheme_for_data_hash(data_hash)
+                          for data_hash in forecast_2.pred_eles.values_list('data_hash', flat=True)])
+
+        # a forecast for a different time zero uses the default scheme. its data is the canonical JSON
+        time_zero_2 = TimeZero.objects.create(project=project, timezero_date=datetime.date(2017, 1, 2))
+        forecast_3 = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero_2)
+        load_predictions_from_json_io_dict(forecast_3, {'predictions': prediction_dicts})
+        self.assertEqual([PredictionElement.BLAKE2B_HASH_SCHEME] * 2,
+                         [PredictionElement.hash_scheme_for_data_hash(data_hash)
+                          for data_hash in forecast_3.pred_eles.values_list('data_hash', flat=True)])
+        for pred_ele in forecast_3.pred_eles.all():
+            self.assertEqual(pred_ele.data_hash,
+                             PredictionElement.hash_for_prediction_data_dict(pred_ele.pred_data.first().data))
 
 
     def test_load_predictions_from_json_io_dict_existing_pred_eles(self):
@@ -64,7 +121,9 @@ class PredictionsTestCase(TestCase):
         forecast = Forecast.objects.create(forecast_model=forecast_model, source='docs-predictions.json',
                                            time_zero=time_zero)
 
-        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+        # we use the legacy MD5 scheme so that these hashes match test_hash_for_prediction_dict()'s
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp, \
+                patch.object(PredictionElement, 'DEFAULT_HASH_SCHEME', PredictionElement.MD5_HASH_SCHEME):
             json_io_dict = json.load(fp)
             load_predictions_from_json_io_dict(forecast, json_io_dict, is_validate_cats=False)
 
@@ -148,6 +207,57 @@ class PredictionsTestCase(TestCase):
             self.assertIsNotNone(pred_data_qs.filter(pred_ele=pred_ele).first())
 
 
+    def test_load_predictions_from_json_io_file(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        forecast_model = ForecastModel.objects.create(project=project, name='name', abbreviation='abbrev')
+        time_zero = TimeZero.objects.create(project=project, timezero_date=datetime.date(2017, 1, 1))
+        forecast = Forecast.objects.create(forecast_model=forecast_model, source='docs-predictions.json',
+                                           time_zero=time_zero)
+
+        # test invalid json_io_dicts
+        for json_str, exp_error in [('[]', "json_io_dict was not a dict"),
+                                    ('{}', "json_io_dict had no 'predictions' key"),
+                                    ('{"meta": {}}', "json_io_dict had no 'predictions' key"),
+                                    ('{"predictions": {}}', "json_io_dict's 'predictions' was not a list"),
+                                    ('{"predictions": []}', "cannot load empty data")]:
+            with self.assertRaises(RuntimeError) as context:
+                load_predictions_from_json_io_file(forecast, io.StringIO(json_str), is_validate_cats=False)
+            self.assertIn(exp_error, str(context.exception))
+
+        # test truncated json
+        with self.assertRaises(json.JSONDecodeError):
+            load_predictions_from_json_io_file(forecast, io.StringIO('{"predictions": [{"unit": "loc1"'),
+                                               is_validate_cats=False)
+
+        # test loading all five types of Predictions, which should match loading via the dict version
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            json_io_dict = json.load(fp)
+            fp.seek(0)
+            load_predictions_from_json_io_file(forecast, fp, is_validate_cats=False)
+
+        self.assertEqual(29, forecast.pred_eles.count())
+        self.assertEqual(29, PredictionData.objects.filter(pred_ele__forecast=forecast).count())
+        act_pred_dicts = json_io_dict_from_forecast(forecast, None)['predictions']
+        exp_pred_dicts = sorted(json_io_dict['predictions'], key=lambda _: (_['unit'], _['target'], _['class']))
+        self.assertEqual(exp_pred_dicts, sorted(act_pred_dicts, key=lambda _: (_['unit'], _['target'], _['class'])))
+
+
+    def test__iter_json_io_predictions(self):
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            json_io_dict = json.load(fp)
+
+        # 'predictions' before and after 'meta', and a tiny read size to exercise buffer refilling, including numbers
+        # that straddle reads
+        json_io_dict['meta'] = {'a': [1, 2.5, {'b': None}], 'c': "d"}
+        json_strs = [json.dumps(json_io_dict), json.dumps({'predictions': json_io_dict['predictions'], 'meta': {}},
+                                                          indent=4)]
+        for json_str in json_strs:
+            with patch('utils.forecast.JSON_STREAM_READ_SIZE', 7):
+                act_pred_dicts = list(_iter_json_io_predictions(io.StringIO(json_str)))
+            self.assertEqual(json_io_dict['predictions'], act_pred_dicts)
+
+
     def test_prediction_dicts_to_db_rows_invalid(self):
         _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
         project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
@@ -161,7 +271,7 @@ class PredictionsTestCase(TestCase):
             bad_prediction_dicts = [
                 {"unit": "bad unit", "target": "1 wk ahead", "class": "BinCat", "prediction": {}}
             ]
-            _validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False)
+            list(_validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False))
         self.assertIn('prediction_dict referred to an undefined Unit', str(context.exception))
 
         # test for invalid target
@@ -169,7 +279,7 @@ class PredictionsTestCase(TestCase):
             bad_prediction_dicts = [
                 {"unit": "loc1", "target": "bad target", "class": "bad class", "prediction": {}}
             ]
-            _validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False)
+            list(_validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False))
         self.assertIn('prediction_dict referred to an undefined Target', str(context.exception))
 
         # test for invalid pred_class
@@ -177,7 +287,7 @@ class PredictionsTestCase(TestCase):
             bad_prediction_dicts = [
                 {"unit": "loc1", "target": "pct next week", "class": "bad class", "prediction": {}}
             ]
-            _validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False)
+            list(_validated_pred_ele_rows_for_pred_dicts(forecast, bad_prediction_dicts, False, False))
         self.assertIn('invalid pred_class', str(context.exception))
 
 
@@ -1,4 +1,5 @@
 import datetime
+import io
 import json
 import logging
 from pathlib import Path
@@ -120,6 +121,23 @@ class ProjectTestCase(TestCase):
         self.assertEqual(14 + 5, truth_data_qs(project).count())
 
 
+    def test_load_truth_data_lock_order(self):
+        # time zeros are locked in time_zero_id order regardless of the file's order, which avoids deadlocks between
+        # concurrent loads (`lock_forecast_versions()` is a no-op on sqlite, so we just test the calls)
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project, _, _, _ = _make_docs_project(po_user)
+        oracle_model = oracle_model_for_project(project)
+        truth_csv = "timezero,unit,target,value\n" \
+                    "2011-10-16,loc1,pct next week,1.1\n" \
+                    "2011-10-02,loc1,pct next week,2.2\n" \
+                    "2011-10-09,loc1,pct next week,3.3\n"
+        with patch('forecast_app.models.forecast.lock_forecast_versions') as lock_mock:
+            load_truth_data(project, io.StringIO(truth_csv), file_name='lock-order.csv')
+        locked_tz_ids = list(dict.fromkeys(call_args[0][1] for call_args in lock_mock.call_args_list
+                                           if call_args[0][0] == oracle_model.pk))  # first lock of each. re-entrant
+        self.assertEqual(sorted(project.timezeros.values_list('id', flat=True)), locked_tz_ids)
+
+
     def test_load_truth_data_other_files(self):
         # test truth files that used to be in yyyymmdd or yyyyww (EW) formats
         # truths-ok.csv (2017-01-17-truths.csv would basically test the same)
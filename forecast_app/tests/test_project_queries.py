@@ -1,23 +1,41 @@
+import copy
+import csv
 import datetime
+import importlib.util
+import io
 import json
 import logging
+import math
 import statistics
+import unittest
+from contextlib import contextmanager
 from numbers import Number
 from pathlib import Path
-from unittest.mock import patch
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
 import numpy
 from botocore.exceptions import BotoCoreError
+from django.db import OperationalError, connection
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
 
-from forecast_app.models import TimeZero, Forecast, Job, Unit, Target
+from forecast_app.models import TimeZero, Forecast, Job, Unit, Target, PredictionElement, LatestPredictionElement
+from forecast_app.models.job import JOB_TYPE_QUERY_FORECAST, JOB_TYPE_QUERY_TRUTH
 from forecast_app.models.forecast_model import ForecastModel
 from forecast_app.models.prediction_element import PRED_CLASS_INT_TO_NAME
-from utils.forecast import load_predictions_from_json_io_dict, NamedData
+from utils.forecast import load_predictions_from_json_io_dict, NamedData, cache_forecast_metadata
 from utils.make_minimal_projects import _make_docs_project
-from utils.project import create_project_from_json
+from utils.project import config_dict_from_project, create_project_from_json
+from utils.project_diff import execute_project_config_diff, project_config_diff
 from utils.project_queries import FORECAST_CSV_HEADER, query_forecasts_for_project, _forecasts_query_worker, \
-    validate_truth_query, _truth_query_worker, query_truth_for_project
+    validate_truth_query, _truth_query_worker, query_truth_for_project, query_cache_key, project_data_version, \
+    cached_query_job, plan_forecast_query_shards, _merge_query_shards_worker, copy_forecasts_query_csv, \
+    estimate_query_num_pred_eles, run_small_query, estimate_forecast_query_rows, is_query_estimate_too_large, \
+    _avg_array_length, NUM_ARRAY_LENGTH_SAMPLES
+from utils.named_distributions import named_bin_probs, named_cdf, named_means, named_medians, named_quantiles, \
+    named_samples
+from utils.query_parquet import write_query_rows_parquet
 from utils.project_queries import validate_forecasts_query
 from utils.project_truth import TRUTH_CSV_HEADER, oracle_model_for_project, load_truth_data
 from utils.utilities import get_or_create_super_po_mo_users, YYYY_MM_DD_DATE_FORMAT
@@ -26,6 +44,19 @@ from utils.utilities import get_or_create_super_po_mo_users, YYYY_MM_DD_DATE_FOR
 logging.getLogger().setLevel(logging.ERROR)
 
 
+@contextmanager
+def _run_on_commit_callbacks():
+    """
+    Runs the `transaction.on_commit()` callbacks registered in the with block when it exits, which tests need b/c
+    TestCase never commits.
+    """
+    num_callbacks = len(connection.run_on_commit)
+    yield
+    while len(connection.run_on_commit) > num_callbacks:
+        _, callback = connection.run_on_commit.pop(num_callbacks)
+        callback()
+
+
 class ProjectQueriesTestCase(TestCase):
     """
     """
@@ -117,9 +148,16 @@ class ProjectQueriesTestCase(TestCase):
         rows = list(query_forecasts_for_project(self.project, {'types': ['bin']}))  # list for generator
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
 
-        # same test but with conversion
-        rows = list(query_forecasts_for_project(self.project, {'types': ['bin'], 'options': {'convert.bin': True}}))
-        self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
+        # same test but with conversion, which adds bins converted from sample or named data for the four numeric
+        # (unit, target)s that have such data but no bins
+        rows_convert = list(
+            query_forecasts_for_project(self.project, {'types': ['bin'], 'options': {'convert.bin': True}}))
+        self.assertEqual(FORECAST_CSV_HEADER, rows_convert.pop(0))
+        exp_rows_named_bin = self._exp_rows_convert_bin(self.project,
+                                                        list(query_forecasts_for_project(self.project, {}))[1:])
+        self.assertEqual({('loc1', 'cases next week'), ('loc1', 'pct next week'), ('loc2', 'cases next week'),
+                          ('loc3', 'pct next week')},
+                         {(row[3], row[4]) for row in exp_rows_named_bin})
 
         exp_rows_bin = [(model, tz, seas, 'loc1', 'Season peak week', 'bin', '2019-12-15', 0.01),
                         (model, tz, seas, 'loc1', 'Season peak week', 'bin', '2019-12-22', 0.1),
@@ -143,6 +181,11 @@ class ProjectQueriesTestCase(TestCase):
         act_rows = [(row[0], row[1], row[2], row[3], row[4], row[5], row[7], row[8]) for row in rows]
         self.assertEqual(exp_rows_bin, sorted(act_rows))
 
+        act_rows = [(row[0], row[1], row[2], row[3], row[4], row[5], row[7], row[8]) for row in rows_convert]
+        exp_rows_convert = exp_rows_bin + [(row[0], row[1], row[2], row[3], row[4], row[5], row[7], row[8])
+                                           for row in exp_rows_named_bin]
+        self.assertEqual(sorted(exp_rows_convert), sorted(act_rows))
+
         # ----  case: all named data in project. check family, and param1, 2, and 3 columns ----
         rows = list(query_forecasts_for_project(self.project, {'types': ['named']}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
@@ -250,8 +293,8 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         rows = list(query_forecasts_for_project(self.project, {'options': {'convert.bin': True}}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
-        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin),
-                         len(rows))
+        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin +
+                             exp_rows_named_bin), len(rows))
 
         # ---- case: only one unit ----
         rows = list(query_forecasts_for_project(self.project, {'units': ['loc3']}))
@@ -262,7 +305,7 @@ class ProjectQueriesTestCase(TestCase):
         rows = list(
             query_forecasts_for_project(self.project, {'units': ['loc3'], 'options': {'convert.bin': True}}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
-        self.assertEqual(18, len(rows))
+        self.assertEqual(18 + 4, len(rows))  # 'pct next week' samples converted to four bins
 
         # ---- case: only one target ----
         rows = list(query_forecasts_for_project(self.project, {'targets': ['above baseline']}))
@@ -295,10 +338,12 @@ class ProjectQueriesTestCase(TestCase):
                          - 4, len(rows))
 
         # same test but with conversion
+        exp_rows_named_bin = self._exp_rows_convert_bin(self.project,
+                                                        list(query_forecasts_for_project(self.project, {}))[1:])
         rows = list(query_forecasts_for_project(self.project, {'options': {'convert.bin': True}}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
         self.assertEqual((len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin) * 2)
-                         - 4, len(rows))
+                         - 4 + len(exp_rows_named_bin), len(rows))
 
         # ---- case: only one timezero ----
         rows = list(query_forecasts_for_project(self.project, {'timezeros': ['2011-10-22']}))
@@ -307,11 +352,13 @@ class ProjectQueriesTestCase(TestCase):
                          len(rows))
 
         # same test but with conversion
+        exp_rows_named_bin = self._exp_rows_convert_bin(
+            self.project, list(query_forecasts_for_project(self.project, {'timezeros': ['2011-10-22']}))[1:])
         rows = list(
             query_forecasts_for_project(self.project, {'timezeros': ['2011-10-22'], 'options': {'convert.bin': True}}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
-        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin) - 4,
-                         len(rows))
+        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin) - 4 +
+                         len(exp_rows_named_bin), len(rows))
 
         # ---- case: only one model ----
         rows = list(query_forecasts_for_project(self.project, {'models': ['abbrev']}))
@@ -321,10 +368,12 @@ class ProjectQueriesTestCase(TestCase):
 
         # ---- case: only one model ----
         # same test but with conversion
+        exp_rows_named_bin = self._exp_rows_convert_bin(
+            self.project, list(query_forecasts_for_project(self.project, {'models': ['abbrev']}))[1:])
         rows = list(query_forecasts_for_project(self.project, {'models': ['abbrev'], 'options': {'convert.bin': True}}))
         self.assertEqual(FORECAST_CSV_HEADER, rows.pop(0))
-        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin) - 4,
-                         len(rows))
+        self.assertEqual(len(exp_rows_quantile + exp_rows_sample + exp_rows_point + exp_rows_named + exp_rows_bin) - 4 +
+                         len(exp_rows_named_bin), len(rows))
 
 
     def test_query_forecasts_for_project_max_num_rows(self):
@@ -355,22 +404,22 @@ class ProjectQueriesTestCase(TestCase):
         # ensure query_forecasts_for_project() is called
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
         with patch('utils.project_queries.query_forecasts_for_project') as query_mock, \
-                patch('utils.cloud_file.upload_file'):
+                patch('utils.cloud_file.upload_file_stream'):
             _forecasts_query_worker(job.pk)
             query_mock.assert_called_once_with(self.project, {})
 
-        # case: upload_file() does not error
+        # case: upload_file_stream() does not error
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
-        with patch('utils.cloud_file.upload_file') as upload_mock:
+        with patch('utils.cloud_file.upload_file_stream') as upload_mock:
             _forecasts_query_worker(job.pk)
             upload_mock.assert_called_once()
 
             job.refresh_from_db()
             self.assertEqual(Job.SUCCESS, job.status)
 
-        # case: upload_file() errors. BotoCoreError: alt: Boto3Error, ClientError, ConnectionClosedError:
+        # case: upload_file_stream() errors. BotoCoreError: alt: Boto3Error, ClientError, ConnectionClosedError:
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
-        with patch('utils.cloud_file.upload_file', side_effect=BotoCoreError()) as upload_mock, \
+        with patch('utils.cloud_file.upload_file_stream', side_effect=BotoCoreError()) as upload_mock, \
                 patch('forecast_app.notifications.send_notification_email'):
             _forecasts_query_worker(job.pk)
             upload_mock.assert_called_once()
@@ -379,13 +428,508 @@ class ProjectQueriesTestCase(TestCase):
             self.assertEqual(Job.FAILED, job.status)
             self.assertIn("_query_worker(): error", job.failure_message)
 
-        # case: allow actual utils.cloud_file.upload_file(), which calls Bucket.put_object(). we don't actually do this
+        # case: allow actual utils.cloud_file.upload_file_stream(), which calls S3. we don't actually do this
         # in this test b/c we don't want to hit S3, but it's commented here for debugging:
         # _forecasts_query_worker(job.pk)
         # job.refresh_from_db()
         # self.assertEqual(Job.SUCCESS, job.status)
 
 
+    def test_copy_forecasts_query_csv_unsupported(self):
+        # type conversion is never supported, and nothing is supported on sqlite
+        text_io = io.StringIO(newline='')
+        self.assertIsNone(copy_forecasts_query_csv(self.project, {'options': {'convert.bin': True}}, text_io))
+        if connection.vendor != 'postgresql':
+            self.assertIsNone(copy_forecasts_query_csv(self.project, {}, text_io))
+        self.assertEqual('', text_io.getvalue())
+
+
+    @unittest.skipIf(connection.vendor != 'postgresql', "copy_forecasts_query_csv() does not support sqlite3")
+    def test_copy_forecasts_query_csv(self):
+        # add a forecast with numbers that Python formats with exponents, plus booleans and empty strings
+        time_zero_2 = self.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        forecast_2 = Forecast.objects.create(forecast_model=self.forecast_model, time_zero=time_zero_2)
+        load_predictions_from_json_io_dict(forecast_2, {'predictions': [
+            {'unit': 'loc1', 'target': 'pct next week', 'class': 'point', 'prediction': {'value': 1.5e-05}},
+            {'unit': 'loc2', 'target': 'pct next week', 'class': 'point', 'prediction': {'value': 2e+16}},
+            {'unit': 'loc1', 'target': 'pct next week', 'class': 'quantile',
+             'prediction': {'quantile': [0.0001, 0.5], 'value': [-3e-07, 1.0]}},
+            {'unit': 'loc1', 'target': 'cases next week', 'class': 'sample', 'prediction': {'sample': [0, 1e-05]}},
+            {'unit': 'loc1', 'target': 'above baseline', 'class': 'point', 'prediction': {'value': True}}]},
+            is_validate_cats=False)
+
+        for query in [{}, {'types': ['bin', 'quantile']}, {'units': ['loc1'], 'as_of': '2100-01-01'},
+                      {'models': ['docs_mod'], 'timezeros': ['2011-10-09']}]:
+            exp_text_io, act_text_io = io.StringIO(newline=''), io.StringIO(newline='')
+            exp_rows = list(query_forecasts_for_project(self.project, query))
+            csv.writer(exp_text_io).writerows(exp_rows)
+            self.assertEqual(len(exp_rows), copy_forecasts_query_csv(self.project, query, act_text_io))
+            self.assertEqual(exp_text_io.getvalue(), act_text_io.getvalue())
+
+        with self.assertRaises(RuntimeError) as context:
+            copy_forecasts_query_csv(self.project, {}, io.StringIO(), max_num_rows=2)
+        self.assertIn("number of rows exceeded maximum", str(context.exception))
+
+
+    def test_estimate_forecast_query_rows(self):
+        # case: all units and targets: the number of prediction elements is exact
+        num_latest_pred_eles = LatestPredictionElement.objects.filter(forecast_model=self.forecast_model).count()
+        estimate = estimate_forecast_query_rows(self.project, {}, validate_forecasts_query(self.project, {})[1])
+        self.assertEqual(num_latest_pred_eles, estimate['num_pred_eles'])
+        self.assertTrue(estimate['is_exact'])
+        self.assertTrue(estimate['is_complete'])
+        self.assertEqual(set(PRED_CLASS_INT_TO_NAME.values()), set(estimate['class_to_num_rows']))
+        self.assertEqual(sum(estimate['class_to_num_rows'].values()), estimate['num_rows'])
+
+        # case: rows are estimated from array lengths. the docs forecast's points have one row each, and its samples
+        # have more than one on average
+        query = {'types': ['point', 'sample']}
+        estimate = estimate_forecast_query_rows(self.project, query, validate_forecasts_query(self.project, query)[1])
+        class_to_num_rows = {class_name: 0 for class_name in query['types']}
+        for row in list(query_forecasts_for_project(self.project, query))[1:]:
+            class_to_num_rows[row[5]] += 1
+        self.assertEqual(class_to_num_rows['point'], estimate['class_to_num_rows']['point'])
+        num_sample_pred_eles = estimate['num_pred_eles'] - class_to_num_rows['point']
+        self.assertGreater(estimate['class_to_num_rows']['sample'], num_sample_pred_eles)
+
+        # case: _avg_array_length() samples each target's arrays in a single query
+        target_id_to_lengths = {}
+        for latest_pred_ele in LatestPredictionElement.objects.filter(forecast_model=self.forecast_model,
+                                                                      pred_class=PredictionElement.SAMPLE_CLASS):
+            target_id_to_lengths.setdefault(latest_pred_ele.target_id, []) \
+                .append(len(latest_pred_ele.pred_ele.pred_data.first().data['sample']))
+        self.assertTrue(all(len(lengths) <= NUM_ARRAY_LENGTH_SAMPLES for lengths in target_id_to_lengths.values()))
+        exp_avg_array_length = statistics.mean(statistics.mean(lengths) for lengths in target_id_to_lengths.values())
+        with self.assertNumQueries(1):
+            self.assertAlmostEqual(exp_avg_array_length,
+                                   _avg_array_length(self.project, [], [], PredictionElement.SAMPLE_CLASS))
+        forecast_model_2 = ForecastModel.objects.create(project=self.project, name='no forecasts', abbreviation='nf')
+        self.assertEqual(1, _avg_array_length(self.project, [forecast_model_2.pk], [],
+                                              PredictionElement.SAMPLE_CLASS))  # no samples
+
+        # case: a new version counts only once, including the predictions it inherits from older ones
+        forecast_2 = Forecast.objects.create(forecast_model=self.forecast_model, time_zero=self.time_zero,
+                                             issued_at=self.forecast.issued_at + datetime.timedelta(days=1))
+        load_predictions_from_json_io_dict(forecast_2, {'predictions': [
+            {'unit': 'loc3', 'target': 'pct next week', 'class': 'point', 'prediction': {'value': 2.1}}]},
+            is_subset_allowed=True)
+        cache_forecast_metadata(forecast_2)
+        estimate = estimate_forecast_query_rows(self.project, {}, validate_forecasts_query(self.project, {})[1])
+        self.assertEqual(LatestPredictionElement.objects.filter(forecast_model=self.forecast_model).count(),
+                         estimate['num_pred_eles'])
+
+        # case: unit and target subsets, and missing metadata, are inexact
+        query = {'units': ['loc1']}
+        self.assertFalse(estimate_forecast_query_rows(self.project, query,
+                                                      validate_forecasts_query(self.project, query)[1])['is_exact'])
+        time_zero_2 = self.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        Forecast.objects.create(forecast_model=self.forecast_model, time_zero=time_zero_2)
+        estimate = estimate_forecast_query_rows(self.project, {}, validate_forecasts_query(self.project, {})[1])
+        self.assertFalse(estimate['is_exact'])
+        self.assertFalse(estimate['is_complete'])
+
+        # case: is_query_estimate_too_large(): inexact estimates must exceed the maximum by a margin
+        for is_exact, num_pred_eles, exp_is_too_large in [(True, 10, False), (True, 11, True), (False, 11, False),
+                                                          (False, 21, True)]:
+            self.assertEqual(exp_is_too_large, is_query_estimate_too_large(
+                {'num_pred_eles': num_pred_eles, 'is_exact': is_exact}, max_num_rows=10))
+
+
+    def test_small_queries(self):
+        # case: forecast estimates come from cached metadata: all predictions, and then just the points
+        exp_num_pred_eles = len(PredictionElement.objects.filter(forecast=self.forecast))
+        self.assertEqual(exp_num_pred_eles, estimate_query_num_pred_eles(
+            self.project, JOB_TYPE_QUERY_FORECAST, {}, validate_forecasts_query(self.project, {})[1]))
+        query = {'types': ['point']}
+        self.assertEqual(len(PredictionElement.objects.filter(forecast=self.forecast,
+                                                              pred_class=PredictionElement.POINT_CLASS)),
+                         estimate_query_num_pred_eles(self.project, JOB_TYPE_QUERY_FORECAST, query,
+                                                      validate_forecasts_query(self.project, query)[1]))
+
+        # case: no estimate if a matching forecast has no cached metadata
+        time_zero_2 = self.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        Forecast.objects.create(forecast_model=self.forecast_model, time_zero=time_zero_2)
+        self.assertIsNone(estimate_query_num_pred_eles(self.project, JOB_TYPE_QUERY_FORECAST, {},
+                                                       validate_forecasts_query(self.project, {})[1]))
+
+        # case: truth estimates are the number of (unit, target, time zero) combinations
+        query = {'units': ['loc1'], 'timezeros': ['2011-10-02', '2011-10-09']}
+        self.assertEqual(1 * self.project.targets.count() * 2,
+                         estimate_query_num_pred_eles(self.project, JOB_TYPE_QUERY_TRUTH, query,
+                                                      validate_truth_query(self.project, query)[1]))
+
+        # case: run_small_query() returns the same rows as the query, or None if it is too large
+        for query_project_fcn in [query_forecasts_for_project, query_truth_for_project]:
+            exp_rows = list(query_project_fcn(self.project, {}))
+            self.assertEqual(exp_rows, run_small_query(self.project, {}, query_project_fcn))
+            self.assertIsNone(run_small_query(self.project, {}, query_project_fcn, max_num_rows=len(exp_rows) - 1))
+            self.assertIsNone(run_small_query(self.project, {}, query_project_fcn, max_num_pred_eles=1))
+
+        # case: timeouts fall back, but other errors are raised
+        for side_effect, exp_exception in [(OperationalError('canceling statement due to statement timeout'), None),
+                                           (KeyError('bug'), KeyError),
+                                           (RuntimeError('bug'), RuntimeError)]:
+            query_project_fcn = Mock(side_effect=side_effect)
+            if exp_exception:
+                with self.assertRaises(exp_exception):
+                    run_small_query(self.project, {}, query_project_fcn)
+            else:
+                self.assertIsNone(run_small_query(self.project, {}, query_project_fcn))
+
+
+    def test_query_result_cache(self):
+        from forecast_app.api_views import _create_query_job  # avoid circular imports
+        from forecast_app.views import query_cache_summary  # ""
+
+
+        # case: equivalent queries have the same key: names are resolved to ids, lists are sorted, and as_of is
+        # canonicalized to UTC
+        query_1 = {'units': ['loc1', 'loc2'], 'as_of': '2020-10-11T12:00:00+00:00'}
+        query_2 = {'units': ['loc2', 'loc1'], 'as_of': '2020-10-11T08:00:00-04:00'}
+        query_hash_1, data_version = query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query_1,
+                                                     validate_forecasts_query(self.project, query_1)[1])
+        query_hash_2, _ = query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query_2,
+                                          validate_forecasts_query(self.project, query_2)[1])
+        self.assertEqual(query_hash_1, query_hash_2)
+        self.assertEqual(data_version, project_data_version(self.project))
+
+        # case: different queries, options, and job types have different keys
+        for query_job_type, query in [(JOB_TYPE_QUERY_FORECAST, {'units': ['loc1']}),
+                                      (JOB_TYPE_QUERY_FORECAST, {**query_1, 'options': {'convert.bin': True}}),
+                                      (JOB_TYPE_QUERY_TRUTH, query_1)]:
+            validated_query = validate_forecasts_query(self.project, query)[1] \
+                if query_job_type == JOB_TYPE_QUERY_FORECAST else validate_truth_query(self.project, query)[1]
+            self.assertNotEqual(query_hash_1,
+                                query_cache_key(self.project, query_job_type, query, validated_query)[0])
+        self.assertNotEqual(query_hash_1,
+                            query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query_1,
+                                            validate_forecasts_query(self.project, query_1)[1], 'parquet')[0])
+
+        # case: a cache miss enqueues the query, and a successful run of it makes its output available
+        request = SimpleNamespace(user=self.po_user)
+        with patch('rq.queue.Queue.enqueue') as enqueue_mock:
+            job_1 = _create_query_job(self.project.pk, query_1, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                      request, query_hash_1, data_version)
+            enqueue_mock.assert_called_once_with(_forecasts_query_worker, job_1.pk)
+        self.assertIsNone(cached_query_job(query_hash_1))
+        with patch('utils.cloud_file.upload_file_stream'):
+            _forecasts_query_worker(job_1.pk)
+        job_1.refresh_from_db()
+        self.assertEqual(query_hash_1, job_1.query_hash)
+        self.assertEqual(job_1, cached_query_job(query_hash_1))
+
+        # case: a cache hit completes at once, sharing job_1's output
+        with patch('rq.queue.Queue.enqueue') as enqueue_mock:
+            job_2 = _create_query_job(self.project.pk, query_2, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                      request, query_hash_2, data_version)
+            enqueue_mock.assert_not_called()
+        self.assertEqual(Job.SUCCESS, job_2.status)
+        self.assertEqual({'num_rows': job_1.output_json['num_rows'], 'cached_job_pk': job_1.pk}, job_2.output_json)
+        self.assertEqual(job_1, job_2.output_job())
+        self.assertEqual(job_1, job_1.output_job())
+        self.assertEqual(job_1, cached_query_job(query_hash_1))  # hits are not themselves cache entries
+        self.assertEqual([['type', 'num_jobs', 'num_hits', 'hit_rate'], [[JOB_TYPE_QUERY_FORECAST, 2, 1, 50.0]]],
+                         list(query_cache_summary([job_1, job_2])))
+
+        # case: loading and deleting forecasts bump the data version, which changes the key. bumps wait for the
+        # transaction to commit so that it does not hold the project's row lock
+        time_zero_2 = self.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        with _run_on_commit_callbacks():
+            forecast_2 = Forecast.objects.create(forecast_model=self.forecast_model, time_zero=time_zero_2)
+            load_predictions_from_json_io_dict(forecast_2, {'predictions': [
+                {'unit': 'loc1', 'target': 'pct next week', 'class': 'point', 'prediction': {'value': 2.1}}]})
+            self.assertEqual(data_version, project_data_version(self.project))
+        self.assertEqual(data_version + 1, project_data_version(self.project))
+        with _run_on_commit_callbacks():
+            forecast_2.delete()
+        self.assertEqual(data_version + 2, project_data_version(self.project))
+        self.assertNotEqual(query_hash_1, query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query_1,
+                                                          validate_forecasts_query(self.project, query_1)[1])[0])
+
+        # case: a job whose data changed while it ran does not make its output available
+        job_3 = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': query_1,
+                                                                  'query_hash': 'stale', 'data_version': data_version})
+        with patch('utils.cloud_file.upload_file_stream'):
+            _forecasts_query_worker(job_3.pk)
+        job_3.refresh_from_db()
+        self.assertEqual(Job.SUCCESS, job_3.status)
+        self.assertIsNone(job_3.query_hash)
+        self.assertIsNone(cached_query_job('stale'))
+
+
+    def test_query_result_cache_config_edits(self):
+        query = {'units': ['loc1']}
+        validated_query = validate_forecasts_query(self.project, query)[1]
+        query_hash, data_version = query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query, validated_query)
+        Job.objects.create(user=self.po_user, status=Job.SUCCESS, query_hash=query_hash)
+        self.assertIsNotNone(cached_query_job(query_hash))
+
+        # case: editing a unit's name via a config diff bumps the data version, so a repeated query misses the cache
+        current_config_dict = config_dict_from_project(self.project, APIRequestFactory().request())
+        edit_config_dict = copy.deepcopy(current_config_dict)
+        [unit_dict for unit_dict in edit_config_dict['units'] if unit_dict['abbreviation'] == 'loc2'][0]['name'] = \
+            'new name'
+        with _run_on_commit_callbacks():
+            execute_project_config_diff(self.project, project_config_diff(current_config_dict, edit_config_dict))
+        self.assertEqual('new name', self.project.units.get(abbreviation='loc2').name)
+        self.assertLess(data_version, project_data_version(self.project))
+        new_query_hash, _ = query_cache_key(self.project, JOB_TYPE_QUERY_FORECAST, query, validated_query)
+        self.assertNotEqual(query_hash, new_query_hash)
+        self.assertIsNone(cached_query_job(new_query_hash))
+
+        # case: saving and deleting models, units, targets, and time zeros each bump the data version
+        forecast_model = ForecastModel.objects.create(project=self.project, name='new model', abbreviation='new')
+        target = self.project.targets.get(name='cases next week')
+        target.name = 'new target name'
+        unit = Unit.objects.create(project=self.project, name='new unit', abbreviation='new')
+        time_zero = TimeZero.objects.create(project=self.project, timezero_date=datetime.date(2020, 1, 1))
+        for change_fcn in [forecast_model.delete, target.save, unit.delete, time_zero.delete]:
+            data_version = project_data_version(self.project)
+            with _run_on_commit_callbacks():
+                change_fcn()
+            self.assertEqual(data_version + 1, project_data_version(self.project), change_fcn)
+
+
+    def test_sharded_forecast_queries(self):
+        from forecast_app.api_views import _create_query_job  # avoid circular imports
+
+
+        # add a second model with forecasts for two time zeros
+        forecast_model_2 = ForecastModel.objects.create(project=self.project, name='model 2', abbreviation='mod_2')
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            json_io_dict = json.load(fp)
+        for timezero_date in [datetime.date(2011, 10, 2), datetime.date(2011, 10, 9)]:
+            time_zero = self.project.timezeros.filter(timezero_date=timezero_date).first()
+            forecast = Forecast.objects.create(forecast_model=forecast_model_2, time_zero=time_zero)
+            load_predictions_from_json_io_dict(forecast, json_io_dict, is_validate_cats=False)
+            cache_forecast_metadata(forecast)
+
+        # case: small queries are not sharded
+        validated_query = validate_forecasts_query(self.project, {})[1]
+        self.assertEqual([], plan_forecast_query_shards(self.project, {}, validated_query))
+
+        # case: shard by model
+        self.assertEqual([{'models': ['docs_mod']}, {'models': ['mod_2']}],
+                         plan_forecast_query_shards(self.project, {}, validated_query, 0, 2))
+
+        # case: a model that is too large by itself is split into ranges of its time zeros
+        query = {'models': ['mod_2'], 'types': ['point']}
+        validated_query = validate_forecasts_query(self.project, query)[1]
+        self.assertEqual([{'models': ['mod_2'], 'types': ['point'], 'timezeros': ['2011-10-02']},
+                          {'models': ['mod_2'], 'types': ['point'], 'timezeros': ['2011-10-09']}],
+                         plan_forecast_query_shards(self.project, query, validated_query, 0, 2))
+        self.assertEqual([], plan_forecast_query_shards(self.project, query, validated_query, 0, 1))
+
+        # run an unsharded job and a sharded one, and compare their outputs. we fake S3 via job_pk_to_csv
+        job_pk_to_csv = {}
+
+
+        @contextmanager
+        def upload_file_stream_mock(job, is_text=True):
+            self.assertTrue(is_text)
+            text_io = io.StringIO(newline='')
+            yield text_io
+            job_pk_to_csv[job.pk] = text_io.getvalue()
+
+
+        def download_file_mock(job, data_file):
+            data_file.write(job_pk_to_csv[job.pk].encode('utf-8'))
+
+
+        request = SimpleNamespace(user=self.po_user)
+        query = {'options': {'convert.bin': True}}  # exercises conversion, whose rows are ordered
+        validated_query = validate_forecasts_query(self.project, query)[1]
+        shard_queries = plan_forecast_query_shards(self.project, query, validated_query, 0, 2)
+        self.assertEqual(2, len(shard_queries))
+        with patch('utils.cloud_file.upload_file_stream', new=upload_file_stream_mock), \
+                patch('utils.cloud_file.download_file', new=download_file_mock), \
+                patch('utils.cloud_file.delete_file') as delete_mock, \
+                patch('rq.queue.Queue.enqueue') as enqueue_mock:
+            exp_job = _create_query_job(self.project.pk, query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                        request, None, None)
+            _forecasts_query_worker(exp_job.pk)
+            exp_job.refresh_from_db()
+
+            enqueue_mock.reset_mock()
+            job = _create_query_job(self.project.pk, query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                    request, None, None, shard_queries)
+            shard_jobs = list(Job.objects.filter(parent_job=job).order_by('pk'))
+            self.assertEqual([0, 1], [shard_job.input_json['shard_idx'] for shard_job in shard_jobs])
+            self.assertEqual([(_forecasts_query_worker, shard_job.pk) for shard_job in shard_jobs],
+                             [call_args.args for call_args in enqueue_mock.call_args_list])
+            self.assertEqual(Job.QUEUED, job.status)
+
+            # the first shard updates progress, and the second enqueues the merge
+            enqueue_mock.reset_mock()
+            _forecasts_query_worker(shard_jobs[0].pk)
+            job.refresh_from_db()
+            self.assertEqual({'num_shards': 2, 'num_shards_done': 1}, job.output_json)
+            enqueue_mock.assert_not_called()
+
+            _forecasts_query_worker(shard_jobs[1].pk)
+            enqueue_mock.assert_called_once_with(_merge_query_shards_worker, job.pk)
+
+            _merge_query_shards_worker(job.pk)
+            job.refresh_from_db()
+            self.assertEqual(Job.SUCCESS, job.status)
+            self.assertEqual(exp_job.output_json['num_rows'], job.output_json['num_rows'])
+            self.assertEqual(job_pk_to_csv[exp_job.pk], job_pk_to_csv[job.pk])
+            self.assertEqual({shard_job.pk for shard_job in shard_jobs},
+                             {call_args.args[0].pk for call_args in delete_mock.call_args_list})
+
+            # case: a failed shard fails the parent, and the merge is not enqueued
+            job = _create_query_job(self.project.pk, query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                    request, None, None, shard_queries)
+            shard_jobs = list(Job.objects.filter(parent_job=job).order_by('pk'))
+            enqueue_mock.reset_mock()
+            with patch('utils.project_queries.query_forecasts_for_project', side_effect=RuntimeError('bad shard')):
+                _forecasts_query_worker(shard_jobs[0].pk)
+            _forecasts_query_worker(shard_jobs[1].pk)
+            enqueue_mock.assert_not_called()
+            job.refresh_from_db()
+            self.assertEqual(Job.FAILED, job.status)
+            self.assertIn("shard 0 FAILED", job.failure_message)
+            self.assertIn("bad shard", job.failure_message)
+
+        # case: only the newest version of each (model, time zero) counts (its counts include the predictions it
+        # inherits), so a new version neither unbalances the shards nor pushes the total over MAX_NUM_QUERY_ROWS
+        new_version_predictions = copy.deepcopy(json_io_dict['predictions'])
+        point_prediction = next(prediction for prediction in new_version_predictions if prediction['class'] == 'point')
+        point_prediction['prediction']['value'] += 1  # a changed prediction so that the version is not a subset
+        forecast_2 = Forecast.objects.create(forecast_model=self.forecast_model, time_zero=self.time_zero,
+                                             issued_at=self.forecast.issued_at + datetime.timedelta(days=1))
+        load_predictions_from_json_io_dict(forecast_2, {'predictions': new_version_predictions},
+                                           is_validate_cats=False)
+        for forecast in [self.forecast, forecast_2]:
+            cache_forecast_metadata(forecast)
+        num_latest_pred_eles = LatestPredictionElement.objects.filter(forecast_model__project=self.project,
+                                                                      forecast_model__is_oracle=False).count()
+        validated_query = validate_forecasts_query(self.project, {})[1]
+        with patch('utils.project_queries.MAX_NUM_QUERY_ROWS', num_latest_pred_eles):
+            self.assertEqual([{'models': ['docs_mod']}, {'models': ['mod_2']}],
+                             plan_forecast_query_shards(self.project, {}, validated_query, 0, 2))
+
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, "pyarrow is not installed")
+    def test_write_query_rows_parquet(self):
+        import pyarrow.parquet as pq
+
+
+        # case: forecasts. every CSV cell is in the Parquet file, typed, and in batches of row_group_size rows
+        exp_rows = list(query_forecasts_for_project(self.project, {}))
+        binary_io = io.BytesIO()
+        self.assertEqual(len(exp_rows), write_query_rows_parquet(iter(exp_rows), binary_io, row_group_size=10))
+        parquet_file = pq.ParquetFile(io.BytesIO(binary_io.getvalue()))
+        self.assertEqual(-(-(len(exp_rows) - 1) // 10), parquet_file.num_row_groups)
+        table = parquet_file.read()
+        self.assertEqual(FORECAST_CSV_HEADER + ['value_text', 'sample_text'], table.column_names)
+        for column_name in ['model', 'unit', 'target', 'class']:
+            self.assertEqual('dictionary', str(table.schema.field(column_name).type).split('<')[0])
+        for column_name in ['value', 'prob', 'sample', 'quantile']:
+            self.assertEqual('double', str(table.schema.field(column_name).type))
+
+        act_rows = []
+        for parquet_row in table.to_pylist():
+            value = parquet_row['value'] if parquet_row['value'] is not None else parquet_row['value_text']
+            sample = parquet_row['sample'] if parquet_row['sample'] is not None else parquet_row['sample_text']
+            act_rows.append([parquet_row['model'], parquet_row['timezero'].strftime(YYYY_MM_DD_DATE_FORMAT),
+                             parquet_row['season'], parquet_row['unit'], parquet_row['target'], parquet_row['class'],
+                             value, parquet_row['cat'], parquet_row['prob'], sample, parquet_row['quantile'],
+                             parquet_row['family'], parquet_row['param1'], parquet_row['param2'],
+                             parquet_row['param3']])
+        cat_idx = FORECAST_CSV_HEADER.index('cat')  # a string column
+        self.assertEqual([[self._parquet_cell_str(cell, idx == cat_idx) for idx, cell in enumerate(row)]
+                          for row in exp_rows[1:]],
+                         [[self._parquet_cell_str(cell, idx == cat_idx) for idx, cell in enumerate(row)]
+                          for row in act_rows])
+
+        # case: truth
+        exp_rows = list(query_truth_for_project(self.project, {}))
+        binary_io = io.BytesIO()
+        self.assertEqual(len(exp_rows), write_query_rows_parquet(iter(exp_rows), binary_io))
+        table = pq.read_table(io.BytesIO(binary_io.getvalue()))
+        self.assertEqual(TRUTH_CSV_HEADER + ['value_text'], table.column_names)
+        self.assertEqual([self._parquet_cell_str(row[3]) for row in exp_rows[1:]],
+                         [self._parquet_cell_str(value if value is not None else value_text) for value, value_text
+                          in zip(table.column('value').to_pylist(), table.column('value_text').to_pylist())])
+
+        # case: no rows
+        binary_io = io.BytesIO()
+        self.assertEqual(1, write_query_rows_parquet(iter([TRUTH_CSV_HEADER]), binary_io))
+        self.assertEqual(0, pq.read_table(io.BytesIO(binary_io.getvalue())).num_rows)
+
+
+    @staticmethod
+    def _parquet_cell_str(cell, is_text=False):
+        """
+        :return: cell as a string for comparing CSV and Parquet cells. the latter's numbers are all doubles, except for
+            those in text columns
+        """
+        if cell in ['', None]:
+            return ''
+        elif isinstance(cell, Number) and not isinstance(cell, bool) and not is_text:
+            return str(float(cell))
+        else:
+            return str(cell)
+
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, "pyarrow is not installed")
+    def test_parquet_query_jobs(self):
+        from forecast_app.api_views import _create_query_job  # avoid circular imports
+        import pyarrow.parquet as pq
+
+
+        # add a second model so that the query can be sharded. we fake S3 via job_pk_to_bytes
+        forecast_model_2 = ForecastModel.objects.create(project=self.project, name='model 2', abbreviation='mod_2')
+        forecast = Forecast.objects.create(forecast_model=forecast_model_2, time_zero=self.time_zero)
+        with open('forecast_app/tests/predictions/docs-predictions.json') as fp:
+            load_predictions_from_json_io_dict(forecast, json.load(fp), is_validate_cats=False)
+        job_pk_to_bytes = {}
+
+
+        @contextmanager
+        def upload_file_stream_mock(job, is_text=True):
+            self.assertFalse(is_text)
+            binary_io = io.BytesIO()
+            yield binary_io
+            job_pk_to_bytes[job.pk] = binary_io.getvalue()
+
+
+        def download_file_mock(job, data_file):
+            data_file.write(job_pk_to_bytes[job.pk])
+
+
+        # an unsharded job and a sharded one write the same table
+        request = SimpleNamespace(user=self.po_user)
+        query = {}
+        validated_query = validate_forecasts_query(self.project, query)[1]
+        shard_queries = plan_forecast_query_shards(self.project, query, validated_query, 0, 2)
+        with patch('utils.cloud_file.upload_file_stream', new=upload_file_stream_mock), \
+                patch('utils.cloud_file.download_file', new=download_file_mock), \
+                patch('utils.cloud_file.delete_file'), \
+                patch('rq.queue.Queue.enqueue'):
+            exp_job = _create_query_job(self.project.pk, query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                        request, None, None, output_format='parquet')
+            _forecasts_query_worker(exp_job.pk)
+            exp_job.refresh_from_db()
+            self.assertEqual(Job.SUCCESS, exp_job.status)
+            self.assertEqual(len(list(query_forecasts_for_project(self.project, query))),
+                             exp_job.output_json['num_rows'])
+
+            job = _create_query_job(self.project.pk, query, JOB_TYPE_QUERY_FORECAST, _forecasts_query_worker,
+                                    request, None, None, shard_queries, 'parquet')
+            for shard_job in Job.objects.filter(parent_job=job):
+                self.assertEqual('parquet', shard_job.input_json['output_format'])
+                _forecasts_query_worker(shard_job.pk)
+            _merge_query_shards_worker(job.pk)
+            job.refresh_from_db()
+            self.assertEqual(Job.SUCCESS, job.status)
+            self.assertEqual(exp_job.output_json['num_rows'], job.output_json['num_rows'])
+            exp_table = pq.read_table(io.BytesIO(job_pk_to_bytes[exp_job.pk]))
+            act_table = pq.read_table(io.BytesIO(job_pk_to_bytes[job.pk]))
+            self.assertEqual(exp_table.to_pylist(), act_table.to_pylist())
+
+
     #
     # test forecast queries with auto-convert
     #
@@ -524,13 +1068,17 @@ class ProjectQueriesTestCase(TestCase):
                                                     {'types': ['point'], 'options': {'convert.point': 'median'}}))
         self.assertEqual(exp_rows, act_rows)
 
-        # case: S->B (currently unsupported conversion) -> returns only header
+        # case: S->B, over the target's [lwr, upper) bins: [0, 2), [2, 50), and [50, inf)
         f1.delete()
         f1 = Forecast.objects.create(forecast_model=forecast_model, source='f1', time_zero=tz1)
         load_predictions_from_json_io_dict(f1, {'predictions': predictions}, is_validate_cats=False)
         exp_rows = [
             ['model', 'timezero', 'season', 'unit', 'target', 'class', 'value', 'cat', 'prob', 'sample', 'quantile',
-             'family', 'param1', 'param2', 'param3']]
+             'family', 'param1', 'param2', 'param3'],
+            ['convs_model', '2011-10-02', '2011-2012', 'loc1', 'cases next week', 'bin', '', 0, 0.25, '', '', '', '',
+             '', ''],
+            ['convs_model', '2011-10-02', '2011-2012', 'loc1', 'cases next week', 'bin', '', 2, 0.75, '', '', '', '',
+             '', '']]
         act_rows = list(query_forecasts_for_project(project, {'types': ['bin'], 'options': {'convert.bin': True}}))
         self.assertEqual(exp_rows, act_rows)
 
@@ -547,6 +1095,320 @@ class ProjectQueriesTestCase(TestCase):
         self.assertEqual(exp_rows, act_rows)
 
 
+    #
+    # test conversions from named distributions
+    #
+
+    @staticmethod
+    def _exp_rows_convert_bin(project, exp_rows):
+        """
+        :return: the rows that the 'convert.bin' option adds to the (unconverted) query rows exp_rows, i.e., bins
+            converted from the sample (or, if none, named) rows of those numeric (model, timezero, unit, target)s that
+            have no bin rows
+        """
+        key_to_rows = {}  # ordered by first row
+        for row in exp_rows:
+            key_to_rows.setdefault((row[0], row[1], row[3], row[4]), []).append(row)
+        bin_rows = []
+        for (_, _, _, target_name), rows in key_to_rows.items():
+            target = project.targets.get(name=target_name)
+            if any(row[5] == 'bin' for row in rows) or not target.lwrs.exists() \
+                    or (target.type not in [Target.CONTINUOUS_TARGET_TYPE, Target.DISCRETE_TARGET_TYPE]):
+                continue
+
+            lwrs, uppers = zip(*target.lwrs.order_by('lwr').values_list('lwr', 'upper'))
+            sample_rows = [row for row in rows if row[5] == 'sample']
+            named_rows = [row for row in rows if row[5] == 'named']
+            if sample_rows:
+                samples = [row[9] for row in sample_rows]
+                probs = [len([sample for sample in samples if lwr <= sample < upper]) / len(samples)
+                         for lwr, upper in zip(lwrs, uppers)]
+            elif named_rows:
+                row = named_rows[0]
+                probs = named_bin_probs(row[11], [row[12]], [row[13] or 0], lwrs, uppers)[0].tolist()
+            else:
+                continue
+
+            for lwr, prob in zip(lwrs, probs):
+                if prob > 0:
+                    cat = int(lwr) if target.type == Target.DISCRETE_TARGET_TYPE else lwr
+                    bin_rows.append(list(rows[0][:5]) + ['bin', '', cat, prob, '', '', '', '', '', ''])
+        return bin_rows
+
+
+    def test_named_distributions(self):
+        # CDFs vs. closed forms and the standard library
+        for z in [-30, -5, -1.5, 0, 0.3, 2, 8]:
+            self.assertAlmostEqual(1, named_cdf('norm', 0, 1, z) / (math.erfc(-z / math.sqrt(2)) / 2), places=12)
+        self.assertAlmostEqual(math.erfc(-1 / math.sqrt(2)) / 2, named_cdf('lnorm', 0, 1, math.e))
+        for x in [0.01, 0.7, 3, 20]:  # gamma with integer shape (Erlang). shape=3, rate=2
+            self.assertAlmostEqual(1 - math.exp(-2 * x) * (1 + 2 * x + (2 * x) ** 2 / 2),
+                                   named_cdf('gamma', 3, 2, x), places=14)
+        for x in [0.01, 0.5, 0.99]:  # beta(2, 3): I_x = 6x^2 - 8x^3 + 3x^4
+            self.assertAlmostEqual(6 * x ** 2 - 8 * x ** 3 + 3 * x ** 4, named_cdf('beta', 2, 3, x), places=14)
+        for k in [0, 3, 10]:
+            self.assertAlmostEqual(sum(math.exp(-1.1) * 1.1 ** i / math.factorial(i) for i in range(k + 1)),
+                                   named_cdf('pois', 1.1, 0, k + 0.5), places=14)
+            self.assertAlmostEqual(sum(math.comb(i + 2, i) * 0.4 ** 3 * 0.6 ** i for i in range(k + 1)),
+                                   named_cdf('nbinom', 3, 0.4, k), places=14)
+            # nbinom2 with mean 4.5 and disp 1/3 is nbinom with r=3, p=0.4
+            self.assertAlmostEqual(named_cdf('nbinom', 3, 0.4, k), named_cdf('nbinom2', 4.5, 1 / 3, k), places=14)
+        self.assertEqual([0.0, 1.0], named_cdf('pois', 1.1, 0, [-1, float('inf')]).tolist())
+
+        # quantiles invert the CDFs. discrete ones are the smallest integers whose CDF is >= the level
+        quantiles = [0.001, 0.025, 0.5, 0.9, 0.999]
+        for family, param1, param2 in [('norm', 1.1, 2.2), ('lnorm', 0.5, 0.3), ('gamma', 0.5, 3), ('beta', 30, 1)]:
+            values = named_quantiles(family, [param1], [param2], quantiles)[0]
+            for quantile, value in zip(quantiles, named_cdf(family, param1, param2, values).tolist()):
+                self.assertAlmostEqual(quantile, value, places=10)
+        self.assertEqual([[-math.inf, 1.1, math.inf]], named_quantiles('norm', [1.1], [2.2], [0, 0.5, 1]).tolist())
+        self.assertAlmostEqual(1.1 + 2.2 * 1.959963984540054, named_quantiles('norm', [1.1], [2.2], [0.975])[0, 0])
+        self.assertEqual([[0, 1, 2, 4, math.inf], [8, 10, 14, 18, math.inf]],
+                         named_quantiles('pois', [1.1, 10], None, [0.3, 0.5, 0.9, 0.99, 1]).tolist())
+
+        # means and medians
+        self.assertAlmostEqual(4.5, named_means('nbinom', [3], [0.4])[0])
+        self.assertAlmostEqual(1.5, named_means('gamma', [3], [2])[0])
+        self.assertAlmostEqual(math.exp(0.5 + 0.3 ** 2 / 2), named_means('lnorm', [0.5], [0.3])[0])
+        self.assertEqual([1.1, 1.0], [named_medians('norm', [1.1], [2.2])[0], named_medians('pois', [1.1], None)[0]])
+
+        # samples are deterministic per seed, regardless of the other distributions passed with it
+        samples = named_samples('norm', [1.1, 1.1, 5], [2.2, 2.2, 1], [7, 8, 7], 10_000)
+        self.assertEqual(samples[0].tolist(), named_samples('norm', [1.1], [2.2], [7], 10_000)[0].tolist())
+        self.assertNotEqual(samples[0].tolist(), samples[1].tolist())
+        self.assertAlmostEqual(1.1, samples[0].mean(), delta=0.1)
+        self.assertAlmostEqual(2.2, samples[0].std(), delta=0.1)
+        samples = named_samples('pois', [3], None, [7], 10_000)[0]
+        self.assertTrue(all(sample == int(sample) for sample in samples))
+        self.assertAlmostEqual(3, samples.mean(), delta=0.1)
+
+        # bins. discrete bins are [lwr, upper) over the integers
+        probs = named_bin_probs('pois', [1.1], None, [0, 2, 50], [2, 50, float('inf')])[0]
+        self.assertAlmostEqual(math.exp(-1.1) * 2.1, probs[0])
+        self.assertAlmostEqual(1 - math.exp(-1.1) * 2.1, probs[1])
+        probs = named_bin_probs('norm', [0], [1], [-math.inf, 0], [0, math.inf])[0]
+        self.assertEqual([0.5, 0.5], probs.tolist())
+
+
+    def test_query_forecasts_for_project_convert_N(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        forecast_model = ForecastModel.objects.create(project=project, name='convert model', abbreviation='convn_model')
+        tz1 = project.timezeros.filter(timezero_date=datetime.date(2011, 10, 2)).first()
+        f1 = Forecast.objects.create(forecast_model=forecast_model, source='f1', time_zero=tz1)
+        predictions = [{"unit": 'loc1', "target": 'pct next week', "class": "named",
+                        "prediction": {"family": "norm", "param1": 1.1, "param2": 2.2}},
+                       {"unit": 'loc2', "target": 'cases next week', "class": "named",
+                        "prediction": {"family": "pois", "param1": 1.1}},
+                       {"unit": 'loc2', "target": 'season severity', "class": "sample",  # not a numeric target
+                        "prediction": {"sample": ["mild", "severe"]}}]
+        load_predictions_from_json_io_dict(f1, {'predictions': predictions}, is_validate_cats=False)
+        model_tz_season = ['convn_model', '2011-10-02', '2011-2012']
+
+        # case: N->P: mean and median. the discrete median is an int
+        for point_option, exp_pois_value in [('mean', 1.1), ('median', 1)]:
+            act_rows = list(query_forecasts_for_project(project, {'types': ['point'],
+                                                                  'options': {'convert.point': point_option}}))
+            self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+            exp_rows = [model_tz_season + ['loc1', 'pct next week', 'point', 1.1, '', '', '', '', '', '', '', ''],
+                        model_tz_season + ['loc2', 'cases next week', 'point', exp_pois_value, '', '', '', '', '', '',
+                                           '', '']]
+            self.assertEqual(exp_rows, sorted(act_rows))
+            self.assertIsInstance(sorted(act_rows)[1][6], type(exp_pois_value))
+
+        # case: N->Q. quantiles are sorted
+        act_rows = list(query_forecasts_for_project(project, {'types': ['quantile'],
+                                                              'options': {'convert.quantile': [0.975, 0.025, 0.5]}}))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        exp_rows = [model_tz_season + ['loc1', 'pct next week', 'quantile', 1.1 - 2.2 * 1.959963984540054, '', '', '',
+                                       0.025, '', '', '', ''],
+                    model_tz_season + ['loc1', 'pct next week', 'quantile', 1.1, '', '', '', 0.5, '', '', '', ''],
+                    model_tz_season + ['loc1', 'pct next week', 'quantile', 1.1 + 2.2 * 1.959963984540054, '', '', '',
+                                       0.975, '', '', '', ''],
+                    model_tz_season + ['loc2', 'cases next week', 'quantile', 0, '', '', '', 0.025, '', '', '', ''],
+                    model_tz_season + ['loc2', 'cases next week', 'quantile', 1, '', '', '', 0.5, '', '', '', ''],
+                    model_tz_season + ['loc2', 'cases next week', 'quantile', 4, '', '', '', 0.975, '', '', '', '']]
+        self._assert_list_of_lists_almost_equal(exp_rows, act_rows)
+
+        # case: N->S. samples are the same for every query
+        query = {'types': ['sample'], 'options': {'convert.sample': 5}}
+        act_rows = list(query_forecasts_for_project(project, query))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        self.assertEqual([('loc1', 'pct next week')] * 5 + [('loc2', 'cases next week')] * 5 +
+                         [('loc2', 'season severity')] * 2,
+                         [(row[3], row[4]) for row in act_rows])
+        self.assertTrue(all(isinstance(row[9], int) for row in act_rows[5:10]))
+        self.assertEqual(act_rows, list(query_forecasts_for_project(project, query))[1:])
+
+        # case: N->B, over the targets' cats. zero probabilities are omitted
+        act_rows = list(query_forecasts_for_project(project, {'types': ['bin'], 'options': {'convert.bin': True}}))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        exp_rows = self._exp_rows_convert_bin(project, list(query_forecasts_for_project(project, {}))[1:])
+        self.assertEqual(exp_rows, act_rows)
+        self.assertEqual([0, 2], [row[7] for row in act_rows if row[4] == 'cases next week'])
+        self.assertEqual(9, len([row for row in act_rows if row[4] == 'pct next week']))  # [50, inf) is 0
+        self.assertAlmostEqual(1.0, sum(row[8] for row in act_rows if row[4] == 'pct next week')
+                               + named_cdf('norm', 1.1, 2.2, 0))  # the rest is below the first bin
+
+        # case: 'convert.bin': False does not convert
+        act_rows = list(query_forecasts_for_project(project, {'types': ['bin'], 'options': {'convert.bin': False}}))
+        self.assertEqual([FORECAST_CSV_HEADER], act_rows)
+
+        # case: batches: rows are the same, and in the same order, as with a single batch
+        query = {'types': ['bin', 'quantile', 'sample'],
+                 'options': {'convert.bin': True, 'convert.quantile': [0.5], 'convert.sample': 2}}
+        with patch('utils.project_queries.CONVERT_BATCH_SIZE', 1):
+            act_rows = list(query_forecasts_for_project(project, query))
+        self.assertEqual(list(query_forecasts_for_project(project, query)), act_rows)
+
+        # case: S and N -> P uses S
+        f1.delete()
+        f1 = Forecast.objects.create(forecast_model=forecast_model, source='f1', time_zero=tz1)
+        predictions = [{"unit": 'loc2', "target": 'cases next week', "class": "named",
+                        "prediction": {"family": "pois", "param1": 1.1}},
+                       {"unit": 'loc2', "target": 'cases next week', "class": "sample",
+                        "prediction": {"sample": [0, 2, 2, 5]}}]
+        load_predictions_from_json_io_dict(f1, {'predictions': predictions}, is_validate_cats=False)
+        act_rows = list(query_forecasts_for_project(project, {'types': ['point'],
+                                                              'options': {'convert.point': 'mean'}}))
+        self.assertEqual([FORECAST_CSV_HEADER,
+                          model_tz_season + ['loc2', 'cases next week', 'point', 2.25, '', '', '', '', '', '', '', '']],
+                         act_rows)
+
+
+    #
+    # test conversions to and from bins
+    #
+
+    def test_query_forecasts_for_project_convert_B(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        forecast_model = ForecastModel.objects.create(project=project, name='convert model', abbreviation='convb_model')
+        tz1 = project.timezeros.filter(timezero_date=datetime.date(2011, 10, 2)).first()
+        f1 = Forecast.objects.create(forecast_model=forecast_model, source='f1', time_zero=tz1)
+        predictions = [{"unit": 'loc1', "target": 'pct next week', "class": "bin",  # bins [1.1, 2.0) and [2.2, 3.0)
+                        "prediction": {"cat": [1.1, 2.2, 50.0], "prob": [0.2, 0.3, 0.5]}},
+                       {"unit": 'loc1', "target": 'cases next week', "class": "bin",  # bins [0, 2) and [2, 50)
+                        "prediction": {"cat": [0, 2], "prob": [0.5, 0.5]}},
+                       {"unit": 'loc2', "target": 'pct next week', "class": "bin",  # no target bins
+                        "prediction": {"cat": [7.7], "prob": [1.0]}},
+                       {"unit": 'loc2', "target": 'cases next week', "class": "sample",
+                        "prediction": {"sample": [0, 1, 1, 60]}},
+                       {"unit": 'loc2', "target": 'season severity', "class": "bin",  # not a numeric target
+                        "prediction": {"cat": ["mild", "severe"], "prob": [0.5, 0.5]}}]
+        load_predictions_from_json_io_dict(f1, {'predictions': predictions}, is_validate_cats=False)
+        model_tz_season = ['convb_model', '2011-10-02', '2011-2012']
+
+        # case: B->Q. probabilities are spread uniformly over each bin, so quantiles are linearly interpolated within
+        # them. the 50 bin is [50, 100) b/c the target's range is [0, 100]. discrete bins' probabilities are spread
+        # over their integers, and quantiles are the smallest integers whose CDF reaches them
+        act_rows = list(query_forecasts_for_project(project, {'types': ['quantile'],
+                                                              'options': {'convert.quantile': [0, 0.1, 0.5, 0.75]}}))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        exp_rows = [model_tz_season + ['loc1', 'pct next week', 'quantile', value, '', '', '', quantile, '', '', '', '']
+                    for quantile, value in [(0, 1.1), (0.1, 1.55), (0.5, 3.0), (0.75, 75.0)]] + \
+                   [model_tz_season + ['loc1', 'cases next week', 'quantile', value, '', '', '', quantile, '', '', '',
+                                       ''] for quantile, value in [(0, 0), (0.1, 0), (0.5, 1), (0.75, 25)]] + \
+                   [model_tz_season + ['loc2', 'cases next week', 'quantile', value, '', '', '', quantile, '', '', '',
+                                       ''] for quantile, value in zip([0, 0.1, 0.5, 0.75],
+                                                                      numpy.quantile([0, 1, 1, 60],
+                                                                                     [0, 0.1, 0.5, 0.75]))]
+        self._assert_list_of_lists_almost_equal(sorted(exp_rows), sorted(act_rows))
+        self.assertTrue(all(isinstance(row[6], int) for row in act_rows if row[3:5] == ['loc1', 'cases next week']))
+
+        # case: B->P: mean and median. a discrete bin's mean is that of its integers
+        for point_option, exp_pct_value, exp_cases_value in [('mean', 0.2 * 1.55 + 0.3 * 2.6 + 0.5 * 75, 13.0),
+                                                             ('median', 3.0, 1)]:
+            act_rows = list(query_forecasts_for_project(project, {'types': ['point'],
+                                                                  'options': {'convert.point': point_option}}))
+            self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+            exp_rows = [model_tz_season + ['loc1', 'cases next week', 'point', exp_cases_value, '', '', '', '', '', '',
+                                           '', ''],
+                        model_tz_season + ['loc1', 'pct next week', 'point', exp_pct_value, '', '', '', '', '', '', '',
+                                           '']]
+            self._assert_list_of_lists_almost_equal(exp_rows, sorted(act_rows)[:2])
+            self.assertEqual(['loc2', 'cases next week'], sorted(act_rows)[2][3:5])  # from samples
+
+        # case: S->B
+        act_rows = list(query_forecasts_for_project(project, {'types': ['bin'], 'options': {'convert.bin': True}}))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        self.assertEqual([model_tz_season + ['loc2', 'cases next week', 'bin', '', 0, 0.75, '', '', '', '', '', ''],
+                          model_tz_season + ['loc2', 'cases next week', 'bin', '', 50, 0.25, '', '', '', '', '', '']],
+                         [row for row in act_rows if row[3:5] == ['loc2', 'cases next week']])
+
+        # case: batches: rows are the same, and in the same order, as with a single batch
+        query = {'types': ['bin', 'point', 'quantile'],
+                 'options': {'convert.bin': True, 'convert.point': 'median', 'convert.quantile': [0.5]}}
+        with patch('utils.project_queries.CONVERT_BATCH_SIZE', 1):
+            act_rows = list(query_forecasts_for_project(project, query))
+        self.assertEqual(list(query_forecasts_for_project(project, query)), act_rows)
+
+
+    #
+    # test conversions from quantiles
+    #
+
+    def test_query_forecasts_for_project_convert_Q(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), po_user)
+        forecast_model = ForecastModel.objects.create(project=project, name='convert model', abbreviation='convq_model')
+        tz1 = project.timezeros.filter(timezero_date=datetime.date(2011, 10, 2)).first()
+        f1 = Forecast.objects.create(forecast_model=forecast_model, source='f1', time_zero=tz1)
+        predictions = [{"unit": 'loc1', "target": 'pct next week', "class": "quantile",  # unsorted
+                        "prediction": {"quantile": [0.75, 0.25, 0.5], "value": [3.0, 1.0, 2.0]}},
+                       {"unit": 'loc1', "target": 'cases next week', "class": "quantile",
+                        "prediction": {"quantile": [0.1, 0.5, 0.9], "value": [0, 1, 10]}},
+                       {"unit": 'loc2', "target": 'cases next week', "class": "quantile",
+                        "prediction": {"quantile": [0.5], "value": [3]}},
+                       {"unit": 'loc2', "target": 'cases next week', "class": "sample",
+                        "prediction": {"sample": [0, 2, 2, 5]}},
+                       {"unit": 'loc2', "target": 'Season peak week', "class": "quantile",  # not a numeric target
+                        "prediction": {"quantile": [0.5], "value": ["2019-12-22"]}}]
+        load_predictions_from_json_io_dict(f1, {'predictions': predictions}, is_validate_cats=False)
+        model_tz_season = ['convq_model', '2011-10-02', '2011-2012']
+
+        # case: Q->Q. values are linearly interpolated between the submitted levels, and are flat outside of them.
+        # discrete values are rounded up. quantiles take precedence over samples
+        quantiles = [0.1, 0.5, 0.6, 0.95]
+        act_rows = list(query_forecasts_for_project(project, {'types': ['quantile'],
+                                                              'options': {'convert.quantile': quantiles}}))
+        self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+        exp_rows = [model_tz_season + ['loc1', 'cases next week', 'quantile', value, '', '', '', quantile, '', '', '',
+                                       ''] for quantile, value in zip(quantiles, [0, 1, 4, 10])] + \
+                   [model_tz_season + ['loc1', 'pct next week', 'quantile', value, '', '', '', quantile, '', '', '', '']
+                    for quantile, value in zip(quantiles, [1.0, 2.0, 2.4, 3.0])] + \
+                   [model_tz_season + ['loc2', 'cases next week', 'quantile', 3, '', '', '', quantile, '', '', '', '']
+                    for quantile in quantiles] + \
+                   [model_tz_season + ['loc2', 'Season peak week', 'quantile', '2019-12-22', '', '', '', 0.5, '', '',
+                                       '', '']]
+        self._assert_list_of_lists_almost_equal(sorted(exp_rows), sorted(act_rows))
+        self.assertTrue(all(isinstance(row[6], int) for row in act_rows if row[4] == 'cases next week'))
+
+        # case: Q->Q is not done without the 'convert.quantile' option
+        act_rows = list(query_forecasts_for_project(project, {'types': ['quantile']}))
+        self.assertEqual(3 + 3 + 1 + 1, len(act_rows) - 1)
+
+        # case: Q->P: median and mean. the mean is the quantile function's integral over [0, 1]
+        for point_option, exp_cases_value, exp_pct_value in [('median', 1, 2.0),
+                                                             ('mean', 0.4 * 0.5 + 0.4 * 5.5 + 0.1 * 10, 2.0)]:
+            act_rows = list(query_forecasts_for_project(project, {'types': ['point'],
+                                                                  'options': {'convert.point': point_option}}))
+            self.assertEqual(FORECAST_CSV_HEADER, act_rows.pop(0))
+            exp_rows = [model_tz_season + ['loc1', 'cases next week', 'point', exp_cases_value, '', '', '', '', '', '',
+                                           '', ''],
+                        model_tz_season + ['loc1', 'pct next week', 'point', exp_pct_value, '', '', '', '', '', '', '',
+                                           ''],
+                        model_tz_season + ['loc2', 'cases next week', 'point',  # samples take precedence for points
+                                           2 if point_option == 'median' else 2.25, '', '', '', '', '', '', '', '']]
+            self._assert_list_of_lists_almost_equal(exp_rows, sorted(act_rows))
+
+        # case: batches: rows are the same, and in the same order, as with a single batch
+        query = {'types': ['point', 'quantile'], 'options': {'convert.point': 'median', 'convert.quantile': quantiles}}
+        with patch('utils.project_queries.CONVERT_BATCH_SIZE', 1):
+            act_rows = list(query_forecasts_for_project(project, query))
+        self.assertEqual(list(query_forecasts_for_project(project, query)), act_rows)
+
+
     #
     # test truth queries
     #
@@ -773,22 +1635,22 @@ class ProjectQueriesTestCase(TestCase):
         # ensure query_truth_for_project() is called
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
         with patch('utils.project_queries.query_truth_for_project') as query_mock, \
-                patch('utils.cloud_file.upload_file'):
+                patch('utils.cloud_file.upload_file_stream'):
             _truth_query_worker(job.pk)
             query_mock.assert_called_once_with(self.project, {})
 
-        # case: upload_file() does not error
+        # case: upload_file_stream() does not error
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
-        with patch('utils.cloud_file.upload_file') as upload_mock:
+        with patch('utils.cloud_file.upload_file_stream') as upload_mock:
             _truth_query_worker(job.pk)
             upload_mock.assert_called_once()
 
             job.refresh_from_db()
             self.assertEqual(Job.SUCCESS, job.status)
 
-        # case: upload_file() errors. BotoCoreError: alt: Boto3Error, ClientError, ConnectionClosedError:
+        # case: upload_file_stream() errors. BotoCoreError: alt: Boto3Error, ClientError, ConnectionClosedError:
         job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
-        with patch('utils.cloud_file.upload_file', side_effect=BotoCoreError()) as upload_mock, \
+        with patch('utils.cloud_file.upload_file_stream', side_effect=BotoCoreError()) as upload_mock, \
                 patch('forecast_app.notifications.send_notification_email'):
             _truth_query_worker(job.pk)
             upload_mock.assert_called_once()
@@ -797,7 +1659,7 @@ class ProjectQueriesTestCase(TestCase):
             self.assertEqual(Job.FAILED, job.status)
             self.assertIn("_query_worker(): error", job.failure_message)
 
-        # case: allow actual utils.cloud_file.upload_file(), which calls Bucket.put_object(). we don't actually do this
+        # case: allow actual utils.cloud_file.upload_file_stream(), which calls S3. we don't actually do this
         # in this test b/c we don't want to hit S3, but it's commented here for debugging:
         # _truth_query_worker(job.pk)
         # job.refresh_from_db()
@@ -1157,7 +2019,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f1.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
         exp_rows = []  # no rows (all are retracted)
         act_rows = list(query_forecasts_for_project(project, {'as_of': f2.issued_at.isoformat()}))[1:]  # skip header
@@ -1166,7 +2028,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f2.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
 
     def test_as_of_case_b(self):
@@ -1220,7 +2082,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f1.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
         exp_rows = [  # all rows from case table
             [model, tz1str, season, u1.abbreviation, t1.name, 'named', '', '', '', '', '', 'pois', 1.2, '', ''],
@@ -1240,7 +2102,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f2.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
 
     def test_as_of_case_c(self):
@@ -1302,7 +2164,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f1.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
         exp_rows = [  # dotted rows
             [model, tz1str, season, u1.abbreviation, t1.name, 'named', '', '', '', '', '', 'pois', 1.1, '', ''],
@@ -1322,7 +2184,7 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f2.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
 
     def test_as_of_case_d(self):
@@ -1386,7 +2248,7 @@ class ProjectQueriesTestCase(TestCase):
         act_rows = list(query_forecasts_for_project(project,
                                                     {'as_of': f1.issued_at.isoformat(),
                                                      'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
 
         exp_rows = [  # dotted rows
             [model, tz1str, season, u1.abbreviation, t1.name, 'named', '', '', '', '', '', 'pois', 1.1, '', ''],
@@ -1404,4 +2266,4 @@ class ProjectQueriesTestCase(TestCase):
         # same test but with conversion
         act_rows = list(query_forecasts_for_project(project, {'as_of': f2.issued_at.isoformat(),
                                                               'options': {'convert.bin': True}}))[1:]  # skip header
-        self.assertEqual(sorted(exp_rows), sorted(act_rows))
+        self.assertEqual(sorted(exp_rows + self._exp_rows_convert_bin(project, exp_rows)), sorted(act_rows))
@@ -0,0 +1,275 @@
+import datetime
+import importlib.util
+import io
+import logging
+import math
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+from rq.timeouts import JobTimeoutException
+
+from forecast_app.models import Forecast, ForecastScore, Job, TargetLwr
+from forecast_app.models.forecast_model import ForecastModel
+from forecast_app.models.job import JOB_TYPE_QUERY_SCORES
+from utils.forecast import load_predictions_from_json_io_dict
+from utils.project import create_project_from_json
+from utils.project_queries import project_data_version
+from utils.project_truth import load_truth_data, oracle_model_for_project
+from utils.query_parquet import write_query_rows_parquet
+from utils.scores import SCORE_CSV_HEADER, query_scores_for_project, update_scores_for_project, \
+    validate_scores_query, _scores_query_worker, _create_scores_for_batch, _unscored_pred_eles_sql, \
+    enqueue_update_scores, _update_scores_worker
+from utils.utilities import get_or_create_super_po_mo_users
+
+
+logging.getLogger().setLevel(logging.ERROR)
+
+
+class ScoresTestCase(TestCase):
+    """
+    """
+
+
+    @classmethod
+    def setUpTestData(cls):
+        _, _, cls.po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        cls.project = create_project_from_json(Path('forecast_app/tests/projects/docs-project.json'), cls.po_user)
+        load_truth_data(cls.project, Path('forecast_app/tests/truth_data/docs-ground-truth.csv'),
+                        file_name='docs-ground-truth.csv')
+        cls.forecast_model = ForecastModel.objects.create(project=cls.project, name='score model',
+                                                          abbreviation='score_model')
+        cls.time_zero = cls.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 2)).first()
+        cls.forecast = Forecast.objects.create(forecast_model=cls.forecast_model, source='f1', time_zero=cls.time_zero)
+
+        # the truths are 4.5432 for 'pct next week' and 10 for 'cases next week'
+        predictions = [{"unit": 'loc1', "target": 'pct next week', "class": "point", "prediction": {"value": 5.0}},
+                       {"unit": 'loc1', "target": 'pct next week', "class": "bin",
+                        "prediction": {"cat": [1.1, 2.2, 3.3, 5], "prob": [0.1, 0.2, 0.3, 0.4]}},
+                       {"unit": 'loc1', "target": 'cases next week', "class": "quantile",
+                        "prediction": {"quantile": [0.025, 0.25, 0.5, 0.75, 0.975], "value": [0, 5, 8, 12, 20]}},
+                       {"unit": 'loc1', "target": 'cases next week', "class": "bin",
+                        "prediction": {"cat": [0, 2, 50], "prob": [0.5, 0.25, 0.25]}},
+                       {"unit": 'loc1', "target": 'cases next week', "class": "sample",
+                        "prediction": {"sample": [20, 0, 40, 10]}},
+                       {"unit": 'loc1', "target": 'Season peak week', "class": "point",  # not a numeric target
+                        "prediction": {"value": "2019-12-22"}},
+                       {"unit": 'loc3', "target": 'pct next week', "class": "point",  # no truth
+                        "prediction": {"value": 1.0}}]
+        load_predictions_from_json_io_dict(cls.forecast, {'predictions': predictions}, is_validate_cats=False)
+
+
+    def test_update_scores_for_project(self):
+        self.assertEqual((0, 11), update_scores_for_project(self.project))
+        exp_scores = {('pct next week', 'abs_error'): 0.4568,
+                      ('pct next week', 'log_score'): math.log(0.3),
+                      ('pct next week', 'pit'): 0.3 + 0.3 * (4.5432 - 3.3) / (5 - 3.3),
+                      ('cases next week', 'wis'): 2 * (0.25 + 1.25 + 1.0 + 0.5 + 0.25) / 5,  # mean pinball loss
+                      ('cases next week', 'interval_50'): 12 - 5,
+                      ('cases next week', 'interval_95'): 20 - 0,
+                      ('cases next week', 'coverage_50'): 1,
+                      ('cases next week', 'coverage_95'): 1,
+                      ('cases next week', 'log_score'): math.log(0.25),
+                      ('cases next week', 'pit'): 0.5 + 0.25 * (10 - 2 + 0.5) / (50 - 2),  # mid-PIT
+                      ('cases next week', 'crps'): (10 + 0 + 10 + 30) / 4 - (2 * 130 / 16) / 2}
+        act_scores = {(forecast_score.pred_ele.target.name, forecast_score.score_as_str()): forecast_score.value
+                      for forecast_score in ForecastScore.objects.all()}
+        self.assertEqual(set(exp_scores), set(act_scores))
+        for key, exp_value in exp_scores.items():
+            self.assertAlmostEqual(exp_value, act_scores[key], msg=key)
+
+        # case: nothing to do
+        versions = project_data_version(self.project, JOB_TYPE_QUERY_SCORES)
+        self.assertEqual((0, 0), update_scores_for_project(self.project))
+        self.assertEqual(versions, project_data_version(self.project, JOB_TYPE_QUERY_SCORES))
+
+        # case: new truth only makes its own scores stale. bumps the score version but not the data version, so that
+        # only cached score query outputs are invalidated
+        load_truth_data(self.project, io.StringIO("timezero,unit,target,value\n2011-10-02,loc1,pct next week,2.5\n"),
+                        file_name='new-truth.csv')
+        data_version, score_version = project_data_version(self.project, JOB_TYPE_QUERY_SCORES)
+        self.assertEqual((3, 3), update_scores_for_project(self.project))
+        new_data_version, new_score_version = project_data_version(self.project, JOB_TYPE_QUERY_SCORES)
+        self.assertEqual(data_version, new_data_version)
+        self.assertLess(score_version, new_score_version)
+        act_scores = {(forecast_score.pred_ele.target.name, forecast_score.score_as_str()): forecast_score.value
+                      for forecast_score in ForecastScore.objects.all()}
+        self.assertAlmostEqual(2.5, act_scores[('pct next week', 'abs_error')])
+        self.assertAlmostEqual(math.log(0.2), act_scores[('pct next week', 'log_score')])
+        self.assertAlmostEqual(0.1 + 0.2 * (2.5 - 2.2) / (3 - 2.2), act_scores[('pct next week', 'pit')])
+        self.assertEqual(exp_scores[('cases next week', 'crps')], act_scores[('cases next week', 'crps')])
+
+        # case: deleting a forecast deletes its scores
+        self.forecast.delete()
+        self.assertEqual(0, ForecastScore.objects.count())
+
+
+    def test_update_scores_for_project_batches(self):
+        with patch('utils.scores.SCORE_BATCH_SIZE', 1):
+            self.assertEqual((0, 11), update_scores_for_project(self.project))
+
+
+    def test_update_scores_for_project_scoped(self):
+        forecast_model_2 = ForecastModel.objects.create(project=self.project, name='model 2', abbreviation='mod_2')
+        forecast_2 = Forecast.objects.create(forecast_model=forecast_model_2, source='f2', time_zero=self.time_zero)
+        load_predictions_from_json_io_dict(forecast_2, {'predictions': [
+            {"unit": 'loc1', "target": 'pct next week', "class": "point", "prediction": {"value": 4.0}}]},
+            is_validate_cats=False)
+
+        # case: limited to forecasts: other forecasts' prediction elements are not scored
+        self.assertEqual((0, 1), update_scores_for_project(self.project, forecast_ids=[forecast_2.pk]))
+
+        # case: limited to time zeros: neither forecast is for time_zero_2
+        time_zero_2 = self.project.timezeros.filter(timezero_date=datetime.date(2011, 10, 9)).first()
+        self.assertEqual((0, 0), update_scores_for_project(self.project, timezero_ids=[time_zero_2.pk]))
+        self.assertEqual((0, 11), update_scores_for_project(self.project, timezero_ids=[self.time_zero.pk]))
+
+        # case: new truth's stale scores are only deleted for the passed time zeros
+        load_truth_data(self.project, io.StringIO("timezero,unit,target,value\n2011-10-02,loc1,pct next week,2.5\n"),
+                        file_name='new-truth.csv')
+        self.assertEqual((0, 0), update_scores_for_project(self.project, timezero_ids=[time_zero_2.pk]))
+        self.assertEqual((4, 4), update_scores_for_project(self.project, timezero_ids=[self.time_zero.pk]))
+
+
+    def test_update_scores_for_project_batch_commits(self):
+        # each batch is committed separately, so an interrupted update keeps the batches it finished, and the next
+        # update picks up where it left off
+        num_calls = []
+
+
+        def create_then_time_out(*args):
+            if num_calls:
+                raise JobTimeoutException()
+
+            num_calls.append(1)
+            return _create_scores_for_batch(*args)
+
+
+        with patch('utils.scores.SCORE_BATCH_SIZE', 1), \
+                patch('utils.scores._create_scores_for_batch', side_effect=create_then_time_out), \
+                self.assertRaises(JobTimeoutException):
+            update_scores_for_project(self.project)
+        num_scores = ForecastScore.objects.count()
+        self.assertGreater(num_scores, 0)
+        self.assertEqual((0, 11 - num_scores), update_scores_for_project(self.project))
+
+
+    def test__update_scores_worker(self):
+        with patch('django_rq.get_queue') as get_queue_mock:
+            enqueue_update_scores(self.project.pk, forecast_ids=[self.forecast.pk])
+            get_queue_mock.return_value.enqueue.assert_called_once_with(_update_scores_worker, self.project.pk,
+                                                                        [self.forecast.pk], None)
+
+        with patch('utils.scores.update_scores_for_project', return_value=(0, 0)) as update_mock:
+            _update_scores_worker(self.project.pk, [self.forecast.pk], None)
+            update_mock.assert_called_once_with(self.project, [self.forecast.pk], None)
+
+        # case: timeouts are re-raised so that RQ records them. other errors are logged
+        with patch('utils.scores.update_scores_for_project', side_effect=JobTimeoutException()), \
+                self.assertRaises(JobTimeoutException):
+            _update_scores_worker(self.project.pk)
+        with patch('utils.scores.update_scores_for_project', side_effect=RuntimeError()):
+            _update_scores_worker(self.project.pk)
+
+
+    def test_update_scores_for_project_concurrent(self):
+        # scores that a concurrent update created first are skipped rather than violating the unique constraint
+        with patch('utils.scores._create_scores_for_batch', wraps=_create_scores_for_batch) as create_mock:
+            self.assertEqual((0, 11), update_scores_for_project(self.project))
+        for call_args in create_mock.call_args_list:
+            _create_scores_for_batch(*call_args[0])
+        self.assertEqual(11, ForecastScore.objects.count())
+
+
+    def test_unscored_pred_eles_sql(self):
+        # prediction elements that cannot be scored are not returned, so that every update does not re-read them. here
+        # the bin for a target without lwrs, the point without truth, and the point for a non-numeric target
+        TargetLwr.objects.filter(target__project=self.project, target__name='pct next week').delete()
+        self.assertEqual((0, 9), update_scores_for_project(self.project))
+        with connection.cursor() as cursor:
+            cursor.execute(_unscored_pred_eles_sql(), (oracle_model_for_project(self.project).pk, self.project.pk))
+            self.assertEqual([], cursor.fetchall())
+
+
+    def test_update_scores_for_project_log_score_min(self):
+        # the truth's bin has zero probability, and the truth is outside of the last bin's assumed width
+        forecast_model = ForecastModel.objects.create(project=self.project, name='bin model', abbreviation='bin_model')
+        forecast = Forecast.objects.create(forecast_model=forecast_model, source='f2', time_zero=self.time_zero)
+        predictions = [{"unit": 'loc1', "target": 'pct next week', "class": "bin",
+                        "prediction": {"cat": [0, 1], "prob": [0.5, 0.5]}}]
+        load_predictions_from_json_io_dict(forecast, {'predictions': predictions}, is_validate_cats=False)
+        update_scores_for_project(self.project)
+        pred_ele = forecast.pred_eles.first()
+        self.assertEqual({'log_score': -10, 'pit': 1.0},
+                         {forecast_score.score_as_str(): forecast_score.value
+                          for forecast_score in ForecastScore.objects.filter(pred_ele=pred_ele)})
+
+
+    def test_validate_scores_query(self):
+        error_messages, _ = validate_scores_query(self.project, -1)
+        self.assertIn("query was not a dict", error_messages[0])
+
+        error_messages, _ = validate_scores_query(self.project, {'types': ['point']})
+        self.assertIn("one or more query keys were invalid", error_messages[0])
+
+        error_messages, _ = validate_scores_query(self.project, {'scores': ['bad score']})
+        self.assertIn("one or more scores were invalid", error_messages[0])
+
+        error_messages, (_, _, _, _, scores, _) = validate_scores_query(self.project, {'scores': ['wis', 'crps']})
+        self.assertEqual([], error_messages)
+        self.assertEqual([ForecastScore.WIS, ForecastScore.CRPS], scores)
+
+
+    def test_query_scores_for_project(self):
+        update_scores_for_project(self.project)
+        model_tz_season_unit = ['score_model', '2011-10-02', '2011-2012', 'loc1']
+
+        # case: all scores
+        act_rows = list(query_scores_for_project(self.project, {}))
+        self.assertEqual(SCORE_CSV_HEADER, act_rows.pop(0))
+        self.assertEqual(11, len(act_rows))
+
+        # case: scores, units, and targets
+        act_rows = list(query_scores_for_project(self.project, {'scores': ['abs_error', 'crps'], 'units': ['loc1']}))
+        self.assertEqual(SCORE_CSV_HEADER, act_rows.pop(0))
+        act_rows = sorted(act_rows)
+        self.assertEqual([model_tz_season_unit + ['cases next week', 'crps'],
+                          model_tz_season_unit + ['pct next week', 'abs_error']], [row[:6] for row in act_rows])
+        self.assertAlmostEqual(4.375, act_rows[0][6])
+        self.assertAlmostEqual(0.4568, act_rows[1][6])
+
+        act_rows = list(query_scores_for_project(self.project, {'targets': ['pct next week'], 'units': ['loc3']}))
+        self.assertEqual([SCORE_CSV_HEADER], act_rows)
+
+        # case: as_of before the forecast was issued
+        as_of = (self.forecast.issued_at - datetime.timedelta(days=1)).isoformat()
+        act_rows = list(query_scores_for_project(self.project, {'as_of': as_of}))
+        self.assertEqual([SCORE_CSV_HEADER], act_rows)
+
+        # case: max_num_rows
+        with self.assertRaisesRegex(RuntimeError, 'number of rows exceeded maximum'):
+            list(query_scores_for_project(self.project, {}, max_num_rows=10))
+
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, "pyarrow is not installed")
+    def test_query_scores_for_project_parquet(self):
+        import pyarrow.parquet as pq
+
+
+        update_scores_for_project(self.project)
+        parquet_io = io.BytesIO()
+        self.assertEqual(1 + 11, write_query_rows_parquet(query_scores_for_project(self.project, {}), parquet_io))
+        parquet_io.seek(0)
+        table = pq.read_table(parquet_io)
+        self.assertEqual(SCORE_CSV_HEADER, table.column_names)
+        self.assertEqual(11, table.num_rows)
+
+
+    def test__scores_query_worker(self):
+        job = Job.objects.create(user=self.po_user, input_json={'project_pk': self.project.pk, 'query': {}})
+        with patch('utils.scores.query_scores_for_project') as query_mock, \
+                patch('utils.cloud_file.upload_file_stream'):
+            _scores_query_worker(job.pk)
+            query_mock.assert_called_once_with(self.project, {})
@@ -14,6 +14,7 @@ from utils.forecast import load_predictions_from_json_io_dict, NamedData
 from utils.make_minimal_projects import _make_docs_project
 from utils.project import create_project_from_json
 from utils.utilities import get_or_create_super_po_mo_users
+from utils.validation_context import validation_context_for_project, invalidate_validation_context
 
 
 logging.getLogger().setLevel(logging.ERROR)
@@ -502,6 +503,48 @@ class TargetTestCase(TestCase):
         self.assertEqual([(1.1, 2.2), (2.2, 3.3), (3.3, float('inf'))], lwrs)
 
 
+    def test_validation_context_for_project(self):
+        _, _, po_user, _, _, _, _, _ = get_or_create_super_po_mo_users(is_create_super=True)
+        project, _, _, _ = _make_docs_project(po_user)
+
+        # test the validators match their Targets
+        context = validation_context_for_project(project)
+        self.assertEqual({target.name for target in project.targets.all()}, set(context.target_name_to_validator))
+        for target in project.targets.all():
+            target_validator = context.target_name_to_validator[target.name]
+            self.assertEqual(target.pk, target_validator.pk)
+            self.assertEqual(target.type, target_validator.type)
+            self.assertEqual(sorted(target.cats_values()), sorted(target_validator.cats_values()))
+            self.assertEqual(target.range_tuple(), target_validator.range_tuple())
+            self.assertEqual(sorted((lwr.lwr, lwr.upper) for lwr in target.lwrs.all()), target_validator.lwrs)
+            for family_abbrev in NamedData.FAMILY_CHOICES:
+                self.assertEqual(Target.is_valid_named_family_for_target_type(family_abbrev, target.type),
+                                 target_validator.is_valid_named_family(family_abbrev))
+
+        # test the cached context is reused, needing only the staleness query
+        with self.assertNumQueries(1):
+            self.assertIs(context, validation_context_for_project(project))
+
+        # test set_cats() and set_range() invalidate
+        target = project.targets.get(name='cases next week')
+        target.set_cats([0, 2, 50, 100])
+        context2 = validation_context_for_project(project)
+        self.assertIsNot(context, context2)
+        self.assertEqual([0, 2, 50, 100], sorted(context2.target_name_to_validator[target.name].cats_values()))
+
+        target.set_range(0, 200)
+        context3 = validation_context_for_project(project)
+        self.assertEqual((0, 200), context3.target_name_to_validator[target.name].range_tuple())
+
+        # test changes made without invalidating (e.g., by another process) are detected via the fingerprint
+        invalidate_validation_context(project.pk)
+        context4 = validation_context_for_project(project)
+        TargetCat.objects.filter(target=target).last().delete()
+        context5 = validation_context_for_project(project)
+        self.assertIsNot(context4, context5)
+        self.assertEqual([0, 2, 50], sorted(context5.target_name_to_validator[target.name].cats_values()))
+
+
     def test_calc_MMWR_WEEK_LAST_TIMEZERO_MONDAY_RDT(self):
         target = Target(name='test target', is_step_ahead=True, numeric_horizon=1,  # arbitrary numeric_horizon
                         reference_date_type=Target.MMWR_WEEK_LAST_TIMEZERO_MONDAY_RDT)
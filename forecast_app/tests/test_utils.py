@@ -1,13 +1,16 @@
 import datetime
 from pathlib import Path
+from unittest.mock import patch
 
 import pymmwr
+from django.db import connection
 from django.test import TestCase
 
 from forecast_app.models import Project, TimeZero
 from forecast_app.models.forecast_model import ForecastModel
 from utils.cdc_io import load_cdc_csv_forecast_file, make_cdc_units_and_targets
 from utils.make_thai_moph_project import cdc_csv_filename_components
+from utils.utilities import IngestStats, batched_rows, streaming_cursor
 
 
 class UtilsTestCase(TestCase):
@@ -61,3 +64,48 @@ class UtilsTestCase(TestCase):
         }
         for cdc_csv_filename, exp_components in filename_to_exp_component_tuples.items():
             self.assertEqual(exp_components, cdc_csv_filename_components(cdc_csv_filename))
+
+
+    def test_ingest_stats(self):
+        # stage times are exclusive of nested stages. we use a fake clock that advances one second per call
+        with patch('time.perf_counter', side_effect=range(100)), patch('time.process_time', side_effect=range(100)):
+            stats = IngestStats()
+            with stats.stage('outer'):  # 0
+                with stats.stage('inner'):  # 1 (charges outer 1), 2
+                    pass  # 3 (charges inner 1)
+                with stats.stage('inner'):  # 4 (charges outer 1), 5
+                    pass  # 6 (charges inner 1)
+            # 7 (charges outer 1)
+            self.assertEqual({'outer': {'wall_secs': 3, 'cpu_secs': 3}, 'inner': {'wall_secs': 2, 'cpu_secs': 2}},
+                             stats.as_dict()['stages'])
+
+        # timed_iter() yields all items, charging each batch to its stage
+        stats.add_count('num_items', 2)
+        stats.add_count('num_items')
+        self.assertEqual(list(range(5)), list(stats.timed_iter('iter', iter(range(5)), 2)))
+        self.assertEqual(['outer', 'inner', 'iter'], list(stats.as_dict()['stages']))
+        self.assertEqual({'num_items': 3}, stats.as_dict()['counts'])
+
+        # from_dict() continues accumulating
+        stats2 = IngestStats.from_dict(stats.as_dict())
+        stats2.add_count('num_items')
+        self.assertEqual({'num_items': 4}, stats2.as_dict()['counts'])
+        self.assertEqual(stats.as_dict()['stages'], stats2.as_dict()['stages'])
+        self.assertEqual({'stages': {}, 'counts': {}}, IngestStats.from_dict(None).as_dict())
+
+
+    def test_streaming_cursor(self):
+        # streaming_cursor() gets its cursor from chunked_cursor() (a named cursor on postgres) and closes it even if the
+        # caller stops early. batched_rows() fetches batch_size rows at a time
+        with patch('django.db.connection.chunked_cursor', wraps=connection.chunked_cursor) as chunked_cursor_mock:
+            with streaming_cursor() as cursor:
+                cursor.execute("SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3;")
+                with patch.object(cursor, 'fetchmany', wraps=cursor.fetchmany) as fetchmany_mock:
+                    self.assertEqual([(1,), (2,), (3,)], sorted(batched_rows(cursor, 2)))
+                    self.assertEqual([2, 2, 2], [call.args[0] for call in fetchmany_mock.call_args_list])
+            chunked_cursor_mock.assert_called_once()
+
+            with self.assertRaises(RuntimeError), streaming_cursor() as cursor:
+                raise RuntimeError('stop early')
+        with self.assertRaises(Exception):  # closed on exit
+            cursor.execute("SELECT 1;")
@@ -17,13 +17,15 @@ from rest_framework import status
 from rest_framework.test import APIClient, APIRequestFactory
 
 from forecast_app.models import Project, ForecastModel, TimeZero, Forecast
-from forecast_app.models.job import Job
+from forecast_app.models.job import Job, JOB_TYPE_UPLOAD_FORECAST_ARCHIVE, JOB_TYPE_BUILD_ENSEMBLE
 from forecast_app.serializers import TargetSerializer, TimeZeroSerializer
 from forecast_app.views import _delete_forecast_worker, HEATMAP_FILTER_ALL_TARGETS
 from utils.cdc_io import load_cdc_csv_forecast_file, make_cdc_units_and_targets
 from utils.forecast import fm_ids_with_min_num_forecasts, forecast_ids_in_date_range, forecast_ids_in_target_group
 from utils.project import delete_project_iteratively, create_project_from_json, group_targets
-from utils.project_queries import _forecasts_query_worker, _truth_query_worker
+from utils.project_queries import _forecasts_query_worker, _truth_query_worker, query_forecasts_for_project, \
+    query_truth_for_project, forecast_query_pred_ele_counts
+from utils.ensemble import _build_ensemble_worker
 from utils.project_truth import load_truth_data
 from utils.utilities import YYYY_MM_DD_DATE_FORMAT, get_or_create_super_po_mo_users
 
@@ -1272,6 +1274,7 @@ class ViewsTestCase(TestCase):
             call_dict = upload_file_mock.call_args[1]
             self.assertIn('forecast_pk', call_dict)
             self.assertEqual(self.public_model.forecast_for_time_zero(self.public_tz2).pk, call_dict['forecast_pk'])
+            self.assertFalse(call_dict['is_patch'])
 
             # case: _upload_file() -> is_error. delete the just-created forecast to avoid
             # "new forecast was not a unique version"
@@ -1297,6 +1300,115 @@ class ViewsTestCase(TestCase):
             self.assertIn("Badly formatted 'timezero_date' form field", json_response.json()['error'])
 
 
+    def test_api_forecast_manifest(self):
+        manifest_url = reverse('api-forecast-manifest', args=[str(self.public_model.pk)])
+
+        # case: not authorized
+        response = self.client.get(manifest_url, {'timezero_date': '2017-12-01'}, format='json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+        # case: no, bad, and not found 'timezero_date'
+        self._authenticate_jwt_user(self.mo_user, self.mo_user_password)
+        for query_params, exp_error in [({}, "No 'timezero_date' query parameter"),
+                                        ({'timezero_date': 'x20171202'}, "Badly formatted 'timezero_date'"),
+                                        ({'timezero_date': '2017-12-03'}, "TimeZero not found")]:
+            response = self.client.get(manifest_url, query_params, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+            self.assertIn(exp_error, response.json()['error'])
+
+        # case: blue sky
+        response = self.client.get(manifest_url, {'timezero_date': '2017-12-01'}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response_dict = response.json()
+        self.assertEqual(self.public_forecast.pk, response_dict['forecast_id'])
+        self.assertEqual(self.public_forecast.pred_eles.count(), len(response_dict['elements']))
+
+
+    def test_api_upload_forecast_archive(self):
+        # to avoid the requirement of RQ, redis, and S3, we patch _upload_file() to return (is_error, job)
+        # with desired return args
+        with patch('forecast_app.views._upload_file') as upload_file_mock:
+            upload_archive_url = reverse('api-forecast-archive-upload', args=[str(self.public_model.pk)])
+            data_file = SimpleUploadedFile('archive.zip', b'file_content', content_type='application/zip')
+
+            # case: not authorized
+            json_response = self.client.post(upload_archive_url, {
+                'data_file': data_file,
+                'Authorization': f'JWT {self._authenticate_jwt_user(self.non_staff_user, self.non_staff_user_password)}',
+            }, format='multipart')
+            self.assertEqual(status.HTTP_403_FORBIDDEN, json_response.status_code)
+
+            # case: no 'data_file'
+            jwt_token = self._authenticate_jwt_user(self.mo_user, self.mo_user_password)
+            json_response = self.client.post(upload_archive_url, {
+                'Authorization': f'JWT {jwt_token}',
+            }, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+            self.assertEqual({'error': "No 'data_file' form field."}, json_response.json())
+
+            # case: blue sky: _upload_file() -> NOT is_error
+            upload_file_mock.return_value = False, Job.objects.create()  # is_error, job
+            json_response = self.client.post(upload_archive_url, {
+                'data_file': data_file,
+                'notes': 'some notes',
+                'Authorization': f'JWT {jwt_token}',
+            }, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, json_response.status_code)
+            call_dict = upload_file_mock.call_args[1]
+            self.assertEqual({'type': JOB_TYPE_UPLOAD_FORECAST_ARCHIVE, 'forecast_model_pk': self.public_model.pk,
+                              'notes': 'some notes'}, call_dict)
+
+            # case: _upload_file() -> is_error
+            upload_file_mock.return_value = True, None  # is_error, job
+            json_response = self.client.post(upload_archive_url, {
+                'data_file': data_file,
+                'Authorization': f'JWT {jwt_token}',
+            }, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+            self.assertIn("There was an error uploading the file", json_response.json()['error'])
+
+
+    @patch('rq.queue.Queue.enqueue')
+    def test_api_build_ensemble(self, enqueue_mock):
+        build_ensemble_url = reverse('api-build-ensemble', args=[str(self.public_model.pk)])
+        ensemble = {'models': ['abbrev', 'abbrev2'], 'rule': 'median'}
+
+        # case: not authorized
+        json_response = self.client.post(build_ensemble_url, {
+            'ensemble': ensemble,
+            'Authorization': f'JWT {self._authenticate_jwt_user(self.non_staff_user, self.non_staff_user_password)}',
+        }, format='json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, json_response.status_code)
+
+        # case: no 'ensemble'
+        jwt_token = self._authenticate_jwt_user(self.mo_user, self.mo_user_password)
+        json_response = self.client.post(build_ensemble_url, {
+            'Authorization': f'JWT {jwt_token}',
+        }, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+        self.assertEqual({'error': "No 'ensemble' form field."}, json_response.json())
+
+        # case: invalid 'ensemble'. the actual validate is tested in test_ensemble.py
+        json_response = self.client.post(build_ensemble_url, {
+            'ensemble': {'models': ['abbrev', 'abbrev5'], 'rule': 'median'},  # includes the ensemble model
+            'Authorization': f'JWT {jwt_token}',
+        }, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+        self.assertIn("the ensemble model cannot be one of the models", json_response.json()['error'])
+
+        # case: blue sky: test that POST enqueues _build_ensemble_worker and returns a Job
+        json_response = self.client.post(build_ensemble_url, {
+            'ensemble': ensemble,
+            'Authorization': f'JWT {jwt_token}',
+        }, format='json')
+        self.assertEqual(status.HTTP_200_OK, json_response.status_code)
+        response_json = json_response.json()  # JobSerializer
+        enqueue_mock.assert_called_once_with(_build_ensemble_worker, response_json['id'])  # job.pk
+        self.assertEqual(Job.QUEUED, response_json['status'])
+        self.assertEqual({'type': JOB_TYPE_BUILD_ENSEMBLE, 'forecast_model_pk': self.public_model.pk,
+                          'ensemble': ensemble}, Job.objects.get(pk=response_json['id']).input_json)
+
+
     @patch('rq.queue.Queue.enqueue')
     def test_api_forecast_queries(self, enqueue_mock):
         forecast_queries_url = reverse('api-forecast-queries', args=[str(self.public_project.pk)])
@@ -1315,7 +1427,7 @@ class ViewsTestCase(TestCase):
         self.assertEqual({'error': "No 'query' form field."}, response.json())
 
         # ensure `validate_forecasts_query()` is called. the actual validate is tested in test_project_queries.py
-        with patch('utils.project_queries.validate_forecasts_query', return_value=([], None)) as validate_mock:
+        with patch('utils.project_queries.validate_forecasts_query', return_value=([], ([], [], [], [], [], None))) as validate_mock:
             self.client.post(forecast_queries_url, {
                 'Authorization': f'JWT {jwt_token}',
                 'query': {'hi': 1},
@@ -1333,6 +1445,37 @@ class ViewsTestCase(TestCase):
 
         self.assertEqual(status.HTTP_200_OK, json_response.status_code)
         self.assertEqual(Job.QUEUED, response_json['status'])
+        self.assertEqual('csv', Job.objects.get(pk=response_json['id']).input_json['output_format'])
+        self.assertIn('num_rows', response_json['input_json']['estimate'])
+
+        # case: estimated to be too large
+        enqueue_mock.reset_mock()
+        with patch('forecast_app.api_views.is_query_estimate_too_large', return_value=True):
+            json_response = self.client.post(forecast_queries_url, {
+                'Authorization': f'JWT {jwt_token}',
+                'query': {},
+            }, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+        self.assertIn("Query too large", json_response.json()['error'])
+        self.assertIn('num_pred_eles', json_response.json()['estimate'])
+        enqueue_mock.assert_not_called()
+
+        # case: 'output_format'
+        json_response = self.client.post(forecast_queries_url, {
+            'Authorization': f'JWT {jwt_token}',
+            'query': {},
+            'output_format': 'parquet',
+        }, format='json')
+        self.assertEqual(status.HTTP_200_OK, json_response.status_code)
+        self.assertEqual('parquet', Job.objects.get(pk=json_response.json()['id']).input_json['output_format'])
+
+        json_response = self.client.post(forecast_queries_url, {
+            'Authorization': f'JWT {jwt_token}',
+            'query': {},
+            'output_format': 'xlsx',
+        }, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, json_response.status_code)
+        self.assertIn("Invalid 'output_format'", json_response.json()['error'])
 
         # case: unauthenticated user (authenticated tested above)
         self.client.logout()  # AnonymousUser
@@ -1363,7 +1506,7 @@ class ViewsTestCase(TestCase):
         self.assertEqual({'error': "No 'query' form field."}, response.json())
 
         # ensure `validate_truth_query()` is called. the actual validate is tested in test_project_queries.py
-        with patch('utils.project_queries.validate_truth_query', return_value=([], None)) as validate_mock:
+        with patch('utils.project_queries.validate_truth_query', return_value=([], ([], [], [], None))) as validate_mock:
             self.client.post(truth_queries_url, {
                 'Authorization': f'JWT {jwt_token}',
                 'query': {'hi': 1},
@@ -1390,6 +1533,50 @@ class ViewsTestCase(TestCase):
         self.assertEqual(status.HTTP_403_FORBIDDEN, json_response.status_code)
 
 
+    @patch('rq.queue.Queue.enqueue')
+    def test_api_queries_sync(self, enqueue_mock):
+        jwt_token = self._authenticate_jwt_user(self.mo_user, self.mo_user_password)
+        for url_name, query_project_fcn, query_worker_fcn in [
+            ('api-forecast-queries-sync', query_forecasts_for_project, _forecasts_query_worker),
+            ('api-truth-queries-sync', query_truth_for_project, _truth_query_worker)]:
+            queries_url = reverse(url_name, args=[str(self.public_project.pk)])
+            query = {'units': ['US National'], 'targets': ['1 wk ahead']}
+
+            # case: small query: run in the request. forecast counts are computed only once
+            enqueue_mock.reset_mock()
+            with patch('forecast_app.api_views.forecast_query_pred_ele_counts',
+                       wraps=forecast_query_pred_ele_counts) as counts_mock:
+                response = self.client.post(queries_url, {'Authorization': f'JWT {jwt_token}', 'query': query},
+                                            format='json')
+            self.assertEqual(1 if query_project_fcn == query_forecasts_for_project else 0, counts_mock.call_count)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual('text/csv', response['Content-Type'])
+            exp_text_io = io.StringIO(newline='')
+            csv.writer(exp_text_io).writerows(query_project_fcn(self.public_project, query))
+            self.assertEqual(exp_text_io.getvalue(), b''.join(response.streaming_content).decode('utf-8'))
+            self.assertGreater(len(exp_text_io.getvalue().splitlines()), 1)
+            enqueue_mock.assert_not_called()
+
+            # case: estimated to be too large, too slow or large when run (`run_small_query()` is tested in
+            # test_project_queries.py), or not CSV: falls back to a job
+            for patch_target, patch_kwargs, output_format in [
+                ('forecast_app.api_views.QUERY_SYNC_MAX_NUM_PRED_ELES', {'new': 0}, 'csv'),
+                ('forecast_app.api_views.run_small_query', {'return_value': None}, 'csv'),
+                ('forecast_app.api_views.run_small_query', {'side_effect': AssertionError}, 'parquet')]:
+                enqueue_mock.reset_mock()
+                with patch(patch_target, **patch_kwargs):
+                    response = self.client.post(queries_url, {'Authorization': f'JWT {jwt_token}', 'query': query,
+                                                              'output_format': output_format}, format='json')
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual('application/json', response['Content-Type'])
+                enqueue_mock.assert_called_once_with(query_worker_fcn, response.json()['id'])
+
+            # case: invalid query
+            response = self.client.post(queries_url, {'Authorization': f'JWT {jwt_token}', 'query': {'units': ['x']}},
+                                        format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
     def test_api_job_data_download(self):
         job_data_download_url = reverse('api-job-data-download', args=[self.job.pk])  # owner self.po_user
 
@@ -1423,6 +1610,14 @@ class ViewsTestCase(TestCase):
             response = self.client.get(job_data_download_url)
             download_file_mock.assert_called_once()
             self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual('text/csv', response['Content-Type'])
+
+            # case: Parquet output
+            parquet_job = Job.objects.create(user=self.po_user, input_json={'query': {}, 'output_format': 'parquet'})
+            response = self.client.get(reverse('api-job-data-download', args=[parquet_job.pk]))
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual('application/vnd.apache.parquet', response['Content-Type'])
+            self.assertIn('.parquet"', response['Content-Disposition'])
 
             # case: authorized: self.po_user
             self._authenticate_jwt_user(self.po_user, self.po_user_password)
@@ -1548,7 +1743,7 @@ class ViewsTestCase(TestCase):
         self.assertEqual('attachment; filename="project-My_project-latest-forecasts.csv"',
                          response['Content-Disposition'])
 
-        string_io = io.StringIO(response.content.decode('utf-8'))
+        string_io = io.StringIO(b''.join(response.streaming_content).decode('utf-8'))  # streamed
         csv_reader = csv.reader(string_io, delimiter=',')
         exp_rows = [['forecast_id', 'source'], [str(forecast.pk), 'split_source']]
         act_rows = [row for row in csv_reader]
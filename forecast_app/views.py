@@ -133,15 +133,104 @@ def zadmin(request):
 
 
 def zadmin_jobs(request):
+    """
+    GET query parameters:
+    - `num_days`: number of days (int) of upload jobs to summarize in the ingest stats table, going back from today
+    """
     if not is_user_ok_admin(request.user):
         return HttpResponseForbidden(render(request, '403.html').content)
 
+    num_days = request.GET.get('num_days')
+    if num_days:
+        try:
+            num_days = int(num_days)
+        except ValueError as ve:
+            return render(request, 'message.html',
+                          context={'title': "Error showing jobs.",
+                                   'message': f"invalid param `num_days`={num_days!r}. must be an integer. ve={ve!r}"})
+    else:
+        num_days = 14  # default
+
     paginator = Paginator(Job.objects.select_related('user').all().order_by('-id'), 25)  # 25/page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    ingest_jobs = Job.objects.filter(created_at__gte=django.utils.timezone.now() - datetime.timedelta(days=num_days),
+                                     output_json__has_key='ingest_stats')
+    ingest_stats_header, ingest_stats_rows = ingest_stats_summary(ingest_jobs)
+    query_jobs = Job.objects.filter(created_at__gte=django.utils.timezone.now() - datetime.timedelta(days=num_days),
+                                    input_json__has_key='query_hash')
+    query_cache_header, query_cache_rows = query_cache_summary(query_jobs)
     return render(
         request, 'zadmin_jobs.html',
-        context={'page_obj': page_obj})
+        context={'page_obj': page_obj,
+                 'num_days': num_days,
+                 'ingest_stats_header': ingest_stats_header,
+                 'ingest_stats_rows': ingest_stats_rows,
+                 'query_cache_header': query_cache_header,
+                 'query_cache_rows': query_cache_rows})
+
+
+def ingest_stats_summary(jobs):
+    """
+    `zadmin_jobs()` helper that aggregates jobs' ingest stats (see `Job.set_ingest_stats()`) by the day they were
+    created, their project, and their type, so that we can compare ingest stages across projects and over time.
+
+    :param jobs: an iterable of Jobs. ones without 'ingest_stats' are skipped
+    :return: a 2-tuple: (header, rows). header is a list of column names: 'date', 'project', 'type', 'num_jobs',
+        'wall_secs', and 'cpu_secs' (both summed over all stages), followed by one '<stage>_wall_secs' column per stage,
+        and then one column per count, e.g., 'num_bytes_downloaded'. stages and counts are those found in jobs, in
+        first-seen order. rows are sorted by date (newest first), project, and type. values are sums over the rows'
+        jobs. missing stages and counts are 0
+    """
+    stage_names = {}  # used as an ordered set
+    count_names = {}  # ""
+    key_to_job_stats = defaultdict(list)  # (date, project_pk, job_type) -> [ingest_stats_dict, ...]
+    for job in jobs:
+        ingest_stats = (job.output_json or {}).get('ingest_stats')
+        if not ingest_stats:
+            continue
+
+        stage_names.update(dict.fromkeys(ingest_stats['stages']))
+        count_names.update(dict.fromkeys(ingest_stats['counts']))
+        key = (job.created_at.date(), job.output_json.get('project_pk'), (job.input_json or {}).get('type'))
+        key_to_job_stats[key].append(ingest_stats)
+
+    project_pk_to_name = dict(Project.objects.filter(pk__in={key[1] for key in key_to_job_stats})
+                              .values_list('pk', 'name'))
+    keys = sorted(key_to_job_stats, key=lambda key: (str(key[1]), str(key[2])))
+    keys.sort(key=lambda key: key[0], reverse=True)  # newest first. stable, so ties stay sorted by project and type
+    rows = []
+    for date, project_pk, job_type in keys:
+        job_stats = key_to_job_stats[(date, project_pk, job_type)]
+        stage_wall_secs = [sum(stats['stages'].get(stage_name, {}).get('wall_secs', 0) for stats in job_stats)
+                           for stage_name in stage_names]
+        cpu_secs = sum(stage_dict['cpu_secs'] for stats in job_stats for stage_dict in stats['stages'].values())
+        counts = [sum(stats['counts'].get(count_name, 0) for stats in job_stats) for count_name in count_names]
+        rows.append([date.strftime(YYYY_MM_DD_DATE_FORMAT), project_pk_to_name.get(project_pk, project_pk), job_type,
+                     len(job_stats), round(sum(stage_wall_secs), 3), round(cpu_secs, 3),
+                     *[round(wall_secs, 3) for wall_secs in stage_wall_secs], *counts])
+    header = ['date', 'project', 'type', 'num_jobs', 'wall_secs', 'cpu_secs',
+              *[f'{stage_name}_wall_secs' for stage_name in stage_names], *count_names]
+    return header, rows
+
+
+def query_cache_summary(jobs):
+    """
+    `zadmin_jobs()` helper that computes the query result cache hit rate (see `_create_query_job()`) by job type.
+
+    :param jobs: an iterable of query Jobs
+    :return: a 2-tuple: (header, rows). header is a list of column names: 'type', 'num_jobs', 'num_hits', and
+        'hit_rate' (a percent). rows are sorted by type
+    """
+    job_type_to_counts = defaultdict(lambda: [0, 0])  # job_type -> [num_jobs, num_hits]
+    for job in jobs:
+        counts = job_type_to_counts[(job.input_json or {}).get('type')]
+        counts[0] += 1
+        if 'cached_job_pk' in (job.output_json or {}):
+            counts[1] += 1
+    rows = [[job_type, num_jobs, num_hits, round(100 * num_hits / num_jobs, 1)]
+            for job_type, (num_jobs, num_hits) in sorted(job_type_to_counts.items(), key=lambda item: str(item[0]))]
+    return ['type', 'num_jobs', 'num_hits', 'hit_rate'], rows
 
 
 def zadmin_jobs_viz(request):
@@ -1254,7 +1343,7 @@ class JobDetailView(UserPassesTestMixin, DetailView):
 
         job = self.get_object()
         context = super().get_context_data(**kwargs)
-        context['is_file_exists'] = is_file_exists(job)[0]  # is_exists, size
+        context['is_file_exists'] = is_file_exists(job.output_job())[0]  # is_exists, size
         return context
 
 
@@ -1283,7 +1372,7 @@ def download_forecast(request, forecast_pk):
 
 def download_job_data_file(request, pk):
     """
-    Returns a CSV file containing the data (if any) corresponding to the passed Job's pk.
+    Returns a CSV (or Parquet) file containing the data (if any) corresponding to the passed Job's pk.
     """
     from forecast_app.api_views import _download_job_data_request  # avoid circular imports
     from utils.cloud_file import is_file_exists
@@ -1293,7 +1382,7 @@ def download_job_data_file(request, pk):
     if not (request.user.is_superuser or (job.user == request.user)):
         return HttpResponseForbidden(render(request, '403.html').content)
 
-    if not is_file_exists(job)[0]:  # is_exists, size
+    if not is_file_exists(job.output_job())[0]:  # is_exists, size
         return render(request, 'message.html',
                       context={'title': f"No data for job {job.pk}",
                                'message': f"The job {job.pk} has no associated data."})
@@ -1355,13 +1444,14 @@ def _upload_truth_worker(job_pk):
     An _upload_file() enqueue() function that loads a truth file. Called by upload_truth().
 
     - Expected Job.input_json key(s): 'project_pk', 'filename'
-    - Saves Job.output_json key(s): None
+    - Saves Job.output_json key(s): 'project_pk', 'ingest_stats' (see `Job.set_ingest_stats()`)
 
     :param job_pk: the Job's pk
     """
     # imported here so that tests can patch via mock:
     from forecast_app.models.job import job_cloud_file
     from utils.project_truth import load_truth_data
+    from utils.scores import enqueue_update_scores
 
 
     try:
@@ -1389,9 +1479,15 @@ def _upload_truth_worker(job_pk):
                 return
 
             filename = job.input_json['filename']
-            load_truth_data(project, cloud_file_fp, file_name=filename)
+            stats = job.ingest_stats()
+            try:
+                timezero_ids = load_truth_data(project, cloud_file_fp, file_name=filename, stats=stats)
+            finally:
+                job.set_ingest_stats(stats, project.pk)
             job.status = Job.SUCCESS
             job.save()
+            if timezero_ids:  # new truth makes some of those time zeros' scores stale
+                transaction.on_commit(lambda: enqueue_update_scores(project_pk, timezero_ids=timezero_ids))
     except JobTimeoutException as jte:
         job.status = Job.TIMEOUT
         job.save()
@@ -1456,14 +1552,17 @@ def _upload_forecast_worker(job_pk):
     An _upload_file() enqueue() function that loads a forecast data file. Called by upload_forecast(). It is passed an
     empty Forecast's id to load into. Deletes that forecast if there were errors loading the data.
 
-    - Expected Job.input_json key(s): 'forecast_pk', 'filename' - passed to _upload_file()
-    - Saves Job.output_json key(s): 'forecast_pk' (passed through from input_json for API caller convenience)
+    - Expected Job.input_json key(s): 'forecast_pk', 'filename' - passed to _upload_file(). optional: 'is_patch' (see
+      load_predictions_from_json_io_dict())
+    - Saves Job.output_json key(s): 'forecast_pk' (passed through from input_json for API caller convenience),
+      'project_pk', 'ingest_stats' (see `Job.set_ingest_stats()`). the latter two are saved on failure, too
 
     :param job_pk: the Job's pk
     """
     # imported here so that tests can patch via mock:
     from forecast_app.models.job import job_cloud_file
-    from utils.forecast import load_predictions_from_json_io_dict, cache_forecast_metadata
+    from utils.forecast import load_predictions_from_json_io_file, cache_forecast_metadata
+    from utils.scores import enqueue_update_scores
 
 
     with job_cloud_file(job_pk) as (job, cloud_file_fp):
@@ -1490,35 +1589,107 @@ def _upload_forecast_worker(job_pk):
         # set source here rather than in caller b/c we now have filename via `_upload_file()`
         forecast.source = job.input_json['filename']
         forecast.save()
+        project_pk = forecast.forecast_model.project_id
+        stats = job.ingest_stats()
         try:
             with transaction.atomic():
-                logger.debug(f"_upload_forecast_worker(): 1/4 loading json_io_dict. forecast={forecast}. job={job}")
-                notes = job.input_json.get('notes', '')
-                json_io_dict = json.load(cloud_file_fp)
-
-                logger.debug(f"_upload_forecast_worker(): 2/4 loading predictions. job={job}")
-                load_predictions_from_json_io_dict(forecast, json_io_dict, is_validate_cats=False)  # transaction.atomic
-
-                logger.debug(f"_upload_forecast_worker(): 3/4 caching metadata. job={job}")
-                cache_forecast_metadata(forecast)  # transaction.atomic
+                # NB: we stream the predictions from the file rather than json.load() it so that memory use does
+                # not grow with the file's size
+                logger.debug(f"_upload_forecast_worker(): 1/3 loading predictions. forecast={forecast}. job={job}")
+                load_predictions_from_json_io_file(forecast, cloud_file_fp, is_validate_cats=False,
+                                                   is_patch=job.input_json.get('is_patch', False),
+                                                   stats=stats)  # atomic
+
+                logger.debug(f"_upload_forecast_worker(): 2/3 caching metadata. job={job}")
+                with stats.stage('cache_metadata'):
+                    cache_forecast_metadata(forecast)  # transaction.atomic
                 job.output_json = {'forecast_pk': forecast_pk}
+                job.set_ingest_stats(stats, project_pk)
                 job.status = Job.SUCCESS
                 job.save()
-                logger.debug(f"_upload_forecast_worker(): 4/4 done. job={job}")
+                transaction.on_commit(lambda: enqueue_update_scores(project_pk, forecast_ids=[forecast_pk]))
+                logger.debug(f"_upload_forecast_worker(): 3/3 done. stats={job.output_json['ingest_stats']}. "
+                             f"job={job}")
         except JobTimeoutException as jte:
             forecast.delete()
+            job.set_ingest_stats(stats, project_pk)
             job.status = Job.TIMEOUT
             job.save()
             logger.error(f"_upload_forecast_worker(): error: {jte!r}. job={job}")
             raise jte
         except Exception as ex:
             forecast.delete()
+            job.set_ingest_stats(stats, project_pk)
             job.status = Job.FAILED
             job.failure_message = f"_upload_forecast_worker(): error: {ex!r}"
             job.save()
             logger.error(job.failure_message + f". job={job}")
 
 
+def _upload_forecast_archive_worker(job_pk):
+    """
+    An _upload_file() enqueue() function that loads a zip or tar archive of forecast files into a model via
+    `load_forecasts_from_archive()`. Called by `api_views.upload_forecast_archive()`.
+
+    - Expected Job.input_json key(s): 'forecast_model_pk', 'filename' - passed to _upload_file(). optional: 'notes'
+    - Saves Job.output_json key(s): 'forecast_model_pk', 'files' (the per-file status dicts returned by
+      `load_forecasts_from_archive()`), 'num_succeeded', 'num_failed', 'project_pk', 'ingest_stats' (see
+      `Job.set_ingest_stats()`)
+
+    :param job_pk: the Job's pk
+    """
+    # imported here so that tests can patch via mock:
+    from forecast_app.models.job import job_cloud_file
+    from utils.forecast import load_forecasts_from_archive
+    from utils.scores import enqueue_update_scores
+
+
+    with job_cloud_file(job_pk) as (job, cloud_file_fp):
+        forecast_model_pk = job.input_json.get('forecast_model_pk')
+        forecast_model = ForecastModel.objects.filter(pk=forecast_model_pk).first()  # None if doesn't exist
+        if not forecast_model:
+            job.status = Job.FAILED
+            job.failure_message = f"_upload_forecast_archive_worker(): error: no ForecastModel found for " \
+                                  f"forecast_model_pk={forecast_model_pk}"
+            job.save()
+            logger.error(job.failure_message + f". job={job}")
+            return
+
+        try:
+            logger.debug(f"_upload_forecast_archive_worker(): 1/2 loading forecasts. forecast_model={forecast_model}. "
+                         f"job={job}")
+            # cloud_file_fp is a text wrapper, but archives are binary
+            stats = job.ingest_stats()
+            file_statuses = load_forecasts_from_archive(forecast_model, cloud_file_fp.buffer,
+                                                        job.input_json.get('notes', ''), stats=stats)
+            num_succeeded = len([file_status for file_status in file_statuses if file_status['is_success']])
+            job.output_json = {'forecast_model_pk': forecast_model_pk, 'files': file_statuses,
+                               'num_succeeded': num_succeeded, 'num_failed': len(file_statuses) - num_succeeded}
+            job.set_ingest_stats(stats, forecast_model.project_id)
+            if num_succeeded:
+                job.status = Job.SUCCESS
+                forecast_ids = [file_status['forecast_pk'] for file_status in file_statuses
+                                if file_status['is_success']]
+                transaction.on_commit(lambda: enqueue_update_scores(forecast_model.project_id,
+                                                                    forecast_ids=forecast_ids))
+            else:
+                job.status = Job.FAILED
+                job.failure_message = f"_upload_forecast_archive_worker(): error: no files were loaded. " \
+                                      f"# files={len(file_statuses)}"
+            job.save()
+            logger.debug(f"_upload_forecast_archive_worker(): 2/2 done. # succeeded={num_succeeded}. job={job}")
+        except JobTimeoutException as jte:
+            job.status = Job.TIMEOUT
+            job.save()
+            logger.error(f"_upload_forecast_archive_worker(): error: {jte!r}. job={job}")
+            raise jte
+        except Exception as ex:
+            job.status = Job.FAILED
+            job.failure_message = f"_upload_forecast_archive_worker(): error: {ex!r}"
+            job.save()
+            logger.error(job.failure_message + f". job={job}")
+
+
 def delete_forecast(request, forecast_pk):
     """
     Enqueues the deletion of a Forecast, returning a Job for it. Assumes that confirmation has already been given by the
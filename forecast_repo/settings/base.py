@@ -212,9 +212,10 @@ QUERY_FORECAST_QUEUE_NAME = HIGH_QUEUE_NAME
 
 # default
 CACHE_FORECAST_METADATA_QUEUE_NAME = DEFAULT_QUEUE_NAME
+ENSEMBLE_QUEUE_NAME = DEFAULT_QUEUE_NAME
 
 # low
-# none
+SCORE_QUEUE_NAME = LOW_QUEUE_NAME
 
 #
 # S3 support - used by cloud_file.py
@@ -303,6 +304,18 @@ if 'MAX_UPLOAD_FILE_SIZE' in os.environ:
             f"base.py: MAX_UPLOAD_FILE_SIZE config var could not be coerced to float: "
             f"{max_upload_file_size_value!r}")
 
+# used by `upload_forecast_archive()` to limit the size of forecast archive files, which are larger than single forecasts:
+MAX_UPLOAD_ARCHIVE_FILE_SIZE = 500E+06
+
+if 'MAX_UPLOAD_ARCHIVE_FILE_SIZE' in os.environ:
+    max_upload_archive_file_size_value = os.environ.get('MAX_UPLOAD_ARCHIVE_FILE_SIZE')
+    try:
+        MAX_UPLOAD_ARCHIVE_FILE_SIZE = float(max_upload_archive_file_size_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: MAX_UPLOAD_ARCHIVE_FILE_SIZE config var could not be coerced to float: "
+            f"{max_upload_archive_file_size_value!r}")
+
 # used by bulk_data_dump_app() to limit the number of prediction elements that can be dumped:
 MAX_NUM_DUMP_PRED_ELES = 2_000_000
 
@@ -315,6 +328,102 @@ if 'MAX_NUM_DUMP_PRED_ELES' in os.environ:
             f"base.py: MAX_NUM_DUMP_PRED_ELES config var could not be coerced to float: "
             f"{max_num_dump_pred_eles_value!r}")
 
+# used by `_validated_pred_ele_rows_for_pred_dicts()` to validate forecasts in parallel processes. parallel validation
+# is switched on for forecasts with at least PARALLEL_VALIDATION_MIN_NUM_PRED_ELES prediction elements, and uses up to
+# PARALLEL_VALIDATION_NUM_WORKERS processes. set either to 0 to disable
+PARALLEL_VALIDATION_MIN_NUM_PRED_ELES = 250_000
+PARALLEL_VALIDATION_NUM_WORKERS = min(os.cpu_count() or 1, 4)
+
+if 'PARALLEL_VALIDATION_MIN_NUM_PRED_ELES' in os.environ:
+    parallel_validation_min_num_pred_eles_value = os.environ.get('PARALLEL_VALIDATION_MIN_NUM_PRED_ELES')
+    try:
+        PARALLEL_VALIDATION_MIN_NUM_PRED_ELES = int(parallel_validation_min_num_pred_eles_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: PARALLEL_VALIDATION_MIN_NUM_PRED_ELES config var could not be coerced to int: "
+            f"{parallel_validation_min_num_pred_eles_value!r}")
+
+if 'PARALLEL_VALIDATION_NUM_WORKERS' in os.environ:
+    parallel_validation_num_workers_value = os.environ.get('PARALLEL_VALIDATION_NUM_WORKERS')
+    try:
+        PARALLEL_VALIDATION_NUM_WORKERS = int(parallel_validation_num_workers_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: PARALLEL_VALIDATION_NUM_WORKERS config var could not be coerced to int: "
+            f"{parallel_validation_num_workers_value!r}")
+
+# number of rows that `batched_rows()` fetches at a time. with a `streaming_cursor()` (postgres) this is the number of
+# rows that are held in a worker's memory at once
+STREAMING_CURSOR_ITERSIZE = 2000
+
+if 'STREAMING_CURSOR_ITERSIZE' in os.environ:
+    streaming_cursor_itersize_value = os.environ.get('STREAMING_CURSOR_ITERSIZE')
+    try:
+        STREAMING_CURSOR_ITERSIZE = int(streaming_cursor_itersize_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: STREAMING_CURSOR_ITERSIZE config var could not be coerced to int: "
+            f"{streaming_cursor_itersize_value!r}")
+
+# forecast queries whose estimated number of prediction elements (see `plan_forecast_query_shards()`) is at least
+# QUERY_SHARD_MIN_NUM_PRED_ELES are split into about QUERY_SHARD_NUM_SHARDS shards that run as separate jobs, and whose
+# outputs are then merged. the latter defaults to the number of rqworker processes in Procfile
+QUERY_SHARD_MIN_NUM_PRED_ELES = 50_000
+QUERY_SHARD_NUM_SHARDS = 7
+
+if 'QUERY_SHARD_MIN_NUM_PRED_ELES' in os.environ:
+    query_shard_min_num_pred_eles_value = os.environ.get('QUERY_SHARD_MIN_NUM_PRED_ELES')
+    try:
+        QUERY_SHARD_MIN_NUM_PRED_ELES = int(query_shard_min_num_pred_eles_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: QUERY_SHARD_MIN_NUM_PRED_ELES config var could not be coerced to int: "
+            f"{query_shard_min_num_pred_eles_value!r}")
+
+if 'QUERY_SHARD_NUM_SHARDS' in os.environ:
+    query_shard_num_shards_value = os.environ.get('QUERY_SHARD_NUM_SHARDS')
+    try:
+        QUERY_SHARD_NUM_SHARDS = int(query_shard_num_shards_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: QUERY_SHARD_NUM_SHARDS config var could not be coerced to int: "
+            f"{query_shard_num_shards_value!r}")
+
+# queries posted to the synchronous query endpoints whose estimated number of prediction elements (see
+# `estimate_query_num_pred_eles()`) is at most QUERY_SYNC_MAX_NUM_PRED_ELES are run in the request, with a postgres
+# `statement_timeout` of QUERY_SYNC_STATEMENT_TIMEOUT seconds, rather than via a job. QUERY_SYNC_MAX_NUM_ROWS caps the
+# number of CSV rows such a query can return, which matters b/c a sample prediction element can have many rows
+QUERY_SYNC_MAX_NUM_PRED_ELES = 2_000
+QUERY_SYNC_MAX_NUM_ROWS = 100_000
+QUERY_SYNC_STATEMENT_TIMEOUT = 5
+
+if 'QUERY_SYNC_MAX_NUM_PRED_ELES' in os.environ:
+    query_sync_max_num_pred_eles_value = os.environ.get('QUERY_SYNC_MAX_NUM_PRED_ELES')
+    try:
+        QUERY_SYNC_MAX_NUM_PRED_ELES = int(query_sync_max_num_pred_eles_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: QUERY_SYNC_MAX_NUM_PRED_ELES config var could not be coerced to int: "
+            f"{query_sync_max_num_pred_eles_value!r}")
+
+if 'QUERY_SYNC_MAX_NUM_ROWS' in os.environ:
+    query_sync_max_num_rows_value = os.environ.get('QUERY_SYNC_MAX_NUM_ROWS')
+    try:
+        QUERY_SYNC_MAX_NUM_ROWS = int(query_sync_max_num_rows_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: QUERY_SYNC_MAX_NUM_ROWS config var could not be coerced to int: "
+            f"{query_sync_max_num_rows_value!r}")
+
+if 'QUERY_SYNC_STATEMENT_TIMEOUT' in os.environ:
+    query_sync_statement_timeout_value = os.environ.get('QUERY_SYNC_STATEMENT_TIMEOUT')
+    try:
+        QUERY_SYNC_STATEMENT_TIMEOUT = int(query_sync_statement_timeout_value)
+    except ValueError:
+        raise RuntimeError(
+            f"base.py: QUERY_SYNC_STATEMENT_TIMEOUT config var could not be coerced to int: "
+            f"{query_sync_statement_timeout_value!r}")
+
 # used to generate /robots.txt . format: CSV (comma-delimited)
 if 'BAD_BOTS' in os.environ:
     bad_bots_value = os.environ.get('BAD_BOTS')
@@ -115,7 +115,7 @@ def bulk_data_dump(project, query, output_dir):
 def filename_for_args(project, query):
     project_name_slug = slugify(project.name)
     ymd_hms = django.utils.timezone.now().strftime('%Y%m%d_%H%M%S')
-    query_hash = PredictionElement.hash_for_prediction_data_dict(query)
+    query_hash = PredictionElement.hash_for_prediction_data_dict(query, PredictionElement.MD5_HASH_SCHEME)
     return f"{project_name_slug}_{ymd_hms}_{query_hash}"
 
 
@@ -1,4 +1,6 @@
+import io
 import logging
+from contextlib import contextmanager
 
 import boto3
 import botocore
@@ -79,6 +81,110 @@ def upload_file(the_object, data_file):
     bucket.put_object(Key=_file_name_for_object(the_object), Body=data_file)
 
 
+# size of the parts that `upload_file_stream()` uploads. S3 requires all parts except the last to be at least 5 MiB. at
+# most about one part is held in memory at a time
+MULTIPART_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+
+@contextmanager
+def upload_file_stream(the_object, part_size=MULTIPART_UPLOAD_PART_SIZE, is_text=True):
+    """
+    A streaming alternative to `upload_file()` for large files that are generated on the fly. A context manager that
+    yields a text file (utf-8, and newline='' as required by `csv.writer()`), or a binary one if not is_text, whose
+    contents are uploaded to the S3 bucket corresponding to the_object as they are written, in parts of part_size bytes
+    via an S3 multipart upload. The upload is completed when the context exits normally. If it exits via any exception
+    (including rq's `JobTimeoutException`, which is raised asynchronously when a job times out) then the upload is
+    aborted, so that neither a partial object nor orphaned parts are left behind, and the exception is re-raised.
+
+    :param the_object: a Model
+    :param part_size: the size of each uploaded part, in bytes
+    :param is_text: True if the yielded file is text (e.g., CSV), False if binary (e.g., Parquet)
+    :raises: S3 exceptions
+    """
+    writer = _MultipartUploadWriter(_s3_bucket_name_for_object(the_object), _file_name_for_object(the_object),
+                                    part_size)
+    file_io = io.TextIOWrapper(writer, 'utf-8', newline='') if is_text else writer
+    try:
+        yield file_io
+        file_io.flush()
+        writer.complete()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class _MultipartUploadWriter(io.RawIOBase):
+    """
+    An `upload_file_stream()` helper: a write-only binary file-like object that uploads what's written to it as the
+    parts of an S3 multipart upload. The multipart upload is started when the first part fills, so small files (that
+    fit into a single part) are instead uploaded via a single `put_object()` by `complete()`.
+    """
+
+
+    def __init__(self, bucket_name, key, part_size):
+        super().__init__()
+        self.s3_client = boto3.client('s3')
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None  # set when the multipart upload is created
+        self.parts = []  # dicts as required by complete_multipart_upload(): {'PartNumber': int, 'ETag': str}
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=self.key)['UploadId']
+            logger.debug(f"_MultipartUploadWriter._upload_part(): created upload. key={self.key!r}, "
+                         f"upload_id={self.upload_id!r}")
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                              PartNumber=part_number, Body=data)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+
+    def complete(self):
+        """
+        Uploads any remaining buffered data and then completes the upload.
+        """
+        if self.upload_id is None:  # never filled a part
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                                     MultipartUpload={'Parts': self.parts})
+        self.buffer = bytearray()
+
+
+    def abort(self):
+        """
+        Aborts the upload, if one was started, and discards buffered data. Errors are logged but not raised so as to not
+        mask the caller's exception.
+        """
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+        except (BotoCoreError, Boto3Error, ClientError, ConnectionClosedError) as aws_exc:
+            logger.error(f"_MultipartUploadWriter.abort(): error: {aws_exc!r}. key={self.key!r}, "
+                         f"upload_id={self.upload_id!r}")
+
+
 def delete_file(the_object):
     """
     Deletes the S3 object corresponding to the_object. note that we do not log delete failures in the instance. This
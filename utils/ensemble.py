@@ -0,0 +1,335 @@
+import datetime
+import json
+
+import numpy
+from django.db import transaction
+from rest_framework.generics import get_object_or_404
+from rq.timeouts import JobTimeoutException
+
+from forecast_app.models import Forecast, ForecastModel, Job, PredictionElement, Target
+from utils.forecast import cache_forecast_metadata, load_predictions_from_json_io_dict
+from utils.project import logger
+from utils.project_queries import _query_forecasts_sql_for_pred_class, _validate_as_of, _validate_query_ids
+from utils.scores import enqueue_update_scores
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, streaming_cursor
+
+
+#
+# Quantile ensembles
+#
+# An ensemble forecast combines the quantile predictions of a project's models into a single forecast of a designated
+# ensemble model, one per time zero. Each (unit, target, quantile level)'s value is computed from the participating
+# models' values for it via one of ENSEMBLE_RULES:
+#
+# - 'mean': the mean across models
+# - 'median': the median across models
+# - 'trimmed_mean': the mean across models after dropping the `trim` fraction (rounded down) of the lowest and of the
+#   highest values
+#
+# Only numeric (continuous and discrete) targets are combined, discrete values are rounded up, and each (unit,
+# target)'s values are made non-decreasing in level (models can submit different levels, which can otherwise cause
+# crossings). The models' latest forecasts are read, or those as of `as_of`. Each time zero's inputs are read and
+# combined in one pass, vectorized via numpy, and the result is loaded via `load_predictions_from_json_io_dict()` as
+# a new version of the ensemble model's forecast for that time zero.
+#
+
+ENSEMBLE_RULES = ('mean', 'median', 'trimmed_mean')
+
+# the default 'trim' for 'trimmed_mean'
+ENSEMBLE_TRIM_FRACTION = 0.2
+
+# quantile levels are rounded to this many decimals before being compared across models
+ENSEMBLE_LEVEL_DECIMALS = 8
+
+
+def validate_ensemble_params(project, ensemble_model, params):
+    """
+    Validates the ensemble parameters in `params`, which is a dict with these keys:
+
+    - 'models' (required): a non-empty list of the participating models' abbreviations
+    - 'rule' (required): one of ENSEMBLE_RULES
+    - 'trim' (optional): the fraction for 'trimmed_mean', in [0, 0.5). default: ENSEMBLE_TRIM_FRACTION
+    - 'timezero_from', 'timezero_to' (optional): an inclusive range of TimeZero.timezero_date strings in
+      YYYY_MM_DD_DATE_FORMAT. default: all of project's time zeros
+    - 'as_of' (optional): as documented in `query_forecasts_for_project()`
+    - 'notes' (optional): the new Forecasts' notes
+
+    :param project: the Project whose models are combined
+    :param ensemble_model: the ForecastModel that the ensemble forecasts are loaded into
+    :param params: a dict as described above
+    :return: a 2-tuple: (error_messages, (model_ids, timezero_ids, as_of, rule, trim)), where timezero_ids are sorted by
+        date
+    """
+    # return value. filled next
+    error_messages, model_ids, timezero_ids, as_of, rule, trim = [], [], [], None, None, ENSEMBLE_TRIM_FRACTION
+
+    # validate params type and keys
+    if not isinstance(params, dict):
+        error_messages.append(f"params was not a dict: {params}, params type={type(params)}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    actual_keys = set(params.keys())
+    expected_keys = {'models', 'rule', 'trim', 'timezero_from', 'timezero_to', 'as_of', 'notes'}
+    if not (actual_keys <= expected_keys) or not ({'models', 'rule'} <= actual_keys):
+        error_messages.append(f"one or more params keys were invalid or missing. params={params}, "
+                              f"actual_keys={actual_keys}, expected_keys={expected_keys}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    # validate the ensemble model
+    if ensemble_model.is_oracle:
+        error_messages.append(f"the ensemble model cannot be an oracle model. ensemble_model={ensemble_model}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    # validate rule and trim
+    rule = params['rule']
+    if rule not in ENSEMBLE_RULES:
+        error_messages.append(f"rule was not one of {ENSEMBLE_RULES}. rule={rule!r}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    trim = params.get('trim', ENSEMBLE_TRIM_FRACTION)
+    if isinstance(trim, bool) or not isinstance(trim, (int, float)) or not (0 <= trim < 0.5):
+        error_messages.append(f"trim was not a number in [0, 0.5). trim={trim!r}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    # validate as_of if passed. must be parsable as a timezone-aware datetime
+    error_message, as_of = _validate_as_of(params)
+    if error_message:
+        error_messages.append(error_message)
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    # validate models
+    if not params['models']:
+        error_messages.append(f"models was empty. params={params}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    error_messages, (model_ids, _, _, _) = _validate_query_ids(project, {'models': params['models']})
+    if error_messages:
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+    elif ensemble_model.pk in model_ids:
+        error_messages.append(f"the ensemble model cannot be one of the models. ensemble_model={ensemble_model}")
+        return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+    # validate the time zero range
+    timezeros = project.timezeros.all()
+    for key_name, lookup in [('timezero_from', 'timezero_date__gte'), ('timezero_to', 'timezero_date__lte')]:
+        if key_name not in params:
+            continue
+
+        try:
+            timezero_date = datetime.datetime.strptime(params[key_name], YYYY_MM_DD_DATE_FORMAT).date()
+        except (TypeError, ValueError):
+            error_messages.append(f"{key_name!r} was not a date in {YYYY_MM_DD_DATE_FORMAT} format. "
+                                  f"{key_name}={params[key_name]!r}")
+            return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+        timezeros = timezeros.filter(**{lookup: timezero_date})
+    timezero_ids = list(timezeros.order_by('timezero_date').values_list('id', flat=True))
+    if not timezero_ids:
+        error_messages.append(f"no time zeros were in the range. params={params}")
+
+    # done (may or may not be valid)
+    return [error_messages, (model_ids, timezero_ids, as_of, rule, trim)]
+
+
+def build_ensemble_forecasts(ensemble_model, model_ids, timezero_ids, as_of, rule, trim=ENSEMBLE_TRIM_FRACTION,
+                             notes=''):
+    """
+    Creates one ensemble forecast in ensemble_model for each of timezero_ids by combining model_ids' quantile
+    predictions as documented above. Each time zero's forecast is loaded in its own transaction, so one that fails
+    (e.g., b/c it is a subset of the previous version) does not prevent the others from loading. Runs in the calling
+    thread and therefore blocks.
+
+    :param ensemble_model: the ForecastModel to load the ensemble forecasts into
+    :param model_ids: the ids of the ForecastModels to combine
+    :param timezero_ids: the ids of the TimeZeros to build ensemble forecasts for
+    :param as_of: optional as_of timezone-aware datetime object, or None to use the latest forecasts
+    :param rule: one of ENSEMBLE_RULES
+    :param trim: the fraction for 'trimmed_mean'
+    :param notes: the new Forecasts' notes
+    :return: a list of per-time zero status dicts, in timezero_ids order. each has these keys: 'timezero_date',
+        'num_models' (the number of models that had any quantile predictions), 'is_success', 'forecast_pk' (None if
+        not is_success), and 'failure_message' ('' if is_success)
+    """
+    project = ensemble_model.project
+    timezero_id_to_obj = {timezero.pk: timezero for timezero in project.timezeros.all()}
+    unit_id_to_obj = {unit.pk: unit for unit in project.units.all()}
+    target_id_to_obj = {target.pk: target for target in project.targets.all()}
+    tz_statuses = []
+    for tz_idx, timezero_id in enumerate(timezero_ids):
+        time_zero = timezero_id_to_obj[timezero_id]
+        tz_status = {'timezero_date': time_zero.timezero_date.strftime(YYYY_MM_DD_DATE_FORMAT), 'num_models': 0,
+                     'is_success': False, 'forecast_pk': None, 'failure_message': ''}
+        tz_statuses.append(tz_status)
+        logger.debug(f"build_ensemble_forecasts(): {tz_idx + 1}/{len(timezero_ids)} combining. "
+                     f"time_zero={time_zero}")
+        predictions, tz_status['num_models'] = _ensemble_predictions(project, model_ids, timezero_id, as_of, rule,
+                                                                     trim, unit_id_to_obj, target_id_to_obj)
+        if not predictions:
+            tz_status['failure_message'] = "no quantile predictions to combine"
+            continue
+
+        forecast = None
+        try:
+            with transaction.atomic():
+                forecast = Forecast.objects.create(forecast_model=ensemble_model, time_zero=time_zero,
+                                                   source=f"ensemble-{rule}", notes=notes)
+                load_predictions_from_json_io_dict(forecast, {'meta': {}, 'predictions': predictions},
+                                                   is_validate_cats=False)  # atomic
+                cache_forecast_metadata(forecast)  # atomic
+            tz_status['is_success'] = True
+            tz_status['forecast_pk'] = forecast.pk
+        except JobTimeoutException:
+            raise
+        except Exception as ex:
+            tz_status['failure_message'] = f"{ex!r}"
+            logger.debug(f"build_ensemble_forecasts(): time zero failed. time_zero={time_zero}, ex={ex!r}")
+    logger.debug(f"build_ensemble_forecasts(): done. # time zeros={len(tz_statuses)}, "
+                 f"# succeeded={len([_ for _ in tz_statuses if _['is_success']])}")
+    return tz_statuses
+
+
+def _ensemble_predictions(project, model_ids, timezero_id, as_of, rule, trim, unit_id_to_obj, target_id_to_obj):
+    """
+    A `build_ensemble_forecasts()` helper that reads and combines one time zero's quantile predictions.
+
+    :return: a 2-tuple: (predictions, num_models) where predictions is a list of quantile prediction dicts as passed to
+        `load_predictions_from_json_io_dict()`, and num_models is the number of models that had any
+    """
+    # read the latest (or as_of) quantile prediction elements, flattening them into parallel lists, one item per
+    # (model, unit, target, level)
+    key_to_idx = {}  # (unit_id, target_id) -> key_idx
+    key_idxs, levels, values = [], [], []
+    fm_ids = set()
+    sql = _query_forecasts_sql_for_pred_class([PredictionElement.QUANTILE_CLASS], model_ids, [], [], [timezero_id],
+                                              as_of, True)
+    with streaming_cursor() as cursor:
+        cursor.execute(sql, (project.pk,))
+        for fm_id, _, _, unit_id, target_id, _, pred_data in batched_rows(cursor):
+            if target_id_to_obj[target_id].type not in (Target.CONTINUOUS_TARGET_TYPE, Target.DISCRETE_TARGET_TYPE):
+                continue
+
+            # counterintuitively must use json.loads per https://code.djangoproject.com/ticket/31991
+            pred_data = json.loads(pred_data)
+            key_idx = key_to_idx.setdefault((unit_id, target_id), len(key_to_idx))
+            key_idxs.extend([key_idx] * len(pred_data['quantile']))
+            levels.extend(pred_data['quantile'])
+            values.extend(pred_data['value'])
+            fm_ids.add(fm_id)
+    if not key_idxs:
+        return [], 0
+
+    # combine, and then convert to predictions
+    key_idxs, levels, combined_values = _combine_quantiles(
+        numpy.array(key_idxs), numpy.round(numpy.array(levels, dtype=float), ENSEMBLE_LEVEL_DECIMALS),
+        numpy.array(values, dtype=float), rule, trim)
+    idx_to_key = {key_idx: key for key, key_idx in key_to_idx.items()}
+    predictions = []
+    key_starts = numpy.flatnonzero(numpy.r_[True, key_idxs[1:] != key_idxs[:-1]])
+    for start, end in zip(key_starts, numpy.r_[key_starts[1:], len(key_idxs)]):
+        unit_id, target_id = idx_to_key[key_idxs[start]]
+        key_values = numpy.maximum.accumulate(combined_values[start:end])  # non-decreasing
+        if target_id_to_obj[target_id].type == Target.DISCRETE_TARGET_TYPE:
+            key_values = [int(value) for value in numpy.ceil(key_values)]
+        else:
+            key_values = key_values.tolist()
+        predictions.append({'unit': unit_id_to_obj[unit_id].abbreviation, 'target': target_id_to_obj[target_id].name,
+                            'class': 'quantile',
+                            'prediction': {'quantile': levels[start:end].tolist(), 'value': key_values}})
+    return predictions, len(fm_ids)
+
+
+def _combine_quantiles(key_idxs, levels, values, rule, trim):
+    """
+    Combines values across models for each (key_idx, level) via rule. Vectorized: sorts by (key_idx, level, value) so
+    that each group is a contiguous run sorted by value, selects the values that rule averages by their rank within
+    their group, and sums the runs via `numpy.add.reduceat()`.
+
+    :param key_idxs: a numpy array of n ints that identify each value's (unit, target)
+    :param levels: "" floats: each value's quantile level
+    :param values: "" floats: the values to combine
+    :param rule: one of ENSEMBLE_RULES
+    :param trim: the fraction for 'trimmed_mean'
+    :return: a 3-tuple of numpy arrays with one item per (key_idx, level) group, sorted by (key_idx, level):
+        (key_idxs, levels, combined_values)
+    """
+    sort_idxs = numpy.lexsort((values, levels, key_idxs))
+    key_idxs, levels, values = key_idxs[sort_idxs], levels[sort_idxs], values[sort_idxs]
+    starts = numpy.flatnonzero(numpy.r_[True, (key_idxs[1:] != key_idxs[:-1]) | (levels[1:] != levels[:-1])])
+    counts = numpy.diff(numpy.r_[starts, len(values)])
+    ranks = numpy.arange(len(values)) - numpy.repeat(starts, counts)  # 0-based rank within the group
+    group_counts = numpy.repeat(counts, counts)
+    if rule == 'median':
+        is_kept = (ranks == (group_counts - 1) // 2) | (ranks == group_counts // 2)  # one or two middle values
+    elif rule == 'trimmed_mean':
+        num_trimmed = numpy.floor(trim * group_counts).astype(int)
+        is_kept = (ranks >= num_trimmed) & (ranks < group_counts - num_trimmed)
+    else:  # 'mean'
+        is_kept = numpy.ones(len(values), dtype=bool)
+    sums = numpy.add.reduceat(numpy.where(is_kept, values, 0), starts)
+    num_kept = numpy.add.reduceat(is_kept.astype(int), starts)
+    return key_idxs[starts], levels[starts], sums / num_kept
+
+
+#
+# _build_ensemble_worker()
+#
+
+def _build_ensemble_worker(job_pk):
+    """
+    enqueue() helper function that builds ensemble forecasts. Called by `api_views.build_ensemble_endpoint()`.
+
+    - Expected Job.input_json key(s): 'forecast_model_pk' (the ensemble model), 'ensemble' (params as documented in
+      `validate_ensemble_params()`)
+    - Saves Job.output_json key(s): 'forecast_model_pk', 'timezeros' (the per-time zero status dicts returned by
+      `build_ensemble_forecasts()`), 'num_succeeded', 'num_failed'
+
+    :param job_pk: the Job's pk
+    """
+    job = get_object_or_404(Job, pk=job_pk)
+    try:
+        forecast_model_pk = job.input_json.get('forecast_model_pk')
+        ensemble_model = ForecastModel.objects.filter(pk=forecast_model_pk).first()  # None if doesn't exist
+        if not ensemble_model:
+            job.status = Job.FAILED
+            job.failure_message = f"_build_ensemble_worker(): error: no ForecastModel found for " \
+                                  f"forecast_model_pk={forecast_model_pk}"
+            job.save()
+            logger.error(job.failure_message + f". job={job}")
+            return
+
+        params = job.input_json.get('ensemble')
+        error_messages, (model_ids, timezero_ids, as_of, rule, trim) = \
+            validate_ensemble_params(ensemble_model.project, ensemble_model, params)
+        if error_messages:
+            job.status = Job.FAILED
+            job.failure_message = f"_build_ensemble_worker(): error: invalid params. errors={error_messages}"
+            job.save()
+            logger.error(job.failure_message + f". job={job}")
+            return
+
+        logger.debug(f"_build_ensemble_worker(): 1/2 building. ensemble_model={ensemble_model}, job={job}")
+        tz_statuses = build_ensemble_forecasts(ensemble_model, model_ids, timezero_ids, as_of, rule, trim,
+                                               params.get('notes', ''))
+        num_succeeded = len([tz_status for tz_status in tz_statuses if tz_status['is_success']])
+        job.output_json = {'forecast_model_pk': forecast_model_pk, 'timezeros': tz_statuses,
+                           'num_succeeded': num_succeeded, 'num_failed': len(tz_statuses) - num_succeeded}
+        if num_succeeded:
+            job.status = Job.SUCCESS
+            forecast_ids = [tz_status['forecast_pk'] for tz_status in tz_statuses if tz_status['is_success']]
+            transaction.on_commit(lambda: enqueue_update_scores(ensemble_model.project_id, forecast_ids=forecast_ids))
+        else:
+            job.status = Job.FAILED
+            job.failure_message = f"_build_ensemble_worker(): error: no ensemble forecasts were built. " \
+                                  f"# time zeros={len(tz_statuses)}"
+        job.save()
+        logger.debug(f"_build_ensemble_worker(): 2/2 done. # succeeded={num_succeeded}. job={job}")
+    except JobTimeoutException as jte:
+        job.status = Job.TIMEOUT
+        job.save()
+        logger.error(f"_build_ensemble_worker(): error: {jte!r}. job={job}")
+        raise jte
+    except Exception as ex:
+        job.status = Job.FAILED
+        job.failure_message = f"_build_ensemble_worker(): error: {ex!r}"
+        job.save()
+        logger.error(job.failure_message + f". job={job}")
@@ -1,22 +1,36 @@
+import concurrent.futures
 import csv
 import datetime
+import functools
 import io
+import itertools
 import json
 import logging
 import math
-from collections import defaultdict
-
+import multiprocessing
+import os
+import tarfile
+import zipfile
+from collections import defaultdict, deque
+
+import django
+import numpy
 from django.db import connection, transaction
 from django.db.models import Count
 from django.shortcuts import get_object_or_404
+from rq.timeouts import JobTimeoutException
 
 from forecast_app.models import Forecast, Target, ForecastMetaPrediction, ForecastMetaUnit, ForecastMetaTarget, \
-    ForecastModel, PredictionElement, PredictionData
+    ForecastModel, LatestPredictionElement, PredictionElement, PredictionData, Unit
+from forecast_app.models.forecast import lock_forecast_versions
 from forecast_app.models.prediction_element import PRED_CLASS_NAME_TO_INT, PRED_CLASS_INT_TO_NAME
+from forecast_repo.settings.base import PARALLEL_VALIDATION_MIN_NUM_PRED_ELES, PARALLEL_VALIDATION_NUM_WORKERS
 from utils.project import _target_dict_for_target, targets_for_group_name
-from utils.project_queries import _query_forecasts_sql_for_pred_class
+from utils.project_queries import _query_forecasts_sql_for_pred_class, bump_project_data_version
 from utils.project_truth import POSTGRES_NULL_VALUE
-from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, streaming_cursor, temp_table_on_commit_sql, \
+    unique_temp_table_name, IngestStats
+from utils.validation_context import validation_context_for_project
 
 
 logger = logging.getLogger(__name__)
@@ -63,7 +77,7 @@ def json_io_dict_from_forecast(forecast, request, is_include_retract=False):
     target_id_to_obj = {target.pk: target for target in forecast.forecast_model.project.targets.all()}
     sql = _query_forecasts_sql_for_pred_class([], [forecast.forecast_model.pk], [], [], [forecast.time_zero.pk],
                                               forecast.issued_at, False, is_include_retract)
-    with connection.cursor() as cursor:
+    with streaming_cursor() as cursor:
         cursor.execute(sql, (forecast.forecast_model.project.pk,))
         # counterintuitively must use json.loads per https://code.djangoproject.com/ticket/31991
         prediction_dicts = [
@@ -75,7 +89,63 @@ def json_io_dict_from_forecast(forecast, request, is_include_retract=False):
             for fm_id, tz_id, pred_class, unit_id, target_id, is_retract, pred_data in batched_rows(cursor)]
 
     # done
-    return {'meta': meta, 'predictions': sorted(prediction_dicts, key=lambda _: (_['unit'], _['target']))}
+    return {'meta': meta, 'predictions': sorted(prediction_dicts, key=lambda _: (_['unit'], _['target'],
+                                                                                PRED_CLASS_NAME_TO_INT[_['class']]))}
+
+
+#
+# forecast_manifest()
+#
+
+def forecast_manifest(forecast_model, time_zero):
+    """
+    Returns a compact "manifest" of the latest version of forecast_model's forecast for time_zero, i.e., the latest
+    non-retracted prediction element for each unit, target, and prediction class across all versions. Clients can
+    compare their data's hashes (see PredictionElement.hash_for_prediction_data_dict()) to the manifest's to create a
+    "patch" that contains only added or changed prediction elements plus explicit retractions (see
+    load_predictions_from_json_io_dict()'s `is_patch`).
+
+    :param forecast_model: a ForecastModel
+    :param time_zero: a TimeZero in forecast_model's project
+    :return: a dict with these keys: 'forecast_id' and 'issued_at' (the latest non-empty version's, or None if none),
+        'hash_scheme' (the PredictionElement *_HASH_SCHEME that data_hashes use), and 'elements': a list of 4-tuples:
+        (unit_abbrev, target_name, pred_class_name, data_hash), sorted
+    """
+    # skip empty versions, e.g., ones whose uploads are in progress
+    latest_forecast = Forecast.objects.filter(forecast_model=forecast_model, time_zero=time_zero,
+                                              pred_eles__isnull=False) \
+        .order_by('-issued_at') \
+        .first()
+    sql = f"""
+        WITH ranked_rows AS (
+            SELECT pred_ele.unit_id    AS unit_id,
+                   pred_ele.target_id  AS target_id,
+                   pred_ele.pred_class AS pred_class,
+                   pred_ele.is_retract AS is_retract,
+                   pred_ele.data_hash  AS data_hash,
+                   RANK() OVER (
+                       PARTITION BY pred_ele.unit_id, pred_ele.target_id, pred_ele.pred_class
+                       ORDER BY f.issued_at DESC) AS rownum
+            FROM {PredictionElement._meta.db_table} AS pred_ele
+                     JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+            WHERE f.forecast_model_id = %s
+              AND f.time_zero_id = %s
+        )
+        SELECT unit.abbreviation, target.name, ranked_rows.pred_class, ranked_rows.data_hash
+        FROM ranked_rows
+                 JOIN {Unit._meta.db_table} AS unit ON ranked_rows.unit_id = unit.id
+                 JOIN {Target._meta.db_table} AS target ON ranked_rows.target_id = target.id
+        WHERE ranked_rows.rownum = 1
+          AND NOT ranked_rows.is_retract;
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (forecast_model.pk, time_zero.pk))
+        elements = sorted((unit_abbrev, target_name, PRED_CLASS_INT_TO_NAME[pred_class], data_hash)
+                          for unit_abbrev, target_name, pred_class, data_hash in batched_rows(cursor))
+    return {'forecast_id': latest_forecast.pk if latest_forecast else None,
+            'issued_at': latest_forecast.issued_at.isoformat() if latest_forecast else None,
+            'hash_scheme': _data_hash_scheme(forecast_model, time_zero),
+            'elements': elements}
 
 
 #
@@ -84,10 +154,14 @@ def json_io_dict_from_forecast(forecast, request, is_include_retract=False):
 
 BIN_SUM_REL_TOL = 0.001  # hard-coded magic number for prediction probability sums
 
+QUANTILE_VALUE_REL_TOL = 1e-05  # `_le_with_tolerance()`'s relative tolerance
+
+VALIDATION_BATCH_SIZE = 5000  # max number of prediction dicts `_BatchValidator` checks at once
+
 
 @transaction.atomic
 def load_predictions_from_json_io_dict(forecast, json_io_dict, is_skip_validation=False, is_validate_cats=True,
-                                       is_subset_allowed=False):
+                                       is_subset_allowed=False, is_patch=False, stats=None):
     """
     Top-level function that loads the prediction data into forecast from json_io_dict. Validates the forecast data. Note
     that we ignore the 'meta' portion of json_io_dict. Errors if any referenced Units and Targets do not exist in
@@ -116,9 +190,16 @@ def load_predictions_from_json_io_dict(forecast, json_io_dict, is_skip_validatio
     :param is_validate_cats: True if bin cat values should be validated against their Target.cats. used for testing
     :param is_subset_allowed: controls whether `_is_pred_eles_subset_prev_versions()` is called:
         True: don't call, False: do call.
+    :param is_patch: True if json_io_dict is a "patch" to the previous version, i.e., it contains only added or changed
+        prediction elements plus explicit retractions. Unchanged elements are carried forward from previous versions
+        (which is how versions are queried anyway), so rule 3 does not apply. Instead, the new version as composed with
+        previous ones is validated (see `_validate_patch_composition()`). Requires a previous version
+    :param stats: an optional IngestStats to record stage times and counts in
     """
     if forecast.pred_eles.count() != 0:
         raise RuntimeError(f"cannot load data into a non-empty forecast: {forecast}")
+    elif is_patch and not _is_previous_version(forecast):
+        raise RuntimeError(f"cannot load a patch into a forecast with no previous version: {forecast}")
     elif not isinstance(json_io_dict, dict):
         raise RuntimeError(f"json_io_dict was not a dict: {json_io_dict!r}, type={type(json_io_dict)}")
     elif 'predictions' not in json_io_dict:
@@ -126,57 +207,419 @@ def load_predictions_from_json_io_dict(forecast, json_io_dict, is_skip_validatio
     elif not json_io_dict['predictions']:  # validate the rule: "cannot load empty data"
         raise RuntimeError(f"cannot load empty data")
 
-    # we have two types of tables to insert into (PredictionElement and PredictionData), which requires loading via two
-    # passes:
-    # 1) iterate over incoming prediction dicts, validating them and generating rows to insert into the
-    #    PredictionElement table
-    # 2) load those just-inserted rows from the database so we can get their PRIMARY KEY (autoincrement) IDs, and then
-    #    re-iterate over prediction dict data (cached in memory) to generate rows to insert into the PredictionData
-    #    table
-
-    # pass 1/2. NB: `_insert_pred_ele_rows()` does some rule validation b/c it creates a temp table of the incoming
-    # forecast's prediction elements to work with
-    data_hash_to_pred_data, pred_ele_rows = \
-        _validated_pred_ele_rows_for_pred_dicts(forecast, json_io_dict['predictions'], is_skip_validation,
-                                                is_validate_cats)
-    del json_io_dict  # hopefully frees up memory
+    _load_prediction_dicts(forecast, json_io_dict['predictions'], is_skip_validation, is_validate_cats,
+                           is_subset_allowed, is_patch, stats)
+
+
+@transaction.atomic
+def load_predictions_from_json_io_file(forecast, json_io_fp, is_skip_validation=False, is_validate_cats=True,
+                                       is_subset_allowed=False, is_patch=False, stats=None):
+    """
+    A streaming version of `load_predictions_from_json_io_dict()` that reads the "JSON IO dict" from a file-like object
+    rather than from an already-parsed dict. The 'predictions' list is parsed one prediction dict at a time (see
+    `_iter_json_io_predictions()`), and each is validated, hashed, and staged as it arrives, so memory use does not
+    grow with the size of the file. Args and FORECAST VERSION RULES are the same as
+    `load_predictions_from_json_io_dict()`.
+
+    :param forecast: a Forecast to load json_io_fp's predictions into
+    :param json_io_fp: a text file-like object containing a "JSON IO dict". see docs for details
+    """
+    if stats is None:
+        stats = IngestStats()
+    if forecast.pred_eles.count() != 0:
+        raise RuntimeError(f"cannot load data into a non-empty forecast: {forecast}")
+    elif is_patch and not _is_previous_version(forecast):
+        raise RuntimeError(f"cannot load a patch into a forecast with no previous version: {forecast}")
+
+    prediction_dicts = stats.timed_iter('parse', _iter_json_io_predictions(json_io_fp), VALIDATION_BATCH_SIZE)
+    _load_prediction_dicts(forecast, prediction_dicts, is_skip_validation, is_validate_cats, is_subset_allowed,
+                           is_patch, stats)
+
+
+def _load_prediction_dicts(forecast, prediction_dicts, is_skip_validation, is_validate_cats, is_subset_allowed,
+                           is_patch=False, stats=None):
+    """
+    `load_predictions_from_json_io_dict()` and `load_predictions_from_json_io_file()` helper that does the actual
+    loading. We have two types of tables to insert into (PredictionElement and PredictionData). We do so by staging
+    each validated prediction element - including its serialized prediction data - in a temp table as we iterate over
+    prediction_dicts, and then inserting into the two tables from that temp table. NB: `_insert_pred_ele_rows()` does
+    some rule validation b/c it works with the staged prediction elements.
+
+    :param prediction_dicts: an iterable of prediction dicts. can be a generator
+    """
+    pred_ele_rows = _validated_pred_ele_rows_for_pred_dicts(forecast, prediction_dicts, is_skip_validation,
+                                                            is_validate_cats, is_patch)  # generator
     # raises. tests version rules then inserts, deleting any dups first
-    _insert_pred_ele_rows(forecast, pred_ele_rows, is_subset_allowed)
+    _insert_pred_ele_rows(forecast, pred_ele_rows, is_subset_allowed, is_skip_validation, is_patch=is_patch,
+                          stats=stats)
+
 
-    # pass 2/2
-    pred_data_rows = []  # appended-to next
-    pred_ele_qs = PredictionElement.objects \
-        .filter(forecast=forecast, is_retract=False) \
-        .values_list('id', 'data_hash')
-    for pred_ele_id, data_hash in pred_ele_qs.iterator():
-        prediction_data = data_hash_to_pred_data[data_hash]
-        pred_data_rows.append((pred_ele_id, prediction_data))
-    if pred_data_rows:
-        _insert_pred_data_rows(pred_data_rows)  # pred_ele_id, prediction_data
+def _is_previous_version(forecast):
+    """
+    :return: True if there is a non-empty version of forecast that was issued before it
+    """
+    return Forecast.objects.filter(forecast_model=forecast.forecast_model, time_zero=forecast.time_zero,
+                                   issued_at__lt=forecast.issued_at, pred_eles__isnull=False).exists()
 
 
-def _validated_pred_ele_rows_for_pred_dicts(forecast, prediction_dicts, is_skip_validation, is_validate_cats):
+#
+# load_forecasts_from_archive()
+#
+
+def load_forecasts_from_archive(forecast_model, archive_fp, notes='', stats=None):
+    """
+    Loads a zip or tar archive of forecast files into forecast_model, one new Forecast per file. Each file is a JSON
+    IO dict whose name starts with the TimeZero.timezero_date that it is for, e.g., '2020-04-12-my-model.json'. Unlike
+    uploading the files one at a time, all the new Forecasts are created at once (sharing the same issued_at), and the
+    project's lookup maps are loaded only once. Each file is loaded in its own savepoint, so a bad file does not prevent
+    the others from loading. Files that fail have their Forecasts deleted.
+
+    :param forecast_model: the ForecastModel to load into
+    :param archive_fp: a seekable binary file-like object of a zip or tar (optionally compressed) archive
+    :param notes: the new Forecasts' notes
+    :param stats: an optional IngestStats to record stage times and counts in, summed over all files
+    :return: a list of per-file status dicts, in archive file name order. each has these keys: 'filename',
+        'timezero_date' (a str, or None if the name didn't start with one), 'is_success', 'forecast_pk' (None if not
+        is_success), and 'failure_message' ('' if is_success)
+    :raises RuntimeError: if archive_fp is not a zip or tar archive
+    """
+    if stats is None:
+        stats = IngestStats()
+    project = forecast_model.project
+    timezero_date_to_obj = {time_zero.timezero_date: time_zero for time_zero in project.timezeros.all()}
+
+    # 1/3 match archive files to TimeZeros
+    logger.debug(f"load_forecasts_from_archive(): 1/3 reading archive. forecast_model={forecast_model}")
+    file_statuses = []
+    filename_to_time_zero = {}
+    for filename in sorted(_archive_file_name_to_opener(archive_fp)):
+        file_status = {'filename': filename, 'timezero_date': None, 'is_success': False, 'forecast_pk': None,
+                       'failure_message': ''}
+        file_statuses.append(file_status)
+        try:
+            timezero_date = datetime.datetime.strptime(os.path.basename(filename)[:10], YYYY_MM_DD_DATE_FORMAT).date()
+        except ValueError:
+            file_status['failure_message'] = f"file name did not start with a timezero_date " \
+                                             f"({YYYY_MM_DD_DATE_FORMAT})"
+            continue
+
+        file_status['timezero_date'] = timezero_date.strftime(YYYY_MM_DD_DATE_FORMAT)
+        time_zero = timezero_date_to_obj.get(timezero_date)
+        if not time_zero:
+            file_status['failure_message'] = f"TimeZero not found for timezero_date"
+        elif time_zero in filename_to_time_zero.values():
+            file_status['failure_message'] = f"more than one file for timezero_date"
+        else:
+            filename_to_time_zero[filename] = time_zero
+
+    # 2/3 create the Forecasts. we create them all at once, which skips `pre_validate_new_or_edited_forecast()`, so we
+    # lock and check its rule here: "you cannot position a new forecast before any existing versions"
+    logger.debug(f"load_forecasts_from_archive(): 2/3 creating forecasts. # files={len(filename_to_time_zero)}")
+    filename_to_status = {file_status['filename']: file_status for file_status in file_statuses}
+    with transaction.atomic():
+        for time_zero_id in sorted(time_zero.pk for time_zero in filename_to_time_zero.values()):
+            lock_forecast_versions(forecast_model.pk, time_zero_id)
+        issued_at = django.utils.timezone.now()
+        newer_time_zero_ids = set(Forecast.objects
+                                  .filter(forecast_model=forecast_model, time_zero__in=filename_to_time_zero.values(),
+                                          issued_at__gte=issued_at)
+                                  .values_list('time_zero_id', flat=True))
+        for filename, time_zero in list(filename_to_time_zero.items()):
+            if time_zero.pk in newer_time_zero_ids:
+                filename_to_status[filename]['failure_message'] = "you cannot position a new forecast before any " \
+                                                                  "existing versions"
+                del filename_to_time_zero[filename]
+        Forecast.objects.bulk_create([Forecast(forecast_model=forecast_model, time_zero=time_zero,
+                                               source=os.path.basename(filename), issued_at=issued_at, notes=notes)
+                                      for filename, time_zero in filename_to_time_zero.items()])
+    # re-query to get pks b/c bulk_create() does not set them for all databases
+    time_zero_pk_to_forecast = {forecast.time_zero_id: forecast for forecast in
+                                Forecast.objects.filter(forecast_model=forecast_model, issued_at=issued_at,
+                                                        time_zero__in=filename_to_time_zero.values())}
+
+    # 3/3 load each file into its Forecast
+    logger.debug(f"load_forecasts_from_archive(): 3/3 loading forecasts")
+    filename_to_opener = _archive_file_name_to_opener(archive_fp)
+    unloaded_forecasts = list(time_zero_pk_to_forecast.values())
+    try:
+        for filename, time_zero in filename_to_time_zero.items():
+            forecast = time_zero_pk_to_forecast[time_zero.pk]
+            file_status = filename_to_status[filename]
+            try:
+                with transaction.atomic(), filename_to_opener[filename]() as member_fp:
+                    load_predictions_from_json_io_file(forecast, io.TextIOWrapper(member_fp, 'utf-8'),
+                                                       is_validate_cats=False, stats=stats)  # transaction.atomic
+                    with stats.stage('cache_metadata'):
+                        cache_forecast_metadata(forecast)  # transaction.atomic
+                file_status['is_success'] = True
+                file_status['forecast_pk'] = forecast.pk
+                unloaded_forecasts.remove(forecast)
+            except JobTimeoutException:
+                raise
+            except Exception as ex:
+                file_status['failure_message'] = f"{ex!r}"
+                logger.debug(f"load_forecasts_from_archive(): file failed. filename={filename!r}, ex={ex!r}")
+    finally:
+        for forecast in unloaded_forecasts:
+            forecast.delete()
+    logger.debug(f"load_forecasts_from_archive(): done. # files={len(file_statuses)}, "
+                 f"# succeeded={len([_ for _ in file_statuses if _['is_success']])}")
+    return file_statuses
+
+
+def _archive_file_name_to_opener(archive_fp):
+    """
+    `load_forecasts_from_archive()` helper.
+
+    :param archive_fp: as passed to `load_forecasts_from_archive()`
+    :return: a dict that maps archive file names to a function of no args that returns a binary file-like object for
+        reading that file. includes only regular files, skipping hidden ones (e.g., '.DS_Store' and '__MACOSX/*')
+    :raises RuntimeError: if archive_fp is not a zip or tar archive
+    """
+    archive_fp.seek(0)
+    if zipfile.is_zipfile(archive_fp):
+        archive_fp.seek(0)
+        zip_file = zipfile.ZipFile(archive_fp)
+        name_to_opener = {zip_info.filename: functools.partial(zip_file.open, zip_info)
+                          for zip_info in zip_file.infolist() if not zip_info.is_dir()}
+    else:
+        archive_fp.seek(0)
+        try:
+            tar_file = tarfile.open(fileobj=archive_fp)  # detects compression
+        except tarfile.TarError:
+            raise RuntimeError(f"file was not a zip or tar archive")
+
+        name_to_opener = {tar_info.name: functools.partial(tar_file.extractfile, tar_info)
+                          for tar_info in tar_file.getmembers() if tar_info.isfile()}
+    return {name: opener for name, opener in name_to_opener.items()
+            if (not os.path.basename(name).startswith('.')) and ('__MACOSX' not in name.split('/'))}
+
+
+#
+# _iter_json_io_predictions()
+#
+
+# number of characters to read from the file at a time. NB: `_JsonStreamReader.fill()` reads at least as many
+# characters as are currently buffered, which keeps re-parsing of very large prediction dicts linear
+JSON_STREAM_READ_SIZE = 2 ** 16
+
+
+def _iter_json_io_predictions(json_io_fp):
+    """
+    A generator that incrementally parses a "JSON IO dict" from json_io_fp, yielding the prediction dicts in its
+    'predictions' list one at a time. Only one prediction dict (plus a bounded read buffer) is in memory at a time. Other
+    top-level keys (i.e., 'meta') are parsed and then discarded.
+
+    :param json_io_fp: a text file-like object containing a "JSON IO dict"
+    :return: a generator of prediction dicts
+    :raises RuntimeError: if the JSON is not a dict, has no 'predictions' key, or its 'predictions' is not a list
+    :raises json.JSONDecodeError: if the JSON is malformed
+    """
+    reader = _JsonStreamReader(json_io_fp)
+    if reader.next_char() != '{':
+        raise RuntimeError(f"json_io_dict was not a dict")
+
+    is_found_predictions = False
+    if reader.peek_char() == '}':
+        reader.next_char()
+    else:
+        while True:
+            key = reader.decode_value()
+            if not isinstance(key, str):
+                raise RuntimeError(f"invalid json_io_dict key: {key!r}")
+            elif reader.next_char() != ':':
+                raise RuntimeError(f"expected ':' after json_io_dict key {key!r}")
+
+            if key == 'predictions':
+                is_found_predictions = True
+                if reader.next_char() != '[':
+                    raise RuntimeError(f"json_io_dict's 'predictions' was not a list")
+
+                if reader.peek_char() == ']':
+                    reader.next_char()
+                else:
+                    while True:
+                        yield reader.decode_value()
+                        char = reader.next_char()
+                        if char == ']':
+                            break
+                        elif char != ',':
+                            raise RuntimeError(f"expected ',' or ']' in 'predictions' list. found={char!r}")
+            else:
+                reader.decode_value()  # e.g., 'meta'. discarded
+
+            char = reader.next_char()
+            if char == '}':
+                break
+            elif char != ',':
+                raise RuntimeError(f"expected ',' or '}}' in json_io_dict. found={char!r}")
+
+    if not is_found_predictions:
+        raise RuntimeError(f"json_io_dict had no 'predictions' key")
+
+
+class _JsonStreamReader:
     """
-    Validates prediction_dicts and returns a list of rows suitable for bulk-loading into the PredictionElement table.
+    `_iter_json_io_predictions()` helper that decodes JSON values one at a time from a text file-like object using
+    `json.JSONDecoder.raw_decode()` over a buffer that is refilled as needed.
+    """
+
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0  # index into buffer of the next unconsumed character
+        self.is_eof = False
+
+
+    def fill(self):
+        """
+        Drops consumed characters from the buffer and appends the next chunk from the file. Sets is_eof if there is
+        nothing left to read.
+        """
+        chunk = self.fp.read(max(JSON_STREAM_READ_SIZE, len(self.buffer) - self.pos))
+        if chunk:
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+        else:
+            self.is_eof = True
+
+
+    def peek_char(self):
+        """
+        :return: the next non-whitespace character without consuming it, or '' if at the end of the file
+        """
+        while True:
+            while (self.pos < len(self.buffer)) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            elif self.is_eof:
+                return ''
+            self.fill()
+
+
+    def next_char(self):
+        """
+        :return: same as peek_char(), but consumes the character
+        """
+        char = self.peek_char()
+        self.pos += len(char)
+        return char
+
+
+    def decode_value(self):
+        """
+        :return: the next JSON value, consuming it
+        """
+        self.peek_char()  # skip whitespace
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a value that ends at the end of the buffer might be truncated, e.g., a number like `12` in `123`
+                if (end < len(self.buffer)) or self.is_eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.is_eof:
+                    raise
+            self.fill()
+
+
+def _validated_pred_ele_rows_for_pred_dicts(forecast, prediction_dicts, is_skip_validation, is_validate_cats,
+                                            is_patch=False):
+    """
+    A generator that validates prediction_dicts and yields rows suitable for bulk-loading into the staging table used
+    by `_insert_pred_ele_rows()`. Each prediction dict is validated and hashed as it is iterated over, so
+    prediction_dicts can itself be a generator (see `_iter_json_io_predictions()`). The "prediction"-level validations
+    are done after the last row is yielded, and raise then.
+
+    Forecasts with at least PARALLEL_VALIDATION_MIN_NUM_PRED_ELES prediction elements are validated and hashed in
+    chunks by a pool of PARALLEL_VALIDATION_NUM_WORKERS processes (see `_iter_validated_rows_parallel()`). NB: to
+    decide this we buffer up to that many prediction dicts.
 
     :param forecast: a Forecast that's used to validate against
     :param prediction_dicts: the 'predictions' portion of a "JSON IO dict" as returned by
-        json_io_dict_from_cdc_csv_file()
+        json_io_dict_from_cdc_csv_file(). can be any iterable
     :param is_skip_validation: same as load_predictions_from_json_io_dict()
     :param is_validate_cats: ""
-    :return: a 2-tuple: (data_hash_to_pred_data, pred_ele_rows):
-        data_hash_to_pred_data: a dict that maps data_hash -> prediction_data. does not include if is_retract (None)
-        pred_ele_rows: a list of 6-tuples: (forecast_id, pred_class_int, unit_id, target_id, is_retract, data_hash)
+    :param is_patch: "". if True then the `Named`/`Bin` "prediction"-level validation is skipped b/c it's done on the
+        composed version instead (see `_validate_patch_composition()`)
+    :return: a generator of 7-tuples: (forecast_id, pred_class_int, unit_id, target_id, is_retract, data_hash,
+        data_json), where data_json is the canonical serialized prediction data, or None if is_retract
     """
-    unit_abbrev_to_obj = {unit.abbreviation: unit for unit in forecast.forecast_model.project.units.all()}
-    target_name_to_obj = {target.name: target for target in forecast.forecast_model.project.targets.all()}
+    snapshot = _ValidationSnapshot.for_forecast(forecast)
 
     # this variable helps to do "prediction"-level validations at the end of this function. it maps 2-tuples to a list
     # of prediction classes (strs):
     loc_targ_to_pred_classes = defaultdict(list)  # (unit_abbrev, target_name) -> [prediction_class1, ...]
 
-    data_hash_to_pred_data = {}  # return value. filled next
-    pred_ele_rows = []  # ""
+    prediction_dicts = iter(prediction_dicts)
+    is_parallel = False
+    head_pred_dicts = []
+    if PARALLEL_VALIDATION_MIN_NUM_PRED_ELES and (PARALLEL_VALIDATION_NUM_WORKERS > 1):
+        head_pred_dicts = list(itertools.islice(prediction_dicts, PARALLEL_VALIDATION_MIN_NUM_PRED_ELES))
+        is_parallel = len(head_pred_dicts) == PARALLEL_VALIDATION_MIN_NUM_PRED_ELES
+    prediction_dicts = itertools.chain(head_pred_dicts, prediction_dicts)
+    if is_parallel:
+        logger.debug(f"_validated_pred_ele_rows_for_pred_dicts(): validating in parallel. forecast={forecast}, "
+                     f"num_workers={PARALLEL_VALIDATION_NUM_WORKERS}")
+        yield from _iter_validated_rows_parallel(snapshot, prediction_dicts, is_skip_validation, is_validate_cats,
+                                                 loc_targ_to_pred_classes, PARALLEL_VALIDATION_NUM_WORKERS)
+    else:
+        yield from _iter_validated_rows(snapshot, prediction_dicts, is_skip_validation, is_validate_cats,
+                                        loc_targ_to_pred_classes)
+
+    # finally, do "prediction"-level validation. recall that "prediction" is defined as "a group of a prediction
+    # elements(s) specific to a unit and target"
+    if not is_skip_validation:
+        _validate_loc_targ_to_pred_classes(loc_targ_to_pred_classes, not is_patch)  # raises o/w
+
+
+class _ValidationSnapshot:
+    """
+    A picklable snapshot of everything needed to validate and hash a forecast's prediction dicts without hitting the
+    database, so that `_iter_validated_rows()` can run in other processes.
+    """
+
+
+    def __init__(self, forecast_pk, unit_abbrev_to_pk, target_name_to_validator, hash_scheme):
+        self.forecast_pk = forecast_pk
+        self.unit_abbrev_to_pk = unit_abbrev_to_pk
+        self.target_name_to_validator = target_name_to_validator
+        self.hash_scheme = hash_scheme
+
+
+    @classmethod
+    def for_forecast(cls, forecast):
+        project = forecast.forecast_model.project
+        unit_abbrev_to_pk = dict(project.units.values_list('abbreviation', 'id'))
+        # validate using TargetValidators rather than Targets to avoid per-element cats and range queries
+        target_name_to_validator = validation_context_for_project(project).target_name_to_validator
+        return cls(forecast.pk, unit_abbrev_to_pk, target_name_to_validator,
+                   _data_hash_scheme(forecast.forecast_model, forecast.time_zero))
+
+
+def _iter_validated_rows(snapshot, prediction_dicts, is_skip_validation, is_validate_cats, loc_targ_to_pred_classes):
+    """
+    `_validated_pred_ele_rows_for_pred_dicts()` helper that validates and hashes each of prediction_dicts, except for
+    the "prediction"-level validations.
+
+    :param snapshot: a _ValidationSnapshot
+    :param prediction_dicts: an iterable of prediction dicts
+    :param is_skip_validation: same as load_predictions_from_json_io_dict()
+    :param is_validate_cats: ""
+    :param loc_targ_to_pred_classes: a defaultdict(list) that's updated with each prediction dict's class
+    :return: a generator of rows as documented in `_validated_pred_ele_rows_for_pred_dicts()`
+    """
+    unit_abbrev_to_pk = snapshot.unit_abbrev_to_pk
+    target_name_to_obj = snapshot.target_name_to_validator
+
+    # the numeric checks of bin, sample, and quantile prediction dicts are deferred to batch_validator, which does them
+    # all at once every VALIDATION_BATCH_SIZE rows. we hold back those rows until their batch is validated
+    batch_validator = _BatchValidator()
+    batch_rows = []
     for prediction_dict in prediction_dicts:
         unit_abbrev = prediction_dict['unit']
         target_name = prediction_dict['target']
@@ -185,140 +628,372 @@ def _validated_pred_ele_rows_for_pred_dicts(forecast, prediction_dicts, is_skip_
         is_retract = prediction_data is None
         loc_targ_to_pred_classes[(unit_abbrev, target_name)].append(pred_class)
         if not is_skip_validation:
-            # validate prediction class, and unit and target names (applies to all prediction classes)
-            if unit_abbrev not in unit_abbrev_to_obj:
-                raise RuntimeError(f"prediction_dict referred to an undefined Unit. unit_abbrev={unit_abbrev!r}. "
-                                   f"existing_unit_abbrevs={unit_abbrev_to_obj.keys()}")
-            elif target_name not in target_name_to_obj:
-                raise RuntimeError(f"prediction_dict referred to an undefined Target. target_name={target_name!r}. "
-                                   f"existing_target_names={target_name_to_obj.keys()}")
-
-            if pred_class not in PRED_CLASS_NAME_TO_INT:
-                raise RuntimeError(f"invalid pred_class: {pred_class!r}. must be one of: "
-                                   f"{list(PRED_CLASS_INT_TO_NAME.values())}. "
-                                   f"prediction_dict={prediction_dict}")
-
-            # do class-specific validation
-            target = target_name_to_obj[target_name]
-            if (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.BIN_CLASS]) \
-                    and not is_retract:
-                _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target)  # raises o/w
-            elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.NAMED_CLASS]) \
-                    and not is_retract:
-                family_abbrev = prediction_data['family']
-                _validate_named_prediction_dict(family_abbrev, prediction_dict, target)  # raises o/w
-            elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.POINT_CLASS]) \
-                    and not is_retract:
-                _validate_point_prediction_dict(prediction_dict, target, prediction_data['value'])  # raises o/w
-            elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.SAMPLE_CLASS]) \
-                    and not is_retract:
-                _validate_sample_prediction_dict(prediction_dict, target)  # raises o/w
-            elif not is_retract:  # pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.QUANTILE_CLASS]:
-                _validate_quantile_prediction_dict(prediction_dict, target)  # raises o/w
-
-        # valid, so update data_hash_to_pred_data and append the row. we store '' if is_retract b/c there is no
-        # PredictionData and therefore no hash
-        data_hash = PredictionElement.hash_for_prediction_data_dict(prediction_data) if not is_retract else ''
-        if not is_retract:
-            data_hash_to_pred_data[data_hash] = prediction_data
-        pred_ele_rows.append((forecast.pk, PRED_CLASS_NAME_TO_INT[pred_class],
-                              unit_abbrev_to_obj[unit_abbrev].pk, target_name_to_obj[target_name].pk,
-                              is_retract, data_hash))
+            try:
+                _validate_prediction_dict(prediction_dict, unit_abbrev_to_pk, target_name_to_obj, is_validate_cats,
+                                          batch_validator)  # raises o/w
+            except RuntimeError:
+                batch_validator.validate()  # report errors in earlier prediction dicts first
+                raise
+
+        # valid (pending batch_validator), so save the row. we serialize once, and use the result for both the hash and
+        # the PredictionData. we store '' if is_retract b/c there is no PredictionData and therefore no hash
+        if is_retract:
+            data_hash, data_json = '', None
+        else:
+            data_json = PredictionElement.canonical_json_for_prediction_data_dict(prediction_data)
+            data_hash = PredictionElement.hash_for_canonical_json(data_json, snapshot.hash_scheme)
+        batch_rows.append((snapshot.forecast_pk, PRED_CLASS_NAME_TO_INT[pred_class],
+                           unit_abbrev_to_pk[unit_abbrev], target_name_to_obj[target_name].pk,
+                           is_retract, data_hash, data_json))
+        if len(batch_rows) == VALIDATION_BATCH_SIZE:
+            batch_validator.validate()  # raises o/w
+            yield from batch_rows
+            batch_rows = []
+    batch_validator.validate()  # raises o/w
+    yield from batch_rows
+
+
+# number of prediction dicts per chunk that's sent to a worker process by `_iter_validated_rows_parallel()`
+PARALLEL_VALIDATION_CHUNK_SIZE = 20000
+
+
+def _iter_validated_rows_parallel(snapshot, prediction_dicts, is_skip_validation, is_validate_cats,
+                                  loc_targ_to_pred_classes, num_workers):
+    """
+    A parallel version of `_iter_validated_rows()` that splits prediction_dicts into chunks of
+    PARALLEL_VALIDATION_CHUNK_SIZE and validates and hashes them in a pool of num_workers processes. Rows are yielded in
+    the same order as prediction_dicts, and errors are raised in the same order, too. At most 2 * num_workers chunks are
+    in flight at a time to bound memory use. Args are the same as `_iter_validated_rows()`, plus:
 
-    # finally, do "prediction"-level validation. recall that "prediction" is defined as "a group of a prediction
-    # elements(s) specific to a unit and target"
-    if not is_skip_validation:
-        # validate: "Within a Prediction, there cannot be more than 1 Prediction Element of the same type".
-        duplicate_unit_target_tuples = [(unit, target, pred_classes) for (unit, target), pred_classes
-                                        in loc_targ_to_pred_classes.items()
-                                        if len(pred_classes) != len(set(pred_classes))]
-        if duplicate_unit_target_tuples:
-            raise RuntimeError(f"Within a Prediction, there cannot be more than 1 Prediction Element of the same "
-                               f"class. Found these duplicate unit/target tuples: {duplicate_unit_target_tuples}")
-
-        # validate: (for both continuous and discrete target types): Within one prediction, there can be at most one of
-        # the following prediction elements, but not both: {`Named`, `Bin`}.
-        named_bin_conflict_tuples = [(unit, target, pred_classes) for (unit, target), pred_classes
-                                     in loc_targ_to_pred_classes.items()
-                                     if (PRED_CLASS_INT_TO_NAME[
-                                             PredictionElement.BIN_CLASS] in pred_classes)
-                                     and (PRED_CLASS_INT_TO_NAME[
-                                              PredictionElement.NAMED_CLASS] in pred_classes)]
-        if named_bin_conflict_tuples:
-            raise RuntimeError(f"Within one prediction, there can be at most one of the following prediction elements, "
-                               f"but not both: `Named`, `Bin`. Found these conflicting unit/target tuples: "
-                               f"{named_bin_conflict_tuples}")
-
-    # done!
-    return data_hash_to_pred_data, pred_ele_rows
-
-
-def _insert_pred_ele_rows(forecast, pred_ele_rows, is_subset_allowed):
-    """
-    Validates forecast against previous data and then loads pred_ele_rows into the PredictionElement table. Skips
-    duplicate prediction elements in `forecast`'s model. See note in _insert_pred_data_rows() re: postgres vs. sqlite.
+    :param num_workers: number of worker processes
+    """
+    # we spawn rather than fork workers so that they do not inherit our open database connection, which is usually in
+    # the middle of the caller's transaction. (a forked worker that used or finalized its copy would corrupt ours, and
+    # we cannot close it first without ending that transaction.) workers set up django themselves (which requires
+    # DJANGO_SETTINGS_MODULE, which they inherit), but do not access the database
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'),
+                                                      initializer=django.setup)
+    futures = deque()
+    try:
+        while True:
+            chunk = list(itertools.islice(prediction_dicts, PARALLEL_VALIDATION_CHUNK_SIZE))
+            if chunk:
+                futures.append(executor.submit(_validated_rows_for_chunk, snapshot, chunk, is_skip_validation,
+                                               is_validate_cats))
+            if futures and ((len(futures) >= 2 * num_workers) or not chunk):
+                chunk_rows, chunk_loc_targ_to_pred_classes = futures.popleft().result()  # raises o/w
+                for loc_targ, pred_classes in chunk_loc_targ_to_pred_classes.items():
+                    loc_targ_to_pred_classes[loc_targ].extend(pred_classes)
+                yield from chunk_rows
+            elif not chunk:
+                break
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _validated_rows_for_chunk(snapshot, prediction_dicts, is_skip_validation, is_validate_cats):
+    """
+    `_iter_validated_rows_parallel()` helper that runs in a worker process.
+
+    :return: a 2-tuple: (rows, loc_targ_to_pred_classes) for prediction_dicts, as generated by `_iter_validated_rows()`
+    """
+    loc_targ_to_pred_classes = defaultdict(list)
+    rows = list(_iter_validated_rows(snapshot, prediction_dicts, is_skip_validation, is_validate_cats,
+                                     loc_targ_to_pred_classes))
+    return rows, loc_targ_to_pred_classes
+
+
+def _validate_loc_targ_to_pred_classes(loc_targ_to_pred_classes, is_check_named_bin=True):
+    """
+    `_validated_pred_ele_rows_for_pred_dicts()` helper that does the "prediction"-level validations.
+
+    :param loc_targ_to_pred_classes: dict that maps (unit_abbrev, target_name) 2-tuples to a list of prediction classes
+        (strs), one for each prediction dict
+    :param is_check_named_bin: False if the `Named`/`Bin` validation should be skipped
+    :raises RuntimeError: if the validations fail
+    """
+    # validate: "Within a Prediction, there cannot be more than 1 Prediction Element of the same type".
+    duplicate_unit_target_tuples = [(unit, target, pred_classes) for (unit, target), pred_classes
+                                    in loc_targ_to_pred_classes.items()
+                                    if len(pred_classes) != len(set(pred_classes))]
+    if duplicate_unit_target_tuples:
+        raise RuntimeError(f"Within a Prediction, there cannot be more than 1 Prediction Element of the same "
+                           f"class. Found these duplicate unit/target tuples: {duplicate_unit_target_tuples}")
+
+    # validate: (for both continuous and discrete target types): Within one prediction, there can be at most one of
+    # the following prediction elements, but not both: {`Named`, `Bin`}.
+    named_bin_conflict_tuples = [(unit, target, pred_classes) for (unit, target), pred_classes
+                                 in loc_targ_to_pred_classes.items()
+                                 if is_check_named_bin
+                                 and (PRED_CLASS_INT_TO_NAME[
+                                         PredictionElement.BIN_CLASS] in pred_classes)
+                                 and (PRED_CLASS_INT_TO_NAME[
+                                          PredictionElement.NAMED_CLASS] in pred_classes)]
+    if named_bin_conflict_tuples:
+        raise RuntimeError(f"Within one prediction, there can be at most one of the following prediction elements, "
+                           f"but not both: `Named`, `Bin`. Found these conflicting unit/target tuples: "
+                           f"{named_bin_conflict_tuples}")
+
+
+def _data_hash_scheme(forecast_model, time_zero):
+    """
+    Duplicate prediction elements are detected by comparing data_hashes across all versions of a forecast, which only
+    works if they all use the same hash scheme. Thus new forecasts use PredictionElement.DEFAULT_HASH_SCHEME, but new
+    versions of existing ones use the scheme of their previous versions.
+
+    :param forecast_model: a ForecastModel
+    :param time_zero: a TimeZero
+    :return: the PredictionElement *_HASH_SCHEME to use for hashing the prediction elements of forecast_model's
+        forecasts for time_zero
+    """
+    prev_data_hash = PredictionElement.objects \
+        .filter(forecast__forecast_model=forecast_model, forecast__time_zero=time_zero, is_retract=False) \
+        .values_list('data_hash', flat=True) \
+        .first()
+    return PredictionElement.hash_scheme_for_data_hash(prev_data_hash) if prev_data_hash \
+        else PredictionElement.DEFAULT_HASH_SCHEME
+
+
+def _validate_prediction_dict(prediction_dict, unit_abbrev_to_obj, target_name_to_obj, is_validate_cats,
+                              batch_validator):
+    """
+    `_validated_pred_ele_rows_for_pred_dicts()` helper that validates a single prediction_dict, except for the numeric
+    checks that are deferred to batch_validator.
+
+    :param prediction_dict: the prediction dict to validate
+    :param unit_abbrev_to_obj: dict that maps Unit abbreviations to Units (or their pks)
+    :param target_name_to_obj: dict that maps Target names to TargetValidators
+    :param is_validate_cats: same as load_predictions_from_json_io_dict()
+    :param batch_validator: a _BatchValidator that's passed bin, sample, and quantile prediction_dicts
+    :raises RuntimeError: if prediction_dict is invalid
+    """
+    unit_abbrev = prediction_dict['unit']
+    target_name = prediction_dict['target']
+    pred_class = prediction_dict['class']
+    prediction_data = prediction_dict['prediction']
+    is_retract = prediction_data is None
+
+    # validate prediction class, and unit and target names (applies to all prediction classes)
+    if unit_abbrev not in unit_abbrev_to_obj:
+        raise RuntimeError(f"prediction_dict referred to an undefined Unit. unit_abbrev={unit_abbrev!r}. "
+                           f"existing_unit_abbrevs={unit_abbrev_to_obj.keys()}")
+    elif target_name not in target_name_to_obj:
+        raise RuntimeError(f"prediction_dict referred to an undefined Target. target_name={target_name!r}. "
+                           f"existing_target_names={target_name_to_obj.keys()}")
+
+    if pred_class not in PRED_CLASS_NAME_TO_INT:
+        raise RuntimeError(f"invalid pred_class: {pred_class!r}. must be one of: "
+                           f"{list(PRED_CLASS_INT_TO_NAME.values())}. "
+                           f"prediction_dict={prediction_dict}")
+
+    # do class-specific validation
+    target = target_name_to_obj[target_name]
+    if (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.BIN_CLASS]) \
+            and not is_retract:
+        _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target, is_check_probs=False)  # raises o/w
+        batch_validator.add_bin(prediction_dict, target, is_validate_cats)
+    elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.NAMED_CLASS]) \
+            and not is_retract:
+        family_abbrev = prediction_data['family']
+        _validate_named_prediction_dict(family_abbrev, prediction_dict, target)  # raises o/w
+    elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.POINT_CLASS]) \
+            and not is_retract:
+        _validate_point_prediction_dict(prediction_dict, target, prediction_data['value'])  # raises o/w
+    elif (pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.SAMPLE_CLASS]) \
+            and not is_retract:
+        _validate_sample_prediction_dict(prediction_dict, target, is_check_range=False)  # raises o/w
+        batch_validator.add_sample(prediction_dict, target)
+    elif not is_retract:  # pred_class == PRED_CLASS_INT_TO_NAME[PredictionElement.QUANTILE_CLASS]:
+        pred_data_values = _validate_quantile_prediction_dict(prediction_dict, target,
+                                                              is_check_values=False)  # raises o/w
+        batch_validator.add_quantile(prediction_dict, target, pred_data_values)
+
+
+# max number of staged rows to buffer in memory before writing them to the staging table
+PRED_ELE_STAGING_BATCH_SIZE = 10000
+
+
+def _insert_pred_ele_rows(forecast, pred_ele_rows, is_subset_allowed, is_dups_allowed=False, is_single_statement=None,
+                          is_patch=False, stats=None):
+    """
+    Validates forecast against previous data and then loads pred_ele_rows into the PredictionElement and PredictionData
+    tables. Skips duplicate prediction elements in `forecast`'s model. For speed, we directly insert via SQL rather than
+    the ORM. We use psycopg2 extensions to the DB API if we're connected to a Postgres server. Otherwise we use
+    execute_many() as a fallback. The reason we don't simply use the latter for Postgres is because its implementation
+    is slow ( http://initd.org/psycopg/docs/extras.html#fast-execution-helpers ).
 
     :param forecast: the new, empty Forecast being inserted into
-    :param pred_ele_rows: as returned by _validated_pred_ele_rows_for_pred_dicts():
-        list of 6-tuples: (forecast_id, pred_class_int, unit_id, target_id, is_retract, data_hash)
+    :param pred_ele_rows: as returned by _validated_pred_ele_rows_for_pred_dicts(): an iterable of 7-tuples:
+        (forecast_id, pred_class_int, unit_id, target_id, is_retract, data_hash, data_json). rows are written to the
+        staging table in batches of PRED_ELE_STAGING_BATCH_SIZE as they are iterated over
     :param is_subset_allowed: controls whether `_is_pred_eles_subset_prev_versions()` is called:
         True: don't call, False: do call.
+    :param is_dups_allowed: True if pred_ele_rows might contain more than one row for the same unit, target, and
+        pred_class, which happens only when validation was skipped (i.e., truth loading)
+    :param is_single_statement: controls how staged rows are inserted: True: use
+        `_insert_staged_rows_single_statement()` (postgres only), False: use `_insert_staged_rows_multi_statement()`,
+        None: use the former if connected to postgres, or the latter o/w. passed by benchmarks
+    :param is_patch: same as load_predictions_from_json_io_dict(). if True then is_subset_allowed is ignored
+    :param stats: an optional IngestStats to record stage times and counts in. the time spent iterating over
+        pred_ele_rows is charged to 'validate' (callers charge parsing to 'parse')
     :raises RuntimeError: if forecast version is invalid
     """
+    if stats is None:
+        stats = IngestStats()
     # in order to validate and to skip inserting duplicate rows, we insert in these steps:
-    # - create a temp table with the same structure as PredictionElement
-    # - insert `pred_ele_rows` into the temp table (some might be duplicates)
-    # - validate forecast against previous data
-    # - delete duplicates from the temp table
-    # - insert the temp table into PredictionElement
+    # - create a temp table with the same structure as PredictionElement, plus PredictionData's data column
+    # - insert `pred_ele_rows` into the temp table in batches (some might be duplicates)
+    # - lock forecast's versions and validate forecast against previous data
+    # - insert the temp table's non-duplicate rows into PredictionElement, and their data into PredictionData
     # - drop the temp table
-    temp_table_name = 'pred_ele_temp'
+    temp_table_name = unique_temp_table_name('pred_ele_temp')
     pred_ele_table_name = PredictionElement._meta.db_table
+    pred_data_table_name = PredictionData._meta.db_table
 
-    # create temp table
-    with connection.cursor() as cursor:
-        cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
-
+    # create temp table. we get the data column's type (jsonb for postgres) from PredictionData
     sql = f"""
-        CREATE TEMP TABLE {temp_table_name} AS
+        CREATE TEMP TABLE {temp_table_name} {temp_table_on_commit_sql()} AS
         SELECT pred_ele.forecast_id,
                pred_ele.pred_class,
                pred_ele.unit_id,
                pred_ele.target_id,
                pred_ele.is_retract,
-               pred_ele.data_hash
+               pred_ele.data_hash,
+               pred_data.data
         FROM {pred_ele_table_name} AS pred_ele
+                 LEFT JOIN {pred_data_table_name} AS pred_data ON pred_ele.id = pred_data.pred_ele_id
         LIMIT 0;
     """
     with connection.cursor() as cursor:
         cursor.execute(sql)
 
-    # insert rows into temp table
-    columns_names = [PredictionElement._meta.get_field('forecast').column,
-                     PredictionElement._meta.get_field('pred_class').column,
-                     PredictionElement._meta.get_field('unit').column,
-                     PredictionElement._meta.get_field('target').column,
-                     PredictionElement._meta.get_field('is_retract').column,
-                     PredictionElement._meta.get_field('data_hash').column]
+    # insert rows into temp table in batches
+    num_rows = 0
+    pred_ele_rows = iter(pred_ele_rows)
+    while True:
+        with stats.stage('validate'):
+            batch_rows = list(itertools.islice(pred_ele_rows, PRED_ELE_STAGING_BATCH_SIZE))
+        if not batch_rows:
+            break
+
+        with stats.stage('stage'):
+            _insert_staging_rows(temp_table_name, batch_rows)
+        num_rows += len(batch_rows)
+        stats.add_count('num_retractions', sum(1 for row in batch_rows if row[4]))  # is_retract
+    stats.add_count('num_pred_eles_parsed', num_rows)
+
+    # validate the rule: "cannot load empty data"
+    if not num_rows:
+        raise RuntimeError(f"cannot load empty data")
+
+    # the remaining rules read previous versions, so we hold the lock from here through the inserts until our caller's
+    # transaction commits. we lock after staging so that concurrent uploads to the same model and time zero can still
+    # validate and stage in parallel
+    with stats.stage('version_rules'):
+        lock_forecast_versions(forecast.forecast_model_id, forecast.time_zero_id)
+
+        # validate the rule: "cannot load data that's a subset of previous data". patches are subsets by definition,
+        # so instead we validate them as composed with previous versions
+        if is_patch:
+            _validate_patch_composition(forecast, temp_table_name)  # raises o/w
+        elif (not is_subset_allowed) and _is_pred_eles_subset_prev_versions(forecast, temp_table_name):
+            raise RuntimeError(f"new data is a subset of previous. forecast={forecast}")
+
+    # insert the non-duplicate staged rows into PredictionElement and PredictionData
+    if is_single_statement is None:
+        is_single_statement = connection.vendor == 'postgresql'
+    if is_single_statement:
+        num_inserted = _insert_staged_rows_single_statement(forecast, temp_table_name, is_dups_allowed,
+                                                            stats)  # raises if 100% dups
+    else:
+        num_inserted = _insert_staged_rows_multi_statement(forecast, temp_table_name, is_dups_allowed, stats)  # ""
+    stats.add_count('num_pred_eles_inserted', num_inserted)
+    stats.add_count('num_dups_skipped', num_rows - num_inserted)
+
+    # keep previous versions' validity intervals and the latest table in sync while we still hold the lock
+    with stats.stage('update_validity'):
+        update_pred_ele_validity_for_forecast(forecast)
+    with stats.stage('update_latest'):
+        update_latest_pred_eles_for_forecast(forecast)
+    bump_project_data_version(forecast.forecast_model.project_id)  # invalidates cached query outputs
+
+    # drop temp table
     with connection.cursor() as cursor:
-        if connection.vendor == 'postgresql':
-            string_io = io.StringIO()
-            csv_writer = csv.writer(string_io, delimiter=',')
-            csv_writer.writerows(pred_ele_rows)
-            string_io.seek(0)
-            cursor.copy_from(string_io, temp_table_name, columns=columns_names, sep=',', null=POSTGRES_NULL_VALUE)
-        else:  # 'sqlite', etc.
-            column_names = (', '.join(columns_names))
-            values_percent_s = ', '.join(['%s'] * len(columns_names))
-            sql = f"""
-                    INSERT INTO {temp_table_name} ({column_names})
-                    VALUES ({values_percent_s});
-                    """
-            cursor.executemany(sql, pred_ele_rows)
+        cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
+
 
-    # validate the rule: "cannot load data that's a subset of previous data"
-    if (not is_subset_allowed) and _is_pred_eles_subset_prev_versions(forecast, temp_table_name):
-        raise RuntimeError(f"new data is a subset of previous. forecast={forecast}")
+def _insert_staged_rows_single_statement(forecast, temp_table_name, is_dups_allowed, stats):
+    """
+    `_insert_pred_ele_rows()` helper that inserts temp_table_name's rows into PredictionElement and PredictionData using
+    a single postgres statement. Duplicates are skipped by the PredictionElement INSERT's SELECT, and the new
+    PredictionElement ids come back via its RETURNING, which feeds the PredictionData INSERT via a data-modifying CTE.
+    Thus there is no separate DELETE of duplicates from the temp table, and no re-read of the new rows.
+
+    :param forecast: the new, empty Forecast being inserted into
+    :param temp_table_name: the staging table
+    :param is_dups_allowed: same as `_insert_pred_ele_rows()`
+    :param stats: an IngestStats. all of our time is charged to 'insert'
+    :return: the number of PredictionElements inserted
+    :raises RuntimeError: if all staged rows were duplicates. NB: the caller's transaction must be rolled back in this
+        case b/c we will have already inserted nothing
+    """
+    pred_ele_table_name = PredictionElement._meta.db_table
+    pred_data_table_name = PredictionData._meta.db_table
+    sql = f"""
+        WITH new_pred_eles AS (
+            INSERT INTO {pred_ele_table_name} (forecast_id, pred_class, unit_id, target_id, is_retract, data_hash,
+                                               valid_from)
+                SELECT %s, temp.pred_class, temp.unit_id, temp.target_id, temp.is_retract, temp.data_hash,
+                       (SELECT f.issued_at FROM {Forecast._meta.db_table} AS f WHERE f.id = %s)
+                FROM {temp_table_name} AS temp
+                WHERE NOT EXISTS(SELECT *
+                                 FROM {pred_ele_table_name} AS pred_ele
+                                          JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+                                 WHERE f.forecast_model_id = %s
+                                   AND f.time_zero_id = %s
+                                   AND temp.pred_class = pred_ele.pred_class
+                                   AND temp.unit_id = pred_ele.unit_id
+                                   AND temp.target_id = pred_ele.target_id
+                                   AND temp.is_retract = pred_ele.is_retract
+                                   AND temp.data_hash = pred_ele.data_hash)
+                RETURNING id, pred_class, unit_id, target_id, is_retract, data_hash
+        ),
+             new_pred_data AS (
+                 INSERT INTO {pred_data_table_name} (pred_ele_id, data)
+                     SELECT {'DISTINCT' if is_dups_allowed else ''} new_pred_eles.id, temp.data
+                     FROM new_pred_eles
+                              JOIN {temp_table_name} AS temp
+                                   ON new_pred_eles.pred_class = temp.pred_class
+                                       AND new_pred_eles.unit_id = temp.unit_id
+                                       AND new_pred_eles.target_id = temp.target_id
+                                       AND new_pred_eles.data_hash = temp.data_hash
+                     WHERE NOT new_pred_eles.is_retract
+                       AND NOT temp.is_retract
+                     RETURNING pred_ele_id
+             )
+        SELECT (SELECT COUNT(*) FROM new_pred_eles), (SELECT COUNT(*) FROM new_pred_data);
+    """
+    with stats.stage('insert'), connection.cursor() as cursor:
+        cursor.execute(sql, (forecast.pk, forecast.pk, forecast.forecast_model.pk, forecast.time_zero.pk))
+        num_pred_eles, _ = cursor.fetchone()
+
+    # validate the rule: "cannot load 100% duplicate data"
+    if not num_pred_eles:
+        raise RuntimeError(f"cannot load 100% duplicate data. forecast={forecast}")
+
+    return num_pred_eles
+
+
+def _insert_staged_rows_multi_statement(forecast, temp_table_name, is_dups_allowed, stats):
+    """
+    `_insert_pred_ele_rows()` helper that inserts temp_table_name's rows into PredictionElement and PredictionData using
+    separate statements. Works with any database. Args, return value, and raises are the same as
+    `_insert_staged_rows_single_statement()`, except that our time is charged to 'dedup', 'insert_pred_eles', and
+    'insert_pred_data'.
+    """
+    pred_ele_table_name = PredictionElement._meta.db_table
+    pred_data_table_name = PredictionData._meta.db_table
 
     # delete duplicates from temp table. note that we are not testing against issued_at, which would be wrong b/c
     # duplicates should be skipped if they exist in /any/ version
@@ -336,32 +1011,91 @@ def _insert_pred_ele_rows(forecast, pred_ele_rows, is_subset_allowed):
                        AND {temp_table_name}.is_retract = pred_ele.is_retract
                        AND {temp_table_name}.data_hash = pred_ele.data_hash);
     """
-    with connection.cursor() as cursor:
+    with stats.stage('dedup'), connection.cursor() as cursor:
         cursor.execute(sql, (forecast.forecast_model.pk, forecast.time_zero.pk))
 
     # validate the rule: "cannot load 100% duplicate data"
     sql = f"""
         SELECT NOT EXISTS(SELECT * FROM {temp_table_name});
      """
-    with connection.cursor() as cursor:
+    with stats.stage('dedup'), connection.cursor() as cursor:
         cursor.execute(sql)
         is_empty = cursor.fetchone()[0]
-        if is_empty:
-            raise RuntimeError(f"cannot load 100% duplicate data. forecast={forecast}")
+    if is_empty:
+        raise RuntimeError(f"cannot load 100% duplicate data. forecast={forecast}")
 
-    # step 5/6: insert temp table into PredictionElement
+    # insert temp table into PredictionElement. valid_from comes from the database so that it's in the same form as
+    # issued_at (see `update_pred_ele_validity_for_forecast()`)
     sql = f"""
         INSERT INTO {pred_ele_table_name} AS pred_ele (forecast_id, pred_class, unit_id, target_id,
-                                                       is_retract, data_hash)
-        SELECT %s, pred_class, unit_id, target_id, is_retract, data_hash
+                                                       is_retract, data_hash, valid_from)
+        SELECT %s, pred_class, unit_id, target_id, is_retract, data_hash,
+               (SELECT f.issued_at FROM {Forecast._meta.db_table} AS f WHERE f.id = %s)
         FROM {temp_table_name};
     """
-    with connection.cursor() as cursor:
+    with stats.stage('insert_pred_eles'), connection.cursor() as cursor:
+        cursor.execute(sql, (forecast.pk, forecast.pk,))
+        num_pred_eles = cursor.rowcount
+
+    # insert temp table's data into PredictionData. the join is unique unless dups are allowed, in which case DISTINCT
+    # collapses rows for identical duplicate prediction elements (same data_hash)
+    sql = f"""
+        INSERT INTO {pred_data_table_name} (pred_ele_id, data)
+        SELECT {'DISTINCT' if is_dups_allowed else ''} pred_ele.id, temp.data
+        FROM {pred_ele_table_name} AS pred_ele
+                 JOIN {temp_table_name} AS temp
+                      ON pred_ele.pred_class = temp.pred_class
+                          AND pred_ele.unit_id = temp.unit_id
+                          AND pred_ele.target_id = temp.target_id
+                          AND pred_ele.data_hash = temp.data_hash
+        WHERE pred_ele.forecast_id = %s
+          AND NOT pred_ele.is_retract
+          AND NOT temp.is_retract;
+    """
+    with stats.stage('insert_pred_data'), connection.cursor() as cursor:
         cursor.execute(sql, (forecast.pk,))
 
-    # drop temp table
+    return num_pred_eles
+
+
+def _insert_staging_rows(temp_table_name, rows):
+    """
+    `_insert_pred_ele_rows()` helper that inserts one batch of rows into the staging table.
+
+    :param temp_table_name: the staging table
+    :param rows: list of 7-tuples as documented in `_insert_pred_ele_rows()`
+    """
+    columns_names = [PredictionElement._meta.get_field('forecast').column,
+                     PredictionElement._meta.get_field('pred_class').column,
+                     PredictionElement._meta.get_field('unit').column,
+                     PredictionElement._meta.get_field('target').column,
+                     PredictionElement._meta.get_field('is_retract').column,
+                     PredictionElement._meta.get_field('data_hash').column,
+                     PredictionData._meta.get_field('data').column]
     with connection.cursor() as cursor:
-        cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
+        if connection.vendor == 'postgresql':
+            # bulk insert via COPY FROM. to avoid possible problems with CSV quoting and delimiters, we follow this
+            # advice: http://adpgtech.blogspot.com/2014/09/importing-json-data.html :
+            #   There is a small set of single-byte characters that happen to be illegal in JSON: e'\x01' and e'\x02'
+            # NB: we pass an explicit NULL string so that retractions' '' data_hashes are not read as NULLs
+            string_io = io.StringIO()
+            csv_writer = csv.writer(string_io, quotechar=chr(1), delimiter=chr(2))
+            csv_writer.writerows(row[:-1] + (row[-1] if row[-1] is not None else POSTGRES_NULL_VALUE,)
+                                 for row in rows)
+            string_io.seek(0)
+            sql = f"""
+                COPY {temp_table_name}({', '.join(columns_names)}) FROM STDIN
+                WITH CSV QUOTE e'\x01' DELIMITER e'\x02' NULL '{POSTGRES_NULL_VALUE}';
+            """
+            cursor.copy_expert(sql, string_io)
+        else:  # 'sqlite', etc.
+            column_names = (', '.join(columns_names))
+            values_percent_s = ', '.join(['%s'] * len(columns_names))
+            sql = f"""
+                    INSERT INTO {temp_table_name} ({column_names})
+                    VALUES ({values_percent_s});
+                    """
+            cursor.executemany(sql, rows)
 
 
 def _is_pred_eles_subset_prev_versions(forecast, temp_table_name):
@@ -392,7 +1126,73 @@ def _is_pred_eles_subset_prev_versions(forecast, temp_table_name):
         return is_subset
 
 
-def _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target):
+def _validate_patch_composition(forecast, temp_table_name):
+    """
+    Validates a patch version (see load_predictions_from_json_io_dict()'s `is_patch`) as composed with previous
+    versions, i.e., the latest non-retracted prediction elements of previous versions that are not replaced by the
+    patch, plus the patch's non-retracted ones. Validates: (for both continuous and discrete target types): Within one
+    prediction, there can be at most one of the following prediction elements, but not both: {`Named`, `Bin`}. (The
+    rule "Within a Prediction, there cannot be more than 1 Prediction Element of the same type" holds for any
+    composition of valid versions.)
+
+    :param forecast: the new, empty Forecast being inserted into
+    :param temp_table_name: contains `forecast`'s candidate prediction elements
+    :raises RuntimeError: if the composition is invalid
+    """
+    sql = f"""
+        WITH ranked_rows AS (
+            SELECT pred_ele.unit_id    AS unit_id,
+                   pred_ele.target_id  AS target_id,
+                   pred_ele.pred_class AS pred_class,
+                   pred_ele.is_retract AS is_retract,
+                   RANK() OVER (
+                       PARTITION BY pred_ele.unit_id, pred_ele.target_id, pred_ele.pred_class
+                       ORDER BY f.issued_at DESC) AS rownum
+            FROM {PredictionElement._meta.db_table} AS pred_ele
+                     JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+            WHERE f.forecast_model_id = %s
+              AND f.time_zero_id = %s
+              AND f.issued_at < %s
+        ),
+             composed_rows AS (
+                 SELECT ranked_rows.unit_id, ranked_rows.target_id, ranked_rows.pred_class
+                 FROM ranked_rows
+                 WHERE ranked_rows.rownum = 1
+                   AND NOT ranked_rows.is_retract
+                   AND NOT EXISTS(SELECT *
+                                  FROM {temp_table_name} AS temp
+                                  WHERE temp.unit_id = ranked_rows.unit_id
+                                    AND temp.target_id = ranked_rows.target_id
+                                    AND temp.pred_class = ranked_rows.pred_class)
+                 UNION ALL
+                 SELECT temp.unit_id, temp.target_id, temp.pred_class
+                 FROM {temp_table_name} AS temp
+                 WHERE NOT temp.is_retract
+             )
+        SELECT unit.abbreviation, target.name
+        FROM composed_rows
+                 JOIN {Unit._meta.db_table} AS unit ON composed_rows.unit_id = unit.id
+                 JOIN {Target._meta.db_table} AS target ON composed_rows.target_id = target.id
+        WHERE composed_rows.pred_class IN (%s, %s)
+        GROUP BY unit.abbreviation, target.name
+        HAVING COUNT(DISTINCT composed_rows.pred_class) = 2
+        ORDER BY unit.abbreviation, target.name;
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (forecast.forecast_model.pk, forecast.time_zero.pk, forecast.issued_at,
+                             PredictionElement.BIN_CLASS, PredictionElement.NAMED_CLASS))
+        named_bin_conflict_tuples = cursor.fetchall()
+    if named_bin_conflict_tuples:
+        raise RuntimeError(f"Within one prediction, there can be at most one of the following prediction elements, "
+                           f"but not both: `Named`, `Bin`. Found these conflicting unit/target tuples in the patch as "
+                           f"composed with previous versions: {named_bin_conflict_tuples}")
+
+
+def _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target, is_check_probs=True):
+    """
+    :param is_check_probs: False if the checks of `prob` values (as opposed to their types) should be skipped b/c the
+        caller checks them via `_BatchValidator`
+    """
     prediction_data = prediction_dict['prediction']
 
     # validate: "The number of elements in the `cat` and `prob` vectors should be identical"
@@ -419,7 +1219,7 @@ def _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target):
 
     # validate: "Entries in `cat` must be a subset of `Target.cats` from the target definition".
     # note: for date targets we format as strings for the comparison (incoming are strings)
-    cats_values = set(target.cats_values())  # datetime.date instances for date targets
+    cats_values = target.cats_values_set  # datetime.date instances for date targets
     pred_data_cat_parsed = [datetime.datetime.strptime(cat, YYYY_MM_DD_DATE_FORMAT).date()
                             for cat in prediction_data['cat']] \
         if target.type == Target.DATE_TARGET_TYPE else prediction_data['cat']  # valid - see is_all_compatible above
@@ -434,14 +1234,14 @@ def _validate_bin_prediction_dict(is_validate_cats, prediction_dict, target):
         raise RuntimeError(f"wrong data type in `prob` column, which should only contain "
                            f"ints or floats. prob column={prediction_data['prob']}, prob_types_set={prob_types_set}, "
                            f"prediction_dict={prediction_dict}")
-    elif (min(prediction_data['prob']) < 0.0) or (max(prediction_data['prob']) > 1.0):
+    elif is_check_probs and ((min(prediction_data['prob']) < 0.0) or (max(prediction_data['prob']) > 1.0)):
         raise RuntimeError(f"Entries in the database rows in the `prob` column must be numbers in [0, 1]. "
                            f"prob column={prediction_data['prob']}, prediction_dict={prediction_dict}")
 
     # validate: "For one prediction element, the values within prob must sum to 1.0 (values within +/- 0.001 of
     # 1 are acceptable)"
     prob_sum = sum(prediction_data['prob'])
-    if not math.isclose(1.0, prob_sum, rel_tol=BIN_SUM_REL_TOL):
+    if is_check_probs and not math.isclose(1.0, prob_sum, rel_tol=BIN_SUM_REL_TOL):
         raise RuntimeError(f"For one prediction element, the values within prob must sum to 1.0. "
                            f"prob_sum={prob_sum}, delta={abs(1 - prob_sum)}, rel_tol={BIN_SUM_REL_TOL}, "
                            f"prediction_dict={prediction_dict}")
@@ -466,7 +1266,7 @@ def _validate_named_prediction_dict(family_abbrev, prediction_dict, target):
 
     # validate: "The Prediction's class must be valid for its target's type". note that only named and quantile
     # predictions are constrained; all other target_type/prediction_class combinations are valid
-    if not Target.is_valid_named_family_for_target_type(family_abbrev, target.type):
+    if not target.is_valid_named_family(family_abbrev):
         raise RuntimeError(f"family {family_abbrev!r} is not valid for {target.type_as_str()!r} "
                            f"target types. prediction_dict={prediction_dict}")
 
@@ -530,7 +1330,10 @@ def _validate_point_prediction_dict(prediction_dict, target, value):
                            f"prediction_dict={prediction_dict}")
 
 
-def _validate_sample_prediction_dict(prediction_dict, target):
+def _validate_sample_prediction_dict(prediction_dict, target, is_check_range=True):
+    """
+    :param is_check_range: False if the `range` check should be skipped b/c the caller checks it via `_BatchValidator`
+    """
     prediction_data = prediction_dict['prediction']
 
     # validate: "Entries in the database rows in the `sample` column cannot be `“”`, `“NA”` or `NULL` (case does
@@ -554,7 +1357,7 @@ def _validate_sample_prediction_dict(prediction_dict, target):
     # within `range`". recall: "The range is assumed to be inclusive on the lower bound and open on the upper bound,
     # e.g. [a, b)."
     range_tuple = target.range_tuple()
-    if range_tuple:
+    if is_check_range and range_tuple:
         is_all_in_range = all([range_tuple[0] <= sample < range_tuple[1] for sample in prediction_data['sample']])
         if not is_all_in_range:
             raise RuntimeError(f"if `range` is specified, any values in `Sample` Prediction Elements should be "
@@ -565,12 +1368,17 @@ def _validate_sample_prediction_dict(prediction_dict, target):
 def _le_with_tolerance(a, b):  # a <= b ?
     # `_validate_quantile_prediction_dict()` helper
     if type(a) in {int, float}:
-        return True if math.isclose(a, b, rel_tol=1e-05) else a <= b  # default: rel_tol=1e-09
+        return True if math.isclose(a, b, rel_tol=QUANTILE_VALUE_REL_TOL) else a <= b  # default: rel_tol=1e-09
     else:  # date
         return a <= b
 
 
-def _validate_quantile_prediction_dict(prediction_dict, target):
+def _validate_quantile_prediction_dict(prediction_dict, target, is_check_values=True):
+    """
+    :param is_check_values: False if the `quantile` bounds and uniqueness checks and the `value` monotonicity and
+        `range` checks should be skipped b/c the caller checks them via `_BatchValidator`
+    :return: the prediction's `value` list, parsed to datetime.date instances for date targets
+    """
     prediction_data = prediction_dict['prediction']
 
     # validate: "The Prediction's class must be valid for its target's type". note that only named and quantile
@@ -588,7 +1396,10 @@ def _validate_quantile_prediction_dict(prediction_dict, target):
                            f"prediction_dict={prediction_dict}")
 
     # validate the quantile list (two validations)
-    _validate_quantile_list(pred_data_quantiles)
+    try:
+        _validate_quantile_list(pred_data_quantiles, is_check_values)
+    except RuntimeError as rte:
+        raise RuntimeError(f"{rte.args[0]}. prediction_dict={prediction_dict}")
 
     # validate: "The data format of `value` should correspond or be translatable to the `type` as in the target
     # definition."
@@ -605,6 +1416,8 @@ def _validate_quantile_prediction_dict(prediction_dict, target):
     pred_data_values = [datetime.datetime.strptime(value, YYYY_MM_DD_DATE_FORMAT).date()
                         for value in pred_data_values] \
         if target.type == Target.DATE_TARGET_TYPE else pred_data_values  # valid - see is_all_compatible above
+    if not is_check_values:
+        return pred_data_values
 
     # per https://stackoverflow.com/questions/7558908/unpacking-a-list-tuple-of-pairs-into-two-lists-tuples
     pred_data_quantiles, pred_data_values = zip(*sorted(zip(pred_data_quantiles, pred_data_values), key=lambda _: _[0]))
@@ -624,11 +1437,15 @@ def _validate_quantile_prediction_dict(prediction_dict, target):
             raise RuntimeError(f"Entries in `value` must obey existing ranges for targets. range_tuple={range_tuple}, "
                                f"pred_data_values={pred_data_values}, prediction_dict={prediction_dict}")
 
+    return pred_data_values
+
 
-def _validate_quantile_list(quantile_list):
+def _validate_quantile_list(quantile_list, is_check_values=True):
     """
     `_validate_quantile_prediction_dict()` helper. a separate function so other apps can validate, specifically
     `validate_forecasts_query()`.
+
+    :param is_check_values: False if only the list's type and its values' types should be checked
     """
     if (not isinstance(quantile_list, list)) or (not quantile_list):
         raise RuntimeError(f"quantile_list was not a non-empty list. quantile_list={quantile_list}, "
@@ -639,6 +1456,8 @@ def _validate_quantile_list(quantile_list):
     if not (quantile_types_set <= {int, float}):
         raise RuntimeError(f"wrong data type in `quantile` column, which should only contain ints or floats. "
                            f"quantile_list={quantile_list}, quantile_types_set={quantile_types_set}")
+    elif not is_check_values:
+        return
     elif (min(quantile_list) < 0.0) or (max(quantile_list) > 1.0):
         raise RuntimeError(f"Entries in the database rows in the `quantile` column must be numbers in [0, 1]. "
                            f"quantile_list={quantile_list}")
@@ -648,41 +1467,467 @@ def _validate_quantile_list(quantile_list):
         raise RuntimeError(f"`quantile`s must be unique. quantile_list={quantile_list}")
 
 
-def _insert_pred_data_rows(rows):
+#
+# _BatchValidator
+#
+
+class _BatchValidator:
+    """
+    Does the numeric checks of bin, sample, and quantile prediction dicts in batches using NumPy rather than one
+    prediction dict at a time. Prediction dicts are added via the `add_*()` methods after their non-numeric checks pass,
+    and are then all checked at once by `validate()`. Prediction dicts of the same class with the same number of values
+    are stacked into a 2D array so that each check is a handful of array operations over the whole group.
+
+    When a check fails, `validate()` picks the first offending prediction dict (in the order added) and re-runs the
+    corresponding `_validate_*_prediction_dict()` on it, which raises the same error (including the prediction dict)
+    that one-at-a-time validation would have.
+
+    The checks are:
+    - bin: `prob`s are in [0, 1] and sum to 1.0 (within BIN_SUM_REL_TOL)
+    - sample: `sample`s are within the target's range (if any)
+    - quantile: `quantile`s are in [0, 1] and are unique, `value`s are non-decreasing as quantiles increase (within
+      QUANTILE_VALUE_REL_TOL for non-date targets), and `value`s are within the target's range (if any)
+    """
+
+
+    def __init__(self):
+        self.num_added = 0  # used for the order of prediction dicts across classes
+        self.bin_entries = []  # 4-tuples: (order, prediction_dict, target, is_validate_cats)
+        self.sample_entries = []  # 3-tuples: (order, prediction_dict, target)
+        self.quantile_entries = []  # 4-tuples: (order, prediction_dict, target, pred_data_values)
+
+
+    def add_bin(self, prediction_dict, target, is_validate_cats):
+        self.bin_entries.append((self.num_added, prediction_dict, target, is_validate_cats))
+        self.num_added += 1
+
+
+    def add_sample(self, prediction_dict, target):
+        if target.range_tuple():  # the only check is the range one
+            self.sample_entries.append((self.num_added, prediction_dict, target))
+        self.num_added += 1
+
+
+    def add_quantile(self, prediction_dict, target, pred_data_values):
+        """
+        :param pred_data_values: as returned by `_validate_quantile_prediction_dict()`, i.e., parsed to dates for date
+            targets
+        """
+        self.quantile_entries.append((self.num_added, prediction_dict, target, pred_data_values))
+        self.num_added += 1
+
+
+    def validate(self):
+        """
+        Checks all added prediction dicts and then clears them.
+
+        :raises RuntimeError: if any are invalid
+        """
+        try:
+            invalid_entries = [entries[idx] for entries, idx
+                               in [(self.bin_entries, self._first_invalid_bin_idx()),
+                                   (self.sample_entries, self._first_invalid_sample_idx()),
+                                   (self.quantile_entries, self._first_invalid_quantile_idx())]
+                               if idx is not None]
+            if invalid_entries:
+                invalid_entry = min(invalid_entries, key=lambda _: _[0])  # first added
+                prediction_dict, target = invalid_entry[1], invalid_entry[2]
+                if prediction_dict['class'] == PRED_CLASS_INT_TO_NAME[PredictionElement.BIN_CLASS]:
+                    _validate_bin_prediction_dict(invalid_entry[3], prediction_dict, target)
+                elif prediction_dict['class'] == PRED_CLASS_INT_TO_NAME[PredictionElement.SAMPLE_CLASS]:
+                    _validate_sample_prediction_dict(prediction_dict, target)
+                else:
+                    _validate_quantile_prediction_dict(prediction_dict, target)
+                raise RuntimeError(f"invalid prediction_dict values. prediction_dict={prediction_dict}")  # shouldn't
+        finally:
+            self.num_added = 0
+            self.bin_entries.clear()
+            self.sample_entries.clear()
+            self.quantile_entries.clear()
+
+
+    @staticmethod
+    def _first_invalid_idx(entries, values_fcn, is_invalid_fcn):
+        """
+        Helper that groups entries by number of values, checks each group, and returns the index of the first entry
+        (by add order) that fails, or None if all pass.
+
+        :param entries: a list of *_entries tuples
+        :param values_fcn: a function of an entry that returns a tuple of equal-length value lists
+        :param is_invalid_fcn: a function that's passed a list of a group's entries and a 2D array for each of
+            values_fcn()'s lists, and returns a 1D bool array of which entries are invalid
+        """
+        len_to_idxs = defaultdict(list)
+        entry_values = []
+        for idx, entry in enumerate(entries):
+            values = values_fcn(entry)
+            entry_values.append(values)
+            len_to_idxs[len(values[0])].append(idx)
+
+        first_idx = None
+        for idxs in len_to_idxs.values():
+            group_entries = [entries[idx] for idx in idxs]
+            group_arrays = [numpy.array([entry_values[idx][array_idx] for idx in idxs], dtype=float)
+                            for array_idx in range(len(entry_values[idxs[0]]))]
+            is_invalid = is_invalid_fcn(group_entries, *group_arrays)
+            if is_invalid.any():
+                group_first_idx = idxs[int(numpy.argmax(is_invalid))]
+                first_idx = group_first_idx if first_idx is None else min(first_idx, group_first_idx)
+        return first_idx
+
+
+    def _first_invalid_bin_idx(self):
+        def is_invalid_fcn(group_entries, probs):
+            prob_sums = probs.sum(axis=1)
+            return ((probs < 0.0) | (probs > 1.0)).any(axis=1) \
+                   | ~(numpy.abs(1.0 - prob_sums) <= BIN_SUM_REL_TOL * numpy.maximum(1.0, numpy.abs(prob_sums)))
+
+
+        return self._first_invalid_idx(self.bin_entries, lambda entry: (entry[1]['prediction']['prob'],),
+                                       is_invalid_fcn)
+
+
+    def _first_invalid_sample_idx(self):
+        def is_invalid_fcn(group_entries, samples):
+            lowers, uppers = _range_columns(group_entries)
+            return ((samples < lowers) | (samples >= uppers)).any(axis=1)
+
+
+        return self._first_invalid_idx(self.sample_entries, lambda entry: (entry[1]['prediction']['sample'],),
+                                       is_invalid_fcn)
+
+
+    def _first_invalid_quantile_idx(self):
+        def values_fcn(entry):
+            # dates are compared as ordinals
+            pred_data_values = [value.toordinal() for value in entry[3]] \
+                if entry[2].type == Target.DATE_TARGET_TYPE else entry[3]
+            return entry[1]['prediction']['quantile'], pred_data_values
+
+
+        def is_invalid_fcn(group_entries, quantiles, values):
+            is_invalid = ((quantiles < 0.0) | (quantiles > 1.0)).any(axis=1)
+
+            # sort each row by quantile (stable, like `sorted()`), then test uniqueness and monotonicity
+            sort_idxs = numpy.argsort(quantiles, axis=1, kind='stable')
+            quantiles = numpy.take_along_axis(quantiles, sort_idxs, axis=1)
+            values = numpy.take_along_axis(values, sort_idxs, axis=1)
+            is_invalid |= (numpy.diff(quantiles, axis=1) == 0).any(axis=1)
+
+            # same as `_le_with_tolerance()`, which uses a symmetric relative tolerance for non-dates
+            rel_tols = numpy.array([[0.0 if entry[2].type == Target.DATE_TARGET_TYPE else QUANTILE_VALUE_REL_TOL]
+                                    for entry in group_entries])
+            values_a, values_b = values[:, :-1], values[:, 1:]
+            is_le = (values_a <= values_b) \
+                    | (numpy.abs(values_a - values_b) <= rel_tols * numpy.maximum(numpy.abs(values_a),
+                                                                                 numpy.abs(values_b)))
+            is_invalid |= ~is_le.all(axis=1)
+
+            lowers, uppers = _range_columns(group_entries)
+            is_invalid |= ((values < lowers) | (values >= uppers)).any(axis=1)
+            return is_invalid
+
+
+        return self._first_invalid_idx(self.quantile_entries, values_fcn, is_invalid_fcn)
+
+
+def _range_columns(entries):
     """
-    Does the actual INSERT of rows into the database table corresponding to pred_data_class. For speed, we directly
-    insert via SQL rather than the ORM. We use psycopg2 extensions to the DB API if we're connected to a Postgres
-    server. Otherwise we use execute_many() as a fallback. The reason we don't simply use the latter for Postgres
-    is because its implementation is slow ( http://initd.org/psycopg/docs/extras.html#fast-execution-helpers ).
+    `_BatchValidator` helper.
 
-    :param rows: list of 2-tuples: (pred_ele_id, prediction_data), where pred_ele_id is a PredictionElement.pk, and
-        prediction_data is the "raw" prediction_data dict, i.e., the prediction_element dict's "prediction" dict.
+    :param entries: a list of *_entries tuples whose third item is a TargetValidator
+    :return: 2-tuple of column arrays: (lowers, uppers) containing each entry's target range. -inf and inf are used for
+        entries whose target has no range
+    """
+    range_tuples = [entry[2].range_tuple() or (-math.inf, math.inf) for entry in entries]
+    return numpy.array([[lower] for lower, _ in range_tuples], dtype=float), \
+           numpy.array([[upper] for _, upper in range_tuples], dtype=float)
+
+
+#
+# PredictionElement validity maintenance
+#
+
+def update_pred_ele_validity_for_forecast(forecast):
+    """
+    Updates the `valid_to` of previous versions' PredictionElements that are superseded or retracted by ones that were
+    just inserted into forecast by `_insert_pred_ele_rows()`, which set their `valid_from`. In the usual case forecast
+    is its version's newest, so its new rows end the intervals of older versions' open ones with the same (unit,
+    target, pred_class), and are themselves open. O/w (forecast was created empty before a newer version was loaded) we
+    recompute forecast's version from scratch. Callers must hold forecast's version lock.
+
+    :param forecast: a Forecast whose PredictionElements were just inserted
+    """
+    if not _is_newest_non_empty_version(forecast):
+        rebuild_pred_ele_validity_for_version(forecast.forecast_model_id, forecast.time_zero_id)
+        return
+
+    pred_ele_table_name = PredictionElement._meta.db_table
+    forecast_table_name = Forecast._meta.db_table
+    sql = f"""
+        UPDATE {pred_ele_table_name}
+        SET valid_to = (SELECT f.issued_at FROM {forecast_table_name} AS f WHERE f.id = %s)
+        WHERE {pred_ele_table_name}.valid_to IS NULL
+          AND {pred_ele_table_name}.forecast_id IN (SELECT f.id
+                                                    FROM {forecast_table_name} AS f
+                                                    WHERE f.forecast_model_id = %s
+                                                      AND f.time_zero_id = %s
+                                                      AND f.id != %s)
+          AND EXISTS(SELECT *
+                     FROM {pred_ele_table_name} AS new_pred_ele
+                     WHERE new_pred_ele.forecast_id = %s
+                       AND new_pred_ele.unit_id = {pred_ele_table_name}.unit_id
+                       AND new_pred_ele.target_id = {pred_ele_table_name}.target_id
+                       AND new_pred_ele.pred_class = {pred_ele_table_name}.pred_class);
     """
-    # serialize to json. NB: assumes no CR or LFs in dicts!
-    rows = [(idx, json.dumps(pred_data)) for idx, pred_data in rows]
-    table_name = PredictionData._meta.db_table
-    columns_names = PredictionData._meta.get_field('pred_ele').column, PredictionData._meta.get_field('data').column
     with connection.cursor() as cursor:
-        if connection.vendor == 'postgresql':
-            # bulk insert via COPY FROM. to avoid possible problems with CSV quoting and delimiters, we follow this
-            # advice: http://adpgtech.blogspot.com/2014/09/importing-json-data.html :
-            #   There is a small set of single-byte characters that happen to be illegal in JSON: e'\x01' and e'\x02'
-            string_io = io.StringIO()
-            csv_writer = csv.writer(string_io, quotechar=chr(1), delimiter=chr(2))
-            csv_writer.writerows(rows)
-            string_io.seek(0)
-            sql = f"""
-                COPY {table_name}({', '.join(columns_names)}) FROM STDIN WITH CSV QUOTE e'\x01' DELIMITER e'\x02';
-            """
-            cursor.copy_expert(sql, string_io)
-        else:  # 'sqlite', etc.
-            column_names = (', '.join(columns_names))
-            values_percent_s = ', '.join(['%s'] * len(columns_names))
-            sql = f"""
-                    INSERT INTO {table_name} ({column_names})
-                    VALUES ({values_percent_s});
-                    """
-            cursor.executemany(sql, rows)
+        cursor.execute(sql, (forecast.pk, forecast.forecast_model_id, forecast.time_zero_id, forecast.pk,
+                             forecast.pk,))
+
+
+def update_pred_ele_validity_for_deleted_forecast(forecast):
+    """
+    Re-opens the intervals that forecast ended. Called after forecast is deleted. This works b/c of the rule "you
+    cannot delete a forecast that has any newer versions", i.e., forecast was its version's newest.
+
+    :param forecast: a just-deleted Forecast
+    """
+    pred_ele_table_name = PredictionElement._meta.db_table
+    sql = f"""
+        UPDATE {pred_ele_table_name}
+        SET valid_to = NULL
+        WHERE {pred_ele_table_name}.valid_to = %s
+          AND {pred_ele_table_name}.forecast_id IN (SELECT f.id
+                                                    FROM {Forecast._meta.db_table} AS f
+                                                    WHERE f.forecast_model_id = %s
+                                                      AND f.time_zero_id = %s);
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (connection.ops.adapt_datetimefield_value(forecast.issued_at),
+                             forecast.forecast_model_id, forecast.time_zero_id,))
+
+
+def update_pred_ele_validity_for_issued_at(forecast, old_issued_at):
+    """
+    Moves forecast's intervals' ends from old_issued_at to forecast.issued_at. Called when a forecast's issued_at is
+    edited, which cannot change the versions' order (see the rule "editing a version's issued_at cannot reposition it
+    before any existing forecasts"). Thus the same intervals start and end at forecast; only the time changes.
+
+    :param forecast: a Forecast whose issued_at is being changed
+    :param old_issued_at: forecast's issued_at before the change
+    """
+    pred_ele_table_name = PredictionElement._meta.db_table
+    new_issued_at = connection.ops.adapt_datetimefield_value(forecast.issued_at)
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {pred_ele_table_name} SET valid_from = %s WHERE forecast_id = %s;",
+                       (new_issued_at, forecast.pk,))
+        cursor.execute(f"""
+            UPDATE {pred_ele_table_name}
+            SET valid_to = %s
+            WHERE {pred_ele_table_name}.valid_to = %s
+              AND {pred_ele_table_name}.forecast_id IN (SELECT f.id
+                                                        FROM {Forecast._meta.db_table} AS f
+                                                        WHERE f.forecast_model_id = %s
+                                                          AND f.time_zero_id = %s
+                                                          AND f.id != %s);
+        """, (new_issued_at, connection.ops.adapt_datetimefield_value(old_issued_at), forecast.forecast_model_id,
+              forecast.time_zero_id, forecast.pk,))
+
+
+def rebuild_pred_ele_validity_for_version(forecast_model_id, time_zero_id):
+    """
+    Recomputes `valid_from` and `valid_to` for all of the PredictionElements of the version identified by
+    (forecast_model_id, time_zero_id).
+
+    :param forecast_model_id: a ForecastModel's pk
+    :param time_zero_id: a TimeZero's pk
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(PRED_ELE_VALIDITY_UPDATE_SQL.format(
+            pred_ele_table_name=PredictionElement._meta.db_table, forecast_table_name=Forecast._meta.db_table,
+            where_clause='forecast_model_id = %s AND time_zero_id = %s'), (forecast_model_id, time_zero_id,))
+
+
+# SQL that recomputes the validity intervals of the prediction elements of the forecasts matching `where_clause` (an
+# expression over Forecast's columns). NB: a copy of this is in migration 0023
+PRED_ELE_VALIDITY_UPDATE_SQL = """
+    UPDATE {pred_ele_table_name}
+    SET valid_from = (SELECT f.issued_at FROM {forecast_table_name} AS f WHERE f.id = {pred_ele_table_name}.forecast_id),
+        valid_to   = (SELECT MIN(newer_f.issued_at)
+                      FROM {pred_ele_table_name} AS newer_pred_ele
+                               JOIN {forecast_table_name} AS newer_f ON newer_pred_ele.forecast_id = newer_f.id
+                               JOIN {forecast_table_name} AS f ON f.id = {pred_ele_table_name}.forecast_id
+                      WHERE newer_f.forecast_model_id = f.forecast_model_id
+                        AND newer_f.time_zero_id = f.time_zero_id
+                        AND newer_f.issued_at > f.issued_at
+                        AND newer_pred_ele.unit_id = {pred_ele_table_name}.unit_id
+                        AND newer_pred_ele.target_id = {pred_ele_table_name}.target_id
+                        AND newer_pred_ele.pred_class = {pred_ele_table_name}.pred_class)
+    WHERE {pred_ele_table_name}.forecast_id IN (SELECT id FROM {forecast_table_name} WHERE {where_clause});
+"""
+
+
+def _is_newest_non_empty_version(forecast):
+    """
+    :return: True if forecast's version has no other non-empty forecasts with the same or a newer issued_at
+    """
+    return not Forecast.objects \
+        .filter(forecast_model_id=forecast.forecast_model_id, time_zero_id=forecast.time_zero_id,
+                issued_at__gte=forecast.issued_at, pred_eles__isnull=False) \
+        .exclude(pk=forecast.pk) \
+        .exists()
+
+
+#
+# LatestPredictionElement maintenance
+#
+
+def update_latest_pred_eles_for_forecast(forecast):
+    """
+    Updates the LatestPredictionElement table to reflect PredictionElements that were just inserted into forecast by
+    `_insert_pred_ele_rows()`. In the usual case forecast is its version's newest, so its new rows mask previous
+    versions' ones with the same (unit, target, pred_class), and its retractions mask them without replacing them.
+    Recall that rows that duplicate previous versions' are not inserted, which means previous versions' rows correctly
+    remain latest for them. If there is a non-empty version that's not older than forecast (possible only if forecast
+    was created empty before it) then we instead rebuild forecast's version from scratch. Callers must hold forecast's
+    version lock (see `lock_forecast_versions()`).
+
+    NB: Editing an existing forecast's issued_at does not require an update b/c the rule "editing a version's issued_at
+    cannot reposition it before any existing forecasts" means that the versions' order does not change.
+
+    :param forecast: a Forecast whose PredictionElements were just inserted
+    """
+    if not _is_newest_non_empty_version(forecast):
+        rebuild_latest_pred_eles_for_version(forecast.forecast_model_id, forecast.time_zero_id)
+        return
+
+    latest_table_name = LatestPredictionElement._meta.db_table
+    pred_ele_table_name = PredictionElement._meta.db_table
+    delete_sql = f"""
+        DELETE
+        FROM {latest_table_name}
+        WHERE {latest_table_name}.forecast_model_id = %s
+          AND {latest_table_name}.time_zero_id = %s
+          AND EXISTS(SELECT *
+                     FROM {pred_ele_table_name} AS pred_ele
+                     WHERE pred_ele.forecast_id = %s
+                       AND pred_ele.unit_id = {latest_table_name}.unit_id
+                       AND pred_ele.target_id = {latest_table_name}.target_id
+                       AND pred_ele.pred_class = {latest_table_name}.pred_class);
+    """
+    insert_sql = f"""
+        INSERT INTO {latest_table_name} (forecast_model_id, time_zero_id, unit_id, target_id, pred_class, pred_ele_id)
+        SELECT %s, %s, pred_ele.unit_id, pred_ele.target_id, pred_ele.pred_class, pred_ele.id
+        FROM {pred_ele_table_name} AS pred_ele
+        WHERE pred_ele.forecast_id = %s
+          AND NOT pred_ele.is_retract;
+    """
+    with connection.cursor() as cursor:
+        params = (forecast.forecast_model_id, forecast.time_zero_id, forecast.pk,)
+        cursor.execute(delete_sql, params)
+        cursor.execute(insert_sql, params)
+
+
+def rebuild_latest_pred_eles_for_version(forecast_model_id, time_zero_id):
+    """
+    Replaces the LatestPredictionElement rows for the version identified by (forecast_model_id, time_zero_id) with ones
+    computed from all of its forecasts. Called after a forecast is deleted, and when an update cannot be done
+    incrementally.
+
+    :param forecast_model_id: a ForecastModel's pk
+    :param time_zero_id: a TimeZero's pk
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {LatestPredictionElement._meta.db_table} "
+                       f"WHERE forecast_model_id = %s AND time_zero_id = %s;", (forecast_model_id, time_zero_id,))
+        cursor.execute(_latest_pred_eles_insert_sql("f.forecast_model_id = %s AND f.time_zero_id = %s"),
+                       (forecast_model_id, time_zero_id,))
+
+
+@transaction.atomic
+def rebuild_latest_pred_eles_for_project(project):
+    """
+    Replaces all of project's LatestPredictionElement rows with ones computed from all of its forecasts.
+
+    :param project: a Project
+    :return: the number of rows inserted
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            DELETE
+            FROM {LatestPredictionElement._meta.db_table}
+            WHERE forecast_model_id IN (SELECT fm.id FROM {ForecastModel._meta.db_table} AS fm WHERE fm.project_id = %s);
+        """, (project.pk,))
+        cursor.execute(_latest_pred_eles_insert_sql("fm.project_id = %s"), (project.pk,))
+        return cursor.rowcount
+
+
+def verify_latest_pred_eles_for_project(project):
+    """
+    Compares project's LatestPredictionElement rows with ones computed from all of its forecasts.
+
+    :param project: a Project
+    :return: a 2-tuple: (num_missing, num_extra), where num_missing is the number of computed rows that are not in the
+        table, and num_extra is the number of rows in the table that were not computed. both are zero if the table is
+        correct
+    """
+    latest_sql = f"""
+        SELECT latest.forecast_model_id, latest.time_zero_id, latest.unit_id, latest.target_id, latest.pred_class,
+               latest.pred_ele_id
+        FROM {LatestPredictionElement._meta.db_table} AS latest
+                 JOIN {ForecastModel._meta.db_table} AS fm ON latest.forecast_model_id = fm.id
+        WHERE fm.project_id = %s
+    """
+    computed_sql = _latest_pred_eles_select_sql("fm.project_id = %s")
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM ({computed_sql} EXCEPT {latest_sql}) AS missing;",
+                       (project.pk, project.pk,))
+        num_missing = cursor.fetchone()[0]
+        cursor.execute(f"SELECT COUNT(*) FROM ({latest_sql} EXCEPT {computed_sql}) AS extra;",
+                       (project.pk, project.pk,))
+        num_extra = cursor.fetchone()[0]
+    return num_missing, num_extra
+
+
+def _latest_pred_eles_select_sql(where_clause):
+    """
+    :param where_clause: an SQL boolean expression over `f` (Forecast) and `fm` (ForecastModel) that limits the
+        forecasts to consider, with `%s` placeholders for the caller to pass
+    :return: SQL that selects the latest, non-retracted PredictionElements of the forecasts matching where_clause as
+        LatestPredictionElement rows. see `_query_forecasts_sql_for_pred_class()` for the ranking
+    """
+    return f"""
+        SELECT ranked_rows.fm_id, ranked_rows.tz_id, ranked_rows.unit_id, ranked_rows.target_id, ranked_rows.pred_class,
+               ranked_rows.pred_ele_id
+        FROM (SELECT f.forecast_model_id  AS fm_id,
+                     f.time_zero_id       AS tz_id,
+                     pred_ele.id          AS pred_ele_id,
+                     pred_ele.pred_class  AS pred_class,
+                     pred_ele.unit_id     AS unit_id,
+                     pred_ele.target_id   AS target_id,
+                     pred_ele.is_retract  AS is_retract,
+                     RANK() OVER (
+                         PARTITION BY f.forecast_model_id, f.time_zero_id, pred_ele.unit_id, pred_ele.target_id,
+                             pred_ele.pred_class
+                         ORDER BY f.issued_at DESC) AS rownum
+              FROM {PredictionElement._meta.db_table} AS pred_ele
+                       JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+                       JOIN {ForecastModel._meta.db_table} AS fm ON f.forecast_model_id = fm.id
+              WHERE {where_clause}) AS ranked_rows
+        WHERE ranked_rows.rownum = 1
+          AND NOT ranked_rows.is_retract
+    """
+
+
+def _latest_pred_eles_insert_sql(where_clause):
+    """
+    :return: SQL that inserts `_latest_pred_eles_select_sql(where_clause)`'s rows into LatestPredictionElement
+    """
+    return f"""
+        INSERT INTO {LatestPredictionElement._meta.db_table}
+            (forecast_model_id, time_zero_id, unit_id, target_id, pred_class, pred_ele_id)
+        {_latest_pred_eles_select_sql(where_clause)};
+    """
 
 
 #
@@ -0,0 +1,200 @@
+import csv
+import io
+import logging
+import random
+import time
+
+import click
+import django
+from django.db import connection, transaction
+
+
+# set up django. must be done before loading models. NB: requires DJANGO_SETTINGS_MODULE to be set
+django.setup()
+
+from forecast_app.models import Forecast, ForecastModel, PredictionData, PredictionElement, Project
+from utils.forecast import _insert_pred_ele_rows, update_latest_pred_eles_for_forecast, \
+    update_pred_ele_validity_for_forecast
+from utils.project_truth import POSTGRES_NULL_VALUE
+from utils.utilities import unique_temp_table_name
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# ---- application----
+#
+
+@click.command()
+@click.argument('project_pk', type=click.INT, required=True)
+@click.option('--num-samples', type=click.INT, default=100, help="number of samples per sample prediction")
+@click.option('--num-reps', type=click.INT, default=3, help="number of times to run each strategy")
+def ingest_benchmark_app(project_pk, num_samples, num_reps):
+    """
+    Times how long it takes to insert a synthetic forecast into PROJECT_PK's first model and time zero, using each of
+    these strategies:
+
+    - 'baseline': the previous two-pass insert (see `_insert_two_pass()`), which we compare against
+    - 'multi': `_insert_pred_ele_rows()` with separate statements (works with any database)
+    - 'single': `_insert_pred_ele_rows()` with one data-modifying statement (postgres only)
+
+    The synthetic forecast has one point and one sample prediction for every unit and target. Each run is rolled back,
+    so the database is unchanged afterwards.
+    """
+    project = Project.objects.get(pk=project_pk)
+    forecast_model = ForecastModel.objects.filter(project=project).first()
+    time_zero = project.timezeros.first()
+    if (not forecast_model) or (not time_zero):
+        logger.error(f"ingest_benchmark_app(): project has no models or no time zeros. project={project}")
+        return
+
+    strategies = [('baseline', None), ('multi', False)]
+    if connection.vendor == 'postgresql':
+        strategies.append(('single', True))
+    logger.info(f"ingest_benchmark_app(): project={project}, forecast_model={forecast_model}, time_zero={time_zero}, "
+                f"num_samples={num_samples}, num_reps={num_reps}, strategies={[name for name, _ in strategies]}")
+    for strategy_name, is_single_statement in strategies:
+        durations = []
+        for _ in range(num_reps):
+            durations.append(_time_insert(forecast_model, time_zero, num_samples, is_single_statement))
+        logger.info(f"ingest_benchmark_app(): {strategy_name}: min={min(durations):.3f}s, "
+                    f"max={max(durations):.3f}s, mean={sum(durations) / len(durations):.3f}s")
+    logger.info(f"ingest_benchmark_app(): done")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _time_insert(forecast_model, time_zero, num_samples, is_single_statement):
+    """
+    :param is_single_statement: passed to `_insert_pred_ele_rows()`, or None to use `_insert_two_pass()` instead
+    :return: the number of seconds it took to insert a synthetic forecast. the forecast is created and then rolled back
+    """
+    duration = None
+    try:
+        with transaction.atomic():
+            forecast = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero,
+                                               source='ingest_benchmark')
+            pred_ele_rows = _synthetic_pred_ele_rows(forecast, num_samples)
+            start_time = time.perf_counter()
+            if is_single_statement is None:
+                _insert_two_pass(forecast, pred_ele_rows)
+            else:
+                _insert_pred_ele_rows(forecast, pred_ele_rows, True, is_single_statement=is_single_statement)
+            duration = time.perf_counter() - start_time
+            raise _Rollback()
+    except _Rollback:
+        pass
+    return duration
+
+
+def _synthetic_pred_ele_rows(forecast, num_samples):
+    """
+    :return: a list of rows as yielded by `_validated_pred_ele_rows_for_pred_dicts()`, with one point and one sample
+        prediction for each of forecast's project's units and targets. values are random, and are not validated
+    """
+    project = forecast.forecast_model.project
+    rows = []
+    for unit in project.units.all():
+        for target in project.targets.all():
+            for pred_class, prediction_data in \
+                    [(PredictionElement.POINT_CLASS, {'value': random.random()}),
+                     (PredictionElement.SAMPLE_CLASS, {'sample': [random.random() for _ in range(num_samples)]})]:
+                data_json = PredictionElement.canonical_json_for_prediction_data_dict(prediction_data)
+                rows.append((forecast.pk, pred_class, unit.pk, target.pk, False,
+                             PredictionElement.hash_for_canonical_json(data_json,
+                                                                       PredictionElement.DEFAULT_HASH_SCHEME),
+                             data_json))
+    return rows
+
+
+def _insert_two_pass(forecast, pred_ele_rows):
+    """
+    The baseline strategy: inserts pred_ele_rows the way `load_predictions_from_json_io_dict()` did before the staging
+    table carried each row's JSON. Pass 1 stages the rows without their data, deletes duplicates from the staging table,
+    and inserts the rest into PredictionElement. Pass 2 re-reads the just-inserted PredictionElements' (id, data_hash)
+    and looks up each hash's data in Python to build the PredictionData rows, which it then inserts. Like
+    `_insert_pred_ele_rows()` (with is_subset_allowed=True), it then updates validity intervals and the latest table so
+    that only the insert strategy differs.
+
+    :param forecast: the new, empty Forecast being inserted into
+    :param pred_ele_rows: as returned by `_synthetic_pred_ele_rows()`
+    """
+    temp_table_name = unique_temp_table_name('pred_ele_temp')
+    pred_ele_table_name = PredictionElement._meta.db_table
+    data_hash_to_data_json = {row[5]: row[6] for row in pred_ele_rows}
+
+    # pass 1/2: stage, delete duplicates, and insert into PredictionElement. valid_from is set as in
+    # `_insert_staged_rows_multi_statement()`
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TEMP TABLE {temp_table_name} AS
+            SELECT forecast_id, pred_class, unit_id, target_id, is_retract, data_hash
+            FROM {pred_ele_table_name}
+            LIMIT 0;
+        """)
+    _insert_rows(temp_table_name, ['forecast_id', 'pred_class', 'unit_id', 'target_id', 'is_retract', 'data_hash'],
+                 [row[:6] for row in pred_ele_rows])
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            DELETE
+            FROM {temp_table_name}
+            WHERE EXISTS(SELECT *
+                         FROM {pred_ele_table_name} AS pred_ele
+                                  JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+                         WHERE f.forecast_model_id = %s
+                           AND f.time_zero_id = %s
+                           AND {temp_table_name}.pred_class = pred_ele.pred_class
+                           AND {temp_table_name}.unit_id = pred_ele.unit_id
+                           AND {temp_table_name}.target_id = pred_ele.target_id
+                           AND {temp_table_name}.is_retract = pred_ele.is_retract
+                           AND {temp_table_name}.data_hash = pred_ele.data_hash);
+        """, (forecast.forecast_model_id, forecast.time_zero_id))
+        cursor.execute(f"""
+            INSERT INTO {pred_ele_table_name} (forecast_id, pred_class, unit_id, target_id, is_retract, data_hash,
+                                               valid_from)
+            SELECT %s, pred_class, unit_id, target_id, is_retract, data_hash,
+                   (SELECT f.issued_at FROM {Forecast._meta.db_table} AS f WHERE f.id = %s)
+            FROM {temp_table_name};
+        """, (forecast.pk, forecast.pk))
+        cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
+
+    # pass 2/2: re-read the new rows' ids and insert their data into PredictionData
+    pred_ele_qs = PredictionElement.objects \
+        .filter(forecast=forecast, is_retract=False) \
+        .values_list('id', 'data_hash')
+    pred_data_rows = [(pred_ele_id, data_hash_to_data_json[data_hash])
+                      for pred_ele_id, data_hash in pred_ele_qs.iterator()]
+    _insert_rows(PredictionData._meta.db_table, ['pred_ele_id', 'data'], pred_data_rows)
+
+    update_pred_ele_validity_for_forecast(forecast)
+    update_latest_pred_eles_for_forecast(forecast)
+
+
+def _insert_rows(table_name, column_names, rows):
+    """
+    `_insert_two_pass()` helper that inserts rows into table_name via COPY FROM (postgres) or executemany() (o/w).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            string_io = io.StringIO()
+            csv_writer = csv.writer(string_io, quotechar=chr(1), delimiter=chr(2))
+            csv_writer.writerows(rows)
+            string_io.seek(0)
+            cursor.copy_expert(f"""
+                COPY {table_name}({', '.join(column_names)}) FROM STDIN
+                WITH CSV QUOTE e'\x01' DELIMITER e'\x02' NULL '{POSTGRES_NULL_VALUE}';
+            """, string_io)
+        else:  # 'sqlite', etc.
+            cursor.executemany(f"INSERT INTO {table_name} ({', '.join(column_names)}) "
+                               f"VALUES ({', '.join(['%s'] * len(column_names))});", rows)
+
+
+#
+# ---- main ----
+#
+
+if __name__ == '__main__':
+    ingest_benchmark_app()
@@ -10,6 +10,7 @@ from django.utils.timezone import now
 django.setup()
 
 from forecast_app.models import Job
+from utils.cloud_file import delete_file
 
 
 logger = logging.getLogger(__name__)
@@ -24,13 +25,23 @@ logger = logging.getLogger(__name__)
 @click.option('--dry-run', is_flag=True, default=False)
 def delete_old_jobs_app(num_days, dry_run):
     """
-    List (and then delete) jobs older than X days.
+    List (and then delete) jobs older than X days. This is also how query result cache entries are evicted (see
+    `query_cache_key()`): deleting an old query job deletes its uploaded output, except that jobs whose outputs are
+    still shared by newer cache hits are kept.
     """
     all_jobs_qs = Job.objects
-    old_jobs_qs = Job.objects.filter(updated_at__lt=now() - datetime.timedelta(days=num_days)).order_by('updated_at')
+    cutoff = now() - datetime.timedelta(days=num_days)
+    shared_jobs_qs = Job.objects.filter(updated_at__gte=cutoff, output_json__has_key='cached_job_pk') \
+        .only('output_json')
+    shared_job_pks = {job.output_json['cached_job_pk'] for job in shared_jobs_qs}
+    old_jobs_qs = Job.objects.filter(updated_at__lt=cutoff).exclude(pk__in=shared_job_pks).order_by('updated_at')
     logger.info(f"delete_old_jobs_app(): num_days={num_days}, dry_run={dry_run}. "
-                f"# jobs={all_jobs_qs.count()}, # old={old_jobs_qs.count()}")
+                f"# jobs={all_jobs_qs.count()}, # old={old_jobs_qs.count()}, # shared={len(shared_job_pks)}")
     if not dry_run:
+        logger.info("delete_old_jobs_app(): deleting query outputs...")
+        for job in old_jobs_qs.filter(input_json__has_key='query', status=Job.SUCCESS) \
+                .exclude(output_json__has_key='cached_job_pk'):
+            delete_file(job)  # logs errors rather than raising them
         logger.info("delete_old_jobs_app(): deleting...")
         delete_result = old_jobs_qs.delete()
         logger.info(f'delete_old_jobs_app(): done. delete_result={delete_result}, # old={old_jobs_qs.count()}')
@@ -0,0 +1,59 @@
+import click
+import django
+from django.shortcuts import get_object_or_404
+
+
+# set up django. must be done before loading models. NB: requires DJANGO_SETTINGS_MODULE to be set
+django.setup()
+
+from utils.forecast import rebuild_latest_pred_eles_for_project, verify_latest_pred_eles_for_project
+
+from forecast_app.models import Project
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--project-pk')
+def rebuild(project_pk):
+    """
+    A subcommand that rebuilds one or all projects' LatestPredictionElement rows from their forecasts. Runs in the
+    calling thread, and therefore blocks.
+
+    :param project_pk: if a valid Project pk then only that project's rows are rebuilt. o/w rebuilds all
+    """
+    projects = [get_object_or_404(Project, pk=project_pk)] if project_pk else Project.objects.all()
+    print("rebuilding latest prediction elements")
+    for project in projects:
+        num_rows = rebuild_latest_pred_eles_for_project(project)
+        print(f"* {project}: {num_rows} rows")
+    print("rebuild done")
+
+
+@cli.command()
+@click.option('--project-pk')
+def verify(project_pk):
+    """
+    A subcommand that compares one or all projects' LatestPredictionElement rows with ones computed from their
+    forecasts, and prints the number of missing and extra rows. Exits with status 1 if any project's rows differ.
+
+    :param project_pk: if a valid Project pk then only that project's rows are verified. o/w verifies all
+    """
+    projects = [get_object_or_404(Project, pk=project_pk)] if project_pk else Project.objects.all()
+    print("verifying latest prediction elements")
+    is_all_ok = True
+    for project in projects:
+        num_missing, num_extra = verify_latest_pred_eles_for_project(project)
+        is_ok = (num_missing == 0) and (num_extra == 0)
+        is_all_ok = is_all_ok and is_ok
+        print(f"* {project}: {'ok' if is_ok else 'MISMATCH'}. num_missing={num_missing}, num_extra={num_extra}")
+    print("verify done")
+    if not is_all_ok:
+        raise click.exceptions.Exit(1)
+
+
+if __name__ == '__main__':
+    cli()
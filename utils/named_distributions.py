@@ -0,0 +1,535 @@
+import math
+
+import numpy
+
+from utils.forecast import NamedData
+
+
+#
+# Vectorized named distributions
+#
+# Query conversions FROM named predictions need each named distribution's mean, median, quantile function (AKA ppf),
+# and CDF. Rather than evaluate them one prediction element at a time, these functions take NumPy arrays of parameters
+# for a single family (one entry per prediction element) and evaluate all of them at once. scipy is not a dependency,
+# so the CDFs are implemented via the regularized incomplete gamma and beta functions, which are computed using their
+# standard series and continued fraction expansions (see "Numerical Recipes", chapter 6). Quantiles are found by
+# safeguarded Newton iteration on the CDF (continuous families) or integer bisection (discrete families).
+#
+# Families and their parameters (param1, param2) are as documented at
+# https://docs.zoltardata.com/fileformats/#named-distributions :
+#
+# - norm: mean, sd          - pois: rate
+# - lnorm: mean, sd (log)   - nbinom: r, p (number of failures before the r-th success, each w/probability p)
+# - gamma: shape, rate      - nbinom2: mean, disp (variance = mean + disp * mean^2)
+# - beta: a, b
+#
+# NB: all functions assume their parameters are valid per `_validate_named_prediction_data()`.
+#
+
+DISCRETE_FAMILIES = (NamedData.POIS_DIST, NamedData.NBINOM_DIST, NamedData.NBINOM2_DIST)
+
+# convergence tolerances and limits for the iterative algorithms. MAX_NUM_ITERATIONS is large enough for the series and
+# continued fractions to converge for parameters up to ~1e7, which need O(sqrt(parameter)) iterations
+EPSILON = 1e-15
+FLOAT_MIN = 1e-300
+MAX_NUM_ITERATIONS = 10_000
+MAX_NUM_NEWTON_ITERATIONS = 100
+MAX_NUM_DOUBLINGS = 64
+PPF_TOLERANCE = 1e-12
+
+# seeds `named_samples()`'s uniforms
+NAMED_SAMPLE_SEED = 0
+
+# Lanczos approximation coefficients for `_lgamma()` (g=7, n=9)
+_LANCZOS_G = 7
+_LANCZOS_COEFS = (0.99999999999980993, 676.5203681218851, -1259.1392167224028, 771.32342877765313,
+                  -176.61502916214059, 12.507343278686905, -0.13857109526572012, 9.9843695780195716e-6,
+                  1.5056327351493116e-7)
+
+
+def is_discrete_family(family):
+    """
+    :return: True if family (one of NamedData.FAMILY_CHOICES) is a distribution over the non-negative integers
+    """
+    return family in DISCRETE_FAMILIES
+
+
+#
+# ---- public functions ----
+#
+
+def named_means(family, param1, param2):
+    """
+    :param family: one of NamedData.FAMILY_CHOICES
+    :param param1: array of n param1 values
+    :param param2: array of n param2 values. ignored for families with one parameter
+    :return: array of the n distributions' means
+    """
+    param1, param2 = _param_arrays(param1, param2)
+    with numpy.errstate(divide='ignore'):
+        if family == NamedData.NORM_DIST:
+            return param1
+        elif family == NamedData.LNORM_DIST:
+            return numpy.exp(param1 + (param2 ** 2) / 2)
+        elif family == NamedData.GAMMA_DIST:
+            return param1 / param2
+        elif family == NamedData.BETA_DIST:
+            return param1 / (param1 + param2)
+        elif family == NamedData.POIS_DIST:
+            return param1
+        elif family == NamedData.NBINOM_DIST:
+            return param1 * (1 - param2) / param2  # inf if p == 0
+        elif family == NamedData.NBINOM2_DIST:
+            return param1
+        else:
+            raise RuntimeError(f"invalid family. family={family!r}, valid families={NamedData.FAMILY_CHOICES}")
+
+
+def named_medians(family, param1, param2):
+    """
+    :return: array of the n distributions' medians. args are as documented in `named_means()`
+    """
+    param1, param2 = _param_arrays(param1, param2)
+    if family == NamedData.NORM_DIST:
+        return param1
+    elif family == NamedData.LNORM_DIST:
+        return numpy.exp(param1)
+    else:
+        return named_quantiles(family, param1, param2, [0.5])[:, 0]
+
+
+def named_quantiles(family, param1, param2, quantiles):
+    """
+    :param quantiles: array of k probability levels in [0, 1], or an array of shape (n, k) of each distribution's own
+        levels. other args are as documented in `named_means()`
+    :return: array of shape (n, k) of the n distributions' quantiles at each level. a discrete distribution's quantile
+        is the smallest integer whose CDF is >= the level
+    """
+    param1, param2 = _param_arrays(param1, param2)
+    quantiles = numpy.asarray(quantiles, dtype=float)
+    quantiles = numpy.broadcast_to(quantiles, (len(param1), quantiles.shape[-1]))
+    param1, param2 = param1[:, numpy.newaxis], param2[:, numpy.newaxis]
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if family == NamedData.NORM_DIST:
+            return param1 + param2 * _std_norm_ppf(quantiles)
+        elif family == NamedData.LNORM_DIST:
+            return numpy.exp(param1 + param2 * _std_norm_ppf(quantiles))
+        elif family == NamedData.GAMMA_DIST:
+            return _std_gamma_ppf(param1, quantiles) / param2
+        elif family == NamedData.BETA_DIST:
+            return _beta_ppf(param1, param2, quantiles)
+        elif is_discrete_family(family):
+            param1_flat = numpy.broadcast_to(param1, quantiles.shape).ravel()
+            param2_flat = numpy.broadcast_to(param2, quantiles.shape).ravel()
+            return _discrete_ppf(lambda idxs, k: named_cdf(family, param1_flat[idxs], param2_flat[idxs], k),
+                                 quantiles, named_means(family, param1, param2))
+        else:
+            raise RuntimeError(f"invalid family. family={family!r}, valid families={NamedData.FAMILY_CHOICES}")
+
+
+def named_samples(family, param1, param2, seeds, num_samples):
+    """
+    Draws samples via inverse transform sampling, i.e., by passing uniforms to `named_quantiles()`. The uniforms are a
+    deterministic function of NAMED_SAMPLE_SEED, each distribution's seed, and the sample's index, and so the same
+    distribution and seed always get the same samples, regardless of which other distributions are passed with it.
+
+    :param seeds: array of n non-negative ints, e.g., prediction element ids. other args are as documented in
+        `named_means()`
+    :param num_samples: the number of samples per distribution
+    :return: array of shape (n, num_samples) of samples
+    """
+    return named_quantiles(family, param1, param2, _uniforms(numpy.asarray(seeds, dtype=numpy.uint64), num_samples))
+
+
+def named_bin_probs(family, param1, param2, lwrs, uppers):
+    """
+    :param lwrs: array of k bin lower bounds, as stored in TargetLwr. other args are as documented in `named_means()`
+    :param uppers: array of k bin upper bounds (exclusive), as stored in TargetLwr. the last is typically inf
+    :return: array of shape (n, k) of the probability of each of the n distributions being in each bin. NB: the
+        probabilities of a distribution sum to < 1 if it has mass below the first bin's lwr
+    """
+    lwrs, uppers = numpy.asarray(lwrs, dtype=float), numpy.asarray(uppers, dtype=float)
+    if is_discrete_family(family):  # P(lwr <= X < upper) = P(X <= ceil(upper) - 1) - P(X <= ceil(lwr) - 1)
+        lwrs, uppers = numpy.ceil(lwrs) - 1, numpy.ceil(uppers) - 1
+    param1, param2 = _param_arrays(param1, param2)
+    param1, param2 = param1[:, numpy.newaxis], param2[:, numpy.newaxis]
+    return numpy.clip(named_cdf(family, param1, param2, uppers) - named_cdf(family, param1, param2, lwrs), 0, 1)
+
+
+def named_cdf(family, param1, param2, x):
+    """
+    :param x: array of values to evaluate the CDF at. it and the params are broadcast against each other
+    :return: array of P(X <= x). other args are as documented in `named_means()`
+    """
+    param1, param2, x = numpy.broadcast_arrays(numpy.asarray(param1, dtype=float), numpy.asarray(param2, dtype=float),
+                                               numpy.asarray(x, dtype=float))
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if family == NamedData.NORM_DIST:
+            return _norm_cdf(param1, param2, x)
+        elif family == NamedData.LNORM_DIST:
+            return numpy.where(x > 0, _norm_cdf(param1, param2, numpy.log(numpy.maximum(x, FLOAT_MIN))), 0.0)
+        elif family == NamedData.GAMMA_DIST:
+            return _gammainc(param1, param2 * numpy.maximum(x, 0))[0]
+        elif family == NamedData.BETA_DIST:
+            return _betainc(param1, param2, x)[0]
+        elif family == NamedData.POIS_DIST:  # P(X <= k) = Q(k + 1, rate)
+            k = numpy.floor(x)
+            is_k_pos = k >= 0
+            return _discrete_cdf(k, lambda k_pos: _gammainc(k_pos + 1, param1[is_k_pos])[1], x)
+        elif family in (NamedData.NBINOM_DIST, NamedData.NBINOM2_DIST):  # P(X <= k) = I_p(r, k + 1)
+            if family == NamedData.NBINOM_DIST:
+                size, prob = param1, param2
+            else:  # nbinom2: size = 1 / disp, prob = size / (size + mean)
+                size, prob = 1 / param2, 1 / (1 + param2 * param1)
+            k = numpy.floor(x)
+            is_k_pos = k >= 0
+            return _discrete_cdf(k, lambda k_pos: _betainc(size[is_k_pos], k_pos + 1, prob[is_k_pos])[0], x)
+        else:
+            raise RuntimeError(f"invalid family. family={family!r}, valid families={NamedData.FAMILY_CHOICES}")
+
+
+#
+# ---- CDF helpers ----
+#
+
+def _param_arrays(param1, param2):
+    param1 = numpy.asarray(param1, dtype=float)
+    param2 = numpy.zeros(param1.shape) if param2 is None else numpy.asarray(param2, dtype=float)
+    return param1, param2
+
+
+def _norm_cdf(mean, sd, x):
+    """
+    Normal CDF via the standard normal's Phi(z) = Q(1/2, z^2 / 2) / 2 for z < 0. A zero sd is a point mass at mean.
+    """
+    cdf = _std_norm_cdf((x - mean) / numpy.where(sd > 0, sd, 1.0))
+    return numpy.where(sd > 0, cdf, (x >= mean).astype(float))
+
+
+def _std_norm_cdf(z):
+    half_tail = _gammainc(0.5, (z ** 2) / 2)[1] / 2
+    return numpy.where(z < 0, half_tail, 1 - half_tail)
+
+
+def _discrete_cdf(k, cdf_k_pos_fcn, x):
+    """
+    :param k: array of floor(x)
+    :param cdf_k_pos_fcn: a function of the k that are >= 0 that returns the CDF at them, ignoring infinite ones
+    :return: array of P(X <= k), which is 0 for k < 0 and 1 for k == inf
+    """
+    cdf = numpy.zeros(k.shape)
+    is_k_pos = k >= 0
+    k_pos = k[is_k_pos]
+    is_inf = numpy.isinf(k_pos)
+    cdf_k_pos = cdf_k_pos_fcn(numpy.where(is_inf, 0, k_pos))
+    cdf[is_k_pos] = numpy.where(is_inf, 1.0, cdf_k_pos)
+    return numpy.where(numpy.isnan(x), numpy.nan, cdf)
+
+
+def _lgamma(x):
+    """
+    :return: array of log(gamma(x)) for x > 0 via the Lanczos approximation
+    """
+    x = numpy.asarray(x, dtype=float)
+    is_small = x < 0.5
+    z = numpy.where(is_small, x + 1, x) - 1  # lgamma(x) = lgamma(x + 1) - log(x)
+    series = numpy.full(z.shape, _LANCZOS_COEFS[0])
+    for idx, coef in enumerate(_LANCZOS_COEFS[1:], start=1):
+        series += coef / (z + idx)
+    t = z + _LANCZOS_G + 0.5
+    lgamma = 0.5 * math.log(2 * math.pi) + (z + 0.5) * numpy.log(t) - t + numpy.log(series)
+    return numpy.where(is_small, lgamma - numpy.log(numpy.where(is_small, x, 1.0)), lgamma)
+
+
+def _gammainc(a, x):
+    """
+    :return: 2-tuple of arrays of the regularized lower and upper incomplete gamma functions: (P(a, x), Q(a, x)), for
+        a > 0 and x >= 0. the smaller of the two is computed directly, so it is accurate in the tail
+    """
+    a, x = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(x, dtype=float))
+    lower, upper = numpy.zeros(a.shape), numpy.ones(a.shape)
+    is_inf = numpy.isinf(x)
+    lower[is_inf], upper[is_inf] = 1.0, 0.0
+    is_series = (x > 0) & (x < a + 1)
+    is_cont_frac = (x >= a + 1) & ~is_inf
+    if is_series.any():
+        lower_series = _gammainc_series(a[is_series], x[is_series])
+        lower[is_series], upper[is_series] = lower_series, 1 - lower_series
+    if is_cont_frac.any():
+        upper_cont_frac = _gammainc_cont_frac(a[is_cont_frac], x[is_cont_frac])
+        lower[is_cont_frac], upper[is_cont_frac] = 1 - upper_cont_frac, upper_cont_frac
+    return lower, upper
+
+
+def _gammainc_series(a, x):
+    """
+    :return: P(a, x) via its series expansion, which converges quickly for x < a + 1
+    """
+    def step(_, arrays):
+        a_, x_, denom, term, total = arrays
+        denom = denom + 1
+        term = term * x_ / denom
+        total = total + term
+        return (a_, x_, denom, term, total), numpy.abs(term) < numpy.abs(total) * EPSILON
+
+
+    total = _iterate_until_converged(step, (a, x, a, 1 / a, 1 / a))[-1]
+    return total * numpy.exp(-x + a * numpy.log(x) - _lgamma(a))
+
+
+def _gammainc_cont_frac(a, x):
+    """
+    :return: Q(a, x) via its continued fraction (modified Lentz's method), which converges quickly for x >= a + 1
+    """
+    def step(iteration, arrays):
+        a_, b, c, d, h = arrays
+        an = -iteration * (iteration - a_)
+        b = b + 2
+        d = 1 / _nonzero(an * d + b)
+        c = _nonzero(b + an / c)
+        delta = d * c
+        return (a_, b, c, d, h * delta), numpy.abs(delta - 1) < EPSILON
+
+
+    b = x + 1 - a
+    h = _iterate_until_converged(step, (a, b, numpy.full(a.shape, 1 / FLOAT_MIN), 1 / b, 1 / b))[-1]
+    return numpy.exp(-x + a * numpy.log(x) - _lgamma(a)) * h
+
+
+def _betainc(a, b, x):
+    """
+    :return: 2-tuple of arrays of the regularized incomplete beta function and its complement: (I_x(a, b),
+        1 - I_x(a, b)), for a > 0, b > 0, and x clipped to [0, 1]
+    """
+    a, b, x = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float),
+                                     numpy.asarray(x, dtype=float))
+    lower = numpy.asarray(x >= 1, dtype=float)
+    upper = numpy.asarray(1 - lower)
+    is_mid = (x > 0) & (x < 1)
+    if is_mid.any():
+        a_mid, b_mid, x_mid = a[is_mid], b[is_mid], x[is_mid]
+        # the continued fraction converges quickly for x < (a + 1) / (a + b + 2). o/w use I_x(a, b) = 1 - I_1-x(b, a)
+        is_swap = x_mid >= (a_mid + 1) / (a_mid + b_mid + 2)
+        a_cf = numpy.where(is_swap, b_mid, a_mid)
+        b_cf = numpy.where(is_swap, a_mid, b_mid)
+        x_cf = numpy.where(is_swap, 1 - x_mid, x_mid)
+        front = numpy.exp(_lgamma(a_cf + b_cf) - _lgamma(a_cf) - _lgamma(b_cf) + a_cf * numpy.log(x_cf) +
+                          b_cf * numpy.log1p(-x_cf)) / a_cf
+        direct = numpy.clip(front * _betainc_cont_frac(a_cf, b_cf, x_cf), 0, 1)
+        lower[is_mid] = numpy.where(is_swap, 1 - direct, direct)
+        upper[is_mid] = numpy.where(is_swap, direct, 1 - direct)
+    return lower, upper
+
+
+def _betainc_cont_frac(a, b, x):
+    """
+    :return: the continued fraction for I_x(a, b) (modified Lentz's method)
+    """
+    def step(m, arrays):
+        a_, b_, x_, c, d, h = arrays
+        m2 = 2 * m
+        aa = m * (b_ - m) * x_ / ((a_ - 1 + m2) * (a_ + m2))
+        d = 1 / _nonzero(1 + aa * d)
+        c = _nonzero(1 + aa / c)
+        h = h * d * c
+        aa = -(a_ + m) * (a_ + b_ + m) * x_ / ((a_ + m2) * (a_ + 1 + m2))
+        d = 1 / _nonzero(1 + aa * d)
+        c = _nonzero(1 + aa / c)
+        delta = d * c
+        return (a_, b_, x_, c, d, h * delta), numpy.abs(delta - 1) < EPSILON
+
+
+    d = 1 / _nonzero(1 - (a + b) * x / (a + 1))
+    return _iterate_until_converged(step, (a, b, x, numpy.ones(a.shape), d, d))[-1]
+
+
+def _iterate_until_converged(step_fcn, arrays):
+    """
+    Runs an iterative algorithm on 1-D arrays of state, one element per problem, stopping each problem when it
+    converges so that later iterations only compute the (typically few) slowly-converging ones.
+
+    :param step_fcn: a function of (iteration, arrays) that returns a 2-tuple: (next arrays, is_converged array).
+        iteration starts at 1
+    :param arrays: the initial state arrays, all of the same length
+    :return: a list of the final state arrays. problems that did not converge within MAX_NUM_ITERATIONS have their
+        last state
+    """
+    final_arrays = [numpy.array(array, dtype=float) for array in arrays]
+    idxs = numpy.arange(len(final_arrays[0]))
+    for iteration in range(1, MAX_NUM_ITERATIONS):
+        if not len(idxs):
+            break
+
+        arrays, is_converged = step_fcn(iteration, arrays)
+        if is_converged.any():
+            for final_array, array in zip(final_arrays, arrays):
+                final_array[idxs[is_converged]] = array[is_converged]
+            is_active = ~is_converged
+            idxs = idxs[is_active]
+            arrays = [array[is_active] for array in arrays]
+    for final_array, array in zip(final_arrays, arrays):
+        final_array[idxs] = array
+    return final_arrays
+
+
+def _nonzero(values):
+    return numpy.where(numpy.abs(values) < FLOAT_MIN, FLOAT_MIN, values)
+
+
+#
+# ---- quantile function (ppf) helpers ----
+#
+
+def _std_norm_ppf(quantiles):
+    """
+    :return: array of the standard normal's quantiles. starts from Abramowitz and Stegun 26.2.23 (|error| < 4.5e-4)
+        and refines via Newton's method in the lower tail, using symmetry for the upper tail so that it is accurate
+        in both
+    """
+    tail_prob = numpy.minimum(quantiles, 1 - quantiles)
+    safe_tail_prob = numpy.clip(tail_prob, FLOAT_MIN, 0.5)
+    t = numpy.sqrt(-2 * numpy.log(safe_tail_prob))
+    z = -(t - (2.515517 + 0.802853 * t + 0.010328 * t ** 2) /
+          (1 + 1.432788 * t + 0.189269 * t ** 2 + 0.001308 * t ** 3))
+    z = _newton_ppf(lambda _, z_: _std_norm_cdf(z_), lambda _, z_: _std_norm_pdf(z_), safe_tail_prob, z, -numpy.inf,
+                    0.0)
+    z = numpy.where(tail_prob == 0.5, 0.0, z)
+    z = numpy.where(quantiles < 0.5, z, -z)
+    z = numpy.where(quantiles == 0, -numpy.inf, z)
+    return numpy.where(quantiles == 1, numpy.inf, z)
+
+
+def _std_norm_pdf(z):
+    return numpy.exp(-(z ** 2) / 2) / math.sqrt(2 * math.pi)
+
+
+def _std_gamma_ppf(shape, quantiles):
+    """
+    :return: array of the quantiles of the gamma distribution with shape and rate 1. starts from the Wilson-Hilferty
+        approximation (or the small-x approximation P(a, x) ~= x^a / (a * gamma(a)) when that is not positive)
+    """
+    shape = numpy.broadcast_to(shape, quantiles.shape)
+    safe_quantiles = numpy.clip(quantiles, FLOAT_MIN, 1 - EPSILON)
+    z = _std_norm_ppf(safe_quantiles)
+    wilson_hilferty = shape * (1 - 1 / (9 * shape) + z / (3 * numpy.sqrt(shape))) ** 3
+    small_x = numpy.exp((numpy.log(safe_quantiles) + numpy.log(shape) + _lgamma(shape)) / shape)
+    x = numpy.where((wilson_hilferty > 0) & (shape >= 1), wilson_hilferty, small_x)
+    shape, lgamma_shape = shape.ravel(), _lgamma(shape).ravel()
+    x = _newton_ppf(lambda idxs, x_: _gammainc(shape[idxs], x_)[0],
+                    lambda idxs, x_: numpy.exp((shape[idxs] - 1) * numpy.log(x_) - x_ - lgamma_shape[idxs]),
+                    safe_quantiles, numpy.maximum(x, FLOAT_MIN), 0.0, numpy.inf)
+    x = numpy.where(quantiles == 0, 0.0, x)
+    return numpy.where(quantiles == 1, numpy.inf, x)
+
+
+def _beta_ppf(a, b, quantiles):
+    """
+    :return: array of the beta distribution's quantiles, starting from its mean. quantiles > 0.5 are found via
+        x = 1 - ppf(b, a, 1 - quantile) so that those near 1 are accurate
+    """
+    is_upper = quantiles > 0.5
+    a, b = numpy.broadcast_to(a, quantiles.shape), numpy.broadcast_to(b, quantiles.shape)
+    a, b = numpy.where(is_upper, b, a), numpy.where(is_upper, a, b)
+    tail_quantiles = numpy.where(is_upper, 1 - quantiles, quantiles)
+    mean = a / (a + b)
+    a, b = a.ravel(), b.ravel()
+    log_beta = _lgamma(a) + _lgamma(b) - _lgamma(a + b)
+    x = _newton_ppf(lambda idxs, x_: _betainc(a[idxs], b[idxs], x_)[0],
+                    lambda idxs, x_: numpy.exp((a[idxs] - 1) * numpy.log(x_) + (b[idxs] - 1) * numpy.log1p(-x_) -
+                                               log_beta[idxs]),
+                    tail_quantiles, mean, 0.0, 1.0)
+    x = numpy.where(tail_quantiles == 0, 0.0, x)
+    return numpy.where(is_upper, 1 - x, x)
+
+
+def _newton_ppf(cdf_fcn, pdf_fcn, quantiles, x, lo, hi):
+    """
+    Solves cdf_fcn(x) == quantiles via Newton's method, safeguarded by bisection of the bracket [lo, hi], which is
+    narrowed each iteration. Newton steps that leave the bracket are replaced by bisection steps (or doubling steps if
+    the bracket is unbounded). Each element stops when its steps are within PPF_TOLERANCE.
+
+    :param cdf_fcn: a function of (idxs, x) that returns the CDF at x, where idxs are the indexes into the flattened
+        quantiles that x corresponds to
+    :param pdf_fcn: "" the PDF
+    :param quantiles: array of levels to solve for
+    :param x: array of starting values. x, lo, and hi are broadcast to quantiles' shape
+    :return: array of x
+    """
+    shape = quantiles.shape
+    quantiles, x, lo, hi = [numpy.array(numpy.broadcast_to(array, shape), dtype=float).ravel()
+                            for array in (quantiles, x, lo, hi)]
+    idxs = numpy.arange(x.size)
+    for _ in range(MAX_NUM_NEWTON_ITERATIONS):
+        if not len(idxs):
+            break
+
+        x_idxs = x[idxs]
+        error = cdf_fcn(idxs, x_idxs) - quantiles[idxs]
+        lo_idxs = numpy.where(error < 0, x_idxs, lo[idxs])
+        hi_idxs = numpy.where(error > 0, x_idxs, hi[idxs])
+        x_new = x_idxs - error / pdf_fcn(idxs, x_idxs)
+        x_bisect = numpy.where(numpy.isinf(hi_idxs), numpy.where(x_idxs > 0, 2 * x_idxs, 1.0),
+                               numpy.where(numpy.isinf(lo_idxs), numpy.where(x_idxs < 0, 2 * x_idxs, -1.0),
+                                           (lo_idxs + hi_idxs) / 2))
+        x_new = numpy.where((x_new > lo_idxs) & (x_new < hi_idxs), x_new, x_bisect)  # NB: False for nan
+        x[idxs] = numpy.where(error == 0, x_idxs, x_new)
+        lo[idxs], hi[idxs] = lo_idxs, hi_idxs
+        is_done = (error == 0) | (numpy.abs(x_new - x_idxs) <= PPF_TOLERANCE * numpy.abs(x_idxs)) | \
+                  (hi_idxs - lo_idxs <= PPF_TOLERANCE * numpy.abs(x_idxs))
+        idxs = idxs[~is_done]
+    return x.reshape(shape)
+
+
+def _discrete_ppf(cdf_fcn, quantiles, guess):
+    """
+    :param cdf_fcn: a function of (idxs, k) that returns the CDF at k, where idxs are the indexes into the flattened
+        quantiles that k corresponds to
+    :param quantiles: array of levels to solve for
+    :param guess: array of starting values, e.g., the means. broadcast to quantiles' shape
+    :return: array of the smallest integers k >= 0 such that cdf_fcn(k) >= quantiles. found by doubling up from guess
+        until cdf_fcn(hi) >= quantile, then bisecting between the last two. inf if there is no such k < 2^64
+    """
+    shape = quantiles.shape
+    quantiles = quantiles.ravel()
+    lo = numpy.full(quantiles.shape, -1.0)  # cdf_fcn(-1) = 0
+    hi = numpy.array(numpy.broadcast_to(numpy.maximum(numpy.floor(numpy.nan_to_num(guess, posinf=0)), 0), shape),
+                     dtype=float).ravel()
+    is_unbounded = numpy.zeros(quantiles.shape, dtype=bool)
+    idxs = numpy.arange(quantiles.size)
+    for num_doublings in range(MAX_NUM_DOUBLINGS + 1):
+        idxs = idxs[cdf_fcn(idxs, hi[idxs]) < quantiles[idxs]]
+        if not len(idxs):
+            break
+        elif num_doublings == MAX_NUM_DOUBLINGS:
+            is_unbounded[idxs] = True
+        else:
+            lo[idxs] = hi[idxs]
+            hi[idxs] = 2 * hi[idxs] + 1
+
+    idxs = numpy.flatnonzero(~is_unbounded & (hi - lo > 1))
+    while len(idxs):
+        mid = numpy.floor((lo[idxs] + hi[idxs]) / 2)
+        is_ge = cdf_fcn(idxs, mid) >= quantiles[idxs]
+        hi[idxs[is_ge]] = mid[is_ge]
+        lo[idxs[~is_ge]] = mid[~is_ge]
+        idxs = idxs[hi[idxs] - lo[idxs] > 1]
+    return numpy.where(is_unbounded | (quantiles >= 1), numpy.inf, hi).reshape(shape)
+
+
+def _uniforms(seeds, num_samples):
+    """
+    :return: array of shape (len(seeds), num_samples) of uniforms in (0, 1), computed via the splitmix64 generator
+    """
+    golden_gamma = numpy.uint64(0x9E3779B97F4A7C15)
+    with numpy.errstate(over='ignore'):
+        states = _splitmix64_mix(seeds + numpy.uint64(NAMED_SAMPLE_SEED) * golden_gamma)
+        states = states[:, numpy.newaxis] + \
+            numpy.arange(1, num_samples + 1, dtype=numpy.uint64)[numpy.newaxis, :] * golden_gamma
+        bits = _splitmix64_mix(states)
+    return ((bits >> numpy.uint64(11)).astype(float) + 0.5) / 2 ** 53
+
+
+def _splitmix64_mix(values):
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return values ^ (values >> numpy.uint64(31))
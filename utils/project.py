@@ -12,7 +12,7 @@ from django.db import transaction
 from forecast_app.models import Project, Unit, Target, Forecast, ForecastModel, ForecastMetaUnit, ForecastMetaTarget
 from forecast_app.models.project import TimeZero
 from forecast_app.models.target import reference_date_type_for_name, reference_date_type_for_id
-from utils.utilities import YYYY_MM_DD_DATE_FORMAT
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, streaming_cursor
 
 
 logger = logging.getLogger(__name__)
@@ -774,14 +774,15 @@ def latest_forecast_ids_for_project(project, is_only_f_id, model_ids=None, timez
 def latest_forecast_cols_for_project(project, is_incl_fm_id=True, is_incl_tz_id=True, is_incl_issued_at=True,
                                      is_incl_created_at=True, is_incl_source=True, is_incl_notes=True):
     """
-    Simpler variation of `latest_forecast_ids_for_project()` that uses window functions and returns a list of requested
+    Simpler variation of `latest_forecast_ids_for_project()` that uses window functions and returns the requested
     fields. Returns information about all of the latest forecasts in `project`.
 
     :param is_incl_*: booleans indicating which Forecast columns to include: 'forecast_model_id', 'time_zero_id',
         'issued_at', 'created_at', 'source', and 'notes'. NB: 'forecast_id' is always included
     :param project: a Project
-    :return: a list of N+1-tuples (depends on is_incl_*):
-        (forecast_id, [forecast_model_id], [time_zero_id], [issued_at], [created_at], [source], [notes])
+    :return: a generator of N+1-tuples (depends on is_incl_*):
+        (forecast_id, [forecast_model_id], [time_zero_id], [issued_at], [created_at], [source], [notes]). rows are
+        streamed via `streaming_cursor()`
     """
     col_name_to_is_include = {
         'id': True,
@@ -811,7 +812,6 @@ def latest_forecast_cols_for_project(project, is_incl_fm_id=True, is_incl_tz_id=
         FROM ranked_rows
         WHERE rownum = 1;
     """
-    with connection.cursor() as cursor:
+    with streaming_cursor() as cursor:
         cursor.execute(sql, (project.pk,))
-        # return batched_rows(cursor)  # todo xx cursor closed error
-        return cursor.fetchall()
+        yield from batched_rows(cursor)
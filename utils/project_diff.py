@@ -9,8 +9,10 @@ from forecast_app.models.project import TimeZero
 from forecast_app.models.target import reference_date_type_for_name
 from utils.project import create_project_from_json, _validate_and_create_units, _validate_and_create_targets, \
     _validate_and_create_timezeros
+from utils.project_queries import bump_project_data_version
 from utils.project_truth import truth_data_qs
 from utils.utilities import basic_str
+from utils.validation_context import invalidate_validation_context
 
 
 logger = logging.getLogger(__name__)
@@ -419,6 +421,11 @@ def execute_project_config_diff(project, changes):
             logger.error(message)
             raise RuntimeError(message)
 
+    # targets might have been added or removed, and query outputs might have changed (e.g., renamed or deleted units,
+    # targets, or time zeros)
+    invalidate_validation_context(project.pk)
+    bump_project_data_version(project.pk)
+
 
 def object_for_change(project, change, objects_to_save):
     """
@@ -1,23 +1,36 @@
 import csv
+import datetime
+import hashlib
 import io
 import json
+import math
+import shutil
 import statistics
-from itertools import groupby
+import tempfile
+from collections import defaultdict
+from itertools import chain, groupby
 
 import dateutil
+import django_rq
 import numpy
 from boto3.exceptions import Boto3Error
 from botocore.exceptions import BotoCoreError, ClientError, ConnectionClosedError
-from django.db import connection, transaction
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
 from rest_framework.generics import get_object_or_404
 from rq.timeouts import JobTimeoutException
 
-from forecast_app.models import Job, Project, Forecast, ForecastModel, PredictionElement, PredictionData, Target
+from forecast_app.models import Job, Project, Forecast, ForecastModel, LatestPredictionElement, PredictionElement, \
+    PredictionData, Target, TargetLwr, Unit
 from forecast_app.models.prediction_element import PRED_CLASS_NAME_TO_INT, PRED_CLASS_INT_TO_NAME
-from forecast_repo.settings.base import MAX_NUM_QUERY_ROWS
+from forecast_app.models.job import JOB_TYPE_QUERY_SCORES, JOB_TYPE_QUERY_TRUTH
+from forecast_repo.settings.base import MAX_NUM_QUERY_ROWS, QUERY_FORECAST_QUEUE_NAME, QUERY_SHARD_MIN_NUM_PRED_ELES, \
+    QUERY_SHARD_NUM_SHARDS, QUERY_SYNC_MAX_NUM_PRED_ELES, QUERY_SYNC_MAX_NUM_ROWS, QUERY_SYNC_STATEMENT_TIMEOUT
 from utils.project import logger
 from utils.project_truth import TRUTH_CSV_HEADER, oracle_model_for_project
-from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows
+from utils.query_parquet import concat_parquet_files, write_query_rows_parquet
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, streaming_cursor, temp_table_on_commit_sql, \
+    unique_temp_table_name
 
 
 #
@@ -68,8 +81,8 @@ def query_forecasts_for_project(project, query, max_num_rows=MAX_NUM_QUERY_ROWS)
 
       B <- NS   # can convert named or samples to bin. options: none
       N <- n/a  # no conversion possible
-      P <- NS   # can convert named or samples to point. options: 'mean' or 'median'
-      Q <- NS   # "" samples. options: list of quantiles
+      P <- NSBQ # can convert named, samples, bins, or quantiles to point. options: 'mean' or 'median'
+      Q <- NSBQ # "" quantiles (quantiles are interpolated onto the requested ones). options: list of quantiles
       S <- N    # can convert named to samples. options: number of samples
 
     Here then are the valid options:
@@ -78,6 +91,13 @@ def query_forecasts_for_project(project, query, max_num_rows=MAX_NUM_QUERY_ROWS)
     - 'convert.quantile': a number if conversion TO quantiles is desired: a list of unique numbers in [0, 1]
     - 'convert.sample': an int if conversion TO samples is desired: an int >0
 
+    Currently implemented are B, P, Q <- S, B, P, Q, S <- N, P, Q <- B, and P, Q <- Q, for continuous and discrete
+    targets, with sources tried in that order (except that quantiles always come from quantiles if there are any).
+    Conversions from named distributions use utils/named_distributions.py . Bins are the target's (TargetLwr), and zero
+    probabilities are omitted. Samples are drawn deterministically per prediction element, so repeated queries return
+    the same ones. Bins are converted to points and quantiles by treating them as a piecewise-linear CDF, and
+    quantiles by treating them as a piecewise-linear quantile function that is flat beyond the submitted levels.
+
     :param project: a Project
     :param query: a dict specifying the query parameters as described above
     :param max_num_rows: the number of rows at which this function raises a RuntimeError
@@ -124,12 +144,13 @@ def _query_forecasts_for_project_no_type_convert(project, query, max_num_rows, m
     yield FORECAST_CSV_HEADER
 
     # get the SQL then execute and iterate over resulting data
-    sql = _query_forecasts_sql_for_pred_class(type_ints, model_ids, unit_ids, target_ids, timezero_ids, as_of, True)
+    sql = _query_forecasts_sql_for_pred_class(type_ints, model_ids, unit_ids, target_ids, timezero_ids, as_of, True,
+                                              is_ordered=True)
     logger.debug(f"_query_forecasts_for_project_no_type_convert(): 1/2 executing sql. type_ints, model_ids, unit_ids, "
                  f"target_ids, timezero_ids, as_of= {type_ints}, {model_ids}, {unit_ids}, {target_ids}, "
                  f"{timezero_ids}, {as_of}")
     num_rows = 0
-    with connection.cursor() as cursor:
+    with streaming_cursor() as cursor:
         cursor.execute(sql, (project.pk,))
         for fm_id, tz_id, pred_class, unit_id, target_id, is_retract, pred_data in batched_rows(cursor):
             # we do not have to check is_retract b/c we pass `is_include_retract=False`, which skips retractions
@@ -188,8 +209,183 @@ def _generate_query_rows_no_type_convert(fm_id, tz_id, unit_id, target_id, forec
                    value, cat, prob, sample, quantile, family, param1, param2, param3]
 
 
+#
+# copy_forecasts_query_csv()
+#
+
+def copy_forecasts_query_csv(project, query, text_io, max_num_rows=MAX_NUM_QUERY_ROWS):
+    """
+    A faster alternative to writing `query_forecasts_for_project()`'s rows to text_io via `csv.writer()` for the case of
+    no prediction type conversions. Rather than loading each PredictionData's json and expanding its lists into rows in
+    Python, the database does both (via `jsonb_array_elements() WITH ORDINALITY`) and streams the result as CSV via
+    `COPY ... TO STDOUT`. The output is the same, byte for byte, as the Python implementation's, including its row
+    order, number formatting (see `_py_str_sql()`), and '\r\n' line endings. Two exceptions that we do not expect in
+    practice: integer values >= 1e16 are formatted like floats, and string values that contain '\r' or '\n' have them
+    written as postgres does.
+
+    :param project: a Project
+    :param query: a dict as documented in `query_forecasts_for_project()`
+    :param text_io: a text file to write the CSV rows (including the header) to
+    :param max_num_rows: as passed to `query_forecasts_for_project()`
+    :return: the number of CSV rows written, including the header. returns None if the query is not supported (i.e.,
+        if not connected to postgres, or if the query has type conversion options), in which case nothing is written
+    :raises RuntimeError: if the query is invalid, or if it has more than max_num_rows prediction elements
+    """
+    if (connection.vendor != 'postgresql') or (('options' in query) and query['options']):
+        return None
+
+    error_messages, (model_ids, unit_ids, target_ids, timezero_ids, type_ints, as_of) = \
+        validate_forecasts_query(project, query)
+    if error_messages:
+        raise RuntimeError(f"invalid query. query={query}, errors={error_messages}")
+
+    forecast_models = list(project.models.all())
+    timezero_to_season_name = project.timezero_to_season_name()
+    if (not forecast_models) or (not timezero_to_season_name):  # VALUES lists below cannot be empty
+        return None
+
+    # check the number of rows first, which is much cheaper than the query itself b/c it does not touch PredictionData
+    sql = _query_forecasts_sql_for_pred_class(type_ints, model_ids, unit_ids, target_ids, timezero_ids, as_of, True)
+    sql = sql.strip().rstrip(';')
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM ({sql}) AS pred_rows;", (project.pk,))
+        num_pred_eles = cursor.fetchone()[0]
+    if num_pred_eles > max_num_rows:
+        raise RuntimeError(f"number of rows exceeded maximum. num_rows={num_pred_eles}, max_num_rows={max_num_rows}")
+
+    # the strings are the same as `_model_tz_season_class_strs()`'s. '' is passed as NULL (see `_py_str_sql()`)
+    model_values = [(forecast_model.pk, forecast_model.abbreviation or forecast_model.name or None)
+                    for forecast_model in forecast_models]
+    timezero_values = [(timezero.pk, timezero.timezero_date.strftime(YYYY_MM_DD_DATE_FORMAT), season_name or None)
+                       for timezero, season_name in timezero_to_season_name.items()]
+    class_case = ' '.join(f"WHEN {class_int} THEN '{class_name}'"
+                          for class_int, class_name in PRED_CLASS_INT_TO_NAME.items())
+    copy_sql = f"""
+        COPY (
+            SELECT m.model_str,
+                   tz.timezero_str,
+                   tz.season,
+                   NULLIF(u.abbreviation, ''),
+                   NULLIF(t.name, ''),
+                   CASE pred_rows.pred_class {class_case} END,
+                   {_py_str_sql('ele.value')},
+                   {_py_str_sql('ele.cat')},
+                   {_py_str_sql('ele.prob')},
+                   {_py_str_sql('ele.sample')},
+                   {_py_str_sql('ele.quantile')},
+                   {_py_str_sql("pred_rows.pred_data -> 'family'")},
+                   {_py_str_sql("pred_rows.pred_data -> 'param1'")},
+                   {_py_str_sql("pred_rows.pred_data -> 'param2'")},
+                   {_py_str_sql("pred_rows.pred_data -> 'param3'")}
+            FROM ({sql}) AS pred_rows
+                     JOIN (VALUES {', '.join(['(%s, %s)'] * len(model_values))}) AS m (id, model_str)
+                          ON pred_rows.fm_id = m.id
+                     JOIN (VALUES {', '.join(['(%s, %s, %s)'] * len(timezero_values))})
+                              AS tz (id, timezero_str, season)
+                          ON pred_rows.tz_id = tz.id
+                     JOIN {Unit._meta.db_table} AS u ON pred_rows.unit_id = u.id
+                     JOIN {Target._meta.db_table} AS t ON pred_rows.target_id = t.id
+                     CROSS JOIN LATERAL (
+                SELECT NULL::jsonb AS value, cat.elem AS cat, prob.elem AS prob, NULL::jsonb AS sample,
+                       NULL::jsonb AS quantile, cat.idx AS idx
+                FROM jsonb_array_elements(pred_rows.pred_data -> 'cat') WITH ORDINALITY AS cat (elem, idx)
+                         JOIN jsonb_array_elements(pred_rows.pred_data -> 'prob') WITH ORDINALITY AS prob (elem, idx)
+                              ON cat.idx = prob.idx
+                WHERE pred_rows.pred_class = {PredictionElement.BIN_CLASS}
+                UNION ALL
+                SELECT pred_rows.pred_data -> 'value', NULL, NULL, NULL, NULL, 1
+                WHERE pred_rows.pred_class IN ({PredictionElement.NAMED_CLASS}, {PredictionElement.POINT_CLASS})
+                UNION ALL
+                SELECT value.elem, NULL, NULL, NULL, quantile.elem, quantile.idx
+                FROM jsonb_array_elements(pred_rows.pred_data -> 'quantile') WITH ORDINALITY AS quantile (elem, idx)
+                         JOIN jsonb_array_elements(pred_rows.pred_data -> 'value') WITH ORDINALITY AS value (elem, idx)
+                              ON quantile.idx = value.idx
+                WHERE pred_rows.pred_class = {PredictionElement.QUANTILE_CLASS}
+                UNION ALL
+                SELECT NULL, NULL, NULL, sample.elem, NULL, sample.idx
+                FROM jsonb_array_elements(pred_rows.pred_data -> 'sample') WITH ORDINALITY AS sample (elem, idx)
+                WHERE pred_rows.pred_class = {PredictionElement.SAMPLE_CLASS}
+                ) AS ele
+            ORDER BY pred_rows.fm_id, pred_rows.tz_id, pred_rows.unit_id, pred_rows.target_id, pred_rows.pred_class,
+                     ele.idx
+        ) TO STDOUT WITH CSV;
+    """
+    params = [project.pk] + [value for row in model_values for value in row] \
+             + [value for row in timezero_values for value in row]
+    logger.debug(f"copy_forecasts_query_csv(): 1/2 copying. num_pred_eles={num_pred_eles}, query={query}, "
+                 f"project={project}")
+    csv.writer(text_io).writerow(FORECAST_CSV_HEADER)
+    copy_writer = _CopyCsvWriter(text_io)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(cursor.mogrify(copy_sql, params).decode(), copy_writer)
+    logger.debug(f"copy_forecasts_query_csv(): 2/2 done. num_rows={copy_writer.num_rows + 1}")
+    return copy_writer.num_rows + 1  # header
+
+
+def _py_str_sql(jsonb_expr):
+    """
+    `copy_forecasts_query_csv()` helper.
+
+    :param jsonb_expr: an SQL expression for a scalar jsonb value (or NULL) as stored by PredictionData
+    :return: an SQL expression for the text that `csv.writer()` writes for the value that `json.loads()` returns for
+        jsonb_expr, i.e., Python's `str()` of it, or NULL for '' and None. Strings and booleans are simple. Numbers
+        are stored by `canonical_json_for_prediction_data_dict()` as Python formats them, which postgres's numeric
+        text matches (digits, and integers vs. floats like '1' vs. '1.0') except when Python uses exponent notation:
+        for floats whose absolute value is < 1e-4 (e.g., '1.5e-05' vs. '0.000015') or >= 1e16 ('1e+16' vs.
+        '10000000000000000'). we build those from the number's significant digits and exponent
+    """
+    scalar_text = f"(({jsonb_expr}) #>> '{{}}')"
+    abs_text = f"abs(({jsonb_expr})::numeric)::text"
+    digits = f"rtrim(ltrim(regexp_replace({abs_text}, '[^0-9]', '', 'g'), '0'), '0')"
+    fraction = f"split_part({abs_text}, '.', 2)"
+    exponent = f"""(CASE WHEN abs(({jsonb_expr})::numeric) < 1
+                         THEN length(ltrim({fraction}, '0')) - length({fraction}) - 1
+                         ELSE length(split_part({abs_text}, '.', 1)) - 1 END)"""
+    exponent_text = f"""(CASE WHEN ({jsonb_expr})::numeric < 0 THEN '-' ELSE '' END
+                         || left({digits}, 1)
+                         || CASE WHEN length({digits}) > 1 THEN '.' || substr({digits}, 2) ELSE '' END
+                         || 'e' || CASE WHEN {exponent} < 0 THEN '-' ELSE '+' END
+                         || lpad(abs({exponent})::text, 2, '0'))"""
+    return f"""CASE jsonb_typeof({jsonb_expr})
+                   WHEN 'string' THEN NULLIF({scalar_text}, '')
+                   WHEN 'boolean' THEN CASE WHEN ({jsonb_expr})::boolean THEN 'True' ELSE 'False' END
+                   WHEN 'number' THEN
+                       CASE WHEN (({jsonb_expr})::numeric <> 0 AND abs(({jsonb_expr})::numeric) < 1e-4)
+                                 OR abs(({jsonb_expr})::numeric) >= 1e16
+                            THEN {exponent_text}
+                            ELSE {scalar_text} END
+                   END"""
+
+
+class _CopyCsvWriter(io.TextIOBase):
+    """
+    `copy_forecasts_query_csv()` helper: a write-only text file for `cursor.copy_expert()` that passes rows through to
+    another text file, converting postgres's '\n' line endings to `csv.writer()`'s '\r\n', and counts them. psycopg2
+    writes one row per `write()` call, so only each call's final '\n' is a line ending. (psycopg2 passes str rather
+    than bytes b/c we are a TextIOBase.)
+    """
+
+
+    def __init__(self, text_io):
+        super().__init__()
+        self.text_io = text_io
+        self.num_rows = 0
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        if data.endswith('\n'):
+            data = data[:-1] + '\r\n'
+            self.num_rows += 1
+        return self.text_io.write(data)
+
+
 def _query_forecasts_sql_for_pred_class(pred_classes, model_ids, unit_ids, target_ids, timezero_ids, as_of,
-                                        is_exclude_oracle, is_include_retract=False, is_type_convert=False):
+                                        is_exclude_oracle, is_include_retract=False, is_type_convert=False,
+                                        is_ordered=False):
     """
     A `query_forecasts_for_project()` helper that returns an SQL query string based on my args that, when executed,
     returns a list of 7-tuples: (forecast_model_id, timezero_id, pred_class, unit_id, target_id, is_retract, pred_data),
@@ -207,26 +403,36 @@ def _query_forecasts_sql_for_pred_class(pred_classes, model_ids, unit_ids, targe
     :param is_include_retract: as passed to query_forecasts_for_project()
     :param is_type_convert: a flag that indicates the caller is _query_forecasts_for_project_yes_type_convert(), which
         changes the query to ignore `pred_classes`, SELECT different columns, and do an ORDER BY
+    :param is_ordered: True if rows should be ordered by (forecast_model_id, timezero_id, unit_id, target_id,
+        pred_class), which makes query output deterministic (see `copy_forecasts_query_csv()`). ignored if
+        is_type_convert, which has its own ORDER BY
     :return SQL to execute. returns columns as described above
     """
-    # about the query: the ranked_rows CTE groups prediction elements and then ranks then in issued_at order, which
-    # implements our masking (newer issued_ats mask older ones) and merging (discarded duplicates are merged back in
-    # via previous versions) search semantics. it is crucial that the CTE /not/ include is_retract b/c that's how
-    # retractions are implemented: they are ranked higher than the prediction elements they mask if they're newer.
-    # retracted ones are optionally removed in the outer query. the outer query's LEFT JOIN is to cover retractions,
-    # which do not have prediction data.
+    # about the query: the ranked_rows CTE selects, for each (model, timezero, unit, target, pred_class), the prediction
+    # elements that are latest as of `as_of`, which implements our masking (newer issued_ats mask older ones) and
+    # merging (discarded duplicates are merged back in via previous versions) search semantics. (the name is historical:
+    # it used to rank all versions via a window function.) there are two sources:
+    # - no as_of and retractions are excluded: the LatestPredictionElement table, which holds exactly those rows
+    # - o/w: PredictionElement's validity intervals (see `PredictionElement.valid_from`), i.e., a range lookup. it is
+    #   crucial that this /not/ filter on is_retract b/c that's how retractions are implemented: their intervals end the
+    #   intervals of the prediction elements they mask. retracted ones are optionally removed in the outer query
+    # the outer query's LEFT JOIN is to cover retractions, which do not have prediction data
+    is_use_latest = (not as_of) and (not is_include_retract)
     and_oracle = f"AND NOT fm.is_oracle" if is_exclude_oracle else ""
     and_model_ids = f"AND fm.id IN ({', '.join(map(str, model_ids))})" if model_ids else ""
     and_pred_classes = "" if (is_type_convert or not pred_classes) else \
         f"AND pred_ele.pred_class IN ({', '.join(map(str, pred_classes))})"
     and_unit_ids = f"AND pred_ele.unit_id IN ({', '.join(map(str, unit_ids))})" if unit_ids else ""
     and_target_ids = f"AND pred_ele.target_id IN ({', '.join(map(str, target_ids))})" if target_ids else ""
-    and_timezero_ids = f"AND f.time_zero_id IN ({', '.join(map(str, timezero_ids))})" if timezero_ids else ""
+    tz_id_column = 'pred_ele.time_zero_id' if is_use_latest else 'f.time_zero_id'
+    and_timezero_ids = f"AND {tz_id_column} IN ({', '.join(map(str, timezero_ids))})" if timezero_ids else ""
     and_is_retract = "" if is_include_retract else "AND NOT ranked_rows.is_retract"
 
-    # set and_issued_at. NB: `as_of.isoformat()` (e.g., '2021-05-05T16:11:47.302099+00:00') works with postgres but not
+    # set and_is_valid. NB: `as_of.isoformat()` (e.g., '2021-05-05T16:11:47.302099+00:00') works with postgres but not
     # sqlite. however, the default str ('2021-05-05 16:11:47.302099+00:00') works with both
-    and_issued_at = f"AND f.issued_at <= '{as_of}'" if as_of else ""
+    and_is_valid = f"AND pred_ele.valid_from <= '{as_of}' " \
+                   f"AND (pred_ele.valid_to IS NULL OR pred_ele.valid_to > '{as_of}')" if as_of \
+        else "AND pred_ele.valid_to IS NULL"
 
     # set select_from and order_by
     if is_type_convert:
@@ -249,10 +455,28 @@ def _query_forecasts_sql_for_pred_class(pred_classes, model_ids, unit_ids, targe
                           FROM ranked_rows
                                    LEFT JOIN {PredictionData._meta.db_table} AS pred_data
                                        ON ranked_rows.pred_ele_id = pred_data.pred_ele_id"""
-        order_by = ""
-
-    sql = f"""
-        WITH ranked_rows AS (
+        order_by = f"""ORDER BY ranked_rows.fm_id, ranked_rows.tz_id, ranked_rows.unit_id, ranked_rows.target_id,
+                               ranked_rows.pred_class""" if is_ordered else ""
+
+    # set ranked_rows. NB: both versions have the same columns (including a constant rownum) so that select_from works
+    # with either
+    if is_use_latest:
+        ranked_rows = f"""
+            SELECT pred_ele.forecast_model_id  AS fm_id,
+                   pred_ele.time_zero_id       AS tz_id,
+                   pred_ele.pred_ele_id        AS pred_ele_id,
+                   pred_ele.pred_class         AS pred_class,
+                   pred_ele.unit_id            AS unit_id,
+                   pred_ele.target_id          AS target_id,
+                   (1 = 0)                     AS is_retract,
+                   1                           AS rownum
+            FROM {LatestPredictionElement._meta.db_table} AS pred_ele
+                JOIN {ForecastModel._meta.db_table} AS fm on pred_ele.forecast_model_id = fm.id
+            WHERE fm.project_id = %s
+                {and_oracle} {and_model_ids} {and_pred_classes} {and_unit_ids} {and_target_ids} {and_timezero_ids}
+        """
+    else:
+        ranked_rows = f"""
             SELECT f.forecast_model_id  AS fm_id,
                    f.time_zero_id       AS tz_id,
                    pred_ele.id          AS pred_ele_id,
@@ -260,16 +484,16 @@ def _query_forecasts_sql_for_pred_class(pred_classes, model_ids, unit_ids, targe
                    pred_ele.unit_id     AS unit_id,
                    pred_ele.target_id   AS target_id,
                    pred_ele.is_retract  AS is_retract,
-                   RANK() OVER (
-                       PARTITION BY fm.id, f.time_zero_id, pred_ele.unit_id, pred_ele.target_id, pred_ele.pred_class
-                       ORDER BY f.issued_at DESC) AS rownum
+                   1                    AS rownum
             FROM {PredictionElement._meta.db_table} AS pred_ele
-                             JOIN {Forecast._meta.db_table} AS f
-            ON pred_ele.forecast_id = f.id
-                JOIN {ForecastModel._meta.db_table} AS fm on f.forecast_model_id = fm.id
+                     JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+                     JOIN {ForecastModel._meta.db_table} AS fm on f.forecast_model_id = fm.id
             WHERE fm.project_id = %s
-                {and_oracle} {and_model_ids} {and_pred_classes} {and_unit_ids} {and_target_ids} {and_timezero_ids} {and_issued_at}
-        )
+                {and_oracle} {and_model_ids} {and_pred_classes} {and_unit_ids} {and_target_ids} {and_timezero_ids} {and_is_valid}
+        """
+
+    sql = f"""
+        WITH ranked_rows AS ({ranked_rows})
         {select_from}
         WHERE ranked_rows.rownum = 1 {and_is_retract}
         {order_by};
@@ -415,6 +639,18 @@ def _validate_as_of(query):
 # _query_forecasts_for_project_yes_type_convert()
 #
 
+# the number of PEs whose rows `_query_forecasts_for_project_yes_type_convert()` processes at a time. conversions from
+# named distributions, from samples to bins, and from bins to points and quantiles are computed for a whole batch at
+# once, which is much faster than one PE at a time
+CONVERT_BATCH_SIZE = 10_000
+
+# maps destination prediction classes that can be converted to from named distributions to their query options
+NAMED_CONVERT_PRED_CLASS_TO_OPTION = {PredictionElement.BIN_CLASS: 'convert.bin',
+                                      PredictionElement.POINT_CLASS: 'convert.point',
+                                      PredictionElement.QUANTILE_CLASS: 'convert.quantile',
+                                      PredictionElement.SAMPLE_CLASS: 'convert.sample'}
+
+
 def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows, model_ids, unit_ids, target_ids,
                                                   timezero_ids, type_ints, as_of, forecast_model_id_to_obj,
                                                   timezero_id_to_obj, unit_id_to_obj, target_id_to_obj,
@@ -434,12 +670,13 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
     # OR b) is a valid "source" that can generate the requested destination. recall that validation of `query` requires
     # that it includes `types` to be valid if there are any `options`
     pe_id_dst_pred_classes = []  # 2-tuples: (pe_id, dst_pred_class). filled next
+    target_id_to_lwrs = _target_id_to_lwrs(project)  # for conversions to and from bins
     sql = _query_forecasts_sql_for_pred_class(type_ints, model_ids, unit_ids, target_ids, timezero_ids, as_of, True,
                                               is_type_convert=True)
     logger.debug(f"_query_forecasts_for_project_yes_type_convert(): 1/4 getting filtered PEs. model_ids, unit_ids, "
                  f"target_ids, timezero_ids, as_of= {model_ids}, {unit_ids}, {target_ids}, {timezero_ids}, {as_of}")
     num_rows = 0
-    with connection.cursor() as cursor:
+    with streaming_cursor() as cursor:
         cursor.execute(sql, (project.pk,))
         for (fm_id, tz_id, unit_id, target_id), pe_id_class_grouper in \
                 groupby(batched_rows(cursor), key=lambda _: (_[0], _[1], _[2], _[3])):
@@ -448,7 +685,9 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
             # counting rows. we need the former to decide which PEs to get data for in the second loop. conveniently we
             # index into it using src_pred_class (PRED_CLASS_CHOICES) - we know there's only one prediction of a
             # particular type per group.
-            # NB: todo currently we only support: 1) target types: continuous, discrete. 2) conversions: P <- S
+            # NB: todo currently we only support: 1) target types: continuous, discrete. 2) conversions: B, P, Q <- S,
+            # B, P, Q, S <- N, P, Q <- B, and P, Q <- Q. when more than one source can be converted, the first of those
+            # (in that order) is used, except that quantiles are always converted from quantiles if there are any
             src_bnpsq_ids = [None, None, None, None, None]  # PRED_CLASS_CHOICES order
 
             # pass 1/2: loop over available ("source") PE types:
@@ -464,7 +703,8 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
             # can convert. NB: these elifs must match those in `_generate_query_rows_yes_type_convert()`
             for dst_pred_class in list(PRED_CLASS_INT_TO_NAME.keys()) if not type_ints else type_ints:
                 if src_bnpsq_ids[dst_pred_class] is not None:
-                    # we have the requested type - no conversion needed
+                    # we have the requested type - no conversion needed, except that numeric quantiles are
+                    # interpolated onto the 'convert.quantile' levels (see `_convert_quantile_pred_datas()`)
                     pe_id_dst_pred_classes.append((src_bnpsq_ids[dst_pred_class], dst_pred_class))
                 elif (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE,
                                                            Target.DISCRETE_TARGET_TYPE]) \
@@ -480,18 +720,46 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
                         and ('convert.quantile' in query_options):
                     # we have a currently-supported conversion
                     pe_id_dst_pred_classes.append((src_bnpsq_ids[PredictionElement.SAMPLE_CLASS], dst_pred_class))
+                elif (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE,
+                                                           Target.DISCRETE_TARGET_TYPE]) \
+                        and (src_bnpsq_ids[PredictionElement.SAMPLE_CLASS] is not None) \
+                        and (dst_pred_class == PredictionElement.BIN_CLASS) \
+                        and query_options.get('convert.bin') \
+                        and target_id_to_lwrs[target_id]:
+                    # we have a currently-supported conversion. NB: bins are the target's, so it must have some
+                    pe_id_dst_pred_classes.append((src_bnpsq_ids[PredictionElement.SAMPLE_CLASS], dst_pred_class))
+                elif (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE,
+                                                           Target.DISCRETE_TARGET_TYPE]) \
+                        and (src_bnpsq_ids[PredictionElement.NAMED_CLASS] is not None) \
+                        and (dst_pred_class in NAMED_CONVERT_PRED_CLASS_TO_OPTION) \
+                        and query_options.get(NAMED_CONVERT_PRED_CLASS_TO_OPTION[dst_pred_class]) \
+                        and ((dst_pred_class != PredictionElement.BIN_CLASS) or target_id_to_lwrs[target_id]):
+                    # we have a currently-supported conversion. NB: bins are the target's, so it must have some
+                    pe_id_dst_pred_classes.append((src_bnpsq_ids[PredictionElement.NAMED_CLASS], dst_pred_class))
+                elif (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE,
+                                                           Target.DISCRETE_TARGET_TYPE]) \
+                        and (src_bnpsq_ids[PredictionElement.BIN_CLASS] is not None) \
+                        and (dst_pred_class in [PredictionElement.POINT_CLASS, PredictionElement.QUANTILE_CLASS]) \
+                        and (NAMED_CONVERT_PRED_CLASS_TO_OPTION[dst_pred_class] in query_options) \
+                        and target_id_to_lwrs[target_id]:
+                    # we have a currently-supported conversion. NB: the bins' bounds are the target's lwrs
+                    pe_id_dst_pred_classes.append((src_bnpsq_ids[PredictionElement.BIN_CLASS], dst_pred_class))
+                elif (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE,
+                                                           Target.DISCRETE_TARGET_TYPE]) \
+                        and (src_bnpsq_ids[PredictionElement.QUANTILE_CLASS] is not None) \
+                        and (dst_pred_class == PredictionElement.POINT_CLASS) \
+                        and ('convert.point' in query_options):
+                    # we have a currently-supported conversion
+                    pe_id_dst_pred_classes.append((src_bnpsq_ids[PredictionElement.QUANTILE_CLASS], dst_pred_class))
 
     # insert the PE rows (pe_id_dst_pred_classes) into a TEMP TABLE for the final JOIN. we use the same insert method as in
     # `_insert_pred_ele_rows()`: dispatch based on vendor
     logger.debug(f"_query_forecasts_for_project_yes_type_convert(): 2/4 creating temp table")
-    temp_table_name = 'pred_ele_temp'
+    temp_table_name = unique_temp_table_name('pred_ele_temp')
     column_names = ('pe_id', 'dst_class')  # both INTEGER
-    with connection.cursor() as cursor:
-        cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
-
     with connection.cursor() as cursor:
         columns_sql = ', '.join([f'{col_name} INTEGER' for col_name in column_names])
-        cursor.execute(f"CREATE TEMP TABLE {temp_table_name}({columns_sql});")
+        cursor.execute(f"CREATE TEMP TABLE {temp_table_name}({columns_sql}) {temp_table_on_commit_sql()};")
 
     with connection.cursor() as cursor:
         if connection.vendor == 'postgresql':
@@ -511,7 +779,8 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
     # JOIN temp table with PredictionData to get the final CSV-ready rows
     logger.debug(f"_query_forecasts_for_project_yes_type_convert(): 3/4 getting final PEs with data")
     sql = f"""
-        SELECT f.forecast_model_id          AS fm_id,
+        SELECT pred_ele.id                  AS pe_id,
+               f.forecast_model_id          AS fm_id,
                f.time_zero_id               AS tz_id,
                pred_ele.unit_id             AS unit_id,
                pred_ele.target_id           AS target_id,
@@ -527,19 +796,26 @@ def _query_forecasts_for_project_yes_type_convert(project, query, max_num_rows,
                      ON pred_ele.forecast_id = f.id
         WHERE pred_ele.id IN (SELECT pe_id FROM {temp_table_name});
     """
-    with connection.cursor() as cursor:
-        cursor.execute(sql)
-        for fm_id, tz_id, unit_id, target_id, pred_class, pred_data, dst_class in batched_rows(cursor):
-            # counterintuitively must use json.loads per https://code.djangoproject.com/ticket/31991
-            pred_data = json.loads(pred_data)
-            if pred_class == dst_class:  # no conversion needed
-                yield from _generate_query_rows_no_type_convert(
-                    fm_id, tz_id, unit_id, target_id, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
-                    target_id_to_obj, timezero_to_season_name, pred_class, pred_data)
-            else:  # need to convert FROM pred_class ("source") TO dst_class ("destination")
-                yield from _generate_query_rows_yes_type_convert(
-                    fm_id, tz_id, unit_id, target_id, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
-                    target_id_to_obj, timezero_to_season_name, pred_class, pred_data, dst_class, query_options)
+    try:
+        with streaming_cursor() as cursor:
+            cursor.execute(sql)
+            # we process rows in batches so that most conversions (see `_generate_query_rows_for_batch()`) can be
+            # computed for all of a batch's PEs at once. a batch's rows are yielded in their original order
+            batch = []  # 8-tuples: (pe_id, fm_id, tz_id, unit_id, target_id, pred_class, pred_data, dst_class)
+            for pe_id, fm_id, tz_id, unit_id, target_id, pred_class, pred_data, dst_class in batched_rows(cursor):
+                # counterintuitively must use json.loads per https://code.djangoproject.com/ticket/31991
+                batch.append((pe_id, fm_id, tz_id, unit_id, target_id, pred_class, json.loads(pred_data), dst_class))
+                if len(batch) == CONVERT_BATCH_SIZE:
+                    yield from _generate_query_rows_for_batch(
+                        batch, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj, target_id_to_obj,
+                        timezero_to_season_name, target_id_to_lwrs, query_options)
+                    batch = []
+            yield from _generate_query_rows_for_batch(
+                batch, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj, target_id_to_obj,
+                timezero_to_season_name, target_id_to_lwrs, query_options)
+    finally:  # we're a generator, so we might be closed before we finish
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name};")
 
     logger.debug(f"_query_forecasts_for_project_yes_type_convert(): 4/4 done. num_rows={num_rows}, query={query}, "
                  f"project={project}")
@@ -578,6 +854,371 @@ def _generate_query_rows_yes_type_convert(fm_id, tz_id, unit_id, target_id, fore
                                                         timezero_to_season_name, dst_pred_class, out_pred_data)
 
 
+def _generate_query_rows_for_batch(batch, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                                   target_id_to_obj, timezero_to_season_name, target_id_to_lwrs, query_options):
+    """
+    A _query_forecasts_for_project_yes_type_convert() helper that yields the rows for batch, a list of 8-tuples as
+    documented in the caller, in order. Conversions from named distributions, from samples to bins, from bins and
+    quantiles to points and quantiles are done for the whole batch via `_convert_named_pred_datas()`,
+    `_convert_bin_pred_datas()`, and `_convert_quantile_pred_datas()`, and all others one PE at a time via
+    `_generate_query_rows_yes_type_convert()`.
+    """
+    batch_idx_to_converted_pred_data = _convert_named_pred_datas(batch, target_id_to_obj, target_id_to_lwrs,
+                                                                 query_options)
+    batch_idx_to_converted_pred_data.update(_convert_bin_pred_datas(batch, target_id_to_obj, target_id_to_lwrs,
+                                                                    query_options))
+    batch_idx_to_converted_pred_data.update(_convert_quantile_pred_datas(batch, target_id_to_obj, query_options))
+    for batch_idx, (pe_id, fm_id, tz_id, unit_id, target_id, pred_class, pred_data, dst_class) in enumerate(batch):
+        if batch_idx in batch_idx_to_converted_pred_data:  # already converted. NB: includes some quantiles -> quantiles
+            out_pred_data = batch_idx_to_converted_pred_data[batch_idx]
+            if out_pred_data is not None:
+                yield from _generate_query_rows_no_type_convert(
+                    fm_id, tz_id, unit_id, target_id, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                    target_id_to_obj, timezero_to_season_name, dst_class, out_pred_data)
+        elif pred_class == dst_class:  # no conversion needed
+            yield from _generate_query_rows_no_type_convert(
+                fm_id, tz_id, unit_id, target_id, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                target_id_to_obj, timezero_to_season_name, pred_class, pred_data)
+        else:  # need to convert FROM pred_class ("source") TO dst_class ("destination")
+            yield from _generate_query_rows_yes_type_convert(
+                fm_id, tz_id, unit_id, target_id, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                target_id_to_obj, timezero_to_season_name, pred_class, pred_data, dst_class, query_options)
+
+
+def _convert_named_pred_datas(batch, target_id_to_obj, target_id_to_lwrs, query_options):
+    """
+    A _generate_query_rows_for_batch() helper that converts batch's named PEs to their destination types. PEs are
+    grouped by family and destination type (and target, for bins) so that each group is evaluated via a single call to
+    one of the vectorized functions in utils/named_distributions.py . NB: the conversions done here must match the named
+    elif in `_query_forecasts_for_project_yes_type_convert()`.
+
+    :return: a dict that maps the index in batch of each named PE that needs converting to its converted prediction
+        data, which is in the destination type's format, e.g., {'quantile': [...], 'value': [...]} for quantiles
+    """
+    # avoid circular imports:
+    from utils.named_distributions import is_discrete_family, named_bin_probs, named_means, named_medians, \
+        named_quantiles, named_samples
+
+
+    group_key_to_batch_idxs = defaultdict(list)  # (family, dst_class, target_id or None) -> batch indexes
+    for batch_idx, (_, _, _, _, target_id, pred_class, pred_data, dst_class) in enumerate(batch):
+        if (pred_class == PredictionElement.NAMED_CLASS) and (dst_class != PredictionElement.NAMED_CLASS):
+            group_key_to_batch_idxs[(pred_data['family'], dst_class,
+                                     target_id if dst_class == PredictionElement.BIN_CLASS else None)].append(batch_idx)
+
+    batch_idx_to_named_pred_data = {}  # return value. filled next
+    for (family, dst_class, target_id), batch_idxs in group_key_to_batch_idxs.items():
+        param1 = [batch[batch_idx][6]['param1'] for batch_idx in batch_idxs]
+        param2 = [batch[batch_idx][6].get('param2', 0) for batch_idx in batch_idxs]
+        is_discrete = is_discrete_family(family)
+        if dst_class == PredictionElement.POINT_CLASS:
+            if query_options['convert.point'] == 'mean':
+                values = named_means(family, param1, param2).tolist()
+            else:
+                values = _converted_values(named_medians(family, param1, param2), is_discrete)
+            out_pred_datas = [{'value': value} for value in values]
+        elif dst_class == PredictionElement.QUANTILE_CLASS:
+            quantiles = sorted(query_options['convert.quantile'])  # assume validated via `_validate_quantile_list()`
+            values = named_quantiles(family, param1, param2, quantiles)
+            out_pred_datas = [{'quantile': quantiles, 'value': _converted_values(row_values, is_discrete)}
+                              for row_values in values]
+        elif dst_class == PredictionElement.SAMPLE_CLASS:
+            seeds = [batch[batch_idx][0] for batch_idx in batch_idxs]  # pe_id, so PEs' samples don't change by query
+            values = named_samples(family, param1, param2, seeds, query_options['convert.sample'])
+            out_pred_datas = [{'sample': _converted_values(row_values, is_discrete)} for row_values in values]
+        else:  # dst_class == PredictionElement.BIN_CLASS
+            lwrs, uppers = zip(*target_id_to_lwrs[target_id])
+            cats = _bin_cats(target_id_to_obj[target_id], lwrs)
+            out_pred_datas = [_bin_pred_data(cats, row_probs)
+                              for row_probs in named_bin_probs(family, param1, param2, lwrs, uppers).tolist()]
+        batch_idx_to_named_pred_data.update(zip(batch_idxs, out_pred_datas))
+    return batch_idx_to_named_pred_data
+
+
+def _converted_values(values, is_discrete):
+    """
+    :return: values (a numpy array) as a list, with finite values converted to ints if is_discrete
+    """
+    return [int(value) if is_discrete and math.isfinite(value) else value for value in values.tolist()]
+
+
+def _convert_bin_pred_datas(batch, target_id_to_obj, target_id_to_lwrs, query_options):
+    """
+    A _generate_query_rows_for_batch() helper that converts batch's sample PEs to bins, and its bin PEs to points and
+    quantiles. Both use the target's bins, i.e., its TargetLwrs' [lwr, upper) intervals. PEs are grouped by source
+    type, destination type, and target so that each group is converted via numpy for all of its PEs at once:
+
+    - S -> B: samples are histogrammed into the bins via `_histogram_samples()`. samples outside of all bins (i.e.,
+      below the first lwr) are dropped, and bins with zero probability are omitted
+    - B -> P, Q: bin probabilities are treated as a piecewise-linear CDF (i.e., each bin's probability is spread
+      uniformly over it) via `_bin_means()` and `_bin_quantiles()`. medians are the 0.5 quantile
+
+    NB: the conversions done here must match the S -> B and B -> P, Q elifs in
+    `_query_forecasts_for_project_yes_type_convert()`.
+
+    :return: a dict that maps the index in batch of each PE that needs converting to its converted prediction data as
+        in `_convert_named_pred_datas()`, or to None if it has no probability in any of the target's bins
+    """
+    group_key_to_batch_idxs = defaultdict(list)  # (src_class, dst_class, target_id) -> batch indexes
+    for batch_idx, (_, _, _, _, target_id, pred_class, pred_data, dst_class) in enumerate(batch):
+        if ((pred_class == PredictionElement.SAMPLE_CLASS) and (dst_class == PredictionElement.BIN_CLASS)) \
+                or ((pred_class == PredictionElement.BIN_CLASS)
+                    and (dst_class in [PredictionElement.POINT_CLASS, PredictionElement.QUANTILE_CLASS])):
+            group_key_to_batch_idxs[(pred_class, dst_class, target_id)].append(batch_idx)
+
+    batch_idx_to_bin_pred_data = {}  # return value. filled next
+    for (src_class, dst_class, target_id), batch_idxs in group_key_to_batch_idxs.items():
+        target = target_id_to_obj[target_id]
+        is_discrete = target.type == Target.DISCRETE_TARGET_TYPE
+        lwrs, uppers = (numpy.array(bounds, dtype=float) for bounds in zip(*target_id_to_lwrs[target_id]))
+        pred_datas = [batch[batch_idx][6] for batch_idx in batch_idxs]
+        if src_class == PredictionElement.SAMPLE_CLASS:  # dst_class == PredictionElement.BIN_CLASS
+            cats = _bin_cats(target, lwrs.tolist())
+            probs = _histogram_samples([pred_data['sample'] for pred_data in pred_datas], lwrs, uppers)
+            out_pred_datas = [_bin_pred_data(cats, row_probs) for row_probs in probs.tolist()]
+        else:  # src_class == PredictionElement.BIN_CLASS
+            probs = _dense_bin_probs([pred_data['cat'] for pred_data in pred_datas],
+                                     [pred_data['prob'] for pred_data in pred_datas], lwrs)
+            if dst_class == PredictionElement.POINT_CLASS:
+                if query_options['convert.point'] == 'mean':
+                    values = _bin_means(probs, lwrs, uppers, is_discrete).tolist()
+                else:
+                    values = _converted_values(_bin_quantiles(probs, lwrs, uppers, [0.5], is_discrete)[:, 0],
+                                               is_discrete)
+                out_pred_datas = [{'value': value} for value in values]
+            else:  # dst_class == PredictionElement.QUANTILE_CLASS
+                quantiles = sorted(query_options['convert.quantile'])  # assume validated
+                values = _bin_quantiles(probs, lwrs, uppers, quantiles, is_discrete)
+                out_pred_datas = [{'quantile': quantiles, 'value': _converted_values(row_values, is_discrete)}
+                                  for row_values in values]
+
+            # PEs none of whose cats are the target's have no CDF
+            out_pred_datas = [out_pred_data if row_prob > 0 else None
+                              for out_pred_data, row_prob in zip(out_pred_datas, probs.sum(axis=1))]
+        batch_idx_to_bin_pred_data.update(zip(batch_idxs, out_pred_datas))
+    return batch_idx_to_bin_pred_data
+
+
+def _histogram_samples(samples_lists, lwrs, uppers):
+    """
+    :param samples_lists: a list of n lists of samples
+    :param lwrs: a sorted numpy array of k bins' lower bounds
+    :param uppers: ""  upper bounds. bins are [lwr, upper)
+    :return: an (n, k) numpy array of the fraction of each list's samples that are in each bin
+    """
+    num_samples = numpy.array([len(samples) for samples in samples_lists])
+    samples = numpy.fromiter(chain.from_iterable(samples_lists), dtype=float, count=num_samples.sum())
+    row_idxs = numpy.repeat(numpy.arange(len(samples_lists)), num_samples)
+    bin_idxs = numpy.searchsorted(lwrs, samples, side='right') - 1  # -1 means below the first lwr
+    is_in_bin = (bin_idxs >= 0) & (samples < uppers[numpy.maximum(bin_idxs, 0)])
+    counts = numpy.zeros((len(samples_lists), len(lwrs)))
+    numpy.add.at(counts, (row_idxs[is_in_bin], bin_idxs[is_in_bin]), 1)
+    return counts / num_samples[:, numpy.newaxis]
+
+
+def _dense_bin_probs(cats_lists, probs_lists, lwrs):
+    """
+    :param cats_lists: a list of n bin predictions' 'cat' lists
+    :param probs_lists: "" 'prob' lists
+    :param lwrs: a sorted numpy array of the target's k lwrs
+    :return: an (n, k) numpy array of each prediction's probability for each of the target's bins. cats that are not
+        lwrs are ignored
+    """
+    num_cats = numpy.array([len(cats) for cats in cats_lists])
+    cats = numpy.fromiter(chain.from_iterable(cats_lists), dtype=float, count=num_cats.sum())
+    probs = numpy.fromiter(chain.from_iterable(probs_lists), dtype=float, count=num_cats.sum())
+    row_idxs = numpy.repeat(numpy.arange(len(cats_lists)), num_cats)
+    bin_idxs = numpy.minimum(numpy.searchsorted(lwrs, cats), len(lwrs) - 1)
+    is_lwr = lwrs[bin_idxs] == cats
+    dense_probs = numpy.zeros((len(cats_lists), len(lwrs)))
+    numpy.add.at(dense_probs, (row_idxs[is_lwr], bin_idxs[is_lwr]), probs[is_lwr])
+    return dense_probs
+
+
+def _bin_widths(lwrs, uppers):
+    """
+    :return: a numpy array of the widths of the bins [lwr, upper). the last bin's upper is infinite, so we use the width
+        of the one before it (or 1 if there is only one bin) to keep the CDF piecewise-linear
+    """
+    widths = uppers - lwrs
+    if numpy.isinf(widths[-1]):
+        widths[-1] = widths[-2] if len(widths) > 1 else 1.0
+    return widths
+
+
+def _bin_means(probs, lwrs, uppers, is_discrete):
+    """
+    :param probs: an (n, k) numpy array as returned by `_dense_bin_probs()`. rows need not sum to 1
+    :param is_discrete: True if the bins hold integers, in which case a bin's mean is that of the integers in it
+    :return: a numpy array of the n piecewise-linear distributions' means
+    """
+    widths = _bin_widths(lwrs, uppers)
+    midpoints = lwrs + ((widths - 1) / 2 if is_discrete else widths / 2)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return (probs @ midpoints) / probs.sum(axis=1)
+
+
+def _bin_quantiles(probs, lwrs, uppers, quantiles, is_discrete):
+    """
+    :param probs: an (n, k) numpy array as returned by `_dense_bin_probs()`. rows need not sum to 1
+    :param quantiles: a sorted list of m quantiles in [0, 1]
+    :param is_discrete: True if the bins hold integers, in which case each bin's probability is spread evenly over its
+        integers, and quantiles are the smallest integers whose CDF reaches them
+    :return: an (n, m) numpy array of the n piecewise-linear distributions' quantiles
+    """
+    widths = _bin_widths(lwrs, uppers)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        cdfs = numpy.cumsum(probs, axis=1)
+        cdfs = cdfs / cdfs[:, -1:]  # the last column is then exactly 1
+        cdfs_before = numpy.hstack([numpy.zeros((len(probs), 1)), cdfs[:, :-1]])
+
+        # each quantile's bin is the first whose CDF reaches it, skipping leading zero-probability bins (for q = 0)
+        quantiles = numpy.asarray(quantiles, dtype=float)
+        bin_idxs = numpy.sum((cdfs[:, numpy.newaxis, :] < quantiles[numpy.newaxis, :, numpy.newaxis])
+                             | (cdfs[:, numpy.newaxis, :] <= 0), axis=2)
+        bin_idxs = numpy.minimum(bin_idxs, len(lwrs) - 1)  # (n, m)
+        bin_cdfs_before = numpy.take_along_axis(cdfs_before, bin_idxs, axis=1)
+        bin_probs = numpy.take_along_axis(cdfs, bin_idxs, axis=1) - bin_cdfs_before
+        fractions = numpy.clip((quantiles - bin_cdfs_before) / bin_probs, 0, 1)
+    values = lwrs[bin_idxs] + fractions * widths[bin_idxs]
+    if is_discrete:
+        # integer k has the CDF of the piecewise-linear one at k + 1
+        values = numpy.maximum(numpy.ceil(values) - 1, lwrs[bin_idxs])
+    return values
+
+
+def _convert_quantile_pred_datas(batch, target_id_to_obj, query_options):
+    """
+    A _generate_query_rows_for_batch() helper that converts batch's quantile PEs to points and to the 'convert.quantile'
+    levels, so that all quantile PEs returned by a query share the same levels. PEs are grouped by destination type
+    and target so that each group is converted via numpy for all of its PEs at once. A PE's quantiles are treated as
+    the points (level, value) of a piecewise-linear quantile function, which is monotone b/c values are non-decreasing
+    in their levels. Levels outside of a PE's lowest and highest ones get the value at the nearest of those (i.e., the
+    function is flat beyond them). Medians are the 0.5 level, and means are the function's integral over [0, 1].
+    Discrete targets' interpolated values are rounded up to ints. NB: the conversions done here must match the
+    "no conversion needed" quantile case and Q -> P elif in `_query_forecasts_for_project_yes_type_convert()`.
+
+    :return: a dict that maps the index in batch of each PE that needs converting to its converted prediction data as
+        in `_convert_named_pred_datas()`
+    """
+    group_key_to_batch_idxs = defaultdict(list)  # (dst_class, target_id) -> batch indexes
+    for batch_idx, (_, _, _, _, target_id, pred_class, _, dst_class) in enumerate(batch):
+        if (pred_class == PredictionElement.QUANTILE_CLASS) \
+                and (target_id_to_obj[target_id].type in [Target.CONTINUOUS_TARGET_TYPE, Target.DISCRETE_TARGET_TYPE]) \
+                and (((dst_class == PredictionElement.QUANTILE_CLASS) and ('convert.quantile' in query_options))
+                     or ((dst_class == PredictionElement.POINT_CLASS) and ('convert.point' in query_options))):
+            group_key_to_batch_idxs[(dst_class, target_id)].append(batch_idx)
+
+    batch_idx_to_quantile_pred_data = {}  # return value. filled next
+    for (dst_class, target_id), batch_idxs in group_key_to_batch_idxs.items():
+        is_discrete = target_id_to_obj[target_id].type == Target.DISCRETE_TARGET_TYPE
+        levels, values = _padded_quantiles([batch[batch_idx][6] for batch_idx in batch_idxs])
+        if (dst_class == PredictionElement.POINT_CLASS) and (query_options['convert.point'] == 'mean'):
+            out_pred_datas = [{'value': value} for value in _quantile_means(levels, values).tolist()]
+        elif dst_class == PredictionElement.POINT_CLASS:  # 'median'
+            medians = _interpolate_quantiles(levels, values, [0.5])[:, 0]
+            out_pred_datas = [{'value': value}
+                              for value in _converted_values(numpy.ceil(medians) if is_discrete else medians,
+                                                             is_discrete)]
+        else:  # dst_class == PredictionElement.QUANTILE_CLASS
+            quantiles = sorted(query_options['convert.quantile'])  # assume validated
+            interp_values = _interpolate_quantiles(levels, values, quantiles)
+            if is_discrete:
+                interp_values = numpy.ceil(interp_values)
+            out_pred_datas = [{'quantile': quantiles, 'value': _converted_values(row_values, is_discrete)}
+                              for row_values in interp_values]
+        batch_idx_to_quantile_pred_data.update(zip(batch_idxs, out_pred_datas))
+    return batch_idx_to_quantile_pred_data
+
+
+def _padded_quantiles(pred_datas):
+    """
+    :param pred_datas: a list of n quantile predictions' data, i.e., dicts with 'quantile' and 'value' lists, which
+        might have different lengths and need not be sorted
+    :return: a 2-tuple of (n, k) numpy arrays: (levels, values), where k is the most quantiles in any prediction. each
+        row is sorted by level, and is padded on the right by repeating its highest level and that level's value
+    """
+    num_quantiles = numpy.array([len(pred_data['quantile']) for pred_data in pred_datas])
+    max_num_quantiles = num_quantiles.max()
+    is_pad = numpy.arange(max_num_quantiles)[numpy.newaxis, :] >= num_quantiles[:, numpy.newaxis]
+    levels = numpy.full((len(pred_datas), max_num_quantiles), numpy.inf)  # sorts to the right
+    values = numpy.zeros((len(pred_datas), max_num_quantiles))
+    levels[~is_pad] = numpy.fromiter(chain.from_iterable(pred_data['quantile'] for pred_data in pred_datas),
+                                     dtype=float, count=num_quantiles.sum())
+    values[~is_pad] = numpy.fromiter(chain.from_iterable(pred_data['value'] for pred_data in pred_datas),
+                                     dtype=float, count=num_quantiles.sum())
+    sort_idxs = numpy.argsort(levels, axis=1, kind='stable')
+    levels = numpy.take_along_axis(levels, sort_idxs, axis=1)
+    values = numpy.take_along_axis(values, sort_idxs, axis=1)
+    last_idxs = (num_quantiles - 1)[:, numpy.newaxis]
+    levels = numpy.where(is_pad, numpy.take_along_axis(levels, last_idxs, axis=1), levels)
+    values = numpy.where(is_pad, numpy.take_along_axis(values, last_idxs, axis=1), values)
+    return levels, values
+
+
+def _interpolate_quantiles(levels, values, quantiles):
+    """
+    :param levels: an (n, k) numpy array as returned by `_padded_quantiles()`
+    :param values: ""
+    :param quantiles: a sorted list of m quantile levels in [0, 1]
+    :return: an (n, m) numpy array of each row's piecewise-linear quantile function at quantiles, which is flat outside
+        of the row's levels
+    """
+    quantiles = numpy.asarray(quantiles, dtype=float)
+
+    # each quantile's segment is [levels[idx - 1], levels[idx]], where idx is the number of levels <= it
+    idxs = numpy.sum(levels[:, numpy.newaxis, :] <= quantiles[numpy.newaxis, :, numpy.newaxis], axis=2)
+    idxs = numpy.clip(idxs, 1, max(levels.shape[1] - 1, 1))
+    lo_levels = numpy.take_along_axis(levels, idxs - 1, axis=1)
+    hi_levels = numpy.take_along_axis(levels, numpy.minimum(idxs, levels.shape[1] - 1), axis=1)
+    lo_values = numpy.take_along_axis(values, idxs - 1, axis=1)
+    hi_values = numpy.take_along_axis(values, numpy.minimum(idxs, levels.shape[1] - 1), axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        fractions = numpy.where(hi_levels > lo_levels,
+                                numpy.clip((quantiles - lo_levels) / (hi_levels - lo_levels), 0, 1), 0)
+    return lo_values + fractions * (hi_values - lo_values)
+
+
+def _quantile_means(levels, values):
+    """
+    :param levels: an (n, k) numpy array as returned by `_padded_quantiles()`
+    :param values: ""
+    :return: a numpy array of the means of the n piecewise-linear quantile functions, i.e., their integrals over
+        [0, 1], which are flat outside of each row's levels
+    """
+    segment_means = (levels[:, 1:] - levels[:, :-1]) * (values[:, 1:] + values[:, :-1]) / 2  # trapezoids
+    return values[:, 0] * levels[:, 0] + segment_means.sum(axis=1) + values[:, -1] * (1 - levels[:, -1])
+
+
+def _bin_cats(target, lwrs):
+    """
+    :return: the cats of target's bins whose lower bounds are lwrs: ints for discrete targets and floats otherwise
+    """
+    return [int(lwr) for lwr in lwrs] if target.type == Target.DISCRETE_TARGET_TYPE else list(lwrs)
+
+
+def _bin_pred_data(cats, probs):
+    """
+    :return: bin prediction data for the passed cats and probs lists, omitting zero probabilities
+    """
+    cat_probs = [(cat, prob) for cat, prob in zip(cats, probs) if prob > 0]
+    return {'cat': [cat for cat, _ in cat_probs], 'prob': [prob for _, prob in cat_probs]}
+
+
+def _target_id_to_lwrs(project):
+    """
+    :return: a dict that maps the ids of project's targets to their TargetLwrs, which are (lwr, upper) 2-tuples sorted
+        by lwr. targets without lwrs map to []
+    """
+    target_id_to_lwrs = defaultdict(list)
+    for target_id, lwr, upper in TargetLwr.objects \
+            .filter(target__project=project, lwr__isnull=False) \
+            .order_by('target_id', 'lwr') \
+            .values_list('target_id', 'lwr', 'upper'):
+        target_id_to_lwrs[target_id].append((lwr, upper))
+    return target_id_to_lwrs
+
+
 #
 # _validate_query_ids()
 #
@@ -672,6 +1313,13 @@ def _validate_query_ids(project, query):
 
 QUERY_FORECAST_STATEMENT_TIMEOUT = 60
 
+# query job output formats, set via the optional 'output_format' input_json field (default: CSV). see
+# utils/query_parquet.py for the Parquet format
+QUERY_OUTPUT_FORMAT_CSV = 'csv'
+QUERY_OUTPUT_FORMAT_PARQUET = 'parquet'
+QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE = {QUERY_OUTPUT_FORMAT_CSV: 'text/csv',
+                                       QUERY_OUTPUT_FORMAT_PARQUET: 'application/vnd.apache.parquet'}
+
 
 class IterCounter(object):
     """
@@ -702,17 +1350,32 @@ def _forecasts_query_worker(job_pk):
     assumes these input_json fields are present and valid:
     - 'project_pk'
     - 'query' (assume has passed `validate_forecasts_query()`)
+
+    and that this one is optional:
+    - 'output_format': one of QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE's keys. default: QUERY_OUTPUT_FORMAT_CSV
+    """
+    _query_worker(job_pk, query_forecasts_for_project, copy_forecasts_query_csv)
+
+
+def _query_worker(job_pk, query_project_fcn, copy_query_fcn=None):
     """
-    _query_worker(job_pk, query_forecasts_for_project)
+    :param job_pk: the query Job's pk
+    :param query_project_fcn: either `query_forecasts_for_project()` or `query_truth_for_project()`
+    :param copy_query_fcn: an optional faster alternative to writing query_project_fcn's rows as CSV. it has the
+        same signature as `copy_forecasts_query_csv()`, which documents how it is called
+    """
+    job = get_object_or_404(Job, pk=job_pk)
+    _run_query_job(job, query_project_fcn, copy_query_fcn)
+    if job.parent_job_id is not None:  # a shard of a sharded query
+        _query_shard_done(job)
 
 
-def _query_worker(job_pk, query_project_fcn):
+def _run_query_job(job, query_project_fcn, copy_query_fcn):
     # imported here so that tests can patch via mock:
-    from utils.cloud_file import upload_file
+    from utils.cloud_file import upload_file_stream
 
 
     # run the query
-    job = get_object_or_404(Job, pk=job_pk)
     project = get_object_or_404(Project, pk=job.input_json['project_pk'])
     query = job.input_json['query']
     try:
@@ -740,31 +1403,30 @@ def _query_worker(job_pk, query_project_fcn):
         logger.error(job.failure_message + f". job={job}")
         return
 
-    # upload the file to cloud storage
+    # stream the rows to cloud storage. NB: rows is a generator, so this is also where the query actually runs. thus
+    # neither the rows nor the output file are ever entirely in memory: `upload_file_stream()` uploads the file in parts
+    # as they fill, and aborts the upload if anything (including a job timeout) goes wrong
+    output_format = job.input_json.get('output_format', QUERY_OUTPUT_FORMAT_CSV)
     try:
-        # we need a BytesIO for upload_file() (o/w it errors: "Unicode-objects must be encoded before hashing"), but
-        # writerows() needs a StringIO (o/w "a bytes-like object is required, not 'str'" error), so we use
-        # TextIOWrapper. BUT: https://docs.python.org/3.6/library/io.html#io.TextIOWrapper :
-        #     Text I/O over a binary storage (such as a file) is significantly slower than binary I/O over the same
-        #     storage, because it requires conversions between unicode and binary data using a character codec. This can
-        #     become noticeable handling huge amounts of text data like large log files.
-
-        # note: using a context is required o/w is closed and becomes unusable:
-        # per https://stackoverflow.com/questions/59079354/how-to-write-utf-8-csv-into-bytesio-in-python3 :
-        with io.BytesIO() as bytes_io:
-            logger.debug(f"_query_worker(): 2/4 writing rows. job={job}")
-            text_io_wrapper = io.TextIOWrapper(bytes_io, 'utf-8', newline='')
-            rows = IterCounter(rows)
-            csv.writer(text_io_wrapper).writerows(rows)
-            text_io_wrapper.flush()
-            bytes_io.seek(0)
-
-            logger.debug(f"_query_worker(): 3/4 uploading file. job={job}")
-            upload_file(job, bytes_io)  # might raise S3 exception
-            job.output_json = {'num_rows': rows.count}
-            job.status = Job.SUCCESS
-            job.save()
-            logger.debug(f"_query_worker(): 4/4 done. job={job}")
+        logger.debug(f"_query_worker(): 2/4 writing and uploading rows. output_format={output_format!r}, job={job}")
+        with upload_file_stream(job, is_text=output_format == QUERY_OUTPUT_FORMAT_CSV) as file_io:  # might raise S3 exc
+            if output_format == QUERY_OUTPUT_FORMAT_PARQUET:
+                num_rows = write_query_rows_parquet(rows, file_io)
+            else:
+                num_rows = copy_query_fcn(project, query, file_io) if copy_query_fcn else None
+                if num_rows is None:  # no copy_query_fcn, or it does not support this query
+                    rows = IterCounter(rows)
+                    csv.writer(file_io).writerows(rows)
+                    num_rows = rows.count
+        logger.debug(f"_query_worker(): 3/4 uploaded file. job={job}")
+        _set_query_job_output(job, project, num_rows)
+        job.status = Job.SUCCESS
+        job.save()
+        logger.debug(f"_query_worker(): 4/4 done. job={job}")
+    except JobTimeoutException as jte:
+        job.status = Job.TIMEOUT
+        job.save()
+        logger.error(f"_query_worker(): error: {jte!r}. job={job}")
     except (BotoCoreError, Boto3Error, ClientError, ConnectionClosedError) as aws_exc:
         job.status = Job.FAILED
         job.failure_message = f"_query_worker(): error: {aws_exc!r}"
@@ -777,6 +1439,561 @@ def _query_worker(job_pk, query_project_fcn):
         job.save()
 
 
+def _set_query_job_output(job, project, num_rows):
+    """
+    Sets the output_json (keeping its other keys) and query_hash of a successful query job that uploaded num_rows rows.
+    Makes the output available to later identical queries (see `query_cache_key()`) only if no data was loaded or
+    deleted (or, for score queries, re-scored) since the job's key was computed, i.e., if the output matches the key's
+    data version. Does not save job.
+    """
+    job.output_json = {**(job.output_json or {}), 'num_rows': num_rows}
+    query_hash = job.input_json.get('query_hash')
+    data_version = project_data_version(project, job.input_json.get('type'))
+    if query_hash and (data_version == job.input_json.get('data_version')):
+        job.query_hash = query_hash
+
+
+#
+# sharded forecast queries
+#
+# Large forecast queries are split by `plan_forecast_query_shards()` into shards that each query a subset of the models
+# (or, for a model that is large by itself, a range of its time zeros), so that they can run in parallel on separate
+# workers. Each shard runs as its own "child" Job whose `parent_job` is the sharded query's Job, and whose input_json
+# has its 'shard_idx'. As each one finishes, `_query_shard_done()` updates the parent's progress, and the last one
+# enqueues `_merge_query_shards_worker()`, which concatenates the shards' outputs into the parent's. Shards are ordered
+# by model id and then time zero id, so the merged output has the same row order as the unsharded query's.
+#
+
+def plan_forecast_query_shards(project, query, validated_query, min_num_pred_eles=QUERY_SHARD_MIN_NUM_PRED_ELES,
+                               num_shards=QUERY_SHARD_NUM_SHARDS, pred_ele_counts=None):
+    """
+    Splits a forecast query into shards of roughly equal size. Sizes are estimated from the ForecastMetaPrediction
+    counts of the newest version (as of the query's as_of) of each of the forecasts that match the query's models and
+    time zeros, scaled by the fraction of the project's units and targets that the query selects. (A version's counts
+    include the predictions it inherits from older versions.) Estimates are only used to decide whether and how to
+    split.
+
+    :param project: the Project being queried
+    :param query: a valid query as passed to `query_forecasts_for_project()`
+    :param validated_query: the second element of the 2-tuple returned by `validate_forecasts_query()` for query
+    :param min_num_pred_eles: queries that are estimated to be smaller than this are not sharded
+    :param num_shards: the number of shards to split into. the actual number can be smaller (when there are few models
+        and time zeros) or a little larger (when a large model's time zeros are split across shards)
+    :param pred_ele_counts: optional counts as returned by `forecast_query_pred_ele_counts()` for query, which saves
+        re-counting them when the caller already has. computed if None
+    :return: a list of shard queries, each of which is query restricted to a subset of models and possibly time zeros,
+        in the order their outputs should be merged. returns [] if query should not be sharded, including if it is
+        estimated to exceed MAX_NUM_QUERY_ROWS, which we leave to the unsharded query to report
+    """
+    fm_id_to_tz_id_to_class_counts, _ = pred_ele_counts or \
+                                        forecast_query_pred_ele_counts(project, query, validated_query)
+    fm_id_to_tz_id_to_count = {fm_id: {tz_id: sum(class_counts.values())
+                                       for tz_id, class_counts in tz_id_to_class_counts.items()}
+                               for fm_id, tz_id_to_class_counts in fm_id_to_tz_id_to_class_counts.items()}
+    total_count = sum(sum(tz_id_to_count.values()) for tz_id_to_count in fm_id_to_tz_id_to_count.values())
+    if (total_count < min_num_pred_eles) or (total_count > MAX_NUM_QUERY_ROWS) or (num_shards < 2):
+        return []
+
+    # assign each model to the shard that contains its midpoint in the (model id) ordered sequence of counts, except that
+    # models that are too large to fit in a shard by themselves are split into their time zeros, each assigned similarly.
+    # a shard holds either whole models or time zeros from a single model so that it can be expressed as a query
+    shard_size = total_count / num_shards
+    shards = []  # 3-tuples: (shard_idx, split_fm_id, ids). ids are fm_ids if split_fm_id is None, and tz_ids o/w
+    cumulative_count = 0
+    for fm_id, tz_id_to_count in sorted(fm_id_to_tz_id_to_count.items()):
+        fm_count = sum(tz_id_to_count.values())
+        if fm_count > shard_size:
+            for tz_id, tz_count in sorted(tz_id_to_count.items()):
+                _add_to_shards(shards, min(num_shards - 1, int((cumulative_count + tz_count / 2) / shard_size)),
+                               fm_id, tz_id)
+                cumulative_count += tz_count
+        else:
+            _add_to_shards(shards, min(num_shards - 1, int((cumulative_count + fm_count / 2) / shard_size)),
+                           None, fm_id)
+            cumulative_count += fm_count
+    if len(shards) < 2:
+        return []
+
+    # convert shards to queries. recall that model abbreviations and timezero dates are unique within a project
+    fm_id_to_abbrev = dict(project.models.values_list('id', 'abbreviation'))
+    tz_id_to_date_str = {timezero.pk: timezero.timezero_date.strftime(YYYY_MM_DD_DATE_FORMAT)
+                         for timezero in project.timezeros.all()}
+    shard_queries = []
+    for _, split_fm_id, ids in shards:
+        if split_fm_id is None:
+            shard_queries.append({**query, 'models': [fm_id_to_abbrev[fm_id] for fm_id in ids]})
+        elif len(ids) == len(fm_id_to_tz_id_to_count[split_fm_id]):  # all of the model's time zeros ended up together
+            shard_queries.append({**query, 'models': [fm_id_to_abbrev[split_fm_id]]})
+        else:
+            shard_queries.append({**query, 'models': [fm_id_to_abbrev[split_fm_id]],
+                                  'timezeros': [tz_id_to_date_str[tz_id] for tz_id in ids]})
+    return shard_queries
+
+
+def forecast_query_pred_ele_counts(project, query, validated_query):
+    """
+    Estimates the number of prediction elements of each prediction class a forecast query reads for each (model, time
+    zero), as documented in `plan_forecast_query_shards()`. Used by that function, `estimate_query_num_pred_eles()`,
+    and `estimate_forecast_query_rows()`, all of which can be passed the result so that callers that need more than one
+    of them (e.g., `_query_endpoint()`) only count once.
+
+    :return: a 2-tuple: (fm_id_to_tz_id_to_class_counts, is_complete) where the first is a dict that maps
+        forecast_model_ids to dicts that map time_zero_ids to dicts that map pred_class ints to estimated counts, and
+        is_complete is False if any of the counted forecasts has no cached metadata (see `cache_forecast_metadata()`),
+        and therefore was counted as zero
+    """
+    from forecast_app.models import ForecastMetaPrediction  # avoid circular imports
+
+
+    model_ids, unit_ids, target_ids, timezero_ids, type_ints, as_of = validated_query
+    if ('options' in query) and query['options']:  # conversions read other prediction types, so count them all
+        type_ints = []
+    type_ints = type_ints or list(PRED_CLASS_INT_TO_NAME.keys())
+    count_fields = [f'forecastmetaprediction__{PRED_CLASS_INT_TO_NAME[type_int]}_count' for type_int in type_ints]
+    forecasts_qs = Forecast.objects.filter(forecast_model__project=project, forecast_model__is_oracle=False)
+    if model_ids:
+        forecasts_qs = forecasts_qs.filter(forecast_model_id__in=model_ids)
+    if timezero_ids:
+        forecasts_qs = forecasts_qs.filter(time_zero_id__in=timezero_ids)
+    if as_of:
+        forecasts_qs = forecasts_qs.filter(issued_at__lte=as_of)
+
+    # only the newest version of each (model, time zero) counts, so iterating in issued_at order lets newer versions
+    # overwrite older ones
+    scale = (len(unit_ids) / project.units.count() if unit_ids else 1) * \
+            (len(target_ids) / project.targets.count() if target_ids else 1)
+    fm_id_to_tz_id_to_class_counts = {}  # forecast_model_id -> {time_zero_id: {pred_class: count}}
+    fm_tz_ids_no_metadata = set()
+    for fm_id, tz_id, fmp_id, *counts in forecasts_qs \
+            .order_by('forecast_model_id', 'time_zero_id', 'issued_at') \
+            .values_list('forecast_model_id', 'time_zero_id', 'forecastmetaprediction__id', *count_fields):
+        fm_id_to_tz_id_to_class_counts.setdefault(fm_id, {})[tz_id] = \
+            {type_int: (count or 0) * scale for type_int, count in zip(type_ints, counts)}
+        if fmp_id is None:
+            fm_tz_ids_no_metadata.add((fm_id, tz_id))
+        else:
+            fm_tz_ids_no_metadata.discard((fm_id, tz_id))
+    return fm_id_to_tz_id_to_class_counts, not fm_tz_ids_no_metadata
+
+
+def _add_to_shards(shards, shard_idx, split_fm_id, the_id):
+    """
+    `plan_forecast_query_shards()` helper that appends the_id to the last of shards if it has the same shard_idx and
+    split_fm_id, or to a new one o/w. thus shards are always contiguous runs of models or time zeros
+    """
+    if shards and (shards[-1][:2] == (shard_idx, split_fm_id)):
+        shards[-1][2].append(the_id)
+    else:
+        shards.append((shard_idx, split_fm_id, [the_id]))
+
+
+def _query_shard_done(shard_job):
+    """
+    Called after each shard Job of a sharded query finishes, whether successfully or not. Updates the parent Job's
+    progress, fails it if shard_job did not succeed, and enqueues the merge once all shards have succeeded. The parent
+    is locked so that shards that finish at the same time see each other's statuses, and so that exactly one of them
+    enqueues the merge.
+
+    :param shard_job: a shard Job as created by `_create_query_job()`
+    """
+    is_enqueue_merge = False
+    with transaction.atomic():
+        parent_job = Job.objects.select_for_update().get(pk=shard_job.parent_job_id)
+        if (parent_job.status != Job.QUEUED) or parent_job.output_json.get('is_merge_enqueued'):
+            return  # parent already failed due to another shard, or already merging
+
+        shard_statuses = list(Job.objects.filter(parent_job=parent_job).values_list('status', flat=True))
+        num_shards_done = sum(1 for status in shard_statuses if status == Job.SUCCESS)
+        parent_job.output_json = {**parent_job.output_json, 'num_shards_done': num_shards_done}
+        if shard_job.status != Job.SUCCESS:
+            parent_job.status = Job.FAILED
+            parent_job.failure_message = f"_query_shard_done(): shard {shard_job.input_json['shard_idx']} " \
+                                         f"{shard_job.status_as_str()}: {shard_job.failure_message}"
+            logger.error(parent_job.failure_message + f". job={parent_job}")
+        elif num_shards_done == parent_job.output_json['num_shards']:
+            parent_job.output_json['is_merge_enqueued'] = True
+            is_enqueue_merge = True
+        parent_job.save()
+
+    # enqueue after committing so that the merge sees the parent as saved above
+    if is_enqueue_merge:
+        django_rq.get_queue(QUERY_FORECAST_QUEUE_NAME).enqueue(_merge_query_shards_worker, parent_job.pk)
+
+
+def _merge_query_shards_worker(job_pk):
+    """
+    enqueue() helper function that concatenates the outputs of a sharded query's shard Jobs (in shard order, and keeping
+    only the first shard's header) into the Job with job_pk's output, and then deletes the shards' outputs.
+    """
+    # imported here so that tests can patch via mock:
+    from utils.cloud_file import delete_file, upload_file_stream
+
+
+    job = get_object_or_404(Job, pk=job_pk)
+    project = get_object_or_404(Project, pk=job.input_json['project_pk'])
+    shard_jobs = sorted(Job.objects.filter(parent_job=job),
+                        key=lambda shard_job: shard_job.input_json['shard_idx'])
+    output_format = job.input_json.get('output_format', QUERY_OUTPUT_FORMAT_CSV)
+    try:
+        logger.debug(f"_merge_query_shards_worker(): 1/3 merging shards. num_shards={len(shard_jobs)}, "
+                     f"output_format={output_format!r}, job={job}")
+        with upload_file_stream(job, is_text=output_format == QUERY_OUTPUT_FORMAT_CSV) as file_io:  # might raise S3 exc
+            if output_format == QUERY_OUTPUT_FORMAT_PARQUET:
+                concat_parquet_files(_downloaded_shard_fps(shard_jobs), file_io)
+            else:
+                for shard_idx, shard_fp in enumerate(_downloaded_shard_fps(shard_jobs)):
+                    shard_text_io = io.TextIOWrapper(shard_fp, 'utf-8', newline='')
+                    header = shard_text_io.readline()
+                    if shard_idx == 0:
+                        file_io.write(header)
+                    shutil.copyfileobj(shard_text_io, file_io)
+                    shard_text_io.detach()  # leave closing shard_fp to `_downloaded_shard_fps()`
+        # each shard counted its header:
+        num_rows = sum(shard_job.output_json['num_rows'] for shard_job in shard_jobs) - (len(shard_jobs) - 1)
+        logger.debug(f"_merge_query_shards_worker(): 2/3 uploaded file. job={job}")
+        _set_query_job_output(job, project, num_rows)
+        job.status = Job.SUCCESS
+        job.save()
+        logger.debug(f"_merge_query_shards_worker(): 3/3 done. job={job}")
+    except JobTimeoutException as jte:
+        job.status = Job.TIMEOUT
+        job.save()
+        logger.error(f"_merge_query_shards_worker(): error: {jte!r}. job={job}")
+    except (BotoCoreError, Boto3Error, ClientError, ConnectionClosedError) as aws_exc:
+        job.status = Job.FAILED
+        job.failure_message = f"_merge_query_shards_worker(): error: {aws_exc!r}"
+        job.save()
+        logger.error(job.failure_message + f". job={job}")
+    except Exception as ex:
+        job.status = Job.FAILED
+        job.failure_message = f"_merge_query_shards_worker(): error: {ex!r}"
+        job.save()
+        logger.error(job.failure_message + f". job={job}")
+    finally:
+        for shard_job in shard_jobs:
+            delete_file(shard_job)  # NB: in current thread
+
+
+def _downloaded_shard_fps(shard_jobs):
+    """
+    A `_merge_query_shards_worker()` helper that downloads each of shard_jobs' outputs in turn into a temporary file,
+    and yields it positioned at its start. each file is closed (and thereby deleted) when the next one is requested.
+    """
+    # imported here so that tests can patch via mock:
+    from utils.cloud_file import download_file
+
+
+    for shard_job in shard_jobs:
+        with tempfile.TemporaryFile() as shard_fp:  # <class '_io.BufferedRandom'>
+            download_file(shard_job, shard_fp)
+            shard_fp.seek(0)  # yes you have to do this!
+            yield shard_fp
+
+
+#
+# query result cache
+#
+# Query jobs whose queries are equivalent and that were run against the same project data produce the same output, so
+# a new query job can reuse a previous one's uploaded output rather than re-running the query. Equivalence is decided
+# by `query_cache_key()`, which hashes the normalized query together with the project's `data_version`. The latter is
+# bumped by `bump_project_data_version()` after the commit of every forecast or truth load, edit, or delete, and of
+# every save or delete of a model, unit, target, or time zero (see their post_save and post_delete signals, and
+# `execute_project_config_diff()`), which invalidates all of the project's previous keys. Score queries' keys also
+# include the project's `score_version`, which `update_scores_for_project()` bumps via `bump_project_score_version()`
+# so that re-scoring invalidates only cached score query outputs. A cache entry is simply a
+# successful query Job whose (indexed) `query_hash` is set, so entries are evicted when `delete_old_jobs_app()` deletes
+# their Jobs.
+#
+
+def bump_project_data_version(project_id):
+    """
+    Increments the `data_version` of the Project with project_id. Called whenever the project's forecast or truth data
+    or its configuration changes. The increment runs after the calling transaction commits (or at once if there is
+    none) rather than in it, so that long transactions like forecast uploads do not hold the Project row's lock until
+    they commit, which would serialize all of a project's uploads and could deadlock with `lock_forecast_versions()`.
+    Keys computed before the increment are still correct b/c their outputs are only cached if the version has not
+    changed by the time the query finishes (see `_set_query_job_output()`).
+
+    :param project_id: a Project's pk
+    """
+    transaction.on_commit(lambda: Project.objects.filter(pk=project_id).update(data_version=F('data_version') + 1))
+
+
+def bump_project_score_version(project_id):
+    """
+    Increments the `score_version` of the Project with project_id. Called whenever the project's scores change.
+
+    :param project_id: a Project's pk
+    """
+    Project.objects.filter(pk=project_id).update(score_version=F('score_version') + 1)
+
+
+def project_data_version(project, query_job_type=None):
+    """
+    :param project: a Project
+    :param query_job_type: an optional query job type. if JOB_TYPE_QUERY_SCORES then the project's `score_version` is
+        included
+    :return: project's current `data_version`, read from the database rather than from project, which might be stale.
+        for score queries, a list instead: [data_version, score_version] (a list rather than a tuple so that it equals
+        itself after a round trip through Job.input_json)
+    """
+    if query_job_type == JOB_TYPE_QUERY_SCORES:
+        return list(Project.objects.filter(pk=project.pk).values_list('data_version', 'score_version').get())
+
+    return Project.objects.filter(pk=project.pk).values_list('data_version', flat=True).get()
+
+
+def query_cache_key(project, query_job_type, query, validated_query, output_format=QUERY_OUTPUT_FORMAT_CSV):
+    """
+    Computes the key that identifies a query's output. Normalizes the query so that equivalent queries get the same
+    key: names are resolved to ids (via validated_query), lists are sorted, and as_of is converted to UTC.
+
+    :param project: the Project being queried
+    :param query_job_type: one of JOB_TYPE_QUERY_FORECAST, JOB_TYPE_QUERY_TRUTH, or JOB_TYPE_QUERY_SCORES
+    :param query: a valid query as passed to `query_forecasts_for_project()`, `query_truth_for_project()`, or
+        `query_scores_for_project()`
+    :param validated_query: the second element of the 2-tuple returned by `validate_forecasts_query()`,
+        `validate_truth_query()`, or `validate_scores_query()` for query. the last item is as_of, and the others are
+        lists of ids
+    :param output_format: the query job's output format. one of QUERY_OUTPUT_FORMAT_TO_CONTENT_TYPE's keys
+    :return: a 2-tuple: (query_hash, data_version) where query_hash is a hex string and data_version is as returned by
+        `project_data_version()` for query_job_type, which is part of the hash
+    """
+    *id_lists, as_of = validated_query
+    data_version = project_data_version(project, query_job_type)
+    normalized_query = {'type': query_job_type,
+                        'project_pk': project.pk,
+                        'data_version': data_version,
+                        'ids': [sorted(ids) for ids in id_lists],
+                        'as_of': as_of.astimezone(datetime.timezone.utc).isoformat() if as_of else None,
+                        'options': query.get('options', {}),
+                        'output_format': output_format}
+    query_json = json.dumps(normalized_query, sort_keys=True)
+    return hashlib.sha256(query_json.encode('utf-8')).hexdigest(), data_version
+
+
+def cached_query_job(query_hash):
+    """
+    :param query_hash: as returned by `query_cache_key()`
+    :return: the newest successful Job whose uploaded output is for query_hash, or None if there is none or if
+        query_hash is None (i.e., the query is not cached)
+    """
+    if query_hash is None:
+        return None
+
+    return Job.objects.filter(status=Job.SUCCESS, query_hash=query_hash).order_by('-pk').first()
+
+
+#
+# preflight row-count estimates
+#
+# `query_forecasts_for_project()` only finds out that a query is too large after reading MAX_NUM_QUERY_ROWS prediction
+# elements, which can take a worker a long time. `estimate_forecast_query_rows()` instead estimates the query's size
+# before it is enqueued, from the forecasts' cached metadata plus a small sample of the arrays of its bin, quantile,
+# and sample predictions, so that `_query_endpoint()` can reject queries that are obviously too large.
+#
+
+# the number of prediction elements of each (target, prediction class) whose arrays `estimate_forecast_query_rows()`
+# reads to estimate their average length
+NUM_ARRAY_LENGTH_SAMPLES = 10
+
+# inexact estimates (see `estimate_forecast_query_rows()`) must exceed MAX_NUM_QUERY_ROWS by this factor for
+# `is_query_estimate_too_large()` to reject them
+INEXACT_ESTIMATE_REJECT_FACTOR = 2
+
+# maps prediction classes whose data is arrays to the key of the array that has one element per CSV row
+PRED_CLASS_TO_ARRAY_KEY = {PredictionElement.BIN_CLASS: 'cat',
+                           PredictionElement.QUANTILE_CLASS: 'quantile',
+                           PredictionElement.SAMPLE_CLASS: 'sample'}
+
+
+def estimate_forecast_query_rows(project, query, validated_query, pred_ele_counts=None):
+    """
+    Estimates the size of a forecast query without running it. The number of prediction elements is estimated as
+    documented in `plan_forecast_query_shards()`. The number of CSV rows is estimated by multiplying the number of
+    prediction elements of each prediction class by the average number of rows that class's prediction elements have:
+    one for points and named distributions, and, for the others, the average length of their arrays, which is the mean
+    over the queried targets of the average of NUM_ARRAY_LENGTH_SAMPLES of the target's current prediction elements.
+    NB: for queries with conversion 'options', the estimates are of the unconverted predictions.
+
+    :param project: the Project being queried
+    :param query: a valid query as passed to `query_forecasts_for_project()`
+    :param validated_query: the second element of the 2-tuple returned by `validate_forecasts_query()` for query
+    :param pred_ele_counts: as passed to `plan_forecast_query_shards()`
+    :return: a dict with these keys:
+        - 'num_pred_eles': the estimated number of prediction elements, which is what MAX_NUM_QUERY_ROWS limits
+        - 'num_rows': the estimated number of CSV rows, excluding the header
+        - 'class_to_num_rows': a dict that maps each of the query's prediction class names to its estimated number of
+          CSV rows
+        - 'is_exact': True if 'num_pred_eles' is exact, which is the case when the query selects all units and targets,
+          has no 'options', and all of the counted forecasts have cached metadata
+        - 'is_complete': False if some of the counted forecasts have no cached metadata, which makes the estimates low
+    """
+    model_ids, unit_ids, target_ids, _, _, _ = validated_query
+    fm_id_to_tz_id_to_class_counts, is_complete = pred_ele_counts or \
+                                                  forecast_query_pred_ele_counts(project, query, validated_query)
+    class_to_count = {}  # pred_class -> count
+    for tz_id_to_class_counts in fm_id_to_tz_id_to_class_counts.values():
+        for class_counts in tz_id_to_class_counts.values():
+            for pred_class, count in class_counts.items():
+                class_to_count[pred_class] = class_to_count.get(pred_class, 0) + count
+
+    class_to_num_rows = {}  # class name -> num_rows
+    for pred_class, count in class_to_count.items():
+        avg_array_length = _avg_array_length(project, model_ids, target_ids, pred_class) \
+            if count and (pred_class in PRED_CLASS_TO_ARRAY_KEY) else 1
+        class_to_num_rows[PRED_CLASS_INT_TO_NAME[pred_class]] = round(count * avg_array_length)
+    is_options = ('options' in query) and query['options']
+    return {'num_pred_eles': round(sum(class_to_count.values())),
+            'num_rows': sum(class_to_num_rows.values()),
+            'class_to_num_rows': class_to_num_rows,
+            'is_exact': (not unit_ids) and (not target_ids) and (not is_options) and is_complete,
+            'is_complete': is_complete}
+
+
+def is_query_estimate_too_large(estimate, max_num_rows=MAX_NUM_QUERY_ROWS):
+    """
+    :param estimate: as returned by `estimate_forecast_query_rows()`
+    :param max_num_rows: as passed to `query_forecasts_for_project()`
+    :return: True if estimate shows that its query would fail b/c it reads more than max_num_rows prediction elements.
+        exact estimates only have to exceed max_num_rows, but inexact ones must exceed it by
+        INEXACT_ESTIMATE_REJECT_FACTOR so that we do not reject queries that might succeed
+    """
+    max_num_pred_eles = max_num_rows if estimate['is_exact'] else max_num_rows * INEXACT_ESTIMATE_REJECT_FACTOR
+    return estimate['num_pred_eles'] > max_num_pred_eles
+
+
+def _avg_array_length(project, model_ids, target_ids, pred_class):
+    """
+    `estimate_forecast_query_rows()` helper.
+
+    :return: the mean over target_ids (or all of project's targets if empty) of the average length of the
+        PRED_CLASS_TO_ARRAY_KEY array of NUM_ARRAY_LENGTH_SAMPLES of the target's current prediction elements of
+        pred_class from model_ids (or all of project's non-oracle models if empty). targets with no such prediction
+        elements are skipped. returns 1 if there are none at all
+    """
+    # about the query: it is a single query for all targets. for each target, the scalar subquery averages the array
+    # lengths of a LIMITed sample of its LatestPredictionElements, which lets the database use the table's index to
+    # read only the sampled rows. targets with no samples have a NULL average, which the outer AVG() ignores
+    array_key = PRED_CLASS_TO_ARRAY_KEY[pred_class]
+    array_length = f"jsonb_array_length(pred_data.data -> '{array_key}')" if connection.vendor == 'postgresql' \
+        else f"json_array_length(pred_data.data, '$.{array_key}')"
+    if model_ids:
+        join_fm = ""
+        and_models = f"AND latest.forecast_model_id IN ({', '.join(map(str, model_ids))})"
+    else:
+        join_fm = f"JOIN {ForecastModel._meta.db_table} AS fm ON latest.forecast_model_id = fm.id"
+        and_models = f"AND fm.project_id = {project.pk} AND NOT fm.is_oracle"
+    where_targets = f"target.id IN ({', '.join(map(str, target_ids))})" if target_ids \
+        else f"target.project_id = {project.pk}"
+    sql = f"""
+        SELECT AVG(target_avg_length)
+        FROM (SELECT (SELECT AVG(COALESCE({array_length}, 0))
+                      FROM {PredictionData._meta.db_table} AS pred_data
+                      WHERE pred_data.pred_ele_id IN (SELECT latest.pred_ele_id
+                                                      FROM {LatestPredictionElement._meta.db_table} AS latest
+                                                          {join_fm}
+                                                      WHERE latest.target_id = target.id
+                                                        AND latest.pred_class = %s
+                                                          {and_models}
+                                                      LIMIT %s)) AS target_avg_length
+              FROM {Target._meta.db_table} AS target
+              WHERE {where_targets}) AS target_avg_lengths;
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (pred_class, NUM_ARRAY_LENGTH_SAMPLES))
+        avg_array_length = cursor.fetchone()[0]
+    return float(avg_array_length) if avg_array_length is not None else 1
+
+
+#
+# synchronous small queries
+#
+# The synchronous query endpoints run queries that are estimated to be small right in the request, and return their CSV
+# directly, which saves the latency of a Job, an RQ enqueue, a worker, an S3 round trip, and client polling. Estimates
+# are cheap: forecast queries use the forecasts' cached metadata (see `plan_forecast_query_shards()`), and truth queries
+# use the project's numbers of units, targets, and time zeros. Estimates can be wrong, so `run_small_query()` also has a
+# short statement timeout and caps the number of rows, and gives up (so that the caller falls back to a Job) if either
+# is exceeded.
+#
+
+def estimate_query_num_pred_eles(project, query_job_type, query, validated_query, pred_ele_counts=None):
+    """
+    :param project: the Project being queried
+    :param query_job_type: either JOB_TYPE_QUERY_FORECAST or JOB_TYPE_QUERY_TRUTH
+    :param query: a valid query as passed to `query_forecasts_for_project()` or `query_truth_for_project()`
+    :param validated_query: the second element of the 2-tuple returned by `validate_forecasts_query()` or
+        `validate_truth_query()` for query
+    :param pred_ele_counts: as passed to `plan_forecast_query_shards()`. ignored for truth queries
+    :return: an estimate of the number of prediction elements that query reads, or None if there is none b/c some
+        matching forecasts have no cached metadata. truth estimates are upper bounds (except for projects whose truth
+        has duplicate rows), and forecast ones are as documented in `plan_forecast_query_shards()`
+    """
+    if query_job_type == JOB_TYPE_QUERY_TRUTH:
+        unit_ids, target_ids, timezero_ids, _ = validated_query
+        return (len(unit_ids) or project.units.count()) * (len(target_ids) or project.targets.count()) * \
+               (len(timezero_ids) or project.timezeros.count())
+
+    fm_id_to_tz_id_to_class_counts, is_complete = pred_ele_counts or \
+                                                  forecast_query_pred_ele_counts(project, query, validated_query)
+    return sum(sum(class_counts.values()) for tz_id_to_class_counts in fm_id_to_tz_id_to_class_counts.values()
+               for class_counts in tz_id_to_class_counts.values()) if is_complete else None
+
+
+def run_small_query(project, query, query_project_fcn, max_num_pred_eles=QUERY_SYNC_MAX_NUM_PRED_ELES,
+                    max_num_rows=QUERY_SYNC_MAX_NUM_ROWS):
+    """
+    Runs a query that is expected to be small in the calling thread, with a postgres `statement_timeout` of
+    QUERY_SYNC_STATEMENT_TIMEOUT seconds.
+
+    :param project: the Project being queried
+    :param query: a valid query as passed to query_project_fcn
+    :param query_project_fcn: either `query_forecasts_for_project()` or `query_truth_for_project()`
+    :param max_num_pred_eles: passed to query_project_fcn as its max_num_rows
+    :param max_num_rows: the maximum number of rows (including the header) to return
+    :return: a list of the query's rows (including the header), or None if the query timed out or was too large. in
+        that case the caller should fall back to running it via a Job. other errors are raised
+    """
+    try:
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL statement_timeout = '{QUERY_SYNC_STATEMENT_TIMEOUT}s';")
+                rows = _small_query_rows(project, query, query_project_fcn, max_num_pred_eles, max_num_rows)
+        else:
+            rows = _small_query_rows(project, query, query_project_fcn, max_num_pred_eles, max_num_rows)
+    except OperationalError as oe:  # 'canceling statement due to statement timeout'
+        logger.debug(f"run_small_query(): falling back: timed out. oe={oe!r}, query={query}, project={project}")
+        return None
+    except RuntimeError as rte:
+        # todo query_project_fcn should raise an application-specific RuntimeError subclass
+        if not rte.args[0].startswith('number of rows exceeded maximum'):
+            raise rte
+
+        logger.debug(f"run_small_query(): falling back: too many prediction elements. rte={rte!r}, query={query}, "
+                     f"project={project}")
+        return None
+
+    if rows is None:
+        logger.debug(f"run_small_query(): falling back: too many rows. max_num_rows={max_num_rows}, query={query}, "
+                     f"project={project}")
+    return rows
+
+
+def _small_query_rows(project, query, query_project_fcn, max_num_pred_eles, max_num_rows):
+    """
+    `run_small_query()` helper that runs the query to completion (and therefore within the caller's transaction).
+
+    :return: a list of rows, or None if there are more than max_num_rows of them
+    """
+    rows = []
+    for row in query_project_fcn(project, query, max_num_rows=max_num_pred_eles):
+        rows.append(row)
+        if len(rows) > max_num_rows:
+            return None
+
+    return rows
+
+
 #
 # query_truth_for_project()
 #
@@ -833,7 +2050,7 @@ def query_truth_for_project(project, query, max_num_rows=MAX_NUM_QUERY_ROWS):
     logger.debug(f"query_truth_for_project(): 2/3 executing sql. model_ids, unit_ids, target_ids, timezero_ids, "
                  f"as_of= {model_ids}, {unit_ids}, {target_ids}, {timezero_ids}, {as_of}")
     num_rows = 0
-    with connection.cursor() as cursor:
+    with streaming_cursor() as cursor:
         cursor.execute(sql, (project.pk,))
         for fm_id, tz_id, pred_class, unit_id, target_id, is_retract, pred_data in batched_rows(cursor):
             # we do not have to check is_retract b/c we pass `is_include_retract=False`, which skips retractions
@@ -897,5 +2114,8 @@ def _truth_query_worker(job_pk):
     assumes these input_json fields are present and valid:
     - 'project_pk'
     - 'query' (assume has passed `validate_truth_query()`)
+
+    and that this one is optional:
+    - 'output_format': "" `_forecasts_query_worker()`
     """
     _query_worker(job_pk, query_truth_for_project)
@@ -8,7 +8,8 @@ from django.db import transaction, connection
 
 from forecast_app.models import PredictionElement
 from forecast_app.models.prediction_element import PRED_CLASS_INT_TO_NAME
-from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, IngestStats
+from utils.validation_context import validation_context_for_project
 
 
 logger = logging.getLogger(__name__)
@@ -130,7 +131,7 @@ TRUTH_CSV_HEADER = ['timezero', 'unit', 'target', 'value']
 
 
 @transaction.atomic
-def load_truth_data(project, truth_file_path_or_fp, file_name=None, is_convert_na_none=False):
+def load_truth_data(project, truth_file_path_or_fp, file_name=None, is_convert_na_none=False, stats=None):
     """
     Loads the data in truth_file_path (see below for file format docs), implementing our truth-as-forecasts approach
     where each group of values in the file with the same timezeros are loaded as PointData within a new Forecast
@@ -161,6 +162,8 @@ def load_truth_data(project, truth_file_path_or_fp, file_name=None, is_convert_n
         combination, OR an already-open file-like object
     :param file_name: name to use for the file
     :param is_convert_na_none: as passed to Target.is_value_compatible_with_target_type()
+    :param stats: an optional IngestStats to record stage times and counts in
+    :return: a list of the ids of the TimeZeros whose truth was loaded, i.e., that got a new oracle Forecast
     """
     logger.debug(f"load_truth_data(): entered. truth_file_path_or_fp={truth_file_path_or_fp}, "
                  f"file_name={file_name}")
@@ -174,28 +177,35 @@ def load_truth_data(project, truth_file_path_or_fp, file_name=None, is_convert_n
     logger.debug(f"load_truth_data(): calling _load_truth_data()")
     # https://stackoverflow.com/questions/1661262/check-if-object-is-file-like-in-python
     if isinstance(truth_file_path_or_fp, io.IOBase):
-        num_rows = _load_truth_data(project, oracle_model, truth_file_path_or_fp, file_name, is_convert_na_none)
+        num_rows, timezero_ids = _load_truth_data(project, oracle_model, truth_file_path_or_fp, file_name,
+                                                  is_convert_na_none, stats)
     else:
         with open(str(truth_file_path_or_fp)) as truth_file_fp:
-            num_rows = _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert_na_none)
+            num_rows, timezero_ids = _load_truth_data(project, oracle_model, truth_file_fp, file_name,
+                                                      is_convert_na_none, stats)
 
     # done
     logger.debug(f"load_truth_data(): saving. num_rows: {num_rows}")
     logger.debug(f"load_truth_data(): done")
+    return timezero_ids
 
 
 @transaction.atomic
-def _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert_na_none):
+def _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert_na_none, stats=None):
     from forecast_app.models import Forecast  # avoid circular imports
     from utils.forecast import load_predictions_from_json_io_dict  # ""
 
 
+    if stats is None:
+        stats = IngestStats()
     # load, validate, and replace with objects and parsed values.
     # rows: (timezero, unit, target, parsed_value) (first three are objects)
     logger.debug(f"_load_truth_data(): entered. calling _read_truth_data_rows()")
-    rows = _read_truth_data_rows(project, truth_file_fp, is_convert_na_none)
+    with stats.stage('parse'):
+        rows = _read_truth_data_rows(project, truth_file_fp, is_convert_na_none)
+    stats.add_count('num_truth_rows', len(rows))
     if not rows:
-        return 0
+        return 0, []
 
     # group rows by timezero and then create and load oracle Forecasts for each group, passing them as
     # json_io_dicts. we leverage _load_truth_data_rows_for_forecast() by creating a json_io_dict for the truth data
@@ -213,7 +223,9 @@ def _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert
     forecasts_100pct_dup = []  # ones that raised RuntimeError "cannot load 100% duplicate data"
     logger.debug(f"_load_truth_data(): creating and loading {len(timezero_groups)} forecasts. source={source!r}")
     point_class = PRED_CLASS_INT_TO_NAME[PredictionElement.POINT_CLASS]
-    for timezero, timezero_rows in timezero_groups.items():
+    # NB: we iterate in time_zero_id order b/c each create locks its (oracle, time zero) version until the transaction
+    # ends (see `lock_forecast_versions()`), and concurrent loads that locked in file order could deadlock
+    for timezero, timezero_rows in sorted(timezero_groups.items(), key=lambda item: item[0].pk):
         forecast = Forecast.objects.create(forecast_model=oracle_model, source=source, time_zero=timezero,
                                            notes=f"oracle forecast")
         prediction_dicts = [{'unit': unit.abbreviation, 'target': target.name,
@@ -224,7 +236,8 @@ def _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert
                             for unit, target, parsed_value in timezero_rows]
         try:
             load_predictions_from_json_io_dict(forecast, {'meta': {}, 'predictions': prediction_dicts},
-                                               is_skip_validation=True, is_subset_allowed=True)  # NB: is_subset_allowed
+                                               is_skip_validation=True, is_subset_allowed=True,  # NB: is_subset_allowed
+                                               stats=stats)
             forecasts.append(forecast)
         except RuntimeError as rte:
             # todo instead of testing for a string, load_predictions_from_json_io_dict() should raise an application-
@@ -255,7 +268,7 @@ def _load_truth_data(project, oracle_model, truth_file_fp, file_name, is_convert
             forecast.save()
 
     logger.debug(f"_load_truth_data(): done")
-    return len(rows)
+    return len(rows), [forecast.time_zero_id for forecast in forecasts]
 
 
 def _read_truth_data_rows(project, csv_file_fp, is_convert_na_none):
@@ -290,8 +303,9 @@ def _read_truth_data_rows(project, csv_file_fp, is_convert_na_none):
     unit_abbrev_to_obj = {unit.abbreviation: unit for unit in project.units.all()}
     target_name_to_obj = {target.name: target for target in project.targets.all()}
     timezero_date_to_obj = {}  # caches Project.time_zero_for_timezero_date()
-    target_to_cats_values = {}  # caches Target.cats_values()
-    range_to_range_tuple = {}  # caches Target.range_tuple()
+    # validate using TargetValidators rather than Targets to avoid per-target cats and range queries
+    target_name_to_validator = validation_context_for_project(project).target_name_to_validator
+    target_to_range_tuple = {}  # caches the implicit range calculated below
     for row in csv_reader:
         if len(row) != 4:
             raise RuntimeError("Invalid row (wasn't 4 columns): {!r}".format(row))
@@ -334,17 +348,13 @@ def _read_truth_data_rows(project, csv_file_fp, is_convert_na_none):
         #   within the `range` of valid values for the target. If `cats` is specified but `range` is not, then there is
         #   an implicit range for the ground truth value, and that is between min(`cats`) and \infty.
         # recall: "The range is assumed to be inclusive on the lower bound and open on the upper bound, # e.g. [a, b)."
-        if target in target_to_cats_values:
-            cats_values = target_to_cats_values[target]
+        target_validator = target_name_to_validator[target_name]
+        cats_values = target_validator.cats_values_set  # datetime.date instances for date targets
+        if target in target_to_range_tuple:
+            range_tuple = target_to_range_tuple[target]
         else:
-            cats_values = target.cats_values()  # datetime.date instances for date targets
-            target_to_cats_values[target] = cats_values
-
-        if target in range_to_range_tuple:
-            range_tuple = range_to_range_tuple[target]
-        else:
-            range_tuple = target.range_tuple() or (min(cats_values), float('inf')) if cats_values else None
-            range_to_range_tuple[target] = range_tuple
+            range_tuple = target_validator.range_tuple() or (min(cats_values), float('inf')) if cats_values else None
+            target_to_range_tuple[target] = range_tuple
 
         if (target.type in [Target.DISCRETE_TARGET_TYPE, Target.CONTINUOUS_TARGET_TYPE]) and range_tuple \
                 and (parsed_value is not None) and not (range_tuple[0] <= parsed_value < range_tuple[1]):
@@ -355,7 +365,6 @@ def _read_truth_data_rows(project, csv_file_fp, is_convert_na_none):
         # validate: For `nominal` and `date` target_types:
         #  - The entry in the `cat` column for a specific `target`-`unit`-`timezero` combination must be contained
         #    within the set of valid values for the target, as defined by the project config file.
-        cats_values = set(cats_values)  # datetime.date instances for date targets
         if (target.type in [Target.NOMINAL_TARGET_TYPE, Target.DATE_TARGET_TYPE]) and cats_values \
                 and (parsed_value not in cats_values):
             raise RuntimeError(f"The entry in the `cat` column for a specific `target`-`unit`-`timezero` "
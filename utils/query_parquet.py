@@ -0,0 +1,179 @@
+import datetime
+import functools
+from numbers import Number
+
+from utils.project_truth import TRUTH_CSV_HEADER
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT
+
+
+#
+# Parquet output for query jobs
+#
+# Query jobs write CSV by default, but can instead write Apache Parquet, which is typed, columnar, and compressed, and
+# so is both smaller and much faster for clients to load than the sparse CSV. The Parquet columns are the CSV's
+# (FORECAST_CSV_HEADER, TRUTH_CSV_HEADER, or SCORE_CSV_HEADER), in the same order, with these types:
+#
+# - 'model', 'season', 'unit', 'target', 'class', 'family', 'score': dictionary-encoded strings
+# - 'timezero': date
+# - 'prob', 'quantile', 'param1', 'param2', 'param3': double
+# - 'cat': string
+# - 'value', 'sample': double. because these can also hold non-numeric values (those of date, text, and boolean
+#   targets), the Parquet file has two additional columns at the end, 'value_text' and 'sample_text', which hold the
+#   string forms of such values (as written to the CSV). exactly one of each pair is non-null when the CSV cell is not
+#   empty. scores' 'value' is always numeric, and so score files do not have 'value_text'
+#
+# Empty CSV cells are nulls. The file is written as rows stream out of the query, one row group per
+# PARQUET_ROW_GROUP_SIZE rows, so that at most about one row group's worth of rows is held in memory at a time.
+# pyarrow is imported only when needed b/c it is a large library that most processes never use.
+#
+
+# the number of rows in each row group, i.e., the number of rows that are batched before being written
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def write_query_rows_parquet(rows, binary_io, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    Writes rows as returned by `query_forecasts_for_project()`, `query_truth_for_project()`, or
+    `query_scores_for_project()` to binary_io as a Parquet file whose columns are as documented above.
+
+    :param rows: an iterator of rows whose first row is one of FORECAST_CSV_HEADER, TRUTH_CSV_HEADER, or
+        SCORE_CSV_HEADER
+    :param binary_io: a binary file-like object to write to
+    :param row_group_size: the number of rows in each row group
+    :return: the number of rows in rows, including the header, so that the count matches the CSV output's
+    """
+    # imported here so that only processes that write Parquet load pyarrow:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from utils.scores import SCORE_CSV_HEADER  # avoid circular imports
+
+
+    rows = iter(rows)
+    header = list(next(rows))
+    if header == TRUTH_CSV_HEADER:
+        schema, parquet_row_fcn = _truth_parquet_schema(pa), _truth_parquet_row
+    elif header == SCORE_CSV_HEADER:
+        schema, parquet_row_fcn = _score_parquet_schema(pa), _score_parquet_row
+    else:
+        schema, parquet_row_fcn = _forecast_parquet_schema(pa), _forecast_parquet_row
+    num_rows = 1  # header
+    with pq.ParquetWriter(binary_io, schema, compression=PARQUET_COMPRESSION) as writer:
+        batch = []
+        for row in rows:
+            batch.append(parquet_row_fcn(row))
+            if len(batch) == row_group_size:
+                writer.write_table(_table_for_parquet_rows(pa, schema, batch))
+                num_rows += len(batch)
+                batch = []
+        if batch or (num_rows == 1):  # write an empty row group for no rows so that the file has the schema
+            writer.write_table(_table_for_parquet_rows(pa, schema, batch))
+            num_rows += len(batch)
+    return num_rows
+
+
+def concat_parquet_files(parquet_fps, binary_io):
+    """
+    Writes the row groups of the passed Parquet files, in order, to binary_io as a single Parquet file. Used to merge
+    the outputs of a sharded query's shards. Only one row group is held in memory at a time.
+
+    :param parquet_fps: an iterator of seekable binary file-like objects that are Parquet files written by
+        `write_query_rows_parquet()` for the same type of query, and therefore have the same schema
+    :param binary_io: a binary file-like object to write to
+    """
+    # imported here so that only processes that write Parquet load pyarrow:
+    import pyarrow.parquet as pq
+
+
+    writer = None
+    try:
+        for parquet_fp in parquet_fps:
+            parquet_file = pq.ParquetFile(parquet_fp)
+            if writer is None:
+                writer = pq.ParquetWriter(binary_io, parquet_file.schema_arrow, compression=PARQUET_COMPRESSION)
+            for row_group_idx in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(row_group_idx))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _forecast_parquet_schema(pa):
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('model', dict_str), ('timezero', pa.date32()), ('season', dict_str), ('unit', dict_str),
+                      ('target', dict_str), ('class', dict_str), ('value', pa.float64()), ('cat', pa.string()),
+                      ('prob', pa.float64()), ('sample', pa.float64()), ('quantile', pa.float64()),
+                      ('family', dict_str), ('param1', pa.float64()), ('param2', pa.float64()),
+                      ('param3', pa.float64()), ('value_text', pa.string()), ('sample_text', pa.string())])
+
+
+def _truth_parquet_schema(pa):
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('timezero', pa.date32()), ('unit', dict_str), ('target', dict_str), ('value', pa.float64()),
+                      ('value_text', pa.string())])
+
+
+def _score_parquet_schema(pa):
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('model', dict_str), ('timezero', pa.date32()), ('season', dict_str), ('unit', dict_str),
+                      ('target', dict_str), ('score', dict_str), ('value', pa.float64())])
+
+
+def _forecast_parquet_row(row):
+    model, timezero, season, unit, target, class_str, value, cat, prob, sample, quantile, family, param1, param2, \
+        param3 = row
+    value_num, value_text = _num_and_text(value)
+    sample_num, sample_text = _num_and_text(sample)
+    return (model, _date_for_str(timezero), season or None, unit, target, class_str, value_num, _text(cat),
+            _num(prob), sample_num, _num(quantile), family or None, _num(param1), _num(param2), _num(param3),
+            value_text, sample_text)
+
+
+def _truth_parquet_row(row):
+    timezero, unit, target, value = row
+    value_num, value_text = _num_and_text(value)
+    return _date_for_str(timezero), unit, target, value_num, value_text
+
+
+def _score_parquet_row(row):
+    model, timezero, season, unit, target, score, value = row
+    return model, _date_for_str(timezero), season or None, unit, target, score, float(value)
+
+
+def _table_for_parquet_rows(pa, schema, parquet_rows):
+    """
+    :return: a pyarrow Table with schema whose rows are parquet_rows, which are as returned by
+        `_forecast_parquet_row()`, `_truth_parquet_row()`, or `_score_parquet_row()`
+    """
+    columns = list(zip(*parquet_rows)) if parquet_rows else [[] for _ in schema]
+    arrays = [pa.array(column, type=pa.string()).dictionary_encode() if pa.types.is_dictionary(field.type)
+              else pa.array(column, type=field.type)
+              for column, field in zip(columns, schema)]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+@functools.lru_cache(maxsize=None)
+def _date_for_str(date_str):
+    return datetime.datetime.strptime(date_str, YYYY_MM_DD_DATE_FORMAT).date()
+
+
+def _num(value):
+    return None if (value == '') or (value is None) else float(value)
+
+
+def _text(value):
+    return None if (value == '') or (value is None) else str(value)
+
+
+def _num_and_text(value):
+    """
+    :return: a 2-tuple for the 'value' or 'sample' column and its '_text' counterpart: (number, text). at most one is
+        non-None
+    """
+    if (value == '') or (value is None):
+        return None, None
+    elif isinstance(value, Number) and not isinstance(value, bool):
+        return float(value), None
+    else:  # date, text, or boolean
+        return None, str(value)
@@ -0,0 +1,537 @@
+import json
+from collections import defaultdict
+from itertools import chain
+
+import django_rq
+import numpy
+from django.db import connection, transaction
+from rest_framework.generics import get_object_or_404
+from rq.timeouts import JobTimeoutException
+
+from forecast_app.models import Forecast, ForecastModel, ForecastScore, LatestPredictionElement, PredictionData, \
+    PredictionElement, Project, Target, TargetLwr
+from forecast_app.models.forecast_score import SCORE_INT_TO_NAME, SCORE_NAME_TO_INT, SCORE_TO_PRED_CLASS
+from forecast_repo.settings.base import MAX_NUM_QUERY_ROWS, SCORE_QUEUE_NAME
+from utils.project import logger
+from utils.project_queries import _bin_widths, _dense_bin_probs, _padded_quantiles, \
+    _query_forecasts_sql_for_pred_class, _query_worker, _target_id_to_lwrs, _validate_as_of, _validate_query_ids, \
+    bump_project_score_version
+from utils.project_truth import oracle_model_for_project
+from utils.utilities import YYYY_MM_DD_DATE_FORMAT, batched_rows, streaming_cursor
+
+
+#
+# Forecast scoring
+#
+# Scores compare forecasts' prediction elements with the project's truth, and are stored in the ForecastScore table so
+# that queries do not have to recompute them. Each numeric (continuous or discrete) prediction element gets the scores
+# for its prediction class:
+#
+# - point: 'abs_error': |value - truth|
+# - quantile: 'wis': the weighted interval score, computed as twice the mean pinball loss over the prediction's
+#   quantiles, which is equivalent to the usual interval-based definition when the quantiles are symmetric. also the
+#   interval score ('interval_50', 'interval_95') and coverage ('coverage_50', 'coverage_95') of the central 50% and 95%
+#   intervals, but only if the prediction has both of an interval's quantiles
+# - bin: 'log_score': the natural log of the probability of the truth's bin, floored at LOG_SCORE_MIN. also 'pit': the
+#   probability integral transform, i.e., the prediction's CDF at the truth, where the CDF is piecewise-linear within
+#   bins as in `_bin_quantiles()`. for discrete targets this is the "mid-PIT": the average of the CDF just below and
+#   just above the truth
+# - sample: 'crps': the continuous ranked probability score of the samples' empirical distribution
+#
+# Scores are computed against the latest truth, and are updated incrementally by `update_scores_for_project()`, which
+# deletes scores whose truth has since been replaced, and then scores the prediction elements that have no scores.
+# Loads enqueue updates that are limited to what they loaded: forecast loads to their forecasts, and truth loads to
+# their time zeros (see `enqueue_update_scores()`). Whole-project updates are left to utils/scores_util.py. Deleted
+# forecasts' and truths' scores are deleted via CASCADE. Scores are computed in batches of SCORE_BATCH_SIZE
+# prediction elements, vectorized via numpy across each batch's elements of the same prediction class and target.
+#
+
+# the number of prediction elements that are scored at a time. limits memory use
+SCORE_BATCH_SIZE = 10_000
+
+# the floor for log scores so that a bin prediction that gives the truth zero probability has a finite score. this is
+# the FluSight convention
+LOG_SCORE_MIN = -10
+
+# the central intervals that get interval and coverage scores: (alpha, interval score, coverage score), where an
+# interval's quantiles are alpha / 2 and 1 - alpha / 2
+SCORE_INTERVALS = ((0.5, ForecastScore.INTERVAL_50, ForecastScore.COVERAGE_50),
+                   (0.05, ForecastScore.INTERVAL_95, ForecastScore.COVERAGE_95))
+
+
+def update_scores_for_project(project, forecast_ids=None, timezero_ids=None):
+    """
+    Brings project's ForecastScores up to date with its forecasts and its latest truth. Runs in the calling thread and
+    therefore blocks. Each SCORE_BATCH_SIZE batch of scores is committed in its own transaction (and so must not be
+    called in one) so that an update that is interrupted, e.g., by a job timeout, keeps the batches it finished, and a
+    later update picks up where it left off. By default the whole project is updated, but callers that know what
+    changed can limit the update to it.
+
+    :param project: a Project
+    :param forecast_ids: optional non-empty list of the ids of just-loaded Forecasts. if passed then only their
+        prediction elements are updated
+    :param timezero_ids: optional non-empty list of the ids of the TimeZeros whose truth was just loaded. if passed
+        then only the prediction elements of forecasts for them are updated
+    :return: a 2-tuple: (num_deleted, num_created) - the number of stale ForecastScores that were deleted and of new
+        ones that were created
+    """
+    logger.debug(f"update_scores_for_project(): 1/4 deleting stale scores. project={project}, "
+                 f"forecast_ids={forecast_ids}, timezero_ids={timezero_ids}")
+    oracle_model = oracle_model_for_project(project)
+    with transaction.atomic():
+        project_scores = ForecastScore.objects.filter(pred_ele__forecast__forecast_model__project=project)
+        if forecast_ids is not None:
+            project_scores = project_scores.filter(pred_ele__forecast_id__in=forecast_ids)
+        if timezero_ids is not None:
+            project_scores = project_scores.filter(pred_ele__forecast__time_zero_id__in=timezero_ids)
+        if oracle_model:
+            latest_truth_pe_ids = LatestPredictionElement.objects.filter(forecast_model=oracle_model)
+            if timezero_ids is not None:
+                latest_truth_pe_ids = latest_truth_pe_ids.filter(time_zero_id__in=timezero_ids)
+            project_scores = project_scores.exclude(truth_pred_ele_id__in=latest_truth_pe_ids.values('pred_ele_id'))
+        num_deleted, _ = project_scores.delete()
+        if num_deleted:
+            bump_project_score_version(project.pk)  # invalidates cached score query outputs
+    if not oracle_model:
+        logger.debug(f"update_scores_for_project(): 4/4 done: no truth. num_deleted={num_deleted}")
+        return num_deleted, 0
+
+    logger.debug(f"update_scores_for_project(): 2/4 getting unscored prediction elements")
+    target_id_to_obj = {target.pk: target for target in project.targets.all()}
+    target_id_to_lwrs = _target_id_to_lwrs(project)
+    num_created = 0
+    with streaming_cursor() as cursor:
+        cursor.execute(_unscored_pred_eles_sql(forecast_ids, timezero_ids), (oracle_model.pk, project.pk))
+
+        logger.debug(f"update_scores_for_project(): 3/4 scoring")
+        batch = []  # 6-tuples: (pe_id, pred_class, target_id, pred_data, truth_pe_id, truth_value)
+        last_pe_id = None
+        for pe_id, pred_class, target_id, pred_data, truth_pe_id, truth_data in batched_rows(cursor):
+            if pe_id == last_pe_id:  # a truth duplicate (see `LatestPredictionElement`). we score the first one
+                continue
+
+            last_pe_id = pe_id
+            # counterintuitively must use json.loads per https://code.djangoproject.com/ticket/31991
+            batch.append((pe_id, pred_class, target_id, json.loads(pred_data), truth_pe_id,
+                          json.loads(truth_data)['value']))
+            if len(batch) == SCORE_BATCH_SIZE:
+                num_created += _commit_scores_for_batch(project, batch, target_id_to_obj, target_id_to_lwrs)
+                batch = []
+        num_created += _commit_scores_for_batch(project, batch, target_id_to_obj, target_id_to_lwrs)
+
+    logger.debug(f"update_scores_for_project(): 4/4 done. num_deleted={num_deleted}, num_created={num_created}")
+    return num_deleted, num_created
+
+
+def _commit_scores_for_batch(project, batch, target_id_to_obj, target_id_to_lwrs):
+    """
+    An `update_scores_for_project()` helper that scores batch in its own transaction, which also bumps project's score
+    version if any scores were created.
+
+    :return: the number of ForecastScores created, as returned by `_create_scores_for_batch()`
+    """
+    with transaction.atomic():
+        num_created = _create_scores_for_batch(batch, target_id_to_obj, target_id_to_lwrs)
+        if num_created:
+            bump_project_score_version(project.pk)  # invalidates cached score query outputs
+    return num_created
+
+
+def _unscored_pred_eles_sql(forecast_ids=None, timezero_ids=None):
+    """
+    An `update_scores_for_project()` helper that returns SQL that, when executed with (oracle model id, project id),
+    returns 6-tuples for every scorable prediction element (of forecast_ids and timezero_ids, if passed, as documented
+    in `update_scores_for_project()`) that has no scores: (pe_id, pred_class, target_id,
+    pred_data, truth_pe_id, truth_data), where the latter two are for the latest truth of the element's (time zero,
+    unit, target). ordered by (pred_class, target_id, pe_id) so that batches are mostly made of a few large groups.
+    elements that cannot be scored are filtered out here rather than by the caller so that they are not re-read by
+    every update: those without a truth (via the inner JOIN), those whose truth value is not a number, and bin ones
+    whose target has no lwrs
+    """
+    pred_classes = sorted(set(SCORE_TO_PRED_CLASS.values()))
+    target_types = [Target.CONTINUOUS_TARGET_TYPE, Target.DISCRETE_TARGET_TYPE]
+    is_numeric_truth = "jsonb_typeof(truth_data.data -> 'value') = 'number'" if connection.vendor == 'postgresql' \
+        else "json_type(truth_data.data, '$.value') IN ('integer', 'real')"
+    and_forecast_ids = f"AND f.id IN ({', '.join(map(str, forecast_ids))})" if forecast_ids is not None else ""
+    and_timezero_ids = f"AND f.time_zero_id IN ({', '.join(map(str, timezero_ids))})" \
+        if timezero_ids is not None else ""
+    return f"""
+        SELECT pred_ele.id          AS pe_id,
+               pred_ele.pred_class  AS pred_class,
+               pred_ele.target_id   AS target_id,
+               pred_data.data       AS pred_data,
+               truth_ele.pred_ele_id AS truth_pe_id,
+               truth_data.data      AS truth_data
+        FROM {PredictionElement._meta.db_table} AS pred_ele
+                 JOIN {Forecast._meta.db_table} AS f ON pred_ele.forecast_id = f.id
+                 JOIN {LatestPredictionElement._meta.db_table} AS truth_ele
+                     ON truth_ele.forecast_model_id = %s
+                         AND truth_ele.time_zero_id = f.time_zero_id
+                         AND truth_ele.unit_id = pred_ele.unit_id
+                         AND truth_ele.target_id = pred_ele.target_id
+                 JOIN {ForecastModel._meta.db_table} AS fm ON f.forecast_model_id = fm.id
+                 JOIN {Target._meta.db_table} AS target ON pred_ele.target_id = target.id
+                 JOIN {PredictionData._meta.db_table} AS pred_data ON pred_ele.id = pred_data.pred_ele_id
+                 JOIN {PredictionData._meta.db_table} AS truth_data ON truth_ele.pred_ele_id = truth_data.pred_ele_id
+        WHERE fm.project_id = %s
+          AND NOT fm.is_oracle
+          AND NOT pred_ele.is_retract
+          {and_forecast_ids}
+          {and_timezero_ids}
+          AND pred_ele.pred_class IN ({', '.join(map(str, pred_classes))})
+          AND target.type IN ({', '.join(map(str, target_types))})
+          AND {is_numeric_truth}
+          AND (pred_ele.pred_class != {PredictionElement.BIN_CLASS}
+              OR EXISTS(SELECT 1
+                        FROM {TargetLwr._meta.db_table} AS target_lwr
+                        WHERE target_lwr.target_id = pred_ele.target_id
+                          AND target_lwr.lwr IS NOT NULL))
+          AND NOT EXISTS(SELECT 1
+                         FROM {ForecastScore._meta.db_table} AS score
+                         WHERE score.pred_ele_id = pred_ele.id)
+        ORDER BY pred_ele.pred_class, pred_ele.target_id, pred_ele.id;
+    """
+
+
+def _create_scores_for_batch(batch, target_id_to_obj, target_id_to_lwrs):
+    """
+    An `update_scores_for_project()` helper that scores batch's prediction elements and saves the results.
+
+    :param batch: a list of 6-tuples: (pe_id, pred_class, target_id, pred_data, truth_pe_id, truth_value)
+    :return: the number of ForecastScores created. can be high by those that a concurrent update created first
+    """
+    pred_class_target_to_batch_idxs = defaultdict(list)
+    for batch_idx, (_, pred_class, target_id, _, _, _) in enumerate(batch):
+        pred_class_target_to_batch_idxs[(pred_class, target_id)].append(batch_idx)
+
+    forecast_scores = []
+    for (pred_class, target_id), batch_idxs in pred_class_target_to_batch_idxs.items():
+        pred_datas = [batch[batch_idx][3] for batch_idx in batch_idxs]
+        truths = numpy.array([batch[batch_idx][5] for batch_idx in batch_idxs], dtype=float)
+        is_discrete = target_id_to_obj[target_id].type == Target.DISCRETE_TARGET_TYPE
+        if pred_class == PredictionElement.POINT_CLASS:
+            score_to_values = {ForecastScore.ABS_ERROR: _abs_errors(pred_datas, truths)}
+        elif pred_class == PredictionElement.QUANTILE_CLASS:
+            score_to_values = _quantile_scores(pred_datas, truths)
+        elif pred_class == PredictionElement.BIN_CLASS:
+            score_to_values = _bin_scores(pred_datas, target_id_to_lwrs[target_id], truths, is_discrete)
+        else:  # PredictionElement.SAMPLE_CLASS
+            score_to_values = {ForecastScore.CRPS: _crps(pred_datas, truths)}
+
+        for score, values in score_to_values.items():
+            for batch_idx, value in zip(batch_idxs, values):
+                if not numpy.isnan(value):  # nan means no score, e.g., a missing interval
+                    forecast_scores.append(ForecastScore(pred_ele_id=batch[batch_idx][0],
+                                                         truth_pred_ele_id=batch[batch_idx][4],
+                                                         score=score, value=float(value)))
+    # concurrent updates of the same project can score the same prediction elements, so we skip the ones that another
+    # update already created rather than violate the unique (pred_ele, score) constraint
+    ForecastScore.objects.bulk_create(forecast_scores, ignore_conflicts=True)
+    return len(forecast_scores)
+
+
+#
+# ---- vectorized scoring functions ----
+#
+# Each takes a list of n predictions' data and a numpy array of their n truths, and returns a numpy array of n scores
+# (or a dict that maps ForecastScore scores to them), where nan means the prediction has no such score.
+#
+
+def _abs_errors(pred_datas, truths):
+    values = numpy.array([pred_data['value'] for pred_data in pred_datas], dtype=float)
+    return numpy.abs(values - truths)
+
+
+def _quantile_scores(pred_datas, truths):
+    """
+    :return: a dict that maps ForecastScore.WIS and SCORE_INTERVALS' scores to numpy arrays of n scores
+    """
+    num_quantiles = numpy.array([len(pred_data['quantile']) for pred_data in pred_datas])
+    levels, values = _padded_quantiles(pred_datas)
+    is_pad = numpy.arange(levels.shape[1])[numpy.newaxis, :] >= num_quantiles[:, numpy.newaxis]
+    truths = truths[:, numpy.newaxis]
+
+    # weighted interval score via pinball losses
+    pinball_losses = ((truths < values) - levels) * (values - truths)
+    score_to_values = {ForecastScore.WIS: 2 * numpy.where(is_pad, 0, pinball_losses).sum(axis=1) / num_quantiles}
+
+    # interval scores and coverage
+    row_idxs = numpy.arange(len(pred_datas))
+    for alpha, interval_score, coverage_score in SCORE_INTERVALS:
+        is_lower = numpy.isclose(levels, alpha / 2)
+        is_upper = numpy.isclose(levels, 1 - alpha / 2)
+        is_interval = is_lower.any(axis=1) & is_upper.any(axis=1)
+        lowers = values[row_idxs, numpy.argmax(is_lower, axis=1)]
+        uppers = values[row_idxs, numpy.argmax(is_upper, axis=1)]
+        interval_truths = truths[:, 0]
+        interval_scores = (uppers - lowers) + (2 / alpha) * numpy.maximum(lowers - interval_truths, 0) \
+                          + (2 / alpha) * numpy.maximum(interval_truths - uppers, 0)
+        coverages = ((lowers <= interval_truths) & (interval_truths <= uppers)).astype(float)
+        score_to_values[interval_score] = numpy.where(is_interval, interval_scores, numpy.nan)
+        score_to_values[coverage_score] = numpy.where(is_interval, coverages, numpy.nan)
+    return score_to_values
+
+
+def _bin_scores(pred_datas, target_lwrs, truths, is_discrete):
+    """
+    :param target_lwrs: the target's TargetLwrs as returned by `_target_id_to_lwrs()`
+    :param is_discrete: True if the target is discrete
+    :return: a dict that maps ForecastScore.LOG_SCORE and ForecastScore.PIT to numpy arrays of n scores
+    """
+    lwrs = numpy.array([lwr for lwr, _ in target_lwrs], dtype=float)
+    uppers = numpy.array([upper for _, upper in target_lwrs], dtype=float)
+    probs = _dense_bin_probs([pred_data['cat'] for pred_data in pred_datas],
+                             [pred_data['prob'] for pred_data in pred_datas], lwrs)
+    widths = _bin_widths(lwrs, uppers)
+
+    # the truths' bins. truths can be outside of all bins, either below the first or in a gap between bins
+    row_idxs = numpy.arange(len(pred_datas))
+    bin_idxs = numpy.searchsorted(lwrs, truths, side='right') - 1  # -1 means below the first lwr
+    is_in_bin = (bin_idxs >= 0) & (truths < uppers[numpy.maximum(bin_idxs, 0)])
+    bin_idxs = numpy.maximum(bin_idxs, 0)
+
+    # log score
+    truth_probs = numpy.where(is_in_bin, probs[row_idxs, bin_idxs], 0)
+    with numpy.errstate(divide='ignore'):
+        log_scores = numpy.maximum(numpy.log(truth_probs), LOG_SCORE_MIN)
+
+    # PIT. the last bin's upper is infinite, so truths beyond its assumed width are clipped to its end
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        cdfs = numpy.cumsum(probs, axis=1) / probs.sum(axis=1)[:, numpy.newaxis]  # at each bin's upper
+    cdfs_below = numpy.where(bin_idxs > 0, cdfs[row_idxs, numpy.maximum(bin_idxs - 1, 0)], 0)
+    cdfs_above = cdfs[row_idxs, bin_idxs]
+    offsets = truths - lwrs[bin_idxs] + (0.5 if is_discrete else 0)  # mid-PIT: average of the CDF at truth and truth+1
+    fractions = numpy.clip(offsets / widths[bin_idxs], 0, 1)
+    pits = cdfs_below + fractions * (cdfs_above - cdfs_below)
+    pits = numpy.where(is_in_bin, pits, numpy.where(truths < lwrs[0], 0, cdfs_above))
+    return {ForecastScore.LOG_SCORE: log_scores, ForecastScore.PIT: pits}
+
+
+def _crps(pred_datas, truths):
+    """
+    :return: a numpy array of the n predictions' CRPSs, computed from their sorted samples as E|X - y| - E|X - X'| / 2,
+        where E|X - X'| = (2 / m^2) * sum_i((2i - m - 1) * x_(i)) for m samples
+    """
+    num_samples = numpy.array([len(pred_data['sample']) for pred_data in pred_datas])
+    is_pad = numpy.arange(num_samples.max())[numpy.newaxis, :] >= num_samples[:, numpy.newaxis]
+    samples = numpy.full(is_pad.shape, numpy.inf)  # sorts to the right
+    samples[~is_pad] = numpy.fromiter(chain.from_iterable(pred_data['sample'] for pred_data in pred_datas),
+                                      dtype=float, count=num_samples.sum())
+    samples = numpy.where(is_pad, 0, numpy.sort(samples, axis=1))
+    ranks = numpy.arange(1, is_pad.shape[1] + 1)[numpy.newaxis, :]
+    weights = numpy.where(is_pad, 0, 2 * ranks - num_samples[:, numpy.newaxis] - 1)
+    abs_errors = numpy.where(is_pad, 0, numpy.abs(samples - truths[:, numpy.newaxis])).sum(axis=1) / num_samples
+    abs_diffs = 2 * (weights * samples).sum(axis=1) / num_samples ** 2
+    return abs_errors - abs_diffs / 2
+
+
+#
+# ---- enqueue_update_scores() ----
+#
+
+def enqueue_update_scores(project_pk, forecast_ids=None, timezero_ids=None):
+    """
+    Enqueues an `update_scores_for_project()` of the Project with project_pk. Called after forecast and truth loads.
+    Scores are derived data that `update_scores_for_project()` can always bring up to date, and so enqueue errors are
+    logged rather than raised so that they do not fail the load.
+
+    :param project_pk: a Project's pk
+    :param forecast_ids: passed to `update_scores_for_project()`
+    :param timezero_ids: ""
+    """
+    try:
+        queue = django_rq.get_queue(SCORE_QUEUE_NAME)
+        queue.enqueue(_update_scores_worker, project_pk, forecast_ids, timezero_ids)
+    except Exception as ex:
+        logger.error(f"enqueue_update_scores(): error: {ex!r}. project_pk={project_pk}")
+
+
+def _update_scores_worker(project_pk, forecast_ids=None, timezero_ids=None):
+    """
+    enqueue() helper function. timeouts are re-raised so that RQ records the job as failed. the batches committed
+    before the timeout are kept
+    """
+    project = get_object_or_404(Project, pk=project_pk)
+    try:
+        logger.debug(f"_update_scores_worker(): 1/2 starting: project_pk={project_pk}, forecast_ids={forecast_ids}, "
+                     f"timezero_ids={timezero_ids}")
+        num_deleted, num_created = update_scores_for_project(project, forecast_ids, timezero_ids)
+        logger.debug(f"_update_scores_worker(): 2/2 done: project_pk={project_pk}, num_deleted={num_deleted}, "
+                     f"num_created={num_created}")
+    except JobTimeoutException as jte:
+        logger.error(f"_update_scores_worker(): error: {jte!r}. project={project}")
+        raise jte
+    except Exception as ex:
+        logger.error(f"_update_scores_worker(): error: {ex!r}. project={project}")
+
+
+#
+# query_scores_for_project()
+#
+
+SCORE_CSV_HEADER = ['model', 'timezero', 'season', 'unit', 'target', 'score', 'value']
+
+# the number of prediction elements whose scores are read at a time
+SCORE_QUERY_BATCH_SIZE = 1_000
+
+
+def query_scores_for_project(project, query, max_num_rows=MAX_NUM_QUERY_ROWS):
+    """
+    Top-level function for querying forecast scores within project. Runs in the calling thread and therefore blocks.
+    Returns the scores of the prediction elements that `query_forecasts_for_project()` would return for the same
+    query, i.e., of the latest forecasts, or of those as of `as_of`. Scores are as of the latest truth, and are only
+    present once `update_scores_for_project()` has computed them. The columns are defined in SCORE_CSV_HEADER.
+
+    `query` is a dict of up to six keys, five of which are lists of strings. all are optional:
+
+    - 'models', 'units', 'targets', 'timezeros', 'as_of': as documented in `query_forecasts_for_project()`
+    - 'scores': Pass a list of score names (see ForecastScore.SCORE_CHOICES) to only get those scores
+
+    :param project: a Project
+    :param query: a dict specifying the query parameters as described above
+    :param max_num_rows: the number of rows at which this function raises a RuntimeError
+    :return: a list of CSV rows including the header
+    """
+    logger.debug(f"query_scores_for_project(): 1/3 validating query. query={query}, project={project}")
+    error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of) = \
+        validate_scores_query(project, query)
+    if error_messages:
+        raise RuntimeError(f"invalid query. query={query}, errors={error_messages}")
+
+    forecast_model_id_to_obj = {forecast_model.pk: forecast_model for forecast_model in project.models.all()}
+    timezero_id_to_obj = {timezero.pk: timezero for timezero in project.timezeros.all()}
+    unit_id_to_obj = {unit.pk: unit for unit in project.units.all()}
+    target_id_to_obj = {target.pk: target for target in project.targets.all()}
+    timezero_to_season_name = project.timezero_to_season_name()
+
+    yield SCORE_CSV_HEADER
+
+    # get the SQL then execute and iterate over resulting PEs, reading their scores in batches
+    scores = scores or list(SCORE_INT_TO_NAME.keys())
+    pred_classes = {SCORE_TO_PRED_CLASS[score] for score in scores}
+    sql = _query_forecasts_sql_for_pred_class(None, model_ids, unit_ids, target_ids, timezero_ids, as_of, True,
+                                              is_type_convert=True)
+    logger.debug(f"query_scores_for_project(): 2/3 executing sql. model_ids, unit_ids, target_ids, timezero_ids, "
+                 f"scores, as_of= {model_ids}, {unit_ids}, {target_ids}, {timezero_ids}, {scores}, {as_of}")
+    num_rows = 0
+    with streaming_cursor() as cursor:
+        cursor.execute(sql, (project.pk,))
+        batch = []  # 5-tuples: (fm_id, tz_id, unit_id, target_id, pred_ele_id)
+        for fm_id, tz_id, unit_id, target_id, pred_ele_id, pred_class in batched_rows(cursor):
+            if pred_class not in pred_classes:
+                continue
+
+            batch.append((fm_id, tz_id, unit_id, target_id, pred_ele_id))
+            if len(batch) == SCORE_QUERY_BATCH_SIZE:
+                for row in _score_rows_for_batch(batch, scores, forecast_model_id_to_obj, timezero_id_to_obj,
+                                                 unit_id_to_obj, target_id_to_obj, timezero_to_season_name):
+                    num_rows += 1
+                    if num_rows > max_num_rows:
+                        raise RuntimeError(f"number of rows exceeded maximum. num_rows={num_rows}, "
+                                           f"max_num_rows={max_num_rows}")
+
+                    yield row
+                batch = []
+        for row in _score_rows_for_batch(batch, scores, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                                         target_id_to_obj, timezero_to_season_name):
+            num_rows += 1
+            if num_rows > max_num_rows:
+                raise RuntimeError(f"number of rows exceeded maximum. num_rows={num_rows}, "
+                                   f"max_num_rows={max_num_rows}")
+
+            yield row
+
+    # done
+    logger.debug(f"query_scores_for_project(): 3/3 done. num_rows={num_rows}, query={query}, project={project}")
+
+
+def _score_rows_for_batch(batch, scores, forecast_model_id_to_obj, timezero_id_to_obj, unit_id_to_obj,
+                          target_id_to_obj, timezero_to_season_name):
+    """
+    A `query_scores_for_project()` helper that yields the SCORE_CSV_HEADER rows for batch's prediction elements'
+    scores, in batch order and then score order.
+
+    :param batch: a list of 5-tuples: (fm_id, tz_id, unit_id, target_id, pred_ele_id)
+    :param scores: a list of the ForecastScore scores to include
+    """
+    pe_id_to_score_values = defaultdict(list)
+    for pe_id, score, value in ForecastScore.objects \
+            .filter(pred_ele_id__in=[pe_id for _, _, _, _, pe_id in batch], score__in=scores) \
+            .order_by('score') \
+            .values_list('pred_ele_id', 'score', 'value'):
+        pe_id_to_score_values[pe_id].append((score, value))
+    for fm_id, tz_id, unit_id, target_id, pe_id in batch:
+        if pe_id not in pe_id_to_score_values:
+            continue
+
+        forecast_model, time_zero = forecast_model_id_to_obj[fm_id], timezero_id_to_obj[tz_id]
+        model_str = forecast_model.abbreviation if forecast_model.abbreviation else forecast_model.name
+        timezero_str = time_zero.timezero_date.strftime(YYYY_MM_DD_DATE_FORMAT)
+        season = timezero_to_season_name[time_zero]
+        unit_str, target_str = unit_id_to_obj[unit_id].abbreviation, target_id_to_obj[target_id].name
+        for score, value in pe_id_to_score_values[pe_id]:
+            yield [model_str, timezero_str, season, unit_str, target_str, SCORE_INT_TO_NAME[score], value]
+
+
+def validate_scores_query(project, query):
+    """
+    Validates `query` according to the parameters documented in `query_scores_for_project()`. Similar to
+    validate_forecasts_query() except validates "scores" instead of "types" and "options".
+
+    :param project: as passed from `query_scores_for_project()`
+    :param query: ""
+    :return: a 2-tuple: (error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)), where scores
+        are converted to ints via SCORE_NAME_TO_INT
+    """
+    # return value. filled next
+    error_messages, model_ids, unit_ids, target_ids, timezero_ids, scores, as_of = [], [], [], [], [], [], None
+
+    # validate query type
+    if not isinstance(query, dict):
+        error_messages.append(f"query was not a dict: {query}, query type={type(query)}")
+        return [error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)]
+
+    # validate keys
+    actual_keys = set(query.keys())
+    expected_keys = {'models', 'units', 'targets', 'timezeros', 'scores', 'as_of'}
+    if not (actual_keys <= expected_keys):
+        error_messages.append(f"one or more query keys were invalid. query={query}, actual_keys={actual_keys}, "
+                              f"expected_keys={expected_keys}")
+        # return even though we could technically continue
+        return [error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)]
+
+    # validate as_of if passed. must be parsable as a timezone-aware datetime
+    error_message, as_of = _validate_as_of(query)
+    if error_message:
+        error_messages.append(error_message)
+        return [error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)]
+
+    # validate object IDs that strings refer to
+    error_messages, (model_ids, unit_ids, target_ids, timezero_ids) = _validate_query_ids(project, query)
+
+    # validate scores
+    if 'scores' in query:
+        scores = query['scores']
+        if not (set(scores) <= set(SCORE_NAME_TO_INT)):
+            error_messages.append(f"one or more scores were invalid. scores={set(scores)}, "
+                                  f"valid_scores={set(SCORE_NAME_TO_INT)}, query={query}")
+            return [error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)]
+
+        scores = [SCORE_NAME_TO_INT[score_name] for score_name in scores]
+
+    # done (may or may not be valid)
+    return [error_messages, (model_ids, unit_ids, target_ids, timezero_ids, scores, as_of)]
+
+
+def _scores_query_worker(job_pk):
+    """
+    enqueue() helper function
+
+    assumes these input_json fields are present and valid:
+    - 'project_pk'
+    - 'query' (assume has passed `validate_scores_query()`)
+
+    and that this one is optional:
+    - 'output_format': "" `_forecasts_query_worker()`
+    """
+    _query_worker(job_pk, query_scores_for_project)
@@ -0,0 +1,43 @@
+import click
+import django
+from django.shortcuts import get_object_or_404
+
+
+# set up django. must be done before loading models. NB: requires DJANGO_SETTINGS_MODULE to be set
+django.setup()
+
+from utils.scores import enqueue_update_scores, update_scores_for_project
+
+from forecast_app.models import Project
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--project-pk')
+@click.option('--no-enqueue', is_flag=True, default=False)
+def update(project_pk, no_enqueue):
+    """
+    A subcommand that brings one or all projects' forecast scores up to date.
+
+    :param project_pk: if a valid Project pk then only that project's scores are updated. o/w updates all
+    :param no_enqueue: controls whether the updates will be immediate in the calling thread (blocks), or enqueued for
+        RQ
+    """
+    projects = [get_object_or_404(Project, pk=project_pk)] if project_pk else Project.objects.all()
+    print(f"updating scores. no_enqueue={no_enqueue}")
+    for project in projects:
+        if no_enqueue:
+            num_deleted, num_created = update_scores_for_project(project)
+            print(f"* {project}: num_deleted={num_deleted}, num_created={num_created}")
+        else:
+            enqueue_update_scores(project.pk)
+            print(f"* {project}: enqueued")
+    print("update done")
+
+
+if __name__ == '__main__':
+    cli()
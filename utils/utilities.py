@@ -1,7 +1,15 @@
+import itertools
 import logging
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 
+from django.db import connection
 from django.template import Template, Context
 
+from forecast_repo.settings.base import STREAMING_CURSOR_ITERSIZE
+
 
 logger = logging.getLogger(__name__)
 from django.contrib.auth.models import User
@@ -96,22 +104,156 @@ def get_or_create_super_po_mo_users(is_create_super):
 # SQL utilities
 #
 
-# "chunk" size of rows to fetch. used by batched_rows(cursor). value from `chunk_size=2000`:
+# "chunk" size of rows to fetch. used by batched_rows(cursor). default value from `chunk_size=2000`:
 # https://docs.djangoproject.com/en/2.2/ref/models/querysets/#iterator
-SQL_ROWS_BATCH_SIZE = 2000
+SQL_ROWS_BATCH_SIZE = STREAMING_CURSOR_ITERSIZE
 
 
-def batched_rows(cursor):
+def batched_rows(cursor, batch_size=None):
     """
     Generator that retrieves rows from `cursor` in batches of size SQL_ROWS_BATCH_SIZE.
 
-    :param cursor: a cursor
+    :param cursor: a cursor. pass a `streaming_cursor()` to avoid holding the entire result set in memory
+    :param batch_size: optional number of rows to fetch at a time. defaults to SQL_ROWS_BATCH_SIZE
     :return: next row from cursor
     """
+    batch_size = batch_size or SQL_ROWS_BATCH_SIZE
     while True:
-        rows = cursor.fetchmany(SQL_ROWS_BATCH_SIZE)
+        rows = cursor.fetchmany(batch_size)
         if not rows:
             break
 
         for row in rows:
             yield row
+
+
+@contextmanager
+def streaming_cursor():
+    """
+    A replacement for `connection.cursor()` for queries with large result sets. A regular postgres (psycopg2) cursor
+    transfers the entire result set into our memory on `execute()`, even if it is then read via `fetchmany()`. Instead,
+    on postgres this returns a named (server-side) cursor, where each `fetchmany()` (e.g., by `batched_rows()`) gets
+    only the next batch from the server, so memory stays flat regardless of the result's size. The cursor is created by
+    Django's `connection.chunked_cursor()`, which declares it WITH HOLD when not in a transaction so that it outlives
+    autocommit, and which honors the DISABLE_SERVER_SIDE_CURSORS database setting (needed with transaction-pooling
+    pgbouncer). Other databases get a regular cursor, which for sqlite already steps through results lazily.
+
+    NB: a named cursor can execute only a single SELECT, and only once.
+    """
+    cursor = connection.chunked_cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def unique_temp_table_name(prefix):
+    """
+    :param prefix: a short, SQL-safe name identifying the caller, e.g., 'pred_ele_temp'
+    :return: a temp table name that's unique to this call, so that concurrent and nested callers never share (or DROP)
+        each other's staging tables
+    """
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+
+def temp_table_on_commit_sql():
+    """
+    :return: the clause to add to `CREATE TEMP TABLE ...` so that postgres drops the table when the current transaction
+        ends, including on rollback. returns '' if not postgres, or if we're not in a transaction (in autocommit mode
+        the table would be dropped right after it's created). callers should still DROP the table when they're done
+        with it so that long transactions don't accumulate them
+    """
+    return 'ON COMMIT DROP' if (connection.vendor == 'postgresql') and connection.in_atomic_block else ''
+
+
+#
+# ---- IngestStats ----
+#
+
+class IngestStats:
+    """
+    Accumulates per-stage wall and CPU times and named counts for one ingest (upload) job, e.g.,
+    `stats.stage('validate')` and `stats.add_count('num_retractions')`. Saved in Job.output_json['ingest_stats'] via
+    `as_dict()`. Stage times are exclusive: time spent in a stage that's entered while another is active is charged
+    only to the inner one, so stage times sum to the total time measured. CPU times are for the current process only,
+    i.e., they exclude time spent by worker processes (see `_iter_validated_rows_parallel()`) and by the database.
+    """
+
+
+    def __init__(self):
+        self.stage_to_wall_cpu = {}  # stage name -> [wall_secs, cpu_secs]. ordered by when each stage was first entered
+        self.counts = defaultdict(int)  # count name -> int
+        self._stage_stack = []  # active stages, innermost last: [stage_name, wall_start, cpu_start]
+
+
+    @classmethod
+    def from_dict(cls, stats_dict):
+        """
+        :param stats_dict: as returned by `as_dict()`, or None
+        :return: a new IngestStats that continues accumulating from stats_dict
+        """
+        stats = cls()
+        for stage_name, wall_cpu_dict in (stats_dict or {}).get('stages', {}).items():
+            stats.stage_to_wall_cpu[stage_name] = [wall_cpu_dict['wall_secs'], wall_cpu_dict['cpu_secs']]
+        stats.counts.update((stats_dict or {}).get('counts', {}))
+        return stats
+
+
+    def as_dict(self):
+        """
+        :return: a JSON-serializable dict: {'stages': {stage_name: {'wall_secs': float, 'cpu_secs': float}, ...},
+            'counts': {count_name: int, ...}}
+        """
+        return {'stages': {stage_name: {'wall_secs': round(wall_secs, 4), 'cpu_secs': round(cpu_secs, 4)}
+                           for stage_name, (wall_secs, cpu_secs) in self.stage_to_wall_cpu.items()},
+                'counts': dict(self.counts)}
+
+
+    @contextmanager
+    def stage(self, stage_name):
+        """
+        A context manager that charges the time spent in its block to stage_name. Can be nested and re-entered.
+        """
+        self._charge_current_stage()  # pause the enclosing stage, if any
+        self._stage_stack.append([stage_name, time.perf_counter(), time.process_time()])
+        try:
+            yield
+        finally:
+            self._charge_current_stage()
+            stage_entry = self._stage_stack.pop()
+            if self._stage_stack:  # resume the enclosing stage from now, i.e., from when we were last charged
+                self._stage_stack[-1][1:] = stage_entry[1:]
+
+
+    def timed_iter(self, stage_name, iterable, batch_size):
+        """
+        A generator that yields iterable's items, charging the time spent getting them to stage_name. Items are
+        fetched batch_size at a time so that timing overhead is per batch rather than per item.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage_name):
+                batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+
+            yield from batch
+
+
+    def add_count(self, count_name, num=1):
+        self.counts[count_name] += num
+
+
+    def _charge_current_stage(self):
+        """
+        Charges the time since the innermost active stage was (re)started to it, and then restarts it.
+        """
+        if not self._stage_stack:
+            return
+
+        stage_entry = self._stage_stack[-1]
+        wall_now, cpu_now = time.perf_counter(), time.process_time()
+        wall_cpu = self.stage_to_wall_cpu.setdefault(stage_entry[0], [0.0, 0.0])
+        wall_cpu[0] += wall_now - stage_entry[1]
+        wall_cpu[1] += cpu_now - stage_entry[2]
+        stage_entry[1], stage_entry[2] = wall_now, cpu_now
@@ -0,0 +1,101 @@
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+import click
+import django
+from django.db import transaction
+
+
+# set up django. must be done before loading models. NB: requires DJANGO_SETTINGS_MODULE to be set
+django.setup()
+
+from forecast_app.models import Forecast, ForecastModel, Project, Target
+from utils.forecast import _ValidationSnapshot, _iter_validated_rows, _iter_validated_rows_parallel
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# ---- application----
+#
+
+@click.command()
+@click.argument('project_pk', type=click.INT, required=True)
+@click.option('--num-pred-eles', type=click.INT, default=500_000, help="number of prediction elements to validate")
+@click.option('--num-samples', type=click.INT, default=100, help="number of samples per sample prediction")
+@click.option('--max-workers', type=click.INT, default=os.cpu_count(), help="max number of worker processes")
+def validation_benchmark_app(project_pk, num_pred_eles, num_samples, max_workers):
+    """
+    Times how long validating and hashing a synthetic forecast of NUM_PRED_ELES sample predictions for PROJECT_PK's
+    numeric targets takes, first serially (`_iter_validated_rows()`) and then in parallel
+    (`_iter_validated_rows_parallel()`) using 2, 4, ... up to MAX_WORKERS processes. Logs the speedup of each over
+    serial. Nothing is saved to the database.
+    """
+    project = Project.objects.get(pk=project_pk)
+    forecast_model = ForecastModel.objects.filter(project=project).first()
+    time_zero = project.timezeros.first()
+    unit_abbrevs = list(project.units.values_list('abbreviation', flat=True))
+    targets = list(project.targets.filter(type__in=[Target.CONTINUOUS_TARGET_TYPE, Target.DISCRETE_TARGET_TYPE]))
+    if (not forecast_model) or (not time_zero) or (not unit_abbrevs) or (not targets):
+        logger.error(f"validation_benchmark_app(): project has no models, time zeros, units, or numeric targets. "
+                     f"project={project}")
+        return
+
+    logger.info(f"validation_benchmark_app(): creating prediction dicts. project={project}, "
+                f"num_pred_eles={num_pred_eles}, num_samples={num_samples}")
+    prediction_dicts = _synthetic_prediction_dicts(unit_abbrevs, targets, num_pred_eles, num_samples)
+
+    num_workers_list = [1]
+    while num_workers_list[-1] * 2 <= max_workers:
+        num_workers_list.append(num_workers_list[-1] * 2)
+    serial_duration = None
+    with transaction.atomic():
+        forecast = Forecast.objects.create(forecast_model=forecast_model, time_zero=time_zero,
+                                           source='validation_benchmark')
+        snapshot = _ValidationSnapshot.for_forecast(forecast)
+        for num_workers in num_workers_list:
+            start_time = time.perf_counter()
+            if num_workers == 1:
+                rows = _iter_validated_rows(snapshot, iter(prediction_dicts), False, False, defaultdict(list))
+            else:
+                rows = _iter_validated_rows_parallel(snapshot, iter(prediction_dicts), False, False,
+                                                     defaultdict(list), num_workers)
+            num_rows = sum(1 for _ in rows)
+            duration = time.perf_counter() - start_time
+            if serial_duration is None:
+                serial_duration = duration
+            logger.info(f"validation_benchmark_app(): num_workers={num_workers}: {duration:.3f}s, "
+                        f"speedup={serial_duration / duration:.2f}x, num_rows={num_rows}")
+        transaction.set_rollback(True)
+    logger.info(f"validation_benchmark_app(): done")
+
+
+def _synthetic_prediction_dicts(unit_abbrevs, targets, num_pred_eles, num_samples):
+    """
+    :return: a list of num_pred_eles valid sample prediction dicts. units and targets are repeated as needed, which is
+        fine b/c we skip the "prediction"-level validations
+    """
+    target_to_range_tuple = {target: target.range_tuple() or (0, 100) for target in targets}
+    prediction_dicts = []
+    for idx in range(num_pred_eles):
+        target = targets[idx % len(targets)]
+        lower, upper = target_to_range_tuple[target]
+        if target.type == Target.DISCRETE_TARGET_TYPE:
+            samples = [random.randrange(lower, upper) for _ in range(num_samples)]
+        else:
+            samples = [random.uniform(lower, upper) for _ in range(num_samples)]
+        prediction_dicts.append({'unit': unit_abbrevs[idx % len(unit_abbrevs)], 'target': target.name,
+                                 'class': 'sample', 'prediction': {'sample': samples}})
+    return prediction_dicts
+
+
+#
+# ---- main ----
+#
+
+if __name__ == '__main__':
+    validation_benchmark_app()
@@ -0,0 +1,213 @@
+import logging
+
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# ---- TargetValidator ----
+#
+
+class TargetValidator:
+    """
+    A precompiled, read-only stand-in for a Target that's used to validate prediction elements and truth values without
+    hitting the database. Implements the subset of Target's interface that validation uses (`type`, `type_as_str()`,
+    `data_types()`, `cats_values()`, and `range_tuple()`), but answers from values loaded once by
+    `ProjectValidationContext`. Instances are plain data, and therefore picklable.
+    """
+
+
+    def __init__(self, pk, name, target_type, cats_values, lwrs, range_tuple):
+        """
+        :param pk: the Target's pk
+        :param name: "" name
+        :param target_type: "" type
+        :param cats_values: list of cat values as returned by Target.cats_values(), i.e., datetime.date instances for
+            date targets
+        :param lwrs: list of 2-tuples: (lwr, upper) as stored in TargetLwr, sorted by lwr
+        :param range_tuple: as returned by Target.range_tuple()
+        """
+        from forecast_app.models import Target  # avoid circular imports
+        from utils.forecast import NamedData  # ""
+
+
+        self.pk = pk
+        self.name = name
+        self.type = target_type
+        self._cats_values = cats_values
+        self.cats_values_set = set(cats_values)
+        self.lwrs = lwrs
+        self._range_tuple = range_tuple
+        self.named_families = frozenset(family_abbrev for family_abbrev in NamedData.FAMILY_CHOICES
+                                        if Target.is_valid_named_family_for_target_type(family_abbrev, target_type))
+
+
+    def __repr__(self):
+        return str((self.pk, self.name, self.type))
+
+
+    def type_as_str(self):
+        from forecast_app.models import Target  # avoid circular imports
+
+
+        return Target.str_for_target_type(self.type)
+
+
+    def data_types(self):
+        from forecast_app.models import Target  # avoid circular imports
+
+
+        return Target.data_types_for_target_type(self.type)
+
+
+    def cats_values(self):
+        return list(self._cats_values)
+
+
+    def range_tuple(self):
+        return self._range_tuple
+
+
+    def is_in_range(self, value):
+        """
+        :return: True if value is within my range_tuple (inclusive lower, exclusive upper), or if I have no range
+        """
+        return (not self._range_tuple) or (self._range_tuple[0] <= value < self._range_tuple[1])
+
+
+    def is_valid_named_family(self, family_abbrev):
+        return family_abbrev in self.named_families
+
+
+#
+# ---- ProjectValidationContext ----
+#
+
+class ProjectValidationContext:
+    """
+    Holds a TargetValidator for each of a Project's Targets. Loaded in bulk via a handful of queries regardless of the
+    number of targets. Use `validation_context_for_project()` rather than instantiating directly, which caches
+    contexts per process.
+    """
+
+
+    def __init__(self, project_pk, fingerprint, target_validators):
+        self.project_pk = project_pk
+        self.fingerprint = fingerprint  # as returned by `_validation_context_fingerprint()`
+        self.target_name_to_validator = {target_validator.name: target_validator
+                                         for target_validator in target_validators}
+        self.target_pk_to_validator = {target_validator.pk: target_validator for target_validator in target_validators}
+
+
+    @classmethod
+    def for_project(cls, project, fingerprint=None):
+        """
+        :param project: the Project to load
+        :param fingerprint: optional fingerprint to save. computed if None
+        :return: a new ProjectValidationContext for project
+        """
+        from forecast_app.models import Target, TargetCat, TargetLwr, TargetRange  # avoid circular imports
+
+
+        if fingerprint is None:
+            fingerprint = _validation_context_fingerprint(project.pk)
+
+        # load cats, using the field corresponding to each target's preferred data type (see Target.cats_values())
+        target_rows = list(project.targets.values_list('id', 'name', 'type'))
+        target_id_to_type = {target_id: target_type for target_id, _, target_type in target_rows}
+        data_type_to_cat_idx = {Target.INTEGER_DATA_TYPE: 0, Target.FLOAT_DATA_TYPE: 1, Target.TEXT_DATA_TYPE: 2,
+                                Target.DATE_DATA_TYPE: 3, Target.BOOLEAN_DATA_TYPE: 4}
+        target_id_to_cats_values = {target_id: [] for target_id, _, _ in target_rows}
+        cats_qs = TargetCat.objects \
+            .filter(target__project=project) \
+            .order_by('id') \
+            .values_list('target_id', 'cat_i', 'cat_f', 'cat_t', 'cat_d', 'cat_b')
+        for target_id, *cat_values in cats_qs:
+            preferred_data_type = Target.data_types_for_target_type(target_id_to_type[target_id])[0]
+            target_id_to_cats_values[target_id].append(cat_values[data_type_to_cat_idx[preferred_data_type]])
+
+        # load lwrs
+        target_id_to_lwrs = {target_id: [] for target_id, _, _ in target_rows}
+        lwrs_qs = TargetLwr.objects \
+            .filter(target__project=project) \
+            .order_by('lwr') \
+            .values_list('target_id', 'lwr', 'upper')
+        for target_id, lwr, upper in lwrs_qs:
+            target_id_to_lwrs[target_id].append((lwr, upper))
+
+        # load ranges. recall there are either zero or two TargetRanges per Target (see Target.range_tuple())
+        target_id_to_range_values = {target_id: [] for target_id, _, _ in target_rows}
+        ranges_qs = TargetRange.objects \
+            .filter(target__project=project) \
+            .order_by('id') \
+            .values_list('target_id', 'value_i', 'value_f')
+        for target_id, value_i, value_f in ranges_qs:
+            target_id_to_range_values[target_id].append(
+                Target.first_non_none_value(value_i, value_f, None, None, None))
+
+        target_validators = []
+        for target_id, name, target_type in target_rows:
+            range_values = target_id_to_range_values[target_id]
+            range_tuple = (min(range_values), max(range_values)) if range_values else None
+            target_validators.append(TargetValidator(target_id, name, target_type, target_id_to_cats_values[target_id],
+                                                     target_id_to_lwrs[target_id], range_tuple))
+        return cls(project.pk, fingerprint, target_validators)
+
+
+#
+# validation_context_for_project() and invalidate_validation_context()
+#
+
+_PROJECT_PK_TO_VALIDATION_CONTEXT = {}  # per-process cache: project_pk -> ProjectValidationContext
+
+
+def validation_context_for_project(project):
+    """
+    Returns a ProjectValidationContext for project, loading it if it's not cached or if the cached one is stale. We
+    check staleness with a single aggregate query (see `_validation_context_fingerprint()`) so that contexts cached by
+    one process are not used after another process has changed the project's targets.
+
+    :param project: a Project
+    :return: a ProjectValidationContext for project
+    """
+    fingerprint = _validation_context_fingerprint(project.pk)
+    context = _PROJECT_PK_TO_VALIDATION_CONTEXT.get(project.pk)
+    if (context is None) or (context.fingerprint != fingerprint):
+        logger.debug(f"validation_context_for_project(): loading. project={project}")
+        context = ProjectValidationContext.for_project(project, fingerprint)
+        _PROJECT_PK_TO_VALIDATION_CONTEXT[project.pk] = context
+    return context
+
+
+def invalidate_validation_context(project_pk):
+    """
+    Removes project_pk's cached ProjectValidationContext, if any. Called when a Project's Targets change.
+
+    :param project_pk: a Project's pk
+    """
+    _PROJECT_PK_TO_VALIDATION_CONTEXT.pop(project_pk, None)
+
+
+def _validation_context_fingerprint(project_pk):
+    """
+    :return: a tuple that changes whenever project_pk's Targets or their cats, lwrs, or ranges change. this works
+        because Target.type, cats, and range cannot be edited in place (see `project_config_diff()`), and
+        `Target.set_cats()` and `Target.set_range()` delete and then re-create rows, which changes their ids
+    """
+    from forecast_app.models import Target, TargetCat, TargetLwr, TargetRange  # avoid circular imports
+
+
+    target_table_name = Target._meta.db_table
+    sub_selects = [f"SELECT 0, COUNT(*), MAX(id), SUM(type) FROM {target_table_name} WHERE project_id = %s"]
+    for idx, model_class in enumerate([TargetCat, TargetLwr, TargetRange], start=1):
+        sub_selects.append(f"""
+            SELECT {idx}, COUNT(*), MAX(child.id), SUM(child.id)
+            FROM {model_class._meta.db_table} AS child
+                     JOIN {target_table_name} AS target ON child.target_id = target.id
+            WHERE target.project_id = %s""")
+    sql = ' UNION ALL '.join(sub_selects) + ';'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (project_pk,) * len(sub_selects))
+        return tuple(sorted(cursor.fetchall()))